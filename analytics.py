@@ -0,0 +1,515 @@
+"""Informes de finanzas sobre una copia columnar de la tabla finanzas.
+
+`exportar` copia los movimientos nuevos (id mayor que la marca de agua) a
+segmentos .npz por mes que no se modifican una vez escritos: cada columna es
+un arreglo de NumPy del tipo más estrecho posible, y los textos repetidos
+(chat_id, categoria) se guardan como códigos de un diccionario. El
+manifiesto (manifest.json) lleva la marca de agua, los diccionarios y la
+lista de segmentos de cada mes. Cuando un mes acumula demasiados segmentos
+pequeños se fusionan en uno.
+
+Los informes leen sólo los meses pedidos y agrupan con bincount sobre los
+códigos, sin consultar la base de datos de la aplicación.
+
+La tabla finanzas sólo recibe inserciones, así que el id basta como marca de
+agua; si se modifican movimientos a mano, hay que exportar con --reconstruir.
+
+Uso:
+    python analytics.py exportar [--reconstruir]
+    python analytics.py tendencia|categorias|anomalias [--chat-id ID] [--desde AAAA-MM[-DD]] [--hasta AAAA-MM[-DD]]
+"""
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+from functools import lru_cache
+
+import numpy as np
+
+import environment
+import metrics
+import storage
+
+try:
+    import fcntl
+except ImportError:  # Windows: sólo se serializan las exportaciones del proceso
+    fcntl = None
+
+environment.load()
+
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+ANALYTICS_EXPORT_BATCH = int(os.getenv("ANALYTICS_EXPORT_BATCH", "100000"))
+# Segmentos de un mes a partir de los cuales se fusionan en uno
+ANALYTICS_COMPACT_SEGMENTS = int(os.getenv("ANALYTICS_COMPACT_SEGMENTS", "16"))
+ANALYTICS_CACHE_SEGMENTS = int(os.getenv("ANALYTICS_CACHE_SEGMENTS", "512"))
+
+TIPOS = ("gasto", "ingreso")
+COLUMNAS = {
+    "id": np.int64,
+    "chat": np.int32,
+    "tipo": np.int8,
+    "categoria": np.int32,
+    "dia": np.int32,       # días desde 1970-01-01
+    "monto": np.float64,
+}
+
+_FECHA = re.compile(r"^(\d{4})-(\d{2})(?:-(\d{2}))?$")
+_EPOCA = date(1970, 1, 1).toordinal()
+_SIN_FECHA = np.iinfo(np.int32).min
+_lock = threading.Lock()
+_ultima_exportacion = {}
+
+
+def _dia(fecha):
+    """Días desde 1970 de una fecha AAAA-MM-DD, o _SIN_FECHA si no tiene ese formato"""
+    try:
+        return date.fromisoformat(fecha[:10]).toordinal() - _EPOCA
+    except (TypeError, ValueError):
+        return _SIN_FECHA
+
+
+def _meses(dias):
+    """Meses desde 1970-01 de un arreglo de días"""
+    if not len(dias):
+        return np.empty(0, np.int32)
+    # Convertir sólo el rango de días presente y repartirlo con una tabla
+    minimo = int(dias.min())
+    rango = np.arange(minimo, int(dias.max()) + 1)
+    tabla = rango.astype("datetime64[D]").astype("datetime64[M]").astype(np.int32)
+    return tabla[dias - minimo]
+
+
+def _nombre_mes(mes):
+    return f"{1970 + mes // 12:04d}-{mes % 12 + 1:02d}"
+
+
+def _dia_iso(dia):
+    return date.fromordinal(int(dia) + _EPOCA).isoformat()
+
+
+def validar_fecha(texto):
+    """Devuelve la fecha AAAA-MM o AAAA-MM-DD; lanza ValueError si no es válida"""
+    if texto is None:
+        return None
+    coincidencia = _FECHA.match(texto)
+    if not coincidencia:
+        raise ValueError(f"Fecha inválida: {texto} (se espera AAAA-MM o AAAA-MM-DD)")
+    anio, mes, dia = coincidencia.groups()
+    try:
+        date(int(anio), int(mes), int(dia or 1))
+    except ValueError:
+        raise ValueError(f"Fecha inválida: {texto}") from None
+    return texto
+
+
+# --- Exportación ---------------------------------------------------------------
+
+def _manifiesto_vacio():
+    return {"version": 1, "marca": 0, "filas": 0, "omitidas": 0, "actualizado": None,
+            "chats": [], "categorias": [], "segmentos": {}}
+
+
+def leer_manifiesto(directorio=ANALYTICS_DIR):
+    try:
+        with open(os.path.join(directorio, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return _manifiesto_vacio()
+
+
+def _guardar_manifiesto(directorio, manifiesto):
+    ruta = os.path.join(directorio, "manifest.json")
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False)
+    os.replace(ruta + ".tmp", ruta)
+
+
+@contextmanager
+def _bloqueo(directorio):
+    """Una exportación a la vez, también entre procesos si hay fcntl"""
+    with _lock:
+        os.makedirs(directorio, exist_ok=True)
+        with open(os.path.join(directorio, ".lock"), "w") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+
+def _escribir_segmento(directorio, mes, columnas):
+    """Escribe un segmento nuevo de un mes y devuelve su ruta relativa"""
+    ids = columnas["id"]
+    relativa = f"{mes}/{int(ids[0]):012d}-{int(ids[-1]):012d}.npz"
+    ruta = os.path.join(directorio, relativa)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    buffer = io.BytesIO()
+    np.savez(buffer, **columnas)
+    with open(ruta + ".tmp", "wb") as f:
+        f.write(buffer.getbuffer())
+    os.replace(ruta + ".tmp", ruta)
+    return relativa
+
+
+def _codigos(valores, diccionario, nuevo):
+    """Código de cada valor; los valores distintos se resuelven una vez con `nuevo`"""
+    for valor in set(valores) - diccionario.keys():
+        diccionario[valor] = nuevo(valor)
+    return np.fromiter(map(diccionario.__getitem__, valores), np.int64, len(valores))
+
+
+def _codificar(filas, chats, categorias, dias):
+    """Convierte filas de finanzas en columnas; devuelve (columnas, omitidas)"""
+    ids, chat_ids, tipos, montos, nombres, fechas = zip(*filas)
+    columnas = {
+        "id": np.array(ids, np.int64),
+        "chat": _codigos(chat_ids, chats, lambda _: len(chats)).astype(np.int32),
+        "tipo": _codigos(tipos, {}, lambda t: TIPOS.index(t) if t in TIPOS else -1).astype(np.int8),
+        "categoria": _codigos(nombres, categorias, lambda _: len(categorias)).astype(np.int32),
+        "dia": _codigos(fechas, dias, _dia).astype(np.int32),
+        "monto": np.array(montos, np.float64),
+    }
+    n = len(ids)
+    validas = (columnas["dia"] != _SIN_FECHA) & (columnas["tipo"] >= 0)
+    if validas.all():
+        return columnas, 0
+    return {nombre: columna[validas] for nombre, columna in columnas.items()}, n - int(validas.sum())
+
+
+def _compactar(directorio, manifiesto, mes):
+    """Fusiona los segmentos de un mes cuando son demasiados; devuelve los que sobran"""
+    segmentos = manifiesto["segmentos"][mes]
+    if len(segmentos) < max(2, ANALYTICS_COMPACT_SEGMENTS):
+        return []
+    partes = [_leer(os.path.join(directorio, s)) for s in segmentos]
+    fusion = {nombre: np.concatenate([p[nombre] for p in partes]) for nombre in COLUMNAS}
+    manifiesto["segmentos"][mes] = [_escribir_segmento(directorio, mes, fusion)]
+    return segmentos
+
+
+def exportar(directorio=ANALYTICS_DIR, reconstruir=False, lote=ANALYTICS_EXPORT_BATCH):
+    """Copia a los segmentos los movimientos posteriores a la marca de agua.
+
+    Devuelve un resumen con las filas exportadas, las omitidas (fecha o tipo
+    no válidos) y la nueva marca de agua.
+    """
+    with _bloqueo(directorio), metrics.span("analytics", operation="export"):
+        if reconstruir:
+            for mes in leer_manifiesto(directorio)["segmentos"]:
+                shutil.rmtree(os.path.join(directorio, mes), ignore_errors=True)
+            manifiesto = _manifiesto_vacio()
+        else:
+            manifiesto = leer_manifiesto(directorio)
+        chats = {chat_id: i for i, chat_id in enumerate(manifiesto["chats"])}
+        categorias = {categoria: i for i, categoria in enumerate(manifiesto["categorias"])}
+        dias = {}
+        exportadas = omitidas = 0
+
+        while True:
+            with storage.connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = None  # tuplas: crear un Row por movimiento es lo más lento de la lectura
+                filas = cursor.execute(
+                    "SELECT id, chat_id, tipo, monto, categoria, fecha FROM finanzas WHERE id > ? ORDER BY id LIMIT ?",
+                    (manifiesto["marca"], lote)
+                ).fetchall()
+            if not filas:
+                break
+            columnas, invalidas = _codificar(filas, chats, categorias, dias)
+            sobrantes = []
+            if len(columnas["id"]):
+                # Orden estable por mes: cada segmento conserva el orden por id
+                meses = _meses(columnas["dia"])
+                orden = np.argsort(meses, kind="stable")
+                ordenadas = {c: v[orden] for c, v in columnas.items()}
+                distintos, inicios = np.unique(meses[orden], return_index=True)
+                for mes, inicio, fin in zip(distintos, inicios, [*inicios[1:], len(orden)]):
+                    nombre = _nombre_mes(int(mes))
+                    segmento = _escribir_segmento(directorio, nombre, {c: v[inicio:fin] for c, v in ordenadas.items()})
+                    manifiesto["segmentos"].setdefault(nombre, []).append(segmento)
+                    sobrantes += _compactar(directorio, manifiesto, nombre)
+            # Los diccionarios conservan el orden de inserción: la posición es el código
+            manifiesto["chats"] = list(chats)
+            manifiesto["categorias"] = list(categorias)
+            manifiesto["marca"] = filas[-1][0]
+            manifiesto["filas"] += len(columnas["id"])
+            manifiesto["omitidas"] += invalidas
+            # El manifiesto se guarda por lote: una exportación interrumpida continúa donde quedó
+            _guardar_manifiesto(directorio, manifiesto)
+            for segmento in sobrantes:
+                os.remove(os.path.join(directorio, segmento))
+            exportadas += len(columnas["id"])
+            omitidas += invalidas
+            if len(filas) < lote:
+                break
+
+        manifiesto["actualizado"] = time.time()
+        _guardar_manifiesto(directorio, manifiesto)
+    _ultima_exportacion[directorio] = time.monotonic()
+    return {"exportadas": exportadas, "omitidas": omitidas, "marca": manifiesto["marca"]}
+
+
+def actualizar(max_antiguedad, directorio=ANALYTICS_DIR):
+    """Exporta los movimientos nuevos si la última exportación del proceso es más antigua que `max_antiguedad` segundos"""
+    ultima = _ultima_exportacion.get(directorio)
+    if ultima is None or time.monotonic() - ultima >= max_antiguedad:
+        return exportar(directorio)
+    return None
+
+
+# --- Lectura -------------------------------------------------------------------
+
+@lru_cache(maxsize=ANALYTICS_CACHE_SEGMENTS)
+def _leer_cacheado(ruta, version):
+    with np.load(ruta) as datos:
+        return {nombre: datos[nombre] for nombre in COLUMNAS}
+
+
+def _leer(ruta):
+    # La fecha de modificación invalida la caché si el segmento se reescribe al reconstruir
+    return _leer_cacheado(ruta, os.stat(ruta).st_mtime_ns)
+
+
+class Datos:
+    """Columnas de los movimientos cargados y los diccionarios para decodificarlas"""
+
+    def __init__(self, columnas, chats, categorias):
+        self.columnas = columnas
+        self.chats = chats
+        self.categorias = categorias
+
+    def __len__(self):
+        return len(self.columnas["id"])
+
+
+def cargar(directorio=ANALYTICS_DIR, chat_id=None, desde=None, hasta=None):
+    """Carga los movimientos exportados, leyendo sólo los meses entre `desde` y `hasta`"""
+    desde, hasta = validar_fecha(desde), validar_fecha(hasta)
+    for intento in range(2):
+        manifiesto = leer_manifiesto(directorio)
+        meses = [mes for mes in sorted(manifiesto["segmentos"])
+                 if (desde is None or mes >= desde[:7]) and (hasta is None or mes <= hasta[:7])]
+        try:
+            partes = [_leer(os.path.join(directorio, segmento))
+                      for mes in meses for segmento in manifiesto["segmentos"][mes]]
+            break
+        except FileNotFoundError:
+            # Una exportación fusionó segmentos entre la lectura del manifiesto y la de los datos
+            if intento:
+                raise
+
+    codigo = None
+    if chat_id is not None:
+        codigo = manifiesto["chats"].index(chat_id) if chat_id in manifiesto["chats"] else -1
+    dia_desde = _dia(desde) if desde is not None and len(desde) == 10 else None
+    dia_hasta = _dia(hasta) if hasta is not None and len(hasta) == 10 else None
+
+    # Los filtros se aplican a cada segmento antes de unirlos: sólo se copia lo seleccionado
+    if codigo is not None or dia_desde is not None or dia_hasta is not None:
+        filtradas = []
+        for parte in partes:
+            seleccion = np.ones(len(parte["id"]), bool)
+            if codigo is not None:
+                seleccion &= parte["chat"] == codigo
+            if dia_desde is not None:
+                seleccion &= parte["dia"] >= dia_desde
+            if dia_hasta is not None:
+                seleccion &= parte["dia"] <= dia_hasta
+            if seleccion.any():
+                filtradas.append({nombre: columna[seleccion] for nombre, columna in parte.items()})
+        partes = filtradas
+
+    columnas = {
+        nombre: np.concatenate([parte[nombre] for parte in partes]) if partes else np.empty(0, tipo)
+        for nombre, tipo in COLUMNAS.items()
+    }
+    return Datos(columnas, manifiesto["chats"], manifiesto["categorias"])
+
+
+def _agrupar(claves):
+    """Índice denso de cada clave (0..k-1) y las claves distintas.
+
+    Si las claves caben en una tabla se resuelve con bincount en O(n); si no,
+    se ordena con np.unique.
+    """
+    if not len(claves):
+        return np.empty(0, np.intp), claves
+    maximo = int(claves.max())
+    if maximo < max(4 * len(claves), 1 << 20):
+        presentes = np.flatnonzero(np.bincount(claves, minlength=maximo + 1))
+        tabla = np.empty(maximo + 1, np.intp)
+        tabla[presentes] = np.arange(len(presentes))
+        return tabla[claves], presentes
+    presentes, inverso = np.unique(claves, return_inverse=True)
+    return inverso, presentes
+
+
+# --- Informes ------------------------------------------------------------------
+
+def tendencia(datos):
+    """Ingresos, gastos, balance, movimientos y usuarios activos por mes"""
+    if not len(datos):
+        return []
+    columnas = datos.columnas
+    meses = _meses(columnas["dia"])
+    base = int(meses.min())
+    indice = (meses - base).astype(np.intp)
+    n = int(indice.max()) + 1
+    # Una sola pasada agrupa por (mes, tipo)
+    clave = indice * len(TIPOS) + columnas["tipo"]
+    totales = np.bincount(clave, weights=columnas["monto"], minlength=n * len(TIPOS)).reshape(n, len(TIPOS))
+    movimientos = np.bincount(clave, minlength=n * len(TIPOS)).reshape(n, len(TIPOS)).sum(axis=1)
+    gastos, ingresos = totales[:, TIPOS.index("gasto")], totales[:, TIPOS.index("ingreso")]
+    # Pares (mes, chat) distintos contados por mes
+    _, pares = _agrupar(indice.astype(np.int64) * len(datos.chats) + columnas["chat"])
+    usuarios = np.bincount(pares // len(datos.chats), minlength=n)
+    return [
+        {
+            "mes": _nombre_mes(base + i),
+            "ingresos": round(float(ingresos[i]), 2),
+            "gastos": round(float(gastos[i]), 2),
+            "balance": round(float(ingresos[i] - gastos[i]), 2),
+            "movimientos": int(movimientos[i]),
+            "usuarios": int(usuarios[i]),
+        }
+        for i in np.flatnonzero(movimientos)
+    ]
+
+
+def categorias(datos, tipo="gasto", limite=20):
+    """Total, movimientos, usuarios y porcentaje por categoría, de mayor a menor"""
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo desconocido: {tipo}")
+    columnas = datos.columnas
+    seleccion = columnas["tipo"] == TIPOS.index(tipo)
+    categoria, monto = columnas["categoria"][seleccion].astype(np.intp), columnas["monto"][seleccion]
+    if not len(categoria):
+        return []
+    n = len(datos.categorias)
+    totales = np.bincount(categoria, weights=monto, minlength=n)
+    movimientos = np.bincount(categoria, minlength=n)
+    _, pares = _agrupar(categoria.astype(np.int64) * len(datos.chats) + columnas["chat"][seleccion])
+    usuarios = np.bincount(pares // len(datos.chats), minlength=n)
+    total = totales.sum()
+    presentes = np.flatnonzero(movimientos)
+    orden = presentes[np.argsort(-totales[presentes], kind="stable")][:limite]
+    return [
+        {
+            "categoria": datos.categorias[i],
+            "total": round(float(totales[i]), 2),
+            "movimientos": int(movimientos[i]),
+            "usuarios": int(usuarios[i]),
+            "promedio": round(float(totales[i] / movimientos[i]), 2),
+            "porcentaje": round(float(totales[i] / total * 100), 1) if total else 0.0,
+        }
+        for i in orden
+    ]
+
+
+def anomalias(datos, umbral=3.0, minimo=5, limite=50):
+    """Gastos muy por encima de lo habitual para el mismo usuario y categoría.
+
+    Para cada par (chat, categoría) con al menos `minimo` gastos se calculan
+    la media y la desviación típica, y se devuelven los gastos cuya
+    puntuación z supera `umbral`, de mayor a menor.
+    """
+    columnas = datos.columnas
+    seleccion = columnas["tipo"] == TIPOS.index("gasto")
+    if not seleccion.any():
+        return []
+    monto = columnas["monto"][seleccion]
+    grupo, _ = _agrupar(columnas["chat"][seleccion].astype(np.int64) * len(datos.categorias)
+                        + columnas["categoria"][seleccion])
+    cuenta = np.bincount(grupo)
+    media = np.bincount(grupo, weights=monto) / cuenta
+    varianza = np.maximum(np.bincount(grupo, weights=monto * monto) / cuenta - media * media, 0)
+    desviacion = np.sqrt(varianza)
+    # Monto a partir del cual un gasto es anómalo en su grupo; los grupos pequeños o constantes no cuentan
+    corte = np.where((cuenta >= minimo) & (desviacion > 0), media + umbral * desviacion, np.inf)
+    candidatos = np.flatnonzero(monto > corte[grupo])
+    z = (monto[candidatos] - media[grupo[candidatos]]) / desviacion[grupo[candidatos]]
+    orden = np.argsort(-z, kind="stable")[:limite]
+    filas = np.flatnonzero(seleccion)
+    return [
+        {
+            "id": int(columnas["id"][filas[i]]),
+            "chat_id": datos.chats[columnas["chat"][filas[i]]],
+            "categoria": datos.categorias[columnas["categoria"][filas[i]]],
+            "fecha": _dia_iso(columnas["dia"][filas[i]]),
+            "monto": round(float(monto[i]), 2),
+            "media": round(float(media[grupo[i]]), 2),
+            "z": round(float(z_i), 2),
+        }
+        for i, z_i in zip(candidatos[orden], z[orden])
+    ]
+
+
+REPORTES = {
+    "tendencia": tendencia,
+    "categorias": categorias,
+    "anomalias": anomalias,
+}
+
+
+def informe(nombre, chat_id=None, desde=None, hasta=None, directorio=ANALYTICS_DIR, **opciones):
+    """Calcula un informe sobre los movimientos exportados; lanza ValueError si no existe"""
+    if nombre not in REPORTES:
+        raise ValueError(f"Informe desconocido: {nombre}")
+    with metrics.span("analytics", operation=nombre):
+        datos = cargar(directorio, chat_id, desde, hasta)
+        return {"report": nombre, "rows": len(datos), "result": REPORTES[nombre](datos, **opciones)}
+
+
+def estado(directorio=ANALYTICS_DIR):
+    """Marca de agua, filas y segmentos de la copia exportada"""
+    manifiesto = leer_manifiesto(directorio)
+    return {
+        "reports": list(REPORTES),
+        "watermark": manifiesto["marca"],
+        "rows": manifiesto["filas"],
+        "skipped": manifiesto["omitidas"],
+        "months": len(manifiesto["segmentos"]),
+        "segments": sum(len(segmentos) for segmentos in manifiesto["segmentos"].values()),
+        "updated": manifiesto["actualizado"],
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Informes de finanzas sobre la copia columnar")
+    parser.add_argument("comando", choices=["exportar", "estado", *REPORTES])
+    parser.add_argument("--directorio", default=ANALYTICS_DIR)
+    parser.add_argument("--reconstruir", action="store_true", help="volver a exportar desde cero")
+    parser.add_argument("--chat-id")
+    parser.add_argument("--desde")
+    parser.add_argument("--hasta")
+    parser.add_argument("--tipo", default="gasto", choices=TIPOS)
+    parser.add_argument("--umbral", type=float, default=3.0)
+    parser.add_argument("--limite", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.comando == "exportar":
+        inicio = time.perf_counter()
+        resumen = exportar(args.directorio, reconstruir=args.reconstruir)
+        print(f"{resumen['exportadas']} movimientos exportados ({resumen['omitidas']} omitidos) "
+              f"en {time.perf_counter() - inicio:.2f} s; marca de agua {resumen['marca']}.")
+        return 0
+    if args.comando == "estado":
+        print(json.dumps(estado(args.directorio), indent=2, ensure_ascii=False))
+        return 0
+
+    opciones = {"categorias": {"tipo": args.tipo, "limite": args.limite},
+                "anomalias": {"umbral": args.umbral, "limite": args.limite}}.get(args.comando, {})
+    inicio = time.perf_counter()
+    resultado = informe(args.comando, args.chat_id, args.desde, args.hasta, args.directorio, **opciones)
+    print(json.dumps(resultado["result"], indent=2, ensure_ascii=False))
+    print(f"{resultado['rows']} movimientos en {(time.perf_counter() - inicio) * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,161 +1,811 @@
-from flask import Flask, request, jsonify, render_template
-from flask_socketio import SocketIO
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+from flask_socketio import SocketIO, join_room, leave_room
 import os
+import atexit
+import json
+import math
 import sqlite3
+import sys
+import threading
+import time
+import uuid
 import requests
 from datetime import datetime
-from dotenv import load_dotenv
+import bulk
+import delivery
+import environment
 import gemini_assistant
+import inbound
+import metrics
+import pubsub
+import reminders
+import retention
+import search
+import storage
+import write_behind
+from worker_pool import WorkerPool, QueueFullError
 
 # Cargar variables de entorno
-load_dotenv()
+environment.load()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'clave_secreta_predeterminada')
-socketio = SocketIO(app)
+# Con SOCKETIO_MESSAGE_QUEUE los eventos se reparten entre todos los procesos
+socketio = SocketIO(app, client_manager=pubsub.create_client_manager())
 
-# Configuración de Twilio para WhatsApp
-TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
-TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
-TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
+# Modo en cola: los webhooks responden de inmediato y un pool de trabajadores
+# procesa los mensajes con Gemini en segundo plano
+QUEUE_MODE = os.getenv('QUEUE_MODE', 'False').lower() == 'true'
+QUEUE_WORKERS = int(os.getenv('QUEUE_WORKERS', 4))
+QUEUE_MAX_SIZE = int(os.getenv('QUEUE_MAX_SIZE', 1000))
+QUEUE_PUT_TIMEOUT = float(os.getenv('QUEUE_PUT_TIMEOUT', 0.5))
 
-# URL del servicio de WhatsApp (si estás usando un servicio personalizado)
-WHATSAPP_SERVICE_URL = os.getenv('WHATSAPP_SERVICE_URL', 'http://localhost:3000')
+# Deduplicación de webhooks por identificador del proveedor (MessageSid de Twilio):
+# los reintentos dentro del TTL se descartan. Con persistencia sobreviven reinicios
+WEBHOOK_DEDUP_TTL = float(os.getenv('WEBHOOK_DEDUP_TTL', 86400))
+WEBHOOK_DEDUP_MAX_IDS = int(os.getenv('WEBHOOK_DEDUP_MAX_IDS', 50000))
+WEBHOOK_DEDUP_PERSIST = os.getenv('WEBHOOK_DEDUP_PERSIST', 'False').lower() == 'true'
+webhook_ids = inbound.IdempotencyStore(
+    WEBHOOK_DEDUP_TTL, WEBHOOK_DEDUP_MAX_IDS, WEBHOOK_DEDUP_PERSIST
+) if WEBHOOK_DEDUP_TTL > 0 else None
 
-def get_db_connection():
-    """Establece una conexión con la base de datos"""
-    try:
-        conn = sqlite3.connect('assistant.db', timeout=10)
-        conn.row_factory = sqlite3.Row
-        return conn
-    except sqlite3.Error as e:
-        print(f"Error de conexión a SQLite: {e}")
-        return None
+# Límite de mensajes por segundo de cada chat; los mensajes que lo superan esperan
+# su turno en orden (hasta CHAT_RATE_MAX_PENDING; después se responde 429) (0 = sin límite)
+CHAT_RATE_LIMIT = float(os.getenv('CHAT_RATE_LIMIT', 0))
+chat_limiter = inbound.ChatRateLimiter(
+    CHAT_RATE_LIMIT,
+    float(os.getenv('CHAT_RATE_BURST', 0)) or None,
+    max_pending=int(os.getenv('CHAT_RATE_MAX_PENDING', 20))
+) if CHAT_RATE_LIMIT > 0 else None
+
+# Canal de los recordatorios de tareas: twilio, service o auto (Twilio si hay credenciales)
+REMINDER_CHANNEL = os.getenv('REMINDER_CHANNEL', 'auto').lower()
+
+# Respuestas de Gemini en streaming hacia la interfaz web
+STREAMING_ENABLED = os.getenv('STREAMING_ENABLED', 'True').lower() == 'true'
+
+# Precalentamiento al arrancar (pool de conexiones, SDK y cliente de Gemini,
+# clientes de envío); /readyz no responde 200 hasta que termina
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'True').lower() == 'true'
+
+# Informes de finanzas: segundos que pueden pasar sin exportar los movimientos nuevos
+ANALYTICS_MAX_STALENESS = float(os.getenv('ANALYTICS_MAX_STALENESS', 60))
+REPORTS_MAX_LIMIT = 500
+
+# Lectura del archivo de mensajes y conversaciones
+ARCHIVE_PAGE_SIZE = 100
+ARCHIVE_MAX_PAGE_SIZE = 1000
+
+# Procesamiento de lotes de mensajes
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', 8))
+BULK_MAX_CONCURRENCY = int(os.getenv('BULK_MAX_CONCURRENCY', 32))
+
+# Paginación de la API de mensajes
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 500
+CONTACTS_PAGE_SIZE = 500
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Longitud del extracto de mensaje que se difunde a la lista de contactos
+CONTACT_PREVIEW_LENGTH = 120
 
-def save_and_emit_message(platform, sender, chat_id, message, timestamp, is_from_assistant=False):
+def chat_room(chat_id):
+    """Sala de Socket.IO con los clientes que tienen abierto un chat"""
+    return f"chat:{chat_id}"
+
+def contact_update(message_data):
+    """Resumen ligero de un mensaje para actualizar la lista de contactos de todos los clientes"""
+    update = {key: message_data[key] for key in ('id', 'platform', 'sender', 'chat_id', 'timestamp', 'is_from_assistant')}
+    update['message'] = message_data['message'][:CONTACT_PREVIEW_LENGTH]
+    return update
+
+def save_and_emit_message(platform, sender, chat_id, message, timestamp, is_from_assistant=False, stream_id=None):
     """Guarda un mensaje en la base de datos y lo emite a través de Socket.IO"""
-    conn = get_db_connection()
-    if conn:
-        try:
-            c = conn.cursor()
-            c.execute('INSERT INTO mensajes (platform, sender, chat_id, message, timestamp, is_from_assistant) VALUES (?, ?, ?, ?, ?, ?)',
-                      (platform, sender, chat_id, message, timestamp, is_from_assistant))
-            conn.commit()
-
-            message_data = {
-                'platform': platform,
-                'sender': sender,
-                'chat_id': chat_id,
-                'message': message,
-                'timestamp': timestamp,
-                'is_from_assistant': is_from_assistant
-            }
-            socketio.emit('new_message', message_data, broadcast=True)
-        except sqlite3.Error as e:
-            print(f"Error al guardar mensaje en la base de datos: {e}")
-        finally:
-            conn.close()
+    row = {
+        'platform': platform,
+        'sender': sender,
+        'chat_id': chat_id,
+        'message': message,
+        'timestamp': timestamp,
+        'is_from_assistant': is_from_assistant
+    }
+
+    def emit(message_id):
+        message_data = {'id': message_id, **row}
+        if stream_id:
+            # Permite a la interfaz reemplazar la respuesta parcial en streaming
+            message_data['stream_id'] = stream_id
+        # El mensaje completo sólo va a quien tiene el chat abierto; el resto recibe un extracto
+        with metrics.span('socketio_emit', operation='new_message'):
+            socketio.emit('new_message', message_data, to=chat_room(row['chat_id']))
+        with metrics.span('socketio_emit', operation='contact_update'):
+            socketio.emit('contact_update', contact_update(message_data))
+
+    try:
+        # El mensaje se emite cuando su lote queda confirmado en la base de datos
+        write_behind.get_writer().insert('mensajes', row, callback=emit)
+    except sqlite3.Error as e:
+        print(f"Error al guardar mensaje en la base de datos: {e}")
 
 @app.route('/')
 def index():
     """Ruta principal que muestra la interfaz web"""
     return render_template('index.html')
 
+def _parse_limit(value, default, maximum):
+    """Convierte el parámetro `limit` a un entero dentro de [1, maximum]"""
+    try:
+        return max(1, min(int(value), maximum))
+    except (TypeError, ValueError):
+        return default
+
+def _encode_cursor(row):
+    return f"{row['timestamp']}|{row['id']}"
+
+def _decode_cursor(cursor):
+    timestamp, _, message_id = cursor.rpartition('|')
+    return timestamp, int(message_id)
+
+def query_messages(chat_id=None, before=None, after_id=None, limit=MESSAGES_PAGE_SIZE):
+    """Consulta una página de mensajes; lanza ValueError si el cursor es inválido"""
+    conditions = []
+    params = []
+    if chat_id:
+        conditions.append('chat_id = ?')
+        params.append(chat_id)
+
+    if after_id is not None:
+        # Sincronización incremental: mensajes nuevos en orden de inserción
+        conditions.append('id > ?')
+        params.append(after_id)
+        order = 'id ASC'
+    else:
+        if before:
+            timestamp, message_id = _decode_cursor(before)
+            conditions.append('(timestamp < ? OR (timestamp = ? AND id < ?))')
+            params.extend([timestamp, timestamp, message_id])
+        order = 'timestamp DESC, id DESC'
+
+    query = 'SELECT * FROM mensajes'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += f' ORDER BY {order} LIMIT ?'
+    params.append(limit + 1)
+
+    with metrics.span('db', operation='messages_page'), storage.connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more and after_id is None:
+        next_cursor = _encode_cursor(rows[-1])
+
+    return {
+        'messages': [dict(row) for row in rows],
+        'has_more': has_more,
+        'next_cursor': next_cursor,
+        'last_id': max((row['id'] for row in rows), default=after_id)
+    }
+
 @app.route('/messages')
 def get_messages():
-    """Obtiene todos los mensajes almacenados"""
-    conn = get_db_connection()
-    if conn:
+    """Obtiene los mensajes almacenados de forma paginada.
+
+    Parámetros opcionales:
+    - chat_id: limita los resultados a un chat
+    - before: cursor devuelto en `next_cursor` para pedir mensajes más antiguos
+    - after_id: devuelve sólo los mensajes con id mayor (sincronización incremental)
+    - limit: número máximo de mensajes (por defecto 50, máximo 500)
+    """
+    try:
+        return jsonify(query_messages(
+            request.args.get('chat_id'),
+            request.args.get('before'),
+            request.args.get('after_id', type=int),
+            _parse_limit(request.args.get('limit'), MESSAGES_PAGE_SIZE, MESSAGES_MAX_PAGE_SIZE)
+        ))
+    except ValueError:
+        return jsonify({'error': 'Cursor inválido'}), 400
+    except sqlite3.Error as e:
+        print(f"Error al obtener mensajes: {e}")
+        return jsonify({'error': 'Error en la base de datos'}), 500
+
+def query_contacts(limit=CONTACTS_PAGE_SIZE):
+    """Consulta un registro por chat con su último mensaje"""
+    with metrics.span('db', operation='contacts'), storage.connection() as conn:
+        # Cada subconsulta se resuelve con el índice (chat_id, timestamp)
+        rows = conn.execute('''
+            SELECT m.id, m.platform, m.chat_id, m.message, m.timestamp, m.is_from_assistant,
+                   COALESCE((SELECT sender FROM mensajes
+                             WHERE chat_id = c.chat_id AND is_from_assistant = 0
+                             ORDER BY timestamp DESC LIMIT 1), c.chat_id) AS name
+            FROM (SELECT DISTINCT chat_id FROM mensajes) c
+            JOIN mensajes m ON m.id = (SELECT id FROM mensajes
+                                       WHERE chat_id = c.chat_id
+                                       ORDER BY timestamp DESC, id DESC LIMIT 1)
+            ORDER BY m.timestamp DESC
+            LIMIT ?
+        ''', (limit,)).fetchall()
+        last_id = conn.execute('SELECT MAX(id) FROM mensajes').fetchone()[0]
+
+    return {'contacts': [dict(row) for row in rows], 'last_id': last_id or 0}
+
+@app.route('/contacts')
+def get_contacts():
+    """Obtiene un registro por chat con su último mensaje"""
+    limit = _parse_limit(request.args.get('limit'), CONTACTS_PAGE_SIZE, CONTACTS_PAGE_SIZE)
+    try:
+        return jsonify(query_contacts(limit))
+    except sqlite3.Error as e:
+        print(f"Error al obtener contactos: {e}")
+        return jsonify({'error': 'Error en la base de datos'}), 500
+
+def query_search(q, chat_id=None, types=None, limit=SEARCH_PAGE_SIZE):
+    """Busca texto en tareas, mensajes y conversaciones; lanza ValueError si un tipo no existe"""
+    types = [t for t in (types or '').split(',') if t] or list(search.INDICES)
+    unknown = [t for t in types if t not in search.INDICES]
+    if unknown:
+        raise ValueError(f"Tipos desconocidos: {', '.join(unknown)}")
+    return {'query': q, 'results': search.buscar(q, chat_id, types, limit)}
+
+@app.route('/search')
+def search_endpoint():
+    """Búsqueda de texto completo ordenada por relevancia.
+
+    Parámetros:
+    - q: texto a buscar (cada palabra se busca por prefijo)
+    - chat_id: limita los resultados a un chat
+    - type: tipos separados por comas (tareas, mensajes, conversaciones); por defecto todos
+    - limit: resultados por tipo (por defecto 20, máximo 100)
+    """
+    try:
+        return jsonify(query_search(
+            request.args.get('q', ''),
+            request.args.get('chat_id'),
+            request.args.get('type'),
+            _parse_limit(request.args.get('limit'), SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE)
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except sqlite3.Error as e:
+        print(f"Error en la búsqueda: {e}")
+        return jsonify({'error': 'Error en la base de datos'}), 500
+
+def query_report(name, args):
+    """Calcula un informe de finanzas; lanza ValueError si el informe o los parámetros no son válidos"""
+    # NumPy se importa con el primer informe, no al arrancar
+    import analytics
+    if name not in analytics.REPORTES:
+        raise ValueError(f"Informe desconocido: {name}")
+    options = {}
+    if 'limit' in args:
+        options['limite'] = _parse_limit(args['limit'], 20, REPORTS_MAX_LIMIT)
+    if name == 'categorias' and 'kind' in args:
+        options['tipo'] = args['kind']
+    if name == 'anomalias' and 'threshold' in args:
+        try:
+            options['umbral'] = float(args['threshold'])
+        except ValueError:
+            raise ValueError(f"Umbral inválido: {args['threshold']}") from None
+    if name == 'tendencia':
+        options.pop('limite', None)
+    # Los movimientos nuevos se exportan a lo sumo cada ANALYTICS_MAX_STALENESS segundos
+    analytics.actualizar(ANALYTICS_MAX_STALENESS)
+    return analytics.informe(name, args.get('chat_id'), args.get('from'), args.get('to'), **options)
+
+def report_status():
+    """Informes disponibles y estado de la copia columnar de finanzas"""
+    import analytics
+    return analytics.estado()
+
+@app.route('/reports')
+def reports_status():
+    """Informes disponibles y estado de la copia columnar de finanzas"""
+    return jsonify(report_status())
+
+@app.route('/reports/<name>')
+def report_endpoint(name):
+    """Informe de finanzas sobre la copia columnar (no consulta la base de datos de la aplicación).
+
+    Informes: tendencia (por mes), categorias, anomalias. Parámetros:
+    - chat_id: limita el informe a un usuario
+    - from, to: AAAA-MM o AAAA-MM-DD
+    - kind: gasto o ingreso (categorias)
+    - threshold: puntuación z mínima (anomalias, por defecto 3)
+    - limit: filas del resultado (categorias y anomalias, máximo 500)
+    """
+    try:
+        return jsonify(query_report(name, request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except sqlite3.Error as e:
+        print(f"Error al exportar las finanzas: {e}")
+        return jsonify({'error': 'Error en la base de datos'}), 500
+
+def query_archive(table, args):
+    """Página de filas archivadas; lanza ValueError si la tabla, una fecha o el cursor no son válidos"""
+    before = args.get('before_id')
+    if before is not None:
+        try:
+            before = int(before)
+        except ValueError:
+            raise ValueError(f"Cursor inválido: {before}") from None
+    return retention.leer(table, args.get('chat_id'), args.get('from'), args.get('to'), before,
+                          _parse_limit(args.get('limit'), ARCHIVE_PAGE_SIZE, ARCHIVE_MAX_PAGE_SIZE))
+
+@app.route('/retention')
+def retention_status():
+    """Políticas de retención, tamaño del archivo y espacio de la base de datos"""
+    return jsonify(retention.estado())
+
+@app.route('/archive/<table>')
+def archive_endpoint(table):
+    """Filas archivadas de mensajes o conversaciones, de la más reciente a la más antigua.
+
+    Parámetros opcionales:
+    - chat_id: limita los resultados a un chat
+    - from, to: AAAA-MM, AAAA-MM-DD o AAAA-MM-DDTHH:MM (inclusivos)
+    - before_id: cursor devuelto en `next_before` para seguir con filas más antiguas
+    - limit: número máximo de filas (por defecto 100, máximo 1000)
+    """
+    try:
+        return jsonify(query_archive(table, request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OSError as e:
+        print(f"Error al leer el archivo: {e}")
+        return jsonify({'error': 'Error al leer el archivo'}), 500
+
+def process_incoming_message(job):
+    """Procesa un mensaje entrante con el asistente, guarda la respuesta y la envía"""
+    with metrics.perfilar('mensaje'), metrics.span('message', operation=job['channel']):
+        respuesta = gemini_assistant.procesar_mensaje(job['message'], job['chat_id'])
+
+        timestamp = datetime.now().isoformat()
+        save_and_emit_message(job['platform'], 'Asistente', job['chat_id'], respuesta, timestamp, True)
+
+        deliver_text(job['channel'], job['chat_id'], respuesta)
+
+    return respuesta
+
+def deliver_text(channel, chat_id, text):
+    """Envía un texto por WhatsApp por el canal indicado (twilio o service; None no envía)"""
+    if channel == 'twilio':
+        delivery.send_twilio_message(chat_id, text)
+    elif channel == 'service':
+        delivery.send_whatsapp_service_message(chat_id, text)
+        print(f"Respuesta del asistente enviada: {text}")
+
+def reminder_channel():
+    """Canal de los recordatorios: el configurado o, en modo auto, Twilio si hay credenciales"""
+    if REMINDER_CHANNEL != 'auto':
+        return REMINDER_CHANNEL
+    if os.getenv('TWILIO_ACCOUNT_SID') and os.getenv('TWILIO_AUTH_TOKEN'):
+        return 'twilio'
+    return 'service'
+
+def send_reminder(chat_id, text):
+    """Guarda un recordatorio de tareas en el historial del chat y lo envía por WhatsApp"""
+    save_and_emit_message('WhatsApp', 'Asistente', chat_id, text, datetime.now().isoformat(), True)
+    deliver_text(reminder_channel(), chat_id, text)
+
+def make_bulk_handler(deliver=None):
+    """Crea el manejador de un elemento de lote; `deliver` indica si se envía la respuesta"""
+    def handler(item):
+        platform = item.get('platform', 'WhatsApp')
+        timestamp = item.get('timestamp') or datetime.now().isoformat()
+        save_and_emit_message(platform, item.get('sender', item['chat_id']), item['chat_id'], item['message'], timestamp)
+        return process_incoming_message({
+            'channel': deliver,
+            'platform': platform,
+            'chat_id': item['chat_id'],
+            'message': item['message']
+        })
+    return handler
+
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+def get_worker_pool():
+    """Devuelve el pool de trabajadores, creándolo la primera vez"""
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = WorkerPool(
+                process_incoming_message,
+                num_workers=QUEUE_WORKERS,
+                max_size=QUEUE_MAX_SIZE,
+                name='llm-worker'
+            )
+            _worker_pool.start()
+            atexit.register(_worker_pool.stop, 10)
+        return _worker_pool
+
+def enqueue_message(job):
+    """Encola un mensaje; devuelve una respuesta 503 si la cola está llena"""
+    try:
+        get_worker_pool().submit(job['chat_id'], job, timeout=QUEUE_PUT_TIMEOUT)
+    except QueueFullError as e:
+        print(f"Mensaje rechazado por contrapresión: {e}")
+        response = jsonify({'error': 'Servicio saturado, inténtalo más tarde'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    return None
+
+def deliver_deferred(job):
+    """Encola un mensaje que esperaba su turno; se llama desde el hilo del limitador.
+
+    Devuelve False si la cola está llena: el webhook ya respondió, así que
+    el limitador lo conserva y lo vuelve a intentar más tarde.
+    """
+    try:
+        get_worker_pool().submit(job['chat_id'], job)
+    except QueueFullError as e:
+        print(f"Mensaje en espera del chat {job['chat_id']} aplazado por contrapresión: {e}")
+        return False
+    return True
+
+def chat_queue_full_response(error):
+    """Respuesta 429 para un chat que ya tiene demasiados mensajes en espera"""
+    print(f"Mensaje rechazado por límite de tasa: {error}")
+    response = jsonify({'error': 'Demasiados mensajes seguidos, inténtalo más tarde'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    return response
+
+def save_queued(accepted):
+    """Llama a `accepted` para un mensaje ya encolado: un error ya no debe rechazarlo"""
+    try:
+        accepted()
+    except Exception as e:
+        print(f"Error al guardar un mensaje ya encolado: {e}")
+
+def handle_job(job, accepted=None):
+    """Procesa el mensaje en línea o en cola según QUEUE_MODE; devuelve la respuesta HTTP o None.
+
+    Con CHAT_RATE_LIMIT, los mensajes de un chat que superan el límite
+    esperan su turno y se procesan después, en orden, en el pool de
+    trabajadores; si ya hay demasiados en espera se responde 429.
+
+    `accepted()` (p. ej. guardar el mensaje recibido) se llama sólo si el
+    mensaje se acepta: antes de procesarlo en línea o en cuanto queda en
+    cola. Con un 429 o un 503 el proveedor lo reenviará y no se guarda dos veces.
+    """
+    if chat_limiter is not None:
         try:
-            messages = conn.execute('SELECT * FROM mensajes ORDER BY timestamp DESC').fetchall()
-            return jsonify([dict(row) for row in messages])
-        except sqlite3.Error as e:
-            print(f"Error al obtener mensajes: {e}")
-            return jsonify({'error': 'Error en la base de datos'}), 500
-        finally:
-            conn.close()
-    return jsonify({'error': 'No se pudo conectar a la base de datos'}), 500
+            if not chat_limiter.submit(job['chat_id'], job, deliver_deferred):
+                if accepted is not None:
+                    save_queued(accepted)
+                return jsonify({'status': 'queued'})
+        except inbound.ChatQueueFullError as e:
+            return chat_queue_full_response(e)
+
+    if QUEUE_MODE:
+        error = enqueue_message(job)
+        if error is not None:
+            return error
+        if accepted is not None:
+            save_queued(accepted)
+        return jsonify({'status': 'queued'})
+
+    if accepted is not None:
+        accepted()
+    process_incoming_message(job)
+    return None
+
+def claim_webhook(message_id):
+    """Registra el identificador del proveedor; devuelve False si es un reintento ya atendido"""
+    return webhook_ids is None or webhook_ids.claim(message_id)
+
+def release_webhook(message_id):
+    """Permite reintentar un mensaje que no llegó a procesarse"""
+    if webhook_ids is not None:
+        webhook_ids.release(message_id)
+
+def rejected(status_code):
+    """Si handle_job rechazó el mensaje sin procesarlo (el proveedor debe reintentar)"""
+    return status_code == 429 or status_code >= 500
+
+def inbound_stats():
+    """Contadores de deduplicación de webhooks y del límite por chat"""
+    return {
+        'dedup': {'enabled': webhook_ids is not None, **(webhook_ids.stats() if webhook_ids else {})},
+        'chat_rate_limit': {'enabled': chat_limiter is not None, **(chat_limiter.stats() if chat_limiter else {})}
+    }
+
+def queue_stats():
+    """Métricas de la cola de procesamiento"""
+    if _worker_pool is None:
+        return {'enabled': QUEUE_MODE, 'depth': 0}
+    return {'enabled': QUEUE_MODE, **_worker_pool.metrics()}
+
+def _optional_stats(component):
+    return {'enabled': False} if component is None else {'enabled': True, **component.stats()}
+
+def intent_cache_stats():
+    """Contadores de la caché de intenciones"""
+    return _optional_stats(gemini_assistant.cache_intenciones)
+
+def classifier_stats():
+    """Cuántos mensajes resolvió el clasificador local"""
+    return _optional_stats(gemini_assistant.clasificador_local)
+
+def context_stats():
+    """Contadores de la caché de contexto de conversación"""
+    return _optional_stats(gemini_assistant.contexto)
+
+@app.route('/inbound/metrics')
+def inbound_metrics():
+    """Devuelve los contadores de deduplicación de webhooks y del límite por chat"""
+    return jsonify(inbound_stats())
+
+@app.route('/queue/metrics')
+def queue_metrics():
+    """Devuelve las métricas de la cola de procesamiento"""
+    return jsonify(queue_stats())
+
+@app.route('/intent-cache/metrics')
+def intent_cache_metrics():
+    """Devuelve los contadores de la caché de intenciones"""
+    return jsonify(intent_cache_stats())
+
+@app.route('/classifier/metrics')
+def classifier_metrics():
+    """Devuelve cuántos mensajes resolvió el clasificador local"""
+    return jsonify(classifier_stats())
+
+@app.route('/context/metrics')
+def context_metrics():
+    """Devuelve los contadores de la caché de contexto de conversación"""
+    return jsonify(context_stats())
+
+@app.route('/db/metrics')
+def db_metrics():
+    """Devuelve los contadores de escritura por lotes"""
+    return jsonify(write_behind.get_writer().stats())
+
+_warmup = {'status': 'pending' if WARMUP_ENABLED else 'disabled', 'seconds': None, 'error': None}
+
+def warm_up(async_mode=False):
+    """Crea por adelantado lo que si no pagaría el primer mensaje.
+
+    En modo asyncio los clientes de envío abren su sesión en el bucle de
+    eventos, así que sólo se importa el SDK de Twilio.
+    """
+    _warmup['status'] = 'running'
+    start = time.perf_counter()
+    try:
+        storage.get_pool().warm()
+        write_behind.get_writer()
+        gemini_assistant.obtener_modelo()
+        if async_mode:
+            if os.getenv('TWILIO_ACCOUNT_SID') and os.getenv('TWILIO_AUTH_TOKEN'):
+                import twilio.rest  # noqa: F401
+        else:
+            delivery.get_twilio_client()
+            delivery.get_whatsapp_client()
+    except Exception as e:
+        _warmup.update(status='failed', error=str(e))
+        print(f"Error en el precalentamiento: {e}")
+        return
+    _warmup.update(status='done', seconds=round(time.perf_counter() - start, 3))
+    print(f"Precalentamiento completado en {_warmup['seconds']} s")
+
+def start_warm_up(async_mode=False):
+    """Lanza el precalentamiento en segundo plano si está activado"""
+    if WARMUP_ENABLED:
+        threading.Thread(target=warm_up, args=(async_mode,), name='warm-up', daemon=True).start()
+
+def readiness():
+    """Comprueba la base de datos, la versión del esquema y el precalentamiento; devuelve (listo, detalle)"""
+    checks = {'warmup': dict(_warmup)}
+    try:
+        expected = {'mensajes': SCHEMA_VERSION, 'asistente': gemini_assistant.VERSION_ESQUEMA,
+                    'retencion': retention.VERSION_ESQUEMA}
+        outdated = [name for name, version in expected.items() if storage.schema_version(name) != version]
+        checks['database'] = 'ok'
+        checks['schema'] = f"desactualizado: {', '.join(outdated)}" if outdated else 'ok'
+    except sqlite3.Error as e:
+        checks['database'] = str(e)
+    ready = (checks['database'] == 'ok' and checks.get('schema') == 'ok'
+             and _warmup['status'] in ('done', 'disabled'))
+    return ready, {'status': 'ready' if ready else 'not_ready', 'checks': checks}
+
+@app.route('/healthz')
+def healthz():
+    """Comprobación de vida: el proceso atiende peticiones (no toca la base de datos)"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Comprobación de disponibilidad: 503 hasta que la base de datos, el esquema y el precalentamiento estén listos"""
+    ready, detail = readiness()
+    return jsonify(detail), 200 if ready else 503
+
+@app.route('/delivery/metrics')
+def delivery_metrics():
+    """Devuelve los contadores de entrega y el estado del circuito del servicio de WhatsApp"""
+    return jsonify(delivery.stats())
+
+def _collect_component_metrics():
+    """Expone como gauges los contadores de la cola, las cachés y la escritura por lotes"""
+    sources = [
+        ('assistant_db_writer', 'Escritura por lotes', write_behind.get_writer().stats()),
+        ('assistant_delivery', 'Entrega al servicio de WhatsApp', delivery.stats()),
+    ]
+    if webhook_ids is not None:
+        sources.append(('assistant_webhook_dedup', 'Deduplicación de webhooks', webhook_ids.stats()))
+    if chat_limiter is not None:
+        sources.append(('assistant_chat_rate_limit', 'Límite de mensajes por chat', chat_limiter.stats()))
+    if gemini_assistant.limite_gemini is not None:
+        sources.append(('assistant_gemini_rate_limit', 'Límite de llamadas a Gemini', gemini_assistant.limite_gemini.stats()))
+    if _worker_pool is not None:
+        sources.append(('assistant_queue', 'Cola de procesamiento', _worker_pool.metrics()))
+    if gemini_assistant.cache_intenciones is not None:
+        sources.append(('assistant_intent_cache', 'Caché de intenciones', gemini_assistant.cache_intenciones.stats()))
+    if gemini_assistant.clasificador_local is not None:
+        sources.append(('assistant_classifier', 'Clasificador local', gemini_assistant.clasificador_local.stats()))
+    if gemini_assistant.contexto is not None:
+        sources.append(('assistant_context', 'Caché de contexto', gemini_assistant.contexto.stats()))
+    if reminders.programador is not None:
+        sources.append(('assistant_reminders', 'Recordatorios de tareas', reminders.programador.stats()))
+    if retention.retencion is not None:
+        sources.append(('assistant_retention', 'Retención y archivo', retention.retencion.stats()))
+
+    for prefix, description, stats in sources:
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            yield f'{prefix}_{key}', f'{description}: {key}', {}, value
+        # La profundidad por trabajador se expone con una etiqueta
+        for i, depth in enumerate(stats.get('depth_per_worker', [])):
+            yield f'{prefix}_worker_depth', f'{description}: profundidad por trabajador', {'worker': i}, depth
+
+metrics.REGISTRY.registrar_recolector(_collect_component_metrics)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Expone histogramas de latencia por etapa y contadores en formato Prometheus"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def bulk_items(data):
+    """Mensajes de un lote JSON (un arreglo o un objeto con la clave `messages`), o None si no es válido"""
+    items = data.get('messages') if isinstance(data, dict) else data
+    return items if isinstance(items, list) else None
+
+@app.route('/messages/bulk', methods=['POST'])
+def bulk_messages():
+    """Procesa un lote de mensajes en paralelo y devuelve el progreso como JSON por línea.
+
+    Acepta un arreglo JSON (o un objeto con la clave `messages`) o un cuerpo
+    JSONL. Parámetros opcionales:
+    - concurrency: número de chats procesados en paralelo
+    - deliver: `service` o `twilio` para enviar también las respuestas
+    """
+    concurrency = _parse_limit(request.args.get('concurrency'), BULK_CONCURRENCY, BULK_MAX_CONCURRENCY)
+    deliver = request.args.get('deliver')
+    if deliver not in (None, 'service', 'twilio'):
+        return jsonify({'error': 'deliver debe ser service o twilio'}), 400
+
+    if request.is_json:
+        items = bulk_items(request.get_json(silent=True))
+        if items is None:
+            return jsonify({'error': 'Se esperaba una lista de mensajes'}), 400
+    else:
+        items = bulk.leer_jsonl(request.get_data(as_text=True).splitlines())
+
+    events = bulk.procesar_lote(items, make_bulk_handler(deliver), concurrency)
+    lines = (json.dumps(event, ensure_ascii=False) + '\n' for event in events)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
 
 @app.route('/whatsapp/webhook', methods=['POST'])
 def whatsapp_webhook():
     """Webhook para recibir mensajes de WhatsApp (Twilio)"""
+    message_sid = None
+    dispatched = False
     try:
         # Extraer información del mensaje de WhatsApp
-        from_number = request.values.get('From', '').replace('whatsapp:', '')
-        to_number = request.values.get('To', '').replace('whatsapp:', '')
-        body = request.values.get('Body', '')
-        
-        # Procesar el mensaje con nuestro asistente
-        respuesta = gemini_assistant.procesar_mensaje(body, from_number)
-        
-        # Guardar el mensaje recibido y la respuesta
+        with metrics.span('parse', operation='twilio'):
+            message_sid = request.values.get('MessageSid')
+            from_number = request.values.get('From', '').replace('whatsapp:', '')
+            body = request.values.get('Body', '')
+
+        # Twilio reintenta si el webhook tarda: el reintento no se vuelve a procesar
+        if not claim_webhook(message_sid):
+            return jsonify({'status': 'duplicate'})
+
+        # Guardar el mensaje recibido cuando se acepte
         timestamp = datetime.now().isoformat()
-        save_and_emit_message('WhatsApp', from_number, from_number, body, timestamp)
-        save_and_emit_message('WhatsApp', 'Asistente', from_number, respuesta, timestamp, True)
-        
-        # Enviar respuesta a través de Twilio
-        if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
-            from twilio.rest import Client
-            client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-            
-            message = client.messages.create(
-                body=respuesta,
-                from_=f'whatsapp:{TWILIO_PHONE_NUMBER}',
-                to=f'whatsapp:{from_number}'
-            )
-            
-            print(f"Mensaje enviado a WhatsApp: {message.sid}")
-        
-        return jsonify({'status': 'success'})
+
+        def save():
+            nonlocal dispatched
+            save_and_emit_message('WhatsApp', from_number, from_number, body, timestamp)
+            dispatched = True
+
+        # Procesar el mensaje, guardar la respuesta y enviarla a través de Twilio
+        response = handle_job({
+            'channel': 'twilio',
+            'platform': 'WhatsApp',
+            'chat_id': from_number,
+            'message': body
+        }, save)
+        if response is not None and rejected(response.status_code):
+            # Rechazado antes de procesarlo: el reintento de Twilio debe atenderse
+            release_webhook(message_sid)
+        return response or jsonify({'status': 'success'})
     except Exception as e:
-        print(f"Error en webhook de WhatsApp: {e}")
+        if dispatched:
+            # El asistente pudo ejecutar ya el comando (p. ej. registrar un gasto):
+            # el identificador queda atendido para que el reintento no lo repita
+            print(f"Error al procesar o responder el mensaje {message_sid} de WhatsApp: {e}")
+        else:
+            print(f"Error en webhook de WhatsApp: {e}")
+            release_webhook(message_sid)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/whatsapp_message', methods=['POST'])
 def whatsapp_message():
     """Endpoint para recibir mensajes de WhatsApp (servicio personalizado)"""
-    data = request.json
-    if not all(key in data for key in ['platform', 'sender', 'chat_id', 'message', 'timestamp']):
+    with metrics.span('parse', operation='service'):
+        data = request.json
+        completo = all(key in data for key in ['platform', 'sender', 'chat_id', 'message', 'timestamp'])
+    if not completo:
         return jsonify({'error': 'Datos incompletos'}), 400
 
-    # Guardar el mensaje recibido
-    save_and_emit_message(data['platform'], data['sender'], data['chat_id'], data['message'], data['timestamp'])
-    
+    # El servicio puede mandar un identificador opcional para deduplicar reenvíos
+    message_id = data.get('message_id')
+    if not claim_webhook(message_id):
+        return jsonify({'status': 'duplicate'})
+
+    # Guardar el mensaje recibido (los de WhatsApp, cuando se aceptan)
+    def save():
+        save_and_emit_message(data['platform'], data['sender'], data['chat_id'], data['message'], data['timestamp'])
+
+    if data['platform'] != 'WhatsApp':
+        save()
+
     # Procesar el mensaje con el asistente
     if data['platform'] == 'WhatsApp':
         try:
-            # Procesar el mensaje con el asistente
-            respuesta = gemini_assistant.procesar_mensaje(data['message'], data['chat_id'])
-            
-            # Enviar la respuesta a WhatsApp (servicio personalizado)
-            response = requests.post(f'{WHATSAPP_SERVICE_URL}/send', json={
-                'chat_id': data['chat_id'] + '@s.whatsapp.net',
-                'message': respuesta
-            }, timeout=5)
-            
-            # Guardar la respuesta del asistente en la base de datos
-            timestamp = datetime.now().isoformat()
-            save_and_emit_message(
-                data['platform'],
-                'Asistente',
-                data['chat_id'],
-                respuesta,
-                timestamp,
-                is_from_assistant=True
-            )
-            
-            print(f"Respuesta del asistente enviada: {respuesta}")
+            response = handle_job({
+                'channel': 'service',
+                'platform': data['platform'],
+                'chat_id': data['chat_id'],
+                'message': data['message']
+            }, save)
+            if response is not None:
+                if rejected(response.status_code):
+                    release_webhook(message_id)
+                return response
         except Exception as e:
             print(f"Error al procesar mensaje con el asistente: {e}")
     
     return jsonify({'status': 'ok'})
 
+@socketio.on('join_chat')
+def handle_join_chat(data):
+    """Suscribe al cliente a los mensajes del chat que está viendo"""
+    chat_id = (data or {}).get('chat_id')
+    if chat_id:
+        join_room(chat_room(chat_id))
+
+@socketio.on('leave_chat')
+def handle_leave_chat(data):
+    """Deja de enviar al cliente los mensajes de un chat"""
+    chat_id = (data or {}).get('chat_id')
+    if chat_id:
+        leave_room(chat_room(chat_id))
+
 @socketio.on('send_message')
 def handle_send_message(data):
     """Maneja el envío de mensajes desde la interfaz web"""
-    platform = data.get('platform')
-    chat_id = data.get('chat_id')
-    message = data.get('message')
+    with metrics.span('parse', operation='socket'):
+        platform = data.get('platform')
+        chat_id = data.get('chat_id')
+        message = data.get('message')
 
     if not all([platform, chat_id, message]):
         print("Error: Datos incompletos en send_message")
@@ -164,29 +814,47 @@ def handle_send_message(data):
     if platform == 'WhatsApp':
         try:
             # Enviar mensaje a través del servicio personalizado
-            response = requests.post(f'{WHATSAPP_SERVICE_URL}/send', json={
-                'chat_id': chat_id + '@s.whatsapp.net',  
-                'message': message
-            }, timeout=5)
+            delivery.send_whatsapp_service_message(chat_id, message)
             
             # Procesar la respuesta del asistente
-            respuesta = gemini_assistant.procesar_mensaje(message, chat_id)
+            stream_id = None
+            if STREAMING_ENABLED:
+                stream_id = uuid.uuid4().hex
+
+                def emit_chunk(chunk):
+                    with metrics.span('socketio_emit', operation='message_chunk'):
+                        socketio.emit('message_chunk', {
+                            'stream_id': stream_id,
+                            'chat_id': chat_id,
+                            'chunk': chunk
+                        }, to=chat_room(chat_id))
+
+                with metrics.perfilar('mensaje'), metrics.span('message', operation='socket'):
+                    respuesta = gemini_assistant.procesar_mensaje_stream(message, chat_id, emit_chunk)
+            else:
+                with metrics.perfilar('mensaje'), metrics.span('message', operation='socket'):
+                    respuesta = gemini_assistant.procesar_mensaje(message, chat_id)
             
             # Guardar la respuesta
             timestamp = datetime.now().isoformat()
-            save_and_emit_message(platform, 'Asistente', chat_id, respuesta, timestamp, is_from_assistant=True)
+            save_and_emit_message(platform, 'Asistente', chat_id, respuesta, timestamp,
+                                  is_from_assistant=True, stream_id=stream_id)
             
             print(f"Mensaje enviado a WhatsApp: {chat_id} - {message}")
             print(f"Respuesta del asistente: {respuesta}")
         except requests.RequestException as e:
             print(f"Error al enviar mensaje a WhatsApp: {e}")
 
+# Versión del esquema de mensajes: subirla al cambiar la tabla o sus índices
+SCHEMA_VERSION = 1
+
 def init_db():
-    """Inicializa la base de datos para mensajes"""
-    conn = sqlite3.connect('assistant.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''CREATE TABLE IF NOT EXISTS mensajes (
+    """Crea la tabla de mensajes si la base de datos no tiene la versión actual del esquema"""
+    if storage.ensure_schema('mensajes', SCHEMA_VERSION, _create_schema):
+        print("Base de datos de mensajes inicializada correctamente.")
+
+def _create_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS mensajes (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         platform TEXT,
         sender TEXT,
@@ -195,18 +863,31 @@ def init_db():
         timestamp TEXT,
         is_from_assistant BOOLEAN DEFAULT 0
     )''')
-    
-    conn.commit()
-    conn.close()
-    print("Base de datos de mensajes inicializada correctamente.")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mensajes_chat_timestamp ON mensajes(chat_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mensajes_timestamp ON mensajes(timestamp)')
+    search.crear_indices(conn, ('mensajes',))
 
 if __name__ == '__main__':
+    port = int(os.getenv('PORT', 5000))
+
+    if os.getenv('SERVER_MODE', 'threading').lower() == 'async':
+        # Servidor asyncio (aiohttp + python-socketio). async_app importa `app`:
+        # se le da este módulo, ya cargado como __main__, en lugar de ejecutarlo
+        # otra vez (otro Flask, otro pool de conexiones y métricas duplicadas)
+        sys.modules['app'] = sys.modules[__name__]
+        import async_app
+        async_app.run(port=port)
+        raise SystemExit(0)
+
     # Inicializar la base de datos
     init_db()
     gemini_assistant.init_db()
+    retention.init_db()
+    reminders.iniciar(send_reminder)
+    retention.iniciar()
+    start_warm_up()
     
     # Iniciar el servidor
-    port = int(os.getenv('PORT', 5000))
     debug = os.getenv('DEBUG', 'True').lower() == 'true'
     
     print(f"Iniciando servidor en el puerto {port}...")
@@ -0,0 +1,578 @@
+"""Modo de servidor asyncio: aiohttp + python-socketio.
+
+Uso:
+    python async_app.py            (o SERVER_MODE=async python app.py)
+
+Atiende los mismos webhooks, la API de mensajes y los eventos de Socket.IO
+que app.py, pero cada mensaje es una corrutina: Gemini, Twilio y el servicio
+de WhatsApp se consultan sin bloquear y la base de datos se usa desde un pool
+de hilos. El despacho de comandos es el mismo que en el modo síncrono.
+"""
+import os
+import json
+import uuid
+import sqlite3
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import socketio
+from aiohttp import web
+from flask import render_template
+
+import app as sync_app
+import bulk
+import delivery
+import gemini_assistant
+import inbound
+import metrics
+import pubsub
+import reminders
+import retention
+import write_behind
+
+# Máximo de mensajes procesándose a la vez en modo cola
+ASYNC_MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', 5000))
+# Hilos para la base de datos y el resto de llamadas bloqueantes
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', 32))
+
+sio = socketio.AsyncServer(async_mode='aiohttp',
+                           client_manager=pubsub.create_client_manager(async_mode=True))
+web_app = web.Application()
+sio.attach(web_app)
+
+_loop = None
+_tasks = set()
+_chat_locks = {}
+
+
+async def emit(event, data, to=None):
+    """Emite un evento de Socket.IO midiendo su duración"""
+    with metrics.span('socketio_emit', operation=event):
+        await sio.emit(event, data, to=to)
+
+
+async def emit_saved_message(message_data):
+    """Emite el mensaje completo a la sala del chat y un extracto a todos los clientes"""
+    await emit('new_message', message_data, to=sync_app.chat_room(message_data['chat_id']))
+    await emit('contact_update', sync_app.contact_update(message_data))
+
+
+def save_and_emit_message(platform, sender, chat_id, message, timestamp, is_from_assistant=False, stream_id=None):
+    """Guarda un mensaje y lo emite cuando su lote queda confirmado (se ejecuta en un hilo)"""
+    row = {
+        'platform': platform,
+        'sender': sender,
+        'chat_id': chat_id,
+        'message': message,
+        'timestamp': timestamp,
+        'is_from_assistant': is_from_assistant
+    }
+
+    def emit_saved(message_id):
+        message_data = {'id': message_id, **row}
+        if stream_id:
+            message_data['stream_id'] = stream_id
+        # El callback corre en el hilo de escritura: la emisión se programa en el bucle
+        asyncio.run_coroutine_threadsafe(emit_saved_message(message_data), _loop)
+
+    try:
+        write_behind.get_writer().insert('mensajes', row, callback=emit_saved)
+    except sqlite3.Error as e:
+        print(f"Error al guardar mensaje en la base de datos: {e}")
+
+
+def send_reminder(chat_id, text):
+    """Guarda un recordatorio de tareas y lo envía por WhatsApp (desde los hilos del programador)"""
+    save_and_emit_message('WhatsApp', 'Asistente', chat_id, text, datetime.now().isoformat(), True)
+    sync_app.deliver_text(sync_app.reminder_channel(), chat_id, text)
+
+
+async def save_and_emit_message_async(*args, **kwargs):
+    await asyncio.to_thread(save_and_emit_message, *args, **kwargs)
+
+
+@asynccontextmanager
+async def chat_order(chat_id):
+    """Serializa los mensajes de un mismo chat (asyncio.Lock atiende en orden de llegada)"""
+    entry = _chat_locks.get(chat_id)
+    if entry is None:
+        entry = _chat_locks[chat_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _chat_locks[chat_id]
+
+
+async def process_incoming_message(job):
+    """Procesa un mensaje entrante con el asistente, guarda la respuesta y la envía"""
+    with metrics.span('message', operation=f"async_{job['channel']}"):
+        respuesta = await gemini_assistant.procesar_mensaje_async(job['message'], job['chat_id'])
+
+        timestamp = datetime.now().isoformat()
+        await save_and_emit_message_async(job['platform'], 'Asistente', job['chat_id'], respuesta, timestamp, True)
+
+        if job['channel'] == 'twilio':
+            await delivery.send_twilio_message_async(job['chat_id'], respuesta)
+        elif job['channel'] == 'service':
+            await delivery.send_whatsapp_service_message_async(job['chat_id'], respuesta)
+
+    return respuesta
+
+
+async def _run_job(job):
+    try:
+        async with chat_order(job['chat_id']):
+            await process_incoming_message(job)
+    except Exception as e:
+        print(f"Error al procesar mensaje en segundo plano: {e}")
+
+
+def enqueue_message(job):
+    """Programa el mensaje en segundo plano; devuelve una respuesta 503 si hay demasiados en curso"""
+    if len(_tasks) >= ASYNC_MAX_IN_FLIGHT:
+        print("Mensaje rechazado por contrapresión: demasiados mensajes en curso")
+        return web.json_response({'error': 'Servicio saturado, inténtalo más tarde'}, status=503,
+                                 headers={'Retry-After': '5'})
+    task = asyncio.create_task(_run_job(job))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return None
+
+
+def deliver_deferred(job):
+    """Programa un mensaje que esperaba su turno; se llama desde el hilo del limitador.
+
+    Devuelve False si hay demasiados mensajes en curso para que el limitador
+    lo conserve y lo vuelva a intentar más tarde.
+    """
+    async def schedule():
+        return enqueue_message(job) is None
+    return asyncio.run_coroutine_threadsafe(schedule(), _loop).result()
+
+
+async def save_queued(accepted):
+    """Espera a `accepted` para un mensaje ya encolado: un error ya no debe rechazarlo"""
+    try:
+        await accepted()
+    except Exception as e:
+        print(f"Error al guardar un mensaje ya encolado: {e}")
+
+
+async def handle_job(job, accepted=None):
+    """Procesa el mensaje en línea o en segundo plano según QUEUE_MODE.
+
+    `accepted` es una corrutina que se espera sólo si el mensaje se acepta
+    (como en app.handle_job).
+    """
+    limiter = sync_app.chat_limiter
+    if limiter is not None:
+        try:
+            if not limiter.submit(job['chat_id'], job, deliver_deferred):
+                if accepted is not None:
+                    await save_queued(accepted)
+                return web.json_response({'status': 'queued'})
+        except inbound.ChatQueueFullError as e:
+            print(f"Mensaje rechazado por límite de tasa: {e}")
+            return web.json_response({'error': 'Demasiados mensajes seguidos, inténtalo más tarde'}, status=429,
+                                     headers={'Retry-After': str(max(1, math.ceil(e.retry_after)))})
+    if sync_app.QUEUE_MODE:
+        error = enqueue_message(job)
+        if error is not None:
+            return error
+        if accepted is not None:
+            await save_queued(accepted)
+        return web.json_response({'status': 'queued'})
+    if accepted is not None:
+        await accepted()
+    async with chat_order(job['chat_id']):
+        await process_incoming_message(job)
+    return None
+
+
+async def claim_webhook(message_id):
+    """Registra el identificador del proveedor; devuelve False si es un reintento ya atendido"""
+    if sync_app.WEBHOOK_DEDUP_PERSIST:
+        return await asyncio.to_thread(sync_app.claim_webhook, message_id)
+    return sync_app.claim_webhook(message_id)
+
+
+async def release_webhook(message_id):
+    """Permite reintentar un mensaje cuyo procesamiento falló"""
+    if sync_app.WEBHOOK_DEDUP_PERSIST:
+        await asyncio.to_thread(sync_app.release_webhook, message_id)
+    else:
+        sync_app.release_webhook(message_id)
+
+
+_index_html = None
+
+
+async def index(request):
+    """Ruta principal que muestra la interfaz web (misma plantilla que el modo síncrono)"""
+    global _index_html
+    if _index_html is None:
+        with sync_app.app.test_request_context('/'):
+            _index_html = render_template('index.html')
+    return web.Response(text=_index_html, content_type='text/html')
+
+
+async def get_messages(request):
+    """Obtiene los mensajes almacenados de forma paginada (mismos parámetros que /messages)"""
+    after_id = request.query.get('after_id')
+    try:
+        after_id = int(after_id) if after_id is not None else None
+    except ValueError:
+        after_id = None
+    limit = sync_app._parse_limit(request.query.get('limit'), sync_app.MESSAGES_PAGE_SIZE, sync_app.MESSAGES_MAX_PAGE_SIZE)
+    try:
+        result = await asyncio.to_thread(sync_app.query_messages, request.query.get('chat_id'),
+                                         request.query.get('before'), after_id, limit)
+    except ValueError:
+        return web.json_response({'error': 'Cursor inválido'}, status=400)
+    except sqlite3.Error as e:
+        print(f"Error al obtener mensajes: {e}")
+        return web.json_response({'error': 'Error en la base de datos'}, status=500)
+    return web.json_response(result)
+
+
+async def get_contacts(request):
+    """Obtiene un registro por chat con su último mensaje"""
+    limit = sync_app._parse_limit(request.query.get('limit'), sync_app.CONTACTS_PAGE_SIZE, sync_app.CONTACTS_PAGE_SIZE)
+    try:
+        result = await asyncio.to_thread(sync_app.query_contacts, limit)
+    except sqlite3.Error as e:
+        print(f"Error al obtener contactos: {e}")
+        return web.json_response({'error': 'Error en la base de datos'}, status=500)
+    return web.json_response(result)
+
+
+async def search_endpoint(request):
+    """Búsqueda de texto completo (mismos parámetros que /search)"""
+    limit = sync_app._parse_limit(request.query.get('limit'), sync_app.SEARCH_PAGE_SIZE, sync_app.SEARCH_MAX_PAGE_SIZE)
+    try:
+        result = await asyncio.to_thread(sync_app.query_search, request.query.get('q', ''),
+                                         request.query.get('chat_id'), request.query.get('type'), limit)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    except sqlite3.Error as e:
+        print(f"Error en la búsqueda: {e}")
+        return web.json_response({'error': 'Error en la base de datos'}, status=500)
+    return web.json_response(result)
+
+
+async def reports_status(request):
+    """Informes disponibles y estado de la copia columnar de finanzas"""
+    return web.json_response(await asyncio.to_thread(sync_app.report_status))
+
+
+async def report_endpoint(request):
+    """Informe de finanzas (mismos parámetros que /reports/<name>)"""
+    try:
+        result = await asyncio.to_thread(sync_app.query_report, request.match_info['name'], dict(request.query))
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    except sqlite3.Error as e:
+        print(f"Error al exportar las finanzas: {e}")
+        return web.json_response({'error': 'Error en la base de datos'}, status=500)
+    return web.json_response(result)
+
+
+async def retention_status(request):
+    """Políticas de retención, tamaño del archivo y espacio de la base de datos"""
+    return web.json_response(await asyncio.to_thread(retention.estado))
+
+
+async def archive_endpoint(request):
+    """Filas archivadas (mismos parámetros que /archive/<table>)"""
+    try:
+        result = await asyncio.to_thread(sync_app.query_archive, request.match_info['table'], dict(request.query))
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    except OSError as e:
+        print(f"Error al leer el archivo: {e}")
+        return web.json_response({'error': 'Error al leer el archivo'}, status=500)
+    return web.json_response(result)
+
+
+async def healthz(request):
+    """Comprobación de vida: el bucle de eventos atiende peticiones"""
+    return web.json_response({'status': 'ok'})
+
+
+async def readyz(request):
+    """Comprobación de disponibilidad (mismos criterios que /readyz del servidor con hilos)"""
+    ready, detail = await asyncio.to_thread(sync_app.readiness)
+    return web.json_response(detail, status=200 if ready else 503)
+
+
+async def prometheus_metrics(request):
+    """Expone histogramas de latencia por etapa y contadores en formato Prometheus"""
+    body = await asyncio.to_thread(metrics.REGISTRY.render)
+    return web.Response(text=body, content_type='text/plain', charset='utf-8')
+
+
+def queue_stats():
+    """Mensajes en curso en segundo plano (el equivalente de la cola del modo con hilos)"""
+    return {'enabled': sync_app.QUEUE_MODE, 'depth': len(_tasks), 'max_size': ASYNC_MAX_IN_FLIGHT}
+
+
+def _collect_queue_metrics():
+    yield 'assistant_queue_depth', 'Cola de procesamiento: depth', {}, len(_tasks)
+
+
+metrics.REGISTRY.registrar_recolector(_collect_queue_metrics)
+
+
+def stats_view(stats):
+    """Ruta que devuelve `stats()` como JSON (los mismos contadores que en app.py)"""
+    async def view(request):
+        return web.json_response(stats())
+    return view
+
+
+def make_bulk_handler(deliver=None):
+    """Como app.make_bulk_handler, pero guarda, emite y procesa en el bucle (desde los hilos del lote)"""
+    def handler(item):
+        platform = item.get('platform', 'WhatsApp')
+        timestamp = item.get('timestamp') or datetime.now().isoformat()
+        save_and_emit_message(platform, item.get('sender', item['chat_id']), item['chat_id'], item['message'], timestamp)
+        job = {'channel': deliver, 'platform': platform, 'chat_id': item['chat_id'], 'message': item['message']}
+        return asyncio.run_coroutine_threadsafe(process_incoming_message(job), _loop).result()
+    return handler
+
+
+async def bulk_messages(request):
+    """Procesa un lote de mensajes en paralelo (mismos parámetros y formato que /messages/bulk)"""
+    concurrency = sync_app._parse_limit(request.query.get('concurrency'), sync_app.BULK_CONCURRENCY,
+                                        sync_app.BULK_MAX_CONCURRENCY)
+    deliver = request.query.get('deliver')
+    if deliver not in (None, 'service', 'twilio'):
+        return web.json_response({'error': 'deliver debe ser service o twilio'}, status=400)
+
+    if request.content_type == 'application/json':
+        try:
+            items = sync_app.bulk_items(await request.json())
+        except ValueError:
+            items = None
+        if items is None:
+            return web.json_response({'error': 'Se esperaba una lista de mensajes'}, status=400)
+    else:
+        items = bulk.leer_jsonl((await request.text()).splitlines())
+
+    # El lote se procesa en sus propios hilos; cada evento se espera fuera del bucle
+    events = bulk.procesar_lote(items, make_bulk_handler(deliver), concurrency)
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    try:
+        while True:
+            event = await asyncio.to_thread(next, events, None)
+            if event is None:
+                break
+            await response.write((json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8'))
+    finally:
+        # Si el cliente se desconecta no se aceptan más mensajes del lote
+        await asyncio.to_thread(events.close)
+    await response.write_eof()
+    return response
+
+
+async def whatsapp_webhook(request):
+    """Webhook para recibir mensajes de WhatsApp (Twilio)"""
+    message_sid = None
+    dispatched = False
+    try:
+        with metrics.span('parse', operation='twilio'):
+            form = await request.post()
+            message_sid = form.get('MessageSid')
+            from_number = form.get('From', '').replace('whatsapp:', '')
+            body = form.get('Body', '')
+
+        # Twilio reintenta si el webhook tarda: el reintento no se vuelve a procesar
+        if not await claim_webhook(message_sid):
+            return web.json_response({'status': 'duplicate'})
+
+        timestamp = datetime.now().isoformat()
+
+        async def save():
+            nonlocal dispatched
+            await save_and_emit_message_async('WhatsApp', from_number, from_number, body, timestamp)
+            dispatched = True
+
+        response = await handle_job({
+            'channel': 'twilio',
+            'platform': 'WhatsApp',
+            'chat_id': from_number,
+            'message': body
+        }, save)
+        if response is not None and sync_app.rejected(response.status):
+            # Rechazado antes de procesarlo: el reintento de Twilio debe atenderse
+            await release_webhook(message_sid)
+        return response or web.json_response({'status': 'success'})
+    except Exception as e:
+        if dispatched:
+            # El asistente pudo ejecutar ya el comando: el reintento no debe repetirlo
+            print(f"Error al procesar o responder el mensaje {message_sid} de WhatsApp: {e}")
+        else:
+            print(f"Error en webhook de WhatsApp: {e}")
+            await release_webhook(message_sid)
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def whatsapp_message(request):
+    """Endpoint para recibir mensajes de WhatsApp (servicio personalizado)"""
+    with metrics.span('parse', operation='service'):
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        completo = isinstance(data, dict) and all(
+            key in data for key in ['platform', 'sender', 'chat_id', 'message', 'timestamp'])
+    if not completo:
+        return web.json_response({'error': 'Datos incompletos'}, status=400)
+
+    # El servicio puede mandar un identificador opcional para deduplicar reenvíos
+    message_id = data.get('message_id')
+    if not await claim_webhook(message_id):
+        return web.json_response({'status': 'duplicate'})
+
+    # Los mensajes de WhatsApp se guardan cuando se aceptan
+    async def save():
+        await save_and_emit_message_async(data['platform'], data['sender'], data['chat_id'],
+                                          data['message'], data['timestamp'])
+
+    if data['platform'] != 'WhatsApp':
+        await save()
+
+    if data['platform'] == 'WhatsApp':
+        try:
+            response = await handle_job({
+                'channel': 'service',
+                'platform': data['platform'],
+                'chat_id': data['chat_id'],
+                'message': data['message']
+            }, save)
+            if response is not None:
+                if sync_app.rejected(response.status):
+                    await release_webhook(message_id)
+                return response
+        except Exception as e:
+            print(f"Error al procesar mensaje con el asistente: {e}")
+
+    return web.json_response({'status': 'ok'})
+
+
+@sio.on('join_chat')
+async def handle_join_chat(sid, data):
+    """Suscribe al cliente a los mensajes del chat que está viendo"""
+    chat_id = (data or {}).get('chat_id')
+    if chat_id:
+        await sio.enter_room(sid, sync_app.chat_room(chat_id))
+
+
+@sio.on('leave_chat')
+async def handle_leave_chat(sid, data):
+    """Deja de enviar al cliente los mensajes de un chat"""
+    chat_id = (data or {}).get('chat_id')
+    if chat_id:
+        await sio.leave_room(sid, sync_app.chat_room(chat_id))
+
+
+@sio.on('send_message')
+async def handle_send_message(sid, data):
+    """Maneja el envío de mensajes desde la interfaz web"""
+    with metrics.span('parse', operation='socket'):
+        platform = data.get('platform')
+        chat_id = data.get('chat_id')
+        message = data.get('message')
+
+    if not all([platform, chat_id, message]):
+        print("Error: Datos incompletos en send_message")
+        return
+
+    if platform != 'WhatsApp':
+        return
+
+    try:
+        await delivery.send_whatsapp_service_message_async(chat_id, message)
+    except Exception as e:
+        print(f"Error al enviar mensaje a WhatsApp: {e}")
+        return
+
+    stream_id = None
+    on_chunk = None
+    if sync_app.STREAMING_ENABLED:
+        stream_id = uuid.uuid4().hex
+
+        async def on_chunk(chunk):
+            await emit('message_chunk', {'stream_id': stream_id, 'chat_id': chat_id, 'chunk': chunk},
+                       to=sync_app.chat_room(chat_id))
+
+    with metrics.span('message', operation='async_socket'):
+        respuesta = await gemini_assistant.procesar_mensaje_async(message, chat_id, on_chunk)
+
+    timestamp = datetime.now().isoformat()
+    await save_and_emit_message_async(platform, 'Asistente', chat_id, respuesta, timestamp,
+                                      is_from_assistant=True, stream_id=stream_id)
+
+
+async def _on_startup(application):
+    global _loop
+    _loop = asyncio.get_running_loop()
+    _loop.set_default_executor(ThreadPoolExecutor(ASYNC_DB_THREADS, thread_name_prefix='async-db'))
+    # Los recordatorios emiten en el bucle: el programador arranca cuando ya existe
+    reminders.iniciar(send_reminder)
+    retention.iniciar()
+    sync_app.start_warm_up(async_mode=True)
+
+
+async def _on_cleanup(application):
+    if _tasks:
+        await asyncio.gather(*_tasks, return_exceptions=True)
+    await asyncio.to_thread(reminders.detener)
+    await asyncio.to_thread(retention.detener)
+    await delivery.close_async_clients()
+
+
+web_app.router.add_get('/', index)
+web_app.router.add_get('/messages', get_messages)
+web_app.router.add_get('/contacts', get_contacts)
+web_app.router.add_get('/search', search_endpoint)
+web_app.router.add_get('/reports', reports_status)
+web_app.router.add_get('/reports/{name}', report_endpoint)
+web_app.router.add_get('/retention', retention_status)
+web_app.router.add_get('/archive/{table}', archive_endpoint)
+web_app.router.add_get('/metrics', prometheus_metrics)
+web_app.router.add_get('/healthz', healthz)
+web_app.router.add_get('/readyz', readyz)
+web_app.router.add_get('/inbound/metrics', stats_view(sync_app.inbound_stats))
+web_app.router.add_get('/queue/metrics', stats_view(queue_stats))
+web_app.router.add_get('/intent-cache/metrics', stats_view(sync_app.intent_cache_stats))
+web_app.router.add_get('/classifier/metrics', stats_view(sync_app.classifier_stats))
+web_app.router.add_get('/context/metrics', stats_view(sync_app.context_stats))
+web_app.router.add_get('/db/metrics', stats_view(lambda: write_behind.get_writer().stats()))
+web_app.router.add_get('/delivery/metrics', stats_view(delivery.stats))
+web_app.router.add_post('/messages/bulk', bulk_messages)
+web_app.router.add_post('/whatsapp/webhook', whatsapp_webhook)
+web_app.router.add_post('/whatsapp_message', whatsapp_message)
+web_app.router.add_static('/static', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+web_app.on_startup.append(_on_startup)
+web_app.on_cleanup.append(_on_cleanup)
+
+
+def run(host='0.0.0.0', port=5000):
+    sync_app.init_db()
+    gemini_assistant.init_db()
+    retention.init_db()
+    print(f"Iniciando servidor asyncio en el puerto {port}...")
+    web.run_app(web_app, host=host, port=port, backlog=1024)
+
+
+if __name__ == '__main__':
+    run(port=int(os.getenv('PORT', 5000)))
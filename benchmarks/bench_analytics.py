@@ -0,0 +1,131 @@
+"""Mide la exportación columnar de finanzas y la latencia de los informes.
+
+Uso:
+    python benchmarks/bench_analytics.py [--rows 1000000,5000000] [--repeat 20] [--json resultados.json]
+
+Llena la tabla finanzas con movimientos sintéticos de 10.000 usuarios a lo
+largo de tres años, exporta de forma incremental en cada tamaño y compara
+cada informe con el GROUP BY equivalente sobre SQLite (comprobando que los
+totales coinciden).
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import percentil
+
+CHATS = 10000
+CATEGORIAS = ("comida", "transporte", "renta", "servicios", "salud", "ocio", "ropa", "educación",
+              "regalos", "mascotas", "viajes", "hogar", "salario", "freelance", "ventas")
+INICIO = date(2023, 1, 1)
+DIAS = 3 * 365
+
+
+def poblar(storage, desde, hasta, rng):
+    def fila(i):
+        ingreso = rng.random() < 0.1
+        categoria = rng.choice(CATEGORIAS[12:] if ingreso else CATEGORIAS[:12])
+        # Unos pocos gastos desproporcionados para el informe de anomalías
+        monto = round(rng.lognormvariate(6 if ingreso else 4, 0.5) * (20 if rng.random() < 0.0005 else 1), 2)
+        fecha = (INICIO + timedelta(days=rng.randrange(DIAS))).isoformat()
+        return (f"52155{i % CHATS:06d}", "ingreso" if ingreso else "gasto", monto, categoria, None, fecha)
+
+    with storage.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO finanzas (chat_id, tipo, monto, categoria, descripcion, fecha) VALUES (?, ?, ?, ?, ?, ?)",
+            (fila(i) for i in range(desde, hasta))
+        )
+
+
+def medir(funcion, repeticiones):
+    latencias = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        latencias.append(time.perf_counter() - inicio)
+    return resultado, {
+        "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="1000000,5000000")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="bench-analytics-")
+    os.environ["ASSISTANT_DB_PATH"] = os.path.join(carpeta, "bench.db")
+    os.environ["ANALYTICS_DIR"] = os.path.join(carpeta, "analytics")
+    import analytics
+    import gemini_assistant
+    import storage
+    gemini_assistant.init_db()
+
+    def sql(consulta):
+        def ejecutar():
+            with storage.connection() as conn:
+                return conn.execute(consulta).fetchall()
+        return ejecutar
+
+    informes = {
+        "tendencia": (lambda: analytics.informe("tendencia"),
+                      sql("SELECT substr(fecha, 1, 7) AS mes, SUM(CASE WHEN tipo = 'gasto' THEN monto END), "
+                          "COUNT(DISTINCT chat_id) FROM finanzas GROUP BY mes ORDER BY mes")),
+        "categorias": (lambda: analytics.informe("categorias", limite=20),
+                       sql("SELECT categoria, SUM(monto), COUNT(DISTINCT chat_id) FROM finanzas "
+                           "WHERE tipo = 'gasto' GROUP BY categoria ORDER BY 2 DESC")),
+        "anomalias": (lambda: analytics.informe("anomalias", limite=50), None),
+        "tendencia_chat": (lambda: analytics.informe("tendencia", chat_id="52155000042"),
+                           sql("SELECT substr(fecha, 1, 7) AS mes, SUM(CASE WHEN tipo = 'gasto' THEN monto END) "
+                               "FROM finanzas WHERE chat_id = '52155000042' GROUP BY mes")),
+    }
+
+    rng = random.Random(11)
+    resultados = []
+    actuales = 0
+    print(f"{'filas':>10} {'informe':<15} {'columnar p50':>13} {'p95':>9} {'sqlite p50':>11}")
+    for total in (int(n) for n in args.rows.split(",")):
+        inicio = time.perf_counter()
+        poblar(storage, actuales, total, rng)
+        carga = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        resumen = analytics.exportar()
+        exportacion = time.perf_counter() - inicio
+        actuales = total
+        print(f"{'':>10} (carga de {total:,} filas: {carga:.1f} s; exportación de "
+              f"{resumen['exportadas']:,}: {exportacion:.2f} s)")
+
+        for nombre, (columnar, consulta) in informes.items():
+            informe, tiempos = medir(columnar, args.repeat)
+            resultado = {"rows": total, "report": nombre, **tiempos}
+            if consulta is not None:
+                filas, tiempos_sql = medir(consulta, max(1, args.repeat // 10))
+                resultado["sqlite_p50_ms"] = tiempos_sql["p50_ms"]
+                clave = "gastos" if nombre.startswith("tendencia") else "total"
+                esperado = round(sum(fila[1] or 0 for fila in filas), 0)
+                obtenido = round(sum(r[clave] for r in informe["result"]), 0)
+                assert abs(esperado - obtenido) <= 1, (nombre, esperado, obtenido)
+            resultados.append(resultado)
+            print(f"{total:>10} {nombre:<15} {resultado['p50_ms']:>13} {resultado['p95_ms']:>9} "
+                  f"{resultado.get('sqlite_p50_ms', '-'):>11}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
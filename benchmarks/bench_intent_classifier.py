@@ -0,0 +1,85 @@
+"""Evalúa el clasificador local de intenciones contra el corpus etiquetado.
+
+Uso:
+    python benchmarks/bench_intent_classifier.py [--corpus RUTA] [--umbral 0.9] [--repeticiones 200]
+
+Cada línea del corpus es un objeto JSON con `mensaje` y `esperado`, donde
+`esperado` es el texto del comando en el protocolo del asistente o null si
+el mensaje debe derivarse a Gemini.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent_classifier import ClasificadorLocal
+
+CORPUS_PREDETERMINADO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_corpus.jsonl')
+
+
+def cargar_corpus(ruta):
+    with open(ruta, encoding='utf-8') as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', default=CORPUS_PREDETERMINADO)
+    parser.add_argument('--umbral', type=float, default=0.9)
+    parser.add_argument('--repeticiones', type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = cargar_corpus(args.corpus)
+    clasificador = ClasificadorLocal(umbral=args.umbral)
+
+    correctos = locales_correctos = locales = esperados_locales = 0
+    errores = []
+    for ejemplo in corpus:
+        resultado = clasificador.clasificar(ejemplo['mensaje'])
+        obtenido = resultado.texto if resultado else None
+        esperado = ejemplo['esperado']
+
+        if esperado is not None:
+            esperados_locales += 1
+        if resultado is not None:
+            locales += 1
+            if obtenido == esperado:
+                locales_correctos += 1
+        if obtenido == esperado:
+            correctos += 1
+        else:
+            errores.append((ejemplo['mensaje'], esperado, obtenido))
+
+    # Latencia por mensaje
+    tiempos = []
+    for _ in range(args.repeticiones):
+        for ejemplo in corpus:
+            inicio = time.perf_counter()
+            clasificador.clasificar(ejemplo['mensaje'])
+            tiempos.append((time.perf_counter() - inicio) * 1e6)
+
+    print(f"Ejemplos: {len(corpus)}  (umbral {args.umbral})")
+    print(f"Exactitud total: {correctos / len(corpus):.1%}")
+    print(f"Precisión local: {locales_correctos / locales:.1%}" if locales else "Precisión local: n/a")
+    print(f"Cobertura local: {locales_correctos}/{esperados_locales} comandos resueltos sin Gemini")
+    print(f"Latencia (µs): p50={percentil(tiempos, 50):.1f} p95={percentil(tiempos, 95):.1f} p99={percentil(tiempos, 99):.1f}")
+
+    if errores:
+        print("\nDiscrepancias:")
+        for mensaje, esperado, obtenido in errores:
+            print(f"- {mensaje!r}: esperado={esperado!r} obtenido={obtenido!r}")
+
+    return 0 if locales_correctos == locales else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
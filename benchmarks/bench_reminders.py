@@ -0,0 +1,128 @@
+"""Mide el programador de recordatorios con cientos de miles de tareas pendientes.
+
+Uso:
+    python benchmarks/bench_reminders.py [--tasks 300000] [--days 90] [--max-loaded 50000] [--json resultados.json]
+
+Reparte las tareas entre `--days` fechas límite y mide la primera carga del
+montículo, la memoria que ocupa, el tiempo hasta enviar todos los avisos de
+un día (reclamados en lote y agrupados por chat) y el coste de los avisos
+de agregar_tarea/completar_tarea.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import percentil
+
+CHATS = 5000
+
+
+def poblar(storage, total, dias, hoy):
+    fechas = [(hoy + timedelta(days=d + 1)).strftime("%Y-%m-%d") for d in range(dias)]
+    with storage.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO tareas (chat_id, titulo, fecha_creacion, fecha_limite, prioridad) VALUES (?, ?, ?, ?, ?)",
+            ((f"52155500{i % CHATS:04d}", f"tarea {i}", hoy.strftime("%Y-%m-%d"), fechas[i % dias], "media")
+             for i in range(total))
+        )
+
+
+def esperar(condicion, limite=120):
+    inicio = time.perf_counter()
+    while not condicion():
+        if time.perf_counter() - inicio > limite:
+            raise TimeoutError("el programador no terminó a tiempo")
+        time.sleep(0.005)
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=300000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--max-loaded", type=int, default=50000)
+    parser.add_argument("--hooks", type=int, default=2000)
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    os.environ["ASSISTANT_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench-reminders-"), "bench.db")
+    import gemini_assistant
+    import reminders
+    import storage
+    gemini_assistant.init_db()
+
+    hoy = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    inicio = time.perf_counter()
+    poblar(storage, args.tasks, args.days, hoy)
+    print(f"carga de {args.tasks:,} tareas: {time.perf_counter() - inicio:.1f} s")
+
+    reloj = [hoy]
+    mensajes = []
+    lock = threading.Lock()
+
+    def entregar(chat_id, texto):
+        with lock:
+            mensajes.append(chat_id)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    programador = reminders.ProgramadorRecordatorios(entregar, max_cargadas=args.max_loaded,
+                                                      reloj=lambda: reloj[0])
+    reminders.programador = programador
+    programador.iniciar()
+    primera_carga = esperar(lambda: programador.stats()["loads"] > 0)
+    estado = programador.stats()
+    memoria = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    latencias = []
+    fecha = (hoy + timedelta(days=2)).strftime("%Y-%m-%d")
+    for i in range(args.hooks):
+        t = time.perf_counter()
+        reminders.tarea_agregada(10 ** 9 + i, fecha)
+        reminders.tarea_completada(10 ** 9 + i)
+        latencias.append(time.perf_counter() - t)
+
+    # A las 9:00 vencen los avisos de las tareas de mañana
+    a_enviar = len(range(0, args.tasks, args.days))
+    inicio = time.perf_counter()
+    reloj[0] = hoy.replace(hour=9, minute=1)
+    with programador._lock:
+        programador._despertar.notify()
+    esperar(lambda: programador.stats()["claimed"] >= a_enviar)
+    programador.detener()  # espera a que terminen los envíos
+    envio = time.perf_counter() - inicio
+
+    final = programador.stats()
+    resultado = {
+        "tasks": args.tasks,
+        "loaded": estado["loaded"],
+        "first_load_ms": round(primera_carga * 1000, 1),
+        "heap_memory_mb": round(memoria / 1e6, 2),
+        "reminders_due": a_enviar,
+        "send_all_ms": round(envio * 1000, 1),
+        "messages": final["sent"],
+        "hook_p50_us": round(percentil(latencias, 50) * 1e6, 1),
+        "hook_p99_us": round(percentil(latencias, 99) * 1e6, 1),
+    }
+    for clave, valor in resultado.items():
+        print(f"{clave:>16}: {valor}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
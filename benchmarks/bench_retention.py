@@ -0,0 +1,177 @@
+"""Mide la deduplicación, el archivo y el vacuum incremental de mensajes y conversaciones.
+
+Uso:
+    python benchmarks/bench_retention.py [--conversations 100000] [--days 730] [--keep-days 180] [--json resultados.json]
+
+Llena mensajes y conversaciones con el historial sintético de 3.000 chats
+repartido en `--days` días (cada conversación guarda el mensaje del usuario
+y la respuesta, como la aplicación) y mide el tamaño de la base de datos:
+al principio, tras deduplicar y tras archivar lo anterior a `--keep-days`
+días. Comprueba que el contexto, la búsqueda y el archivo devuelven el
+mismo texto que se insertó y mide la latencia de las lecturas del archivo.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import percentil
+
+CHATS = 3000
+PALABRAS = ("gasto comida transporte renta tarea informe reunión proyecto recordar pagar factura "
+            "luz agua internet médico farmacia supermercado cena viaje hotel vuelo regalo cumpleaños "
+            "presupuesto ahorro quincena salario cliente entrega revisión correo llamada").split()
+
+
+def frase(rng, palabras):
+    return " ".join(rng.choice(PALABRAS) for _ in range(palabras)).capitalize() + "."
+
+
+def poblar(storage, total, dias, rng):
+    """Devuelve una muestra {conversacion_id: (chat_id, mensaje, respuesta)} para comprobar el texto"""
+    inicio = datetime.now() - timedelta(days=dias)
+    paso = dias * 86400 / total
+    mensajes, conversaciones = [], []
+    for i in range(total):
+        chat_id = f"52155{rng.randrange(CHATS):06d}"
+        momento = inicio + timedelta(seconds=i * paso)
+        texto = frase(rng, rng.randint(6, 25))
+        respuesta = frase(rng, rng.randint(15, 80))
+        mensajes.append(("WhatsApp", chat_id, chat_id, texto, momento.isoformat(), False))
+        conversaciones.append((chat_id, texto, respuesta, (momento + timedelta(seconds=1)).isoformat()))
+        mensajes.append(("WhatsApp", "Asistente", chat_id, respuesta, (momento + timedelta(seconds=2)).isoformat(), True))
+    with storage.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO mensajes (platform, sender, chat_id, message, timestamp, is_from_assistant) "
+            "VALUES (?, ?, ?, ?, ?, ?)", mensajes
+        )
+        conn.executemany(
+            "INSERT INTO conversaciones (chat_id, mensaje, respuesta, timestamp) VALUES (?, ?, ?, ?)",
+            conversaciones
+        )
+    return {i + 1: conversaciones[i][:3] for i in rng.sample(range(total), min(200, total))}
+
+
+def tamano(storage):
+    with storage.connection() as conn:
+        pagina = conn.execute("PRAGMA page_size").fetchone()[0]
+        paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+        libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return round(pagina * paginas / 1e6, 1), round(pagina * libres / 1e6, 1)
+
+
+def medir(funcion, repeticiones):
+    latencias = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        latencias.append(time.perf_counter() - inicio)
+    return {"p50_ms": round(percentil(latencias, 50) * 1000, 2), "p95_ms": round(percentil(latencias, 95) * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--keep-days", type=int, default=180)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="bench-retention-")
+    os.environ["ASSISTANT_DB_PATH"] = os.path.join(carpeta, "bench.db")
+    os.environ["ARCHIVE_DIR"] = os.path.join(carpeta, "archive")
+    import app
+    import conversation_context
+    import gemini_assistant
+    import retention
+    import search
+    import storage
+    app.init_db()
+    gemini_assistant.init_db()
+    retention.init_db()
+
+    rng = random.Random(5)
+    inicio = time.perf_counter()
+    muestra = poblar(storage, args.conversations, args.days, rng)
+    print(f"carga de {args.conversations:,} conversaciones: {time.perf_counter() - inicio:.1f} s")
+    resultado = {"conversations": args.conversations, "initial_mb": tamano(storage)[0]}
+
+    # 1. Deduplicación (sin políticas activas)
+    sin_politicas = {t: retention.Politica(t) for t in retention.TABLAS}
+    proceso = retention.Retencion(sin_politicas, directorio=os.environ["ARCHIVE_DIR"])
+    inicio = time.perf_counter()
+    resumen = proceso.ciclo()
+    resultado["dedup_s"] = round(time.perf_counter() - inicio, 2)
+    resultado["linked"] = resumen["linked"]
+    resultado["after_dedup_mb"], resultado["after_dedup_free_mb"] = tamano(storage)
+
+    contexto = conversation_context.ContextoConversaciones(turnos=1000)
+    for conversacion_id, (chat_id, mensaje, respuesta) in list(muestra.items())[:50]:
+        assert (mensaje, respuesta) in contexto._cargar(chat_id)["turnos"], conversacion_id
+        encontrados = search.buscar(mensaje, chat_id, ("conversaciones",), limite=50)["conversaciones"]
+        assert any(f["id"] == conversacion_id and f["respuesta"] == respuesta for f in encontrados), conversacion_id
+
+    # 2. Archivo de lo anterior a --keep-days
+    politicas = {t: retention.Politica(t, args.keep_days, "archive") for t in ("conversaciones", "mensajes")}
+    proceso = retention.Retencion(politicas, directorio=os.environ["ARCHIVE_DIR"])
+    inicio = time.perf_counter()
+    resumen = proceso.ciclo()
+    resultado["archive_s"] = round(time.perf_counter() - inicio, 2)
+    resultado["archived"] = resumen["archived"]
+    resultado["restored"] = resumen["restored"]
+    resultado["freed_pages"] = resumen["freed_pages"]
+    resultado["after_archive_mb"], resultado["after_archive_free_mb"] = tamano(storage)
+    estado = retention.estado(os.environ["ARCHIVE_DIR"])["archive"]
+    resultado["archive_mb"] = round(sum(e["bytes"] for e in estado.values()) / 1e6, 1)
+
+    with storage.connection() as conn:
+        vivas = conn.execute("SELECT COUNT(*) FROM conversaciones").fetchone()[0]
+    assert vivas + estado["conversaciones"]["rows"] == args.conversations
+    for conversacion_id, (chat_id, mensaje, respuesta) in muestra.items():
+        fila = retention.buscar_id("conversaciones", conversacion_id, os.environ["ARCHIVE_DIR"])
+        if fila is None:
+            continue
+        assert (fila["chat_id"], fila["mensaje"], fila["respuesta"]) == (chat_id, mensaje, respuesta)
+    # Lo que sigue en la base de datos conserva su texto aunque sus mensajes se hayan archivado
+    for conversacion_id, (chat_id, mensaje, respuesta) in muestra.items():
+        encontrados = search.buscar(mensaje, chat_id, ("conversaciones",), limite=50)["conversaciones"]
+        if any(f["id"] == conversacion_id for f in encontrados):
+            assert any(f["id"] == conversacion_id and f["mensaje"] == mensaje for f in encontrados)
+
+    chats = [f"52155{i:06d}" for i in rng.sample(range(CHATS), 20)]
+    directorio = os.environ["ARCHIVE_DIR"]
+    lecturas = {
+        "chat_page": lambda: retention.leer("mensajes", rng.choice(chats), limite=50, directorio=directorio),
+        "chat_month": lambda: retention.leer("mensajes", rng.choice(chats), *_mes(args), limite=500,
+                                             directorio=directorio),
+        "by_id": lambda: retention.buscar_id("mensajes", rng.randrange(1, estado["mensajes"]["last_id"] or 2),
+                                             directorio),
+    }
+    for nombre, lectura in lecturas.items():
+        resultado[f"read_{nombre}"] = medir(lectura, args.repeat)
+
+    for clave, valor in resultado.items():
+        print(f"{clave:>22}: {valor}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+def _mes(args):
+    """Rango de un mes en medio del periodo archivado"""
+    mitad = datetime.now() - timedelta(days=(args.days + args.keep_days) / 2)
+    return mitad.strftime("%Y-%m"), mitad.strftime("%Y-%m")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
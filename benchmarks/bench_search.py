@@ -0,0 +1,116 @@
+"""Mide la latencia de la búsqueda de texto completo según crece el historial.
+
+Uso:
+    python benchmarks/bench_search.py [--rows 10000,100000,1000000] [--queries 200] [--json resultados.json]
+
+Llena la tabla de mensajes con texto sintético (los índices FTS5 se
+mantienen con los triggers) y compara la búsqueda con el índice frente a la
+antigua búsqueda con LIKE '%...%' en cada tamaño.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import percentil
+
+PALABRAS = (
+    "hola gracias mañana reunión pagar renta comprar pan leche café tarea informe proyecto cliente "
+    "factura banco tarjeta cena película viaje hotel vuelo médico cita dentista gimnasio regalo "
+    "cumpleaños familia trabajo oficina correo llamada mensaje semana mes lunes viernes"
+).split()
+CHATS = 500
+
+
+def poblar(storage, desde, hasta, rng):
+    filas = (
+        ("WhatsApp", f"usuario{i % CHATS}", f"52155500{i % CHATS:04d}",
+         " ".join(rng.choice(PALABRAS) for _ in range(rng.randint(4, 16))) + f" ref{i}",
+         f"2025-01-01T00:00:{i % 60:02d}", i % 2)
+        for i in range(desde, hasta)
+    )
+    with storage.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO mensajes (platform, sender, chat_id, message, timestamp, is_from_assistant) VALUES (?, ?, ?, ?, ?, ?)",
+            filas
+        )
+
+
+def medir(funcion, consultas):
+    latencias = []
+    for consulta in consultas:
+        inicio = time.perf_counter()
+        funcion(*consulta)
+        latencias.append(time.perf_counter() - inicio)
+    return {
+        "p50_ms": round(percentil(latencias, 50) * 1000, 3),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 3),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="10000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    os.environ["ASSISTANT_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench-search-"), "bench.db")
+    import app
+    import search
+    import storage
+    app.init_db()
+
+    def con_like(texto, chat_id):
+        with storage.connection() as conn:
+            conn.execute(
+                "SELECT * FROM mensajes WHERE chat_id = ? AND message LIKE ? ORDER BY timestamp DESC LIMIT 20",
+                (chat_id, f"%{texto}%")
+            ).fetchall()
+
+    def con_like_global(texto, chat_id):
+        with storage.connection() as conn:
+            conn.execute("SELECT * FROM mensajes WHERE message LIKE ? LIMIT 20", (f"%{texto}%",)).fetchall()
+
+    def con_fts(texto, chat_id):
+        search.buscar(texto, chat_id, ("mensajes",), 20)
+
+    def con_fts_global(texto, chat_id):
+        search.buscar(texto, None, ("mensajes",), 20)
+
+    rng = random.Random(7)
+    resultados = []
+    actuales = 0
+    print(f"{'filas':>10} {'método':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for total in (int(n) for n in args.rows.split(",")):
+        inicio = time.perf_counter()
+        poblar(storage, actuales, total, rng)
+        carga = time.perf_counter() - inicio
+        actuales = total
+        consultas = [(" ".join(rng.sample(PALABRAS, 2)), f"52155500{rng.randrange(CHATS):04d}")
+                     for _ in range(args.queries)]
+        # Una palabra rara: sin coincidencias en la mayoría de las filas
+        raras = [(f"ref{rng.randrange(total)}", None) for _ in range(args.queries)]
+        for metodo, funcion, lote in (("fts_chat", con_fts, consultas), ("like_chat", con_like, consultas),
+                                      ("fts_global", con_fts_global, raras), ("like_global", con_like_global, raras)):
+            resultado = {"rows": total, "method": metodo, **medir(funcion, lote)}
+            resultados.append(resultado)
+            print(f"{total:>10} {metodo:<12} {resultado['p50_ms']:>9} {resultado['p95_ms']:>9} {resultado['p99_ms']:>9}")
+        print(f"{'':>10} (carga de {total:,} filas: {carga:.1f} s)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
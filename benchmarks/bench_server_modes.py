@@ -0,0 +1,193 @@
+"""Compara el servidor con hilos (Flask) y el servidor asyncio (aiohttp).
+
+Uso:
+    python benchmarks/bench_server_modes.py [--requests 1000] [--concurrency 50,200,1000]
+                                            [--sync-threads 32] [--gemini-latency 0.5]
+                                            [--service-latency 0.05] [--json resultados.json]
+
+Levanta ambos servidores en puertos locales con Gemini y el servicio de
+WhatsApp simulados y envía mensajes a /whatsapp_message con distintos
+niveles de concurrencia. El servidor con hilos atiende con un pool fijo de
+--sync-threads hilos, como un despliegue con gunicorn --threads.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes
+from load_test import percentil
+
+
+def preparar(args):
+    directorio = tempfile.mkdtemp(prefix="bench-modes-")
+    os.environ["ASSISTANT_DB_PATH"] = os.path.join(directorio, "bench.db")
+    os.environ["QUEUE_MODE"] = "False"
+    # Todas las peticiones pasan por Gemini
+    os.environ["LOCAL_CLASSIFIER_ENABLED"] = "False"
+    os.environ["INTENT_CACHE_ENABLED"] = "False"
+    os.environ["DELIVERY_POOL_SIZE"] = str(max(args.niveles))
+
+    fakes.instalar(gemini_latencia=args.gemini_latency, twilio_latencia=0.0)
+    _, url = fakes.iniciar_servicio_whatsapp(args.service_latency)
+    os.environ["WHATSAPP_SERVICE_URL"] = url
+
+    import app
+    import gemini_assistant
+    app.init_db()
+    gemini_assistant.init_db()
+    return app
+
+
+def iniciar_sync(app, hilos):
+    """Servidor WSGI que atiende las peticiones con un pool fijo de hilos"""
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class SilentHandler(WSGIRequestHandler):
+        def log(self, *args):
+            pass
+
+    class PoolWSGIServer(BaseWSGIServer):
+        request_queue_size = 1024
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.executor = ThreadPoolExecutor(hilos, thread_name_prefix="sync-http")
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self._atender, request, client_address)
+
+        def _atender(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    servidor = PoolWSGIServer("127.0.0.1", 0, app.app, handler=SilentHandler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{servidor.server_port}"
+
+
+def iniciar_async():
+    """Arranca el servidor aiohttp en un bucle de eventos propio; devuelve la URL y cómo detenerlo"""
+    import async_app
+    from aiohttp import web
+
+    listo = threading.Event()
+    estado = {}
+
+    def ejecutar():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(async_app.web_app)
+        loop.run_until_complete(runner.setup())
+        sitio = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+        loop.run_until_complete(sitio.start())
+        estado["url"] = f"http://127.0.0.1:{sitio._server.sockets[0].getsockname()[1]}"
+        estado["detener"] = lambda: asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        listo.set()
+        loop.run_forever()
+
+    threading.Thread(target=ejecutar, daemon=True).start()
+    listo.wait()
+    return estado["url"], estado["detener"]
+
+
+async def _generar_carga(url, total, concurrencia):
+    import aiohttp
+
+    latencias = []
+    errores = 0
+    semaforo = asyncio.Semaphore(concurrencia)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as sesion:
+        async def peticion(i):
+            nonlocal errores
+            chat = f"52155500{i % concurrencia:04d}"
+            async with semaforo:
+                inicio = time.perf_counter()
+                try:
+                    async with sesion.post(f"{url}/whatsapp_message", json={
+                        "platform": "WhatsApp",
+                        "sender": chat,
+                        "chat_id": chat,
+                        "message": f"hola {i}",
+                        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    }) as respuesta:
+                        await respuesta.read()
+                        if respuesta.status >= 400:
+                            errores += 1
+                except Exception:
+                    errores += 1
+                latencias.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(peticion(i) for i in range(total)))
+        duracion = time.perf_counter() - inicio
+    return latencias, errores, duracion
+
+
+def medir(modo, url, total, concurrencia):
+    latencias, errores, duracion = asyncio.run(_generar_carga(url, total, concurrencia))
+    return {
+        "mode": modo,
+        "concurrency": concurrencia,
+        "requests": total,
+        "errors": errores,
+        "seconds": round(duracion, 3),
+        "throughput": round(total / duracion, 2),
+        "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", default="50,200,1000")
+    parser.add_argument("--sync-threads", type=int, default=32)
+    parser.add_argument("--gemini-latency", type=float, default=0.5)
+    parser.add_argument("--service-latency", type=float, default=0.05)
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args()
+    args.niveles = [int(n) for n in args.concurrency.split(",")]
+
+    salida = sys.stdout
+    resultados = []
+    # La aplicación escribe en la salida estándar por cada mensaje
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        app = preparar(args)
+        url_async, detener_async = iniciar_async()
+        urls = {"threading": iniciar_sync(app, args.sync_threads), "async": url_async}
+
+        print(f"{'modo':<10} {'concurrencia':>12} {'msg/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errores':>8}",
+              file=salida)
+        for concurrencia in args.niveles:
+            for modo, url in urls.items():
+                resultado = medir(modo, url, args.requests, concurrencia)
+                resultados.append(resultado)
+                print(f"{modo:<10} {concurrencia:>12} {resultado['throughput']:>9} {resultado['p50_ms']:>9} "
+                      f"{resultado['p95_ms']:>9} {resultado['p99_ms']:>9} {resultado['errors']:>8}", file=salida)
+        detener_async()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Mide el arranque en frío: importación de app, init_db y primer cliente de Gemini.
+
+Uso:
+    python benchmarks/bench_startup.py [--repeat 10] [--repo RUTA] [--top 10] [--json resultados.json]
+
+Cada medición se hace en un proceso nuevo (sin módulos en caché). Con --repo
+se mide otra copia del proyecto, por ejemplo una versión anterior extraída
+con `git worktree add /tmp/base <commit>`, para comparar ambas.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cada fragmento imprime los segundos medidos en la última línea
+IMPORTAR = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+INIT_DB = ("import time, app, gemini_assistant; t = time.perf_counter(); app.init_db(); "
+           "gemini_assistant.init_db(); print(time.perf_counter() - t)")
+MODELO = ("import time, gemini_assistant as g; t = time.perf_counter(); "
+          "getattr(g, 'obtener_modelo', g.crear_modelo)(); print(time.perf_counter() - t)")
+
+
+def ejecutar(repo, codigo, entorno, opciones=()):
+    proceso = subprocess.run([sys.executable, *opciones, "-c", codigo], cwd=repo, env=entorno,
+                             capture_output=True, text=True, check=True)
+    return proceso
+
+
+def medir(repo, codigo, entorno, repeticiones):
+    tiempos = [float(ejecutar(repo, codigo, entorno).stdout.strip().splitlines()[-1])
+               for _ in range(repeticiones)]
+    return round(statistics.median(tiempos) * 1000, 1)
+
+
+def modulos_lentos(repo, entorno, cuantos):
+    """Módulos de nivel superior que más tardan en importarse (python -X importtime)"""
+    salida = ejecutar(repo, "import app", entorno, ("-X", "importtime")).stderr
+    modulos = []
+    for linea in salida.splitlines():
+        partes = linea.split("|")
+        if len(partes) != 3 or not partes[1].strip().isdigit():
+            continue
+        nombre = partes[2].rstrip()
+        # Sólo los importados directamente por app (dos espacios de sangría)
+        if len(nombre) - len(nombre.lstrip()) <= 3:
+            modulos.append((int(partes[1]), nombre.strip()))
+    return [(nombre, round(us / 1000, 1)) for us, nombre in sorted(modulos, reverse=True)[:cuantos]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--repo", default=RAIZ, help="copia del proyecto a medir")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="bench-startup-")
+    entorno = dict(os.environ, PYTHONPATH=os.path.abspath(args.repo),
+                   ASSISTANT_DB_PATH=os.path.join(carpeta, "bench.db"),
+                   ANALYTICS_DIR=os.path.join(carpeta, "analytics"),
+                   GOOGLE_API_KEY=os.environ.get("GOOGLE_API_KEY", "clave-de-prueba"))
+    # La primera ejecución crea la base de datos; las medidas son sobre una ya existente
+    ejecutar(args.repo, INIT_DB, entorno)
+
+    resultado = {
+        "repo": os.path.abspath(args.repo),
+        "import_app_ms": medir(args.repo, IMPORTAR, entorno, args.repeat),
+        "init_db_ms": medir(args.repo, INIT_DB, entorno, args.repeat),
+        "first_model_ms": medir(args.repo, MODELO, entorno, max(1, args.repeat // 2)),
+        "slowest_imports_ms": modulos_lentos(args.repo, entorno, args.top),
+    }
+    for clave in ("import_app_ms", "init_db_ms", "first_model_ms"):
+        print(f"{clave:>16}: {resultado[clave]}")
+    print("importaciones más lentas:")
+    for nombre, ms in resultado["slowest_imports_ms"]:
+        print(f"  {ms:>8} ms  {nombre}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
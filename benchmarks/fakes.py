@@ -0,0 +1,190 @@
+"""Dobles locales de Gemini, Twilio y el servicio de WhatsApp para los benchmarks.
+
+Todos tienen latencia configurable y no hacen llamadas de red externas, de
+modo que los benchmarks pueden ejecutarse sin conexión ni credenciales.
+"""
+import sys
+import time
+import asyncio
+import threading
+import types
+import itertools
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Tiempo acumulado por servicio externo simulado: {nombre: [segundos, llamadas]}
+tiempos_externos = defaultdict(lambda: [0.0, 0])
+_tiempos_lock = threading.Lock()
+
+
+def _registrar(nombre, inicio):
+    with _tiempos_lock:
+        entrada = tiempos_externos[nombre]
+        entrada[0] += time.perf_counter() - inicio
+        entrada[1] += 1
+
+
+class _Respuesta:
+    def __init__(self, text):
+        self.text = text
+
+
+def responder(mensaje):
+    """Respuesta determinista del modelo falso según palabras clave"""
+    texto = mensaje.lower()
+    if "saldo" in texto:
+        return "SALDO_ACTUAL"
+    if "lista" in texto or "tareas" in texto:
+        return "LISTAR_TAREAS pendientes"
+    if "gasto" in texto or "gasté" in texto:
+        return "REGISTRAR_GASTO 120, comida, almuerzo"
+    if "ingreso" in texto or "cobré" in texto:
+        return "REGISTRAR_INGRESO 1000, salario"
+    if "resumen" in texto:
+        return "RESUMEN_FINANCIERO mes"
+    if "tarea" in texto:
+        return "AGREGAR_TAREA Revisar informe, enviar comentarios, 2030-01-01, alta"
+    return "¡Hola! Soy tu asistente. ¿En qué puedo ayudarte hoy con tus tareas o finanzas?"
+
+
+class FakeGenerativeModel:
+    """Sustituto de genai.GenerativeModel con latencia configurable"""
+
+    latencia = 0.2
+    latencia_primer_token = 0.05
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @staticmethod
+    def _ultimo_mensaje(contenidos):
+        if isinstance(contenidos, str):
+            return contenidos
+        ultimo = contenidos[-1]
+        if isinstance(ultimo, dict):
+            return " ".join(str(p) for p in ultimo.get("parts", []))
+        return str(ultimo)
+
+    def generate_content(self, contenidos, stream=False, **kwargs):
+        texto = responder(self._ultimo_mensaje(contenidos))
+        if stream:
+            return self._stream(texto)
+        inicio = time.perf_counter()
+        time.sleep(self.latencia)
+        _registrar("gemini", inicio)
+        return _Respuesta(texto)
+
+    def _stream(self, texto):
+        inicio = time.perf_counter()
+        time.sleep(self.latencia_primer_token)
+        fragmentos = [texto[i:i + 12] for i in range(0, len(texto), 12)] or [""]
+        pausa = max(0.0, self.latencia - self.latencia_primer_token) / len(fragmentos)
+        for i, fragmento in enumerate(fragmentos):
+            if i:
+                time.sleep(pausa)
+            yield _Respuesta(fragmento)
+        _registrar("gemini", inicio)
+
+    async def generate_content_async(self, contenidos, stream=False, **kwargs):
+        texto = responder(self._ultimo_mensaje(contenidos))
+        if stream:
+            return self._stream_async(texto)
+        inicio = time.perf_counter()
+        await asyncio.sleep(self.latencia)
+        _registrar("gemini", inicio)
+        return _Respuesta(texto)
+
+    async def _stream_async(self, texto):
+        inicio = time.perf_counter()
+        await asyncio.sleep(self.latencia_primer_token)
+        fragmentos = [texto[i:i + 12] for i in range(0, len(texto), 12)] or [""]
+        pausa = max(0.0, self.latencia - self.latencia_primer_token) / len(fragmentos)
+        for i, fragmento in enumerate(fragmentos):
+            if i:
+                await asyncio.sleep(pausa)
+            yield _Respuesta(fragmento)
+        _registrar("gemini", inicio)
+
+
+class FakeTwilioClient:
+    """Sustituto de twilio.rest.Client con latencia configurable"""
+
+    latencia = 0.1
+    _sids = itertools.count(1)
+
+    def __init__(self, *args, **kwargs):
+        self.messages = self
+
+    def create(self, body=None, from_=None, to=None, **kwargs):
+        inicio = time.perf_counter()
+        time.sleep(self.latencia)
+        _registrar("twilio", inicio)
+        return types.SimpleNamespace(sid=f"SMfake{next(self._sids):08d}")
+
+    async def create_async(self, body=None, from_=None, to=None, **kwargs):
+        inicio = time.perf_counter()
+        await asyncio.sleep(self.latencia)
+        _registrar("twilio", inicio)
+        return types.SimpleNamespace(sid=f"SMfake{next(self._sids):08d}")
+
+
+class _ServicioHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 para que el cliente pueda reutilizar las conexiones
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latencia = 0.05
+
+    def do_POST(self):
+        inicio = time.perf_counter()
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latencia)
+        cuerpo = b'{"status": "sent"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+        _registrar("whatsapp_service", inicio)
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_servicio_whatsapp(latencia=0.05):
+    """Arranca un servicio de WhatsApp falso en un puerto libre y devuelve su URL"""
+    handler = type("ServicioHandler", (_ServicioHandler,), {"latencia": latencia})
+    # Cola de conexiones amplia para las pruebas con mucha concurrencia
+    servidor = type("Servidor", (ThreadingHTTPServer,), {"request_queue_size": 1024})(("127.0.0.1", 0), handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+
+def instalar(gemini_latencia=0.2, twilio_latencia=0.1):
+    """Reemplaza Gemini y Twilio por los dobles locales.
+
+    Debe llamarse antes de importar app o gemini_assistant. Si los SDK no
+    están instalados se registran módulos mínimos en su lugar.
+    """
+    FakeGenerativeModel.latencia = gemini_latencia
+    FakeGenerativeModel.latencia_primer_token = min(gemini_latencia, 0.05)
+    FakeTwilioClient.latencia = twilio_latencia
+
+    try:
+        import google.generativeai as genai
+    except ImportError:
+        genai = types.ModuleType("google.generativeai")
+        google = sys.modules.setdefault("google", types.ModuleType("google"))
+        google.generativeai = genai
+        sys.modules["google.generativeai"] = genai
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.configure = lambda **kwargs: None
+
+    try:
+        import twilio.rest as twilio_rest
+    except ImportError:
+        twilio_rest = types.ModuleType("twilio.rest")
+        twilio = sys.modules.setdefault("twilio", types.ModuleType("twilio"))
+        twilio.rest = twilio_rest
+        sys.modules["twilio.rest"] = twilio_rest
+    twilio_rest.Client = FakeTwilioClient
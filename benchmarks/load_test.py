@@ -0,0 +1,295 @@
+"""Prueba de carga del asistente con Gemini, Twilio y WhatsApp simulados.
+
+Uso:
+    python benchmarks/load_test.py [--scenario webhook|service|socket|all]
+                                   [--requests 200] [--concurrency 16] [--chats 20]
+                                   [--gemini-latency 0.2] [--twilio-latency 0.1]
+                                   [--service-latency 0.05] [--queue-mode]
+                                   [--no-fast-path] [--json resultados.json]
+                                   [--compare base.json --tolerance 0.2]
+
+Ejecuta los escenarios contra una base de datos temporal y muestra latencia
+p50/p95/p99, rendimiento y el tiempo de base de datos por etapa. Con
+--compare termina con código 1 si el p95 o el rendimiento empeoran más de la
+tolerancia respecto a una ejecución anterior guardada con --json.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes
+
+MENSAJES = [
+    "hola, ¿cómo estás?",
+    "¿cuál es mi saldo?",
+    "gasté 200 en comida",
+    "lista mis tareas",
+    "agrega una tarea para revisar el informe",
+    "registra un gasto de la cena de ayer",
+    "resumen del mes",
+    "¿qué me recomiendas para ahorrar?",
+]
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+class TiemposBD:
+    """Acumula el tiempo de base de datos por etapa (función que pidió la conexión)"""
+
+    ALIAS = {"_escribir": "write_behind", "_cargar": "conversation_context"}
+
+    def __init__(self):
+        self.tiempos = defaultdict(lambda: [0.0, 0])
+        self._lock = threading.Lock()
+
+    def instalar(self, storage):
+        original = storage.connection
+        tiempos = self
+
+        def connection():
+            etapa = sys._getframe(1).f_code.co_name
+            if etapa == "transaction":
+                etapa = sys._getframe(3).f_code.co_name
+            return tiempos._medir(original, tiempos.ALIAS.get(etapa, etapa))
+
+        storage.connection = connection
+
+    @contextmanager
+    def _medir(self, original, etapa):
+        inicio = time.perf_counter()
+        try:
+            with original() as conn:
+                yield conn
+        finally:
+            with self._lock:
+                entrada = self.tiempos[etapa]
+                entrada[0] += time.perf_counter() - inicio
+                entrada[1] += 1
+
+    def reiniciar(self):
+        with self._lock:
+            self.tiempos.clear()
+
+
+def preparar(args):
+    """Configura el entorno, instala los dobles e importa la aplicación"""
+    directorio = tempfile.mkdtemp(prefix="bench-assistant-")
+    os.environ["ASSISTANT_DB_PATH"] = os.path.join(directorio, "bench.db")
+    os.environ["QUEUE_MODE"] = "True" if args.queue_mode else "False"
+    os.environ["STREAMING_ENABLED"] = "True"
+    if args.no_fast_path:
+        os.environ["LOCAL_CLASSIFIER_ENABLED"] = "False"
+        os.environ["INTENT_CACHE_ENABLED"] = "False"
+
+    fakes.instalar(gemini_latencia=args.gemini_latency, twilio_latencia=args.twilio_latency)
+    _, url = fakes.iniciar_servicio_whatsapp(args.service_latency)
+    os.environ["WHATSAPP_SERVICE_URL"] = url
+    os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACbenchmark")
+    os.environ.setdefault("TWILIO_AUTH_TOKEN", "benchmark")
+    os.environ.setdefault("TWILIO_PHONE_NUMBER", "+10000000000")
+
+    import app
+    import gemini_assistant
+    import storage
+
+    tiempos_bd = TiemposBD()
+    tiempos_bd.instalar(storage)
+
+    app.init_db()
+    gemini_assistant.init_db()
+    return app, tiempos_bd
+
+
+def _cliente_http(app, locales):
+    if not hasattr(locales, "http"):
+        locales.http = app.app.test_client()
+    return locales.http
+
+
+def _cliente_socket(app, locales):
+    if not hasattr(locales, "socket"):
+        locales.socket = app.socketio.test_client(app.app)
+    return locales.socket
+
+
+def peticion(app, escenario, i, chats, locales):
+    """Ejecuta una petición del escenario y devuelve si tuvo éxito"""
+    chat = f"52155500{i % chats:04d}"
+    mensaje = random.choice(MENSAJES)
+
+    if escenario == "webhook":
+        respuesta = _cliente_http(app, locales).post("/whatsapp/webhook", data={
+            "MessageSid": f"SM{i:032x}",
+            "From": f"whatsapp:+{chat}",
+            "To": "whatsapp:+10000000000",
+            "Body": mensaje,
+        })
+        return respuesta.status_code < 400
+    if escenario == "service":
+        respuesta = _cliente_http(app, locales).post("/whatsapp_message", json={
+            "platform": "WhatsApp",
+            "sender": chat,
+            "chat_id": chat,
+            "message": mensaje,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        })
+        return respuesta.status_code < 400
+    if escenario == "socket":
+        cliente = _cliente_socket(app, locales)
+        cliente.emit("send_message", {"platform": "WhatsApp", "chat_id": chat, "message": mensaje})
+        cliente.get_received()
+        return True
+    raise ValueError(f"Escenario desconocido: {escenario}")
+
+
+def esperar_cola(app, timeout=300):
+    """En modo cola, espera a que los trabajadores terminen"""
+    pool = app._worker_pool
+    if pool is None:
+        return
+    limite = time.monotonic() + timeout
+    while pool.metrics()["depth"] > 0 and time.monotonic() < limite:
+        time.sleep(0.01)
+
+
+def ejecutar(app, tiempos_bd, escenario, args):
+    tiempos_bd.reiniciar()
+    fakes.tiempos_externos.clear()
+    locales = threading.local()
+    latencias = []
+    errores = 0
+    lock = threading.Lock()
+
+    def tarea(i):
+        nonlocal errores
+        inicio = time.perf_counter()
+        try:
+            ok = peticion(app, escenario, i, args.chats, locales)
+        except Exception as e:
+            print(f"Error en petición {i}: {e}")
+            ok = False
+        duracion = time.perf_counter() - inicio
+        with lock:
+            latencias.append(duracion)
+            if not ok:
+                errores += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(tarea, range(args.requests)))
+    esperar_cola(app)
+    total = time.perf_counter() - inicio
+
+    import write_behind
+    write_behind.get_writer().flush()
+
+    return {
+        "scenario": escenario,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errores,
+        "seconds": round(total, 3),
+        "throughput": round(args.requests / total, 2),
+        "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+        "db": {etapa: {"ms": round(t * 1000, 2), "calls": n, "avg_ms": round(t / n * 1000, 3)}
+               for etapa, (t, n) in sorted(tiempos_bd.tiempos.items())},
+        "external": {nombre: {"ms": round(t * 1000, 2), "calls": n}
+                     for nombre, (t, n) in sorted(fakes.tiempos_externos.items())},
+    }
+
+
+def mostrar(resultado):
+    print(f"\n== {resultado['scenario']} ({resultado['requests']} peticiones, concurrencia {resultado['concurrency']}) ==")
+    print(f"Rendimiento: {resultado['throughput']} msg/s en {resultado['seconds']} s, errores: {resultado['errors']}")
+    print(f"Latencia: p50={resultado['p50_ms']} ms  p95={resultado['p95_ms']} ms  p99={resultado['p99_ms']} ms")
+    if resultado["db"]:
+        print("Tiempo de base de datos por etapa:")
+        for etapa, datos in resultado["db"].items():
+            print(f"  {etapa:<28} {datos['ms']:>10.2f} ms  {datos['calls']:>6} llamadas  {datos['avg_ms']:.3f} ms/llamada")
+    if resultado["external"]:
+        print("Servicios externos simulados:")
+        for nombre, datos in resultado["external"].items():
+            print(f"  {nombre:<28} {datos['ms']:>10.2f} ms  {datos['calls']:>6} llamadas")
+
+
+def comparar(resultados, ruta, tolerancia):
+    """Compara con una ejecución anterior; devuelve la lista de regresiones"""
+    with open(ruta, encoding="utf-8") as f:
+        base = {r["scenario"]: r for r in json.load(f)}
+
+    regresiones = []
+    for resultado in resultados:
+        anterior = base.get(resultado["scenario"])
+        if not anterior:
+            continue
+        if resultado["p95_ms"] > anterior["p95_ms"] * (1 + tolerancia):
+            regresiones.append(f"{resultado['scenario']}: p95 {anterior['p95_ms']} -> {resultado['p95_ms']} ms")
+        if resultado["throughput"] < anterior["throughput"] * (1 - tolerancia):
+            regresiones.append(f"{resultado['scenario']}: rendimiento {anterior['throughput']} -> {resultado['throughput']} msg/s")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=["webhook", "service", "socket", "all"], default="all")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--gemini-latency", type=float, default=0.2)
+    parser.add_argument("--twilio-latency", type=float, default=0.1)
+    parser.add_argument("--service-latency", type=float, default=0.05)
+    parser.add_argument("--queue-mode", action="store_true", help="procesar los webhooks en segundo plano")
+    parser.add_argument("--no-fast-path", action="store_true", help="desactivar clasificador local y caché de intenciones")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    parser.add_argument("--compare", help="resultados anteriores contra los que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    app, tiempos_bd = preparar(args)
+
+    escenarios = ["webhook", "service", "socket"] if args.scenario == "all" else [args.scenario]
+    resultados = []
+    for escenario in escenarios:
+        resultado = ejecutar(app, tiempos_bd, escenario, args)
+        mostrar(resultado)
+        resultados.append(resultado)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        regresiones = comparar(resultados, args.compare, args.tolerance)
+        if regresiones:
+            print("\nRegresiones detectadas:")
+            for regresion in regresiones:
+                print(f"- {regresion}")
+            return 1
+        print("\nSin regresiones respecto a la ejecución anterior.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Procesamiento concurrente de lotes de mensajes (reprocesos, importaciones y difusiones).
+
+Uso:
+    python bulk.py mensajes.jsonl [--concurrency 8] [--deliver service|twilio]
+                                  [--rate 5 --burst 10] [--output resultados.jsonl]
+
+Cada línea del archivo es un objeto JSON con al menos `chat_id` y `message`
+(opcionalmente `platform`, `sender` y `timestamp`). Los mensajes de un mismo
+chat se procesan en orden; los de chats distintos, en paralelo. El progreso se
+escribe como JSON por línea.
+"""
+import json
+import queue
+import threading
+import time
+
+from worker_pool import WorkerPool
+
+# Tiempo máximo que el productor espera por espacio en la cola del lote
+SUBMIT_TIMEOUT = 3600
+
+_FIN = object()
+
+
+def leer_jsonl(lineas):
+    """Convierte líneas JSONL en objetos, ignorando las líneas vacías"""
+    for numero, linea in enumerate(lineas, start=1):
+        if isinstance(linea, bytes):
+            linea = linea.decode("utf-8")
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            yield json.loads(linea)
+        except json.JSONDecodeError as e:
+            # Se entrega como elemento inválido para no abortar el lote
+            yield {"_error": f"JSON inválido en la línea {numero}: {e.msg}"}
+
+
+def validar(item):
+    """Devuelve el motivo por el que el elemento no se puede procesar, o None"""
+    if not isinstance(item, dict):
+        return "Cada elemento debe ser un objeto JSON"
+    if "_error" in item:
+        return item["_error"]
+    if not item.get("chat_id") or not item.get("message"):
+        return "Faltan chat_id o message"
+    return None
+
+
+def procesar_lote(items, handler, concurrencia=8):
+    """Procesa los elementos con `handler` y genera un evento de progreso por elemento.
+
+    Los elementos de un mismo chat_id se asignan al mismo trabajador y se
+    procesan en orden. Al final se genera un evento con el resumen del lote.
+    """
+    resultados = queue.Queue()
+    cancelado = threading.Event()
+    producidos = 0
+
+    def ejecutar(trabajo):
+        indice, item = trabajo
+        inicio = time.perf_counter()
+        evento = {"index": indice, "chat_id": item["chat_id"]}
+        try:
+            evento["status"] = "ok"
+            evento["response"] = handler(item)
+        except Exception as e:
+            evento["status"] = "error"
+            evento["error"] = str(e)
+        evento["ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+        resultados.put(evento)
+
+    pool = WorkerPool(ejecutar, num_workers=concurrencia, max_size=concurrencia * 4, name="bulk")
+    pool.start()
+
+    def producir():
+        nonlocal producidos
+        try:
+            for indice, item in enumerate(items):
+                if cancelado.is_set():
+                    break
+                producidos += 1
+                error = validar(item)
+                if error:
+                    resultados.put({"index": indice, "status": "invalid", "error": error})
+                    continue
+                item["chat_id"] = str(item["chat_id"])
+                # Espera con contrapresión a que los trabajadores liberen espacio
+                pool.submit(item["chat_id"], (indice, item), timeout=SUBMIT_TIMEOUT)
+        except Exception as e:
+            resultados.put({"index": producidos - 1, "status": "error", "error": f"Lote interrumpido: {e}"})
+        finally:
+            resultados.put(_FIN)
+
+    inicio = time.perf_counter()
+    productor = threading.Thread(target=producir, name="bulk-producer", daemon=True)
+    productor.start()
+
+    conteo = {"ok": 0, "error": 0, "invalid": 0}
+    hechos = 0
+    fin = False
+    try:
+        while not fin or hechos < producidos:
+            evento = resultados.get()
+            if evento is _FIN:
+                fin = True
+                continue
+            hechos += 1
+            conteo[evento["status"]] += 1
+            evento["done"] = hechos
+            yield evento
+    finally:
+        # Si el consumidor abandona el lote (p. ej. el cliente se desconecta)
+        # no se encolan más mensajes, pero se terminan los ya aceptados
+        cancelado.set()
+        productor.join()
+        pool.stop()
+
+    duracion = time.perf_counter() - inicio
+    yield {"summary": {
+        "total": hechos,
+        **conteo,
+        "concurrency": concurrencia,
+        "seconds": round(duracion, 3),
+        "throughput": round(hechos / duracion, 2) if duracion else 0.0,
+    }}
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("archivo", help="archivo JSONL con los mensajes ('-' para la entrada estándar)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--deliver", choices=["service", "twilio"], help="enviar también las respuestas")
+    parser.add_argument("--rate", type=float, help="llamadas a Gemini por segundo (sustituye a GEMINI_RATE_LIMIT)")
+    parser.add_argument("--burst", type=float, help="ráfaga máxima de llamadas a Gemini")
+    parser.add_argument("--output", help="escribir el progreso en este archivo en lugar de la salida estándar")
+    args = parser.parse_args()
+
+    import app
+    import gemini_assistant
+    from rate_limit import TokenBucket
+
+    app.init_db()
+    gemini_assistant.init_db()
+    if args.rate:
+        gemini_assistant.limite_gemini = TokenBucket(args.rate, args.burst)
+
+    entrada = sys.stdin if args.archivo == "-" else open(args.archivo, encoding="utf-8")
+    salida = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    errores = 0
+    try:
+        handler = app.make_bulk_handler(args.deliver)
+        for evento in procesar_lote(leer_jsonl(entrada), handler, max(1, args.concurrency)):
+            salida.write(json.dumps(evento, ensure_ascii=False) + "\n")
+            salida.flush()
+            if "summary" in evento:
+                errores = evento["summary"]["error"] + evento["summary"]["invalid"]
+    finally:
+        if entrada is not sys.stdin:
+            entrada.close()
+        if salida is not sys.stdout:
+            salida.close()
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,298 @@
+"""Protocolo de comandos del asistente: esquemas, validación y reparación local.
+
+Cada comando declara sus argumentos con `Campo`. El mismo esquema sirve para:
+- declarar la función a Gemini en el modo de llamadas a funciones,
+- interpretar el protocolo de texto heredado ("REGISTRAR_GASTO 200, comida"),
+- validar los argumentos y repararlos localmente (montos con símbolo de moneda,
+  fechas relativas, sinónimos de prioridad o periodo...) antes de ejecutar.
+
+Las llamadas a funciones se representan como texto JSON
+{"comando": "REGISTRAR_GASTO", "argumentos": {"monto": 200, "categoria": "comida"}}
+para que la caché de intenciones y el streaming sigan trabajando con texto.
+"""
+import re
+import json
+import unicodedata
+from datetime import datetime, timedelta
+
+from intent_classifier import parse_monto
+
+# Pseudocomando para las respuestas conversacionales
+CONVERSACION = "CONVERSACION"
+
+_MONTO = re.compile(r"\d+(?:[.,]\d+)*")
+_BLOQUE_CODIGO = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+_FORMATOS_FECHA = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y", "%Y/%m/%d")
+_FECHAS_RELATIVAS = {"hoy": 0, "manana": 1, "pasado manana": 2, "ayer": -1}
+
+# Tipos de los campos en el esquema de funciones de Gemini
+_TIPOS_ESQUEMA = {"texto": "string", "numero": "number", "fecha": "string"}
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFKD", str(texto).strip().lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+class ErrorValidacion(ValueError):
+    """Argumentos de un comando que no se pudieron reparar localmente"""
+
+    def __init__(self, comando, mensaje):
+        super().__init__(mensaje)
+        self.comando = comando
+
+
+class Campo:
+    """Argumento de un comando: tipo, obligatoriedad y valores permitidos.
+
+    `tipo` es "texto", "numero" (montos positivos) o "fecha" (se guarda como
+    AAAA-MM-DD). Con `valores`, el texto se normaliza sin acentos y se
+    traduce con `sinonimos` antes de compararlo.
+    """
+
+    def __init__(self, tipo="texto", requerido=False, valores=None, sinonimos=None, por_defecto=None, descripcion=""):
+        self.tipo = tipo
+        self.requerido = requerido
+        self.valores = valores
+        self.por_defecto = por_defecto
+        self.descripcion = descripcion
+        self._equivalentes = {}
+        if valores:
+            for valor in valores:
+                self._equivalentes[_normalizar(valor)] = valor
+            for sinonimo, valor in (sinonimos or {}).items():
+                self._equivalentes[_normalizar(sinonimo)] = valor
+
+    def reparar(self, valor):
+        """Devuelve el valor normalizado; lanza ValueError si no es reparable"""
+        if self.tipo == "numero":
+            return self._numero(valor)
+        if self.tipo == "fecha":
+            return self._fecha(valor)
+        texto = _formatear(valor).strip()
+        if self.valores:
+            equivalente = self._equivalentes.get(_normalizar(texto))
+            if equivalente is None:
+                raise ValueError(f"debe ser uno de: {', '.join(self.valores)}")
+            return equivalente
+        return texto
+
+    @staticmethod
+    def _numero(valor):
+        if isinstance(valor, bool):
+            raise ValueError("debe ser un número")
+        if isinstance(valor, (int, float)):
+            monto = float(valor)
+        else:
+            # "$1.500", "200 pesos", "200,50"
+            match = _MONTO.search(str(valor))
+            if not match:
+                raise ValueError("debe ser un número")
+            monto = parse_monto(match.group())
+        if monto <= 0:
+            raise ValueError("debe ser mayor que cero")
+        return monto
+
+    @staticmethod
+    def _fecha(valor):
+        texto = str(valor).strip()
+        dias = _FECHAS_RELATIVAS.get(_normalizar(texto))
+        if dias is not None:
+            return (datetime.now() + timedelta(days=dias)).strftime("%Y-%m-%d")
+        for formato in _FORMATOS_FECHA:
+            try:
+                # Admite también fechas con hora ("2025-03-01T10:00")
+                return datetime.strptime(texto[:10], formato).strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+        raise ValueError("debe ser una fecha AAAA-MM-DD")
+
+    def esquema(self):
+        esquema = {"type": _TIPOS_ESQUEMA[self.tipo]}
+        descripcion = self.descripcion + (" (AAAA-MM-DD)" if self.tipo == "fecha" else "")
+        if descripcion:
+            esquema["description"] = descripcion
+        if self.valores:
+            esquema["enum"] = list(self.valores)
+        return esquema
+
+
+class Comando:
+    """Comando interpretado. `formato` es "json" (llamada a función) o "texto" (protocolo heredado)"""
+
+    __slots__ = ("nombre", "argumentos", "formato", "reparado")
+
+    def __init__(self, nombre, argumentos, formato="texto", reparado=False):
+        self.nombre = nombre
+        self.argumentos = argumentos
+        self.formato = formato
+        self.reparado = reparado
+
+    def __repr__(self):
+        return f"Comando({self.nombre!r}, {self.argumentos!r})"
+
+
+class DefinicionComando:
+    """Entrada de la tabla de comandos: esquema de argumentos y manejador.
+
+    El orden de `campos` es el de los argumentos posicionales del protocolo
+    de texto. Si el comando tiene un solo campo, recibe todo el texto sin
+    separar por comas. El manejador se llama como `manejador(chat_id, **argumentos)`.
+    """
+
+    def __init__(self, nombre, descripcion, campos, manejador, mensaje_error=None):
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.campos = campos
+        self.manejador = manejador
+        self.mensaje_error = mensaje_error
+
+    def desde_texto(self, detalles):
+        """Argumentos del protocolo de texto: valores separados por comas en orden"""
+        if not self.campos or not detalles:
+            return {}
+        if len(self.campos) == 1:
+            partes = [detalles]
+        else:
+            partes = detalles.split(",")
+        return {nombre: parte.strip() for nombre, parte in zip(self.campos, partes) if parte.strip()}
+
+    def como_texto(self, argumentos):
+        """Representación en el protocolo de texto (la que reconoce la caché de intenciones)"""
+        valores = [argumentos.get(nombre) for nombre in self.campos]
+        while valores and valores[-1] is None:
+            valores.pop()
+        if not valores:
+            return self.nombre
+        return f"{self.nombre} " + ", ".join("" if v is None else _formatear(v) for v in valores)
+
+    def validar(self, argumentos):
+        """Devuelve los argumentos reparados; lanza ErrorValidacion si falta uno obligatorio o no es reparable"""
+        validados = {}
+        for nombre, campo in self.campos.items():
+            valor = argumentos.get(nombre)
+            if isinstance(valor, str) and not valor.strip():
+                valor = None
+            if valor is None:
+                if campo.requerido:
+                    raise ErrorValidacion(self.nombre, f"falta el argumento '{nombre}'")
+                if campo.por_defecto is not None:
+                    validados[nombre] = campo.por_defecto
+                continue
+            try:
+                validados[nombre] = campo.reparar(valor)
+            except ValueError as e:
+                raise ErrorValidacion(self.nombre, f"'{nombre}' {e} (recibido: {valor!r})") from None
+        return validados
+
+    def declaracion(self):
+        """Declaración de la función para Gemini"""
+        declaracion = {"name": self.nombre, "description": self.descripcion}
+        if self.campos:
+            declaracion["parameters"] = {
+                "type": "object",
+                "properties": {nombre: campo.esquema() for nombre, campo in self.campos.items()},
+                "required": [nombre for nombre, campo in self.campos.items() if campo.requerido],
+            }
+        return declaracion
+
+
+def _formatear(valor):
+    if isinstance(valor, float) and valor == int(valor):
+        return str(int(valor))
+    return str(valor)
+
+
+class Protocolo:
+    """Tabla de comandos: interpreta respuestas del modelo y despacha al manejador"""
+
+    def __init__(self, definiciones):
+        self.definiciones = {d.nombre: d for d in definiciones}
+        # Las respuestas conversacionales se devuelven tal cual
+        self.definiciones[CONVERSACION] = DefinicionComando(
+            CONVERSACION, "Respuesta conversacional", {"texto": Campo()}, lambda chat_id, texto="": texto)
+        # Los nombres más largos primero para que ningún comando oculte a otro por prefijo
+        self._por_prefijo = sorted(self.definiciones, key=len, reverse=True)
+
+    def declaraciones(self):
+        """Declaraciones de funciones para el modelo (sin la conversación)"""
+        return [d.declaracion() for nombre, d in self.definiciones.items() if nombre != CONVERSACION]
+
+    @staticmethod
+    def serializar(nombre, argumentos):
+        """Texto JSON canónico de una llamada a función"""
+        return json.dumps({"comando": nombre, "argumentos": argumentos}, ensure_ascii=False)
+
+    def nombre_comando(self, texto):
+        """Nombre del comando de la respuesta sin validarla, o CONVERSACION"""
+        try:
+            return self.interpretar(texto).nombre
+        except ErrorValidacion as e:
+            return e.comando
+
+    def puede_ser_comando(self, texto):
+        """Indica si el texto empieza, o podría empezar, con un comando"""
+        texto = texto.lstrip()
+        if texto.startswith(("{", "`")) or not texto:
+            return True
+        return any(texto.startswith(nombre) or nombre.startswith(texto)
+                   for nombre in self._por_prefijo if nombre != CONVERSACION)
+
+    def interpretar(self, texto):
+        """Convierte la respuesta del modelo en un Comando sin validar sus argumentos"""
+        limpio = texto.strip()
+        bloque = _BLOQUE_CODIGO.match(limpio)
+        if bloque:
+            limpio = bloque.group(1)
+        if limpio.startswith("{"):
+            return self._interpretar_json(limpio)
+
+        for nombre in self._por_prefijo:
+            if nombre != CONVERSACION and limpio.startswith(nombre):
+                detalles = limpio[len(nombre):].strip()
+                return Comando(nombre, self.definiciones[nombre].desde_texto(detalles))
+        return Comando(CONVERSACION, {"texto": texto})
+
+    def _interpretar_json(self, texto):
+        try:
+            datos = json.loads(texto)
+        except ValueError:
+            raise ErrorValidacion(CONVERSACION, "la respuesta no es JSON válido") from None
+        if not isinstance(datos, dict):
+            raise ErrorValidacion(CONVERSACION, "la respuesta JSON debe ser un objeto")
+
+        nombre = str(datos.get("comando") or datos.get("name") or "").strip().upper().replace(" ", "_")
+        argumentos = datos.get("argumentos", datos.get("args")) or {}
+        if nombre not in self.definiciones:
+            raise ErrorValidacion(CONVERSACION, f"comando desconocido: {nombre or '(vacío)'}")
+        if not isinstance(argumentos, dict):
+            raise ErrorValidacion(nombre, "los argumentos deben ser un objeto")
+        # Claves sin distinguir mayúsculas
+        argumentos = {str(clave).strip().lower(): valor for clave, valor in argumentos.items()}
+        return Comando(nombre, argumentos, formato="json")
+
+    def resolver(self, texto):
+        """Interpreta y valida la respuesta; lanza ErrorValidacion si no se puede reparar"""
+        comando = self.interpretar(texto)
+        definicion = self.definiciones[comando.nombre]
+        argumentos = definicion.validar(comando.argumentos)
+        reparado = comando.formato == "json" and any(
+            argumentos.get(clave) != valor for clave, valor in comando.argumentos.items())
+        return Comando(comando.nombre, argumentos, comando.formato, reparado)
+
+    def como_texto(self, comando):
+        """Comando validado en el protocolo de texto; las conversaciones devuelven su texto"""
+        if comando.nombre == CONVERSACION:
+            return comando.argumentos.get("texto", "")
+        return self.definiciones[comando.nombre].como_texto(comando.argumentos)
+
+    def ejecutar(self, comando, chat_id):
+        """Ejecuta un comando ya validado con su manejador"""
+        return self.definiciones[comando.nombre].manejador(chat_id, **comando.argumentos)
+
+    def mensaje_error(self, error):
+        """Respuesta para el usuario cuando un comando no se pudo validar"""
+        definicion = self.definiciones.get(error.comando)
+        if definicion is not None and definicion.mensaje_error:
+            return definicion.mensaje_error
+        return f"❌ Error: No pude interpretar la solicitud ({error})."
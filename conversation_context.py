@@ -0,0 +1,142 @@
+import threading
+from collections import OrderedDict, deque
+
+import storage
+import metrics
+
+# Longitud máxima de cada mensaje dentro del resumen de turnos antiguos
+LONGITUD_RESUMEN = 80
+
+
+def estimar_tokens(texto):
+    """Estimación rápida de tokens (~4 caracteres por token)"""
+    return len(texto) // 4 + 1
+
+
+def _recortar(texto, longitud):
+    texto = " ".join(texto.split())
+    return texto if len(texto) <= longitud else texto[:longitud - 1] + "…"
+
+
+def _textos_enlazados(conn, filas):
+    """Texto de los mensajes a los que apuntan las conversaciones deduplicadas: {id: texto}"""
+    ids = {f[c] for f in filas for c in ("mensaje_id", "respuesta_id") if f[c] is not None}
+    if not ids:
+        return {}
+    marcadores = ", ".join("?" * len(ids))
+    return dict(conn.execute(f"SELECT id, message FROM mensajes WHERE id IN ({marcadores})", tuple(ids)).fetchall())
+
+
+class ContextoConversaciones:
+    """Ventana acotada de turnos recientes por chat para conversaciones multi-turno.
+
+    Mantiene en una caché LRU los últimos `turnos` intercambios de cada chat y
+    el historial ya armado para Gemini, de modo que sólo se consulta la tabla
+    `conversaciones` la primera vez que se ve un chat (o tras ser desalojado).
+    """
+
+    def __init__(self, turnos=10, presupuesto_tokens=1200, max_chats=1000):
+        self.turnos = turnos
+        self.presupuesto_tokens = presupuesto_tokens
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @metrics.instrumentar("db", operation="context_load")
+    def _cargar(self, chat_id):
+        with storage.connection() as conn:
+            filas = conn.execute(
+                "SELECT mensaje, respuesta, mensaje_id, respuesta_id FROM conversaciones "
+                "WHERE chat_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (chat_id, self.turnos)
+            ).fetchall()
+            textos = _textos_enlazados(conn, filas)
+        turnos = ((textos.get(f["mensaje_id"], f["mensaje"]), textos.get(f["respuesta_id"], f["respuesta"]) or "")
+                  for f in reversed(filas))
+        return {"turnos": deque(turnos, maxlen=self.turnos), "historial": None}
+
+    def _entrada(self, chat_id):
+        with self._lock:
+            entrada = self._chats.get(chat_id)
+            if entrada is not None:
+                self._chats.move_to_end(chat_id)
+                self.hits += 1
+                return entrada
+            self.misses += 1
+
+        # Leer fuera del lock para no bloquear a otros chats
+        entrada = self._cargar(chat_id)
+        with self._lock:
+            existente = self._chats.get(chat_id)
+            if existente is not None:
+                return existente
+            self._chats[chat_id] = entrada
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        return entrada
+
+    def agregar(self, chat_id, mensaje, respuesta):
+        """Registra un turno nuevo en la ventana del chat si está en caché"""
+        with self._lock:
+            entrada = self._chats.get(chat_id)
+            if entrada is not None:
+                entrada["turnos"].append((mensaje, respuesta or ""))
+                entrada["historial"] = None
+
+    def olvidar(self, chat_id):
+        """Descarta la ventana de un chat"""
+        with self._lock:
+            self._chats.pop(chat_id, None)
+
+    def historial(self, chat_id):
+        """Devuelve el historial del chat en el formato de contenidos de Gemini"""
+        entrada = self._entrada(chat_id)
+        historial = entrada["historial"]
+        if historial is None:
+            with self._lock:
+                historial = self._armar(list(entrada["turnos"]))
+                entrada["historial"] = historial
+        return historial
+
+    def _armar(self, turnos):
+        """Selecciona los turnos más recientes que caben en el presupuesto y resume el resto"""
+        restante = self.presupuesto_tokens
+        recientes = []
+        indice = len(turnos)
+        while indice > 0:
+            mensaje, respuesta = turnos[indice - 1]
+            costo = estimar_tokens(mensaje) + estimar_tokens(respuesta)
+            if costo > restante:
+                break
+            recientes.append((mensaje, respuesta))
+            restante -= costo
+            indice -= 1
+        recientes.reverse()
+
+        contenidos = []
+        antiguos = turnos[:indice]
+        if antiguos:
+            resumen = "Resumen de la conversación anterior: " + "; ".join(
+                _recortar(mensaje, LONGITUD_RESUMEN) for mensaje, _ in antiguos
+            )
+            # El resumen también respeta lo que queda del presupuesto
+            resumen = _recortar(resumen, max(LONGITUD_RESUMEN, restante * 4))
+            contenidos.append({"role": "user", "parts": [resumen]})
+            contenidos.append({"role": "model", "parts": ["Entendido."]})
+
+        for mensaje, respuesta in recientes:
+            contenidos.append({"role": "user", "parts": [mensaje]})
+            contenidos.append({"role": "model", "parts": [respuesta]})
+        return contenidos
+
+    def stats(self):
+        """Devuelve los contadores de la caché de contexto"""
+        with self._lock:
+            return {
+                "chats": len(self._chats),
+                "max_chats": self.max_chats,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
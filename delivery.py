@@ -0,0 +1,399 @@
+import os
+import time
+import asyncio
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+
+class CircuitOpenError(requests.RequestException):
+    """El circuito del servicio está abierto y no se intentó el envío"""
+
+
+class CircuitBreaker:
+    """Corta los envíos a un servicio tras varios fallos consecutivos.
+
+    Con el circuito abierto las llamadas fallan de inmediato durante
+    `reset_timeout` segundos; después se deja pasar una llamada de prueba
+    (semiabierto) que lo cierra si tiene éxito o lo vuelve a abrir si falla.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+        self.opened = 0
+        self.short_circuited = 0
+
+    def allow(self):
+        """Indica si se puede intentar una llamada"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "open": int(self._state != self.CLOSED),
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "short_circuited": self.short_circuited,
+            }
+
+
+def create_session(pool_size=20):
+    """Crea una sesión HTTP con un pool de conexiones persistentes"""
+    session = requests.Session()
+    # Los reintentos se hacen en WhatsAppServiceClient para aplicar el circuito
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class _ServiceClientBase:
+    """Configuración, backoff y contadores comunes a los clientes del servicio de WhatsApp"""
+
+    def __init__(self, base_url, timeout=5.0, retries=3, backoff_base=0.1, backoff_max=2.0,
+                 pool_size=20, breaker=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _backoff(self, intento):
+        # Full jitter: espera aleatoria entre 0 y el límite exponencial
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** intento)))
+
+    def _count(self, campo):
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+
+    def _payload(self, chat_id, message):
+        return {
+            "chat_id": chat_id + "@s.whatsapp.net",
+            "message": message
+        }
+
+    def _check_circuit(self):
+        if not self.breaker.allow():
+            self._count("failed")
+            raise CircuitOpenError(f"Circuito abierto para {self.base_url}")
+
+    def _retry_delay(self, intento, error):
+        """Registra un fallo; devuelve la espera antes de reintentar o None si no quedan intentos"""
+        self.breaker.record_failure()
+        if intento >= self.retries:
+            self._count("failed")
+            return None
+        espera = self._backoff(intento)
+        self._count("retried")
+        print(f"Reintentando envío a WhatsApp ({intento + 1}/{self.retries}) en {espera:.2f} s: {error}")
+        return espera
+
+    def _give_up(self):
+        """Registra un fallo que no se reintenta"""
+        self.breaker.record_failure()
+        self._count("failed")
+
+    def _record_success(self):
+        self.breaker.record_success()
+        self._count("sent")
+
+    def stats(self):
+        with self._lock:
+            contadores = {"sent": self.sent, "retried": self.retried, "failed": self.failed}
+        return {**contadores, **{f"circuit_{k}": v for k, v in self.breaker.stats().items()}}
+
+
+class WhatsAppServiceClient(_ServiceClientBase):
+    """Cliente del servicio de WhatsApp personalizado.
+
+    Reutiliza las conexiones con keep-alive y reintenta los errores de
+    conexión (también los timeouts al conectar) y las respuestas 5xx con
+    backoff exponencial y jitter. Un timeout de lectura no se reintenta: el
+    servicio pudo haber enviado ya el mensaje, igual que con Twilio.
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.session = create_session(self.pool_size)
+
+    def send(self, chat_id, message):
+        """Envía un mensaje; lanza requests.RequestException si no se pudo entregar"""
+        payload = self._payload(chat_id, message)
+        intento = 0
+        while True:
+            self._check_circuit()
+            try:
+                response = self.session.post(f"{self.base_url}/send", json=payload, timeout=self.timeout)
+                if response.status_code >= 500:
+                    raise requests.HTTPError(f"Error {response.status_code} del servicio de WhatsApp", response=response)
+            except (requests.ConnectionError, requests.HTTPError) as e:
+                # ConnectTimeout es un ConnectionError: la petición no llegó a enviarse
+                espera = self._retry_delay(intento, e)
+                if espera is None:
+                    raise
+                intento += 1
+                time.sleep(espera)
+                continue
+            except requests.Timeout:
+                self._give_up()
+                raise
+
+            self._record_success()
+            return response
+
+
+class AsyncWhatsAppServiceClient(_ServiceClientBase):
+    """Versión asyncio del cliente del servicio de WhatsApp sobre aiohttp (mismos reintentos)"""
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self._session = None
+
+    def _get_session(self):
+        # La sesión se crea dentro del bucle de eventos que la usa
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def send(self, chat_id, message):
+        """Envía un mensaje; lanza aiohttp.ClientError o CircuitOpenError si no se pudo entregar"""
+        import aiohttp
+
+        payload = self._payload(chat_id, message)
+        intento = 0
+        while True:
+            self._check_circuit()
+            try:
+                async with self._get_session().post(f"{self.base_url}/send", json=payload) as response:
+                    await response.read()
+                    if response.status >= 500:
+                        response.raise_for_status()
+            except (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError, aiohttp.ClientResponseError) as e:
+                espera = self._retry_delay(intento, e)
+                if espera is None:
+                    raise
+                intento += 1
+                await asyncio.sleep(espera)
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                # Timeout de lectura o conexión cortada con la petición ya enviada
+                self._give_up()
+                raise
+
+            self._record_success()
+            return response.status
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+_whatsapp_client = None
+_async_whatsapp_client = None
+_twilio_client = None
+_async_twilio_client = None
+_async_twilio_http = None
+_breaker = None
+_clients_lock = threading.Lock()
+
+
+def _client_settings():
+    """Configuración común de los clientes del servicio de WhatsApp.
+
+    Ambos clientes comparten el circuito, que refleja el estado del servicio.
+    """
+    global _breaker
+    if _breaker is None:
+        _breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5)),
+            reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+        )
+    return {
+        "base_url": os.getenv("WHATSAPP_SERVICE_URL", "http://localhost:3000"),
+        "timeout": float(os.getenv("DELIVERY_TIMEOUT", 5)),
+        "retries": int(os.getenv("DELIVERY_RETRIES", 3)),
+        "backoff_base": float(os.getenv("DELIVERY_BACKOFF_BASE", 0.1)),
+        "backoff_max": float(os.getenv("DELIVERY_BACKOFF_MAX", 2)),
+        "pool_size": int(os.getenv("DELIVERY_POOL_SIZE", 20)),
+        "breaker": _breaker,
+    }
+
+
+def get_whatsapp_client():
+    """Devuelve el cliente compartido del servicio de WhatsApp, creándolo la primera vez"""
+    global _whatsapp_client
+    if _whatsapp_client is None:
+        with _clients_lock:
+            if _whatsapp_client is None:
+                _whatsapp_client = WhatsAppServiceClient(**_client_settings())
+    return _whatsapp_client
+
+
+def get_async_whatsapp_client():
+    """Devuelve el cliente asyncio compartido del servicio de WhatsApp"""
+    global _async_whatsapp_client
+    if _async_whatsapp_client is None:
+        with _clients_lock:
+            if _async_whatsapp_client is None:
+                _async_whatsapp_client = AsyncWhatsAppServiceClient(**_client_settings())
+    return _async_whatsapp_client
+
+
+def get_twilio_client():
+    """Devuelve el cliente de Twilio compartido, o None si no hay credenciales"""
+    global _twilio_client
+    if _twilio_client is None:
+        account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+        auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+        if not (account_sid and auth_token):
+            return None
+        with _clients_lock:
+            if _twilio_client is None:
+                from twilio.rest import Client
+                # El cliente mantiene su propia sesión HTTP con keep-alive
+                _twilio_client = Client(account_sid, auth_token)
+    return _twilio_client
+
+
+def get_async_twilio_client():
+    """Devuelve un cliente de Twilio con transporte aiohttp, o None si no hay credenciales"""
+    global _async_twilio_client, _async_twilio_http
+    if _async_twilio_client is None:
+        account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+        auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+        if not (account_sid and auth_token):
+            return None
+        with _clients_lock:
+            if _async_twilio_client is None:
+                from twilio.rest import Client
+                from twilio.http.async_http_client import AsyncTwilioHttpClient
+                _async_twilio_http = AsyncTwilioHttpClient()
+                _async_twilio_client = Client(account_sid, auth_token, http_client=_async_twilio_http)
+    return _async_twilio_client
+
+
+def send_twilio_message(to_number, body):
+    """Envía un mensaje de WhatsApp a través de Twilio"""
+    client = get_twilio_client()
+    if client is None:
+        return None
+
+    # Sin reintentos: un reintento tras un timeout podría duplicar el mensaje
+    with metrics.span("send", operation="twilio"):
+        message = client.messages.create(
+            body=body,
+            from_=f"whatsapp:{os.getenv('TWILIO_PHONE_NUMBER')}",
+            to=f"whatsapp:{to_number}"
+        )
+
+    print(f"Mensaje enviado a WhatsApp: {message.sid}")
+    return message.sid
+
+
+def send_whatsapp_service_message(chat_id, message):
+    """Envía un mensaje a través del servicio de WhatsApp personalizado"""
+    with metrics.span("send", operation="whatsapp_service"):
+        return get_whatsapp_client().send(chat_id, message)
+
+
+async def send_twilio_message_async(to_number, body):
+    """Versión asyncio de send_twilio_message"""
+    client = get_async_twilio_client()
+    if client is None:
+        return None
+
+    with metrics.span("send", operation="twilio"):
+        message = await client.messages.create_async(
+            body=body,
+            from_=f"whatsapp:{os.getenv('TWILIO_PHONE_NUMBER')}",
+            to=f"whatsapp:{to_number}"
+        )
+
+    print(f"Mensaje enviado a WhatsApp: {message.sid}")
+    return message.sid
+
+
+async def send_whatsapp_service_message_async(chat_id, message):
+    """Versión asyncio de send_whatsapp_service_message"""
+    with metrics.span("send", operation="whatsapp_service"):
+        return await get_async_whatsapp_client().send(chat_id, message)
+
+
+async def close_async_clients():
+    """Cierra las sesiones HTTP de los clientes asyncio"""
+    if _async_whatsapp_client is not None:
+        await _async_whatsapp_client.close()
+    if _async_twilio_http is not None:
+        await _async_twilio_http.close()
+
+
+def stats():
+    """Devuelve los contadores de entrega del servicio de WhatsApp"""
+    clientes = [c for c in (_whatsapp_client, _async_whatsapp_client) if c is not None]
+    if not clientes:
+        return {}
+    resultado = clientes[0].stats()
+    for cliente in clientes[1:]:
+        # El circuito es compartido; sólo se suman los contadores de envío
+        for clave in ("sent", "retried", "failed"):
+            resultado[clave] += cliente.stats()[clave]
+    return resultado
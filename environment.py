@@ -0,0 +1,22 @@
+"""Carga del archivo .env, una sola vez por proceso.
+
+Cada módulo que lee su configuración al importarse llama a `load()` antes de
+hacerlo, así funciona tanto dentro de la aplicación como desde su propia
+línea de comandos sin volver a buscar y leer el archivo.
+"""
+import threading
+
+from dotenv import load_dotenv
+
+_loaded = False
+_lock = threading.Lock()
+
+
+def load():
+    """Carga las variables de .env la primera vez que se llama"""
+    global _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                load_dotenv()
+                _loaded = True
@@ -1,16 +1,60 @@
 import os
 import json
-import sqlite3
+import asyncio
+import threading
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-import google.generativeai as genai
+import environment
+import storage
+import write_behind
+import metrics
+import search
+import reminders
+from intent_cache import IntentCache
+from intent_classifier import ClasificadorLocal
+from conversation_context import ContextoConversaciones
+from rate_limit import TokenBucket
+from command_protocol import Campo, Comando, DefinicionComando, ErrorValidacion, Protocolo
 
 # Cargar variables de entorno
-load_dotenv()
+environment.load()
 
-# Configurar la API de Gemini
 API_KEY = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=API_KEY)
+
+# Caché de clasificaciones de comandos para mensajes repetidos
+INTENT_CACHE_ENABLED = os.getenv("INTENT_CACHE_ENABLED", "True").lower() == "true"
+cache_intenciones = IntentCache(
+    max_size=int(os.getenv("INTENT_CACHE_SIZE", 1000)),
+    ttl=float(os.getenv("INTENT_CACHE_TTL", 3600)),
+    fuzzy_threshold=float(os.getenv("INTENT_CACHE_FUZZY_THRESHOLD", 0.9))
+) if INTENT_CACHE_ENABLED else None
+
+# Clasificador local para comandos evidentes que no necesitan a Gemini
+LOCAL_CLASSIFIER_ENABLED = os.getenv("LOCAL_CLASSIFIER_ENABLED", "True").lower() == "true"
+clasificador_local = ClasificadorLocal(
+    umbral=float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", 0.9))
+) if LOCAL_CLASSIFIER_ENABLED else None
+
+# Ventana de conversación reciente que se envía a Gemini en cada mensaje
+CONTEXT_ENABLED = os.getenv("CONTEXT_ENABLED", "True").lower() == "true"
+contexto = ContextoConversaciones(
+    turnos=int(os.getenv("CONTEXT_TURNS", 10)),
+    presupuesto_tokens=int(os.getenv("CONTEXT_TOKEN_BUDGET", 1200)),
+    max_chats=int(os.getenv("CONTEXT_CACHE_CHATS", 1000))
+) if CONTEXT_ENABLED else None
+
+# Límite de llamadas a Gemini por segundo para respetar la cuota de la API (0 = sin límite)
+GEMINI_RATE_LIMIT = float(os.getenv("GEMINI_RATE_LIMIT", 0))
+limite_gemini = TokenBucket(
+    GEMINI_RATE_LIMIT,
+    float(os.getenv("GEMINI_RATE_BURST", 0)) or None
+) if GEMINI_RATE_LIMIT > 0 else None
+
+# Protocolo de respuesta del modelo: "functions" (llamadas a funciones con
+# argumentos estructurados) o "text" (comandos en texto separados por comas).
+# El protocolo de texto se sigue aceptando en ambos modos.
+GEMINI_PROTOCOL = os.getenv("GEMINI_PROTOCOL", "functions").lower()
+# Veces que se pide al modelo corregir un comando que no se pudo reparar localmente
+GEMINI_REPAIR_RETRIES = int(os.getenv("GEMINI_REPAIR_RETRIES", 1))
 
 # Instrucciones del sistema para el asistente
 SYSTEM_INSTRUCTIONS = """
@@ -28,23 +72,69 @@ Cuando el usuario quiere:
 7. Ver saldo actual: Responde con "SALDO_ACTUAL".
 
 Si el usuario te saluda o hace preguntas generales, responde de manera conversacional sin usar ninguno de los comandos anteriores.
+
+El historial de la conversación muestra los resultados de las acciones ya ejecutadas. Úsalo para entender referencias
+como "márcala como completada", pero para cualquier acción nueva responde siempre con el comando correspondiente.
 """
 
+# Instrucciones del sistema en el modo de llamadas a funciones
+SYSTEM_INSTRUCTIONS_FUNCIONES = """
+Eres un asistente personal digital que ayuda a los usuarios a organizar sus vidas mediante la gestión de tareas y finanzas.
+Tu objetivo es entender las solicitudes en lenguaje natural y convertirlas en acciones concretas.
+Siempre responde en español de manera amigable y concisa.
+
+Cuando el usuario quiera agregar, listar o completar tareas, registrar gastos o ingresos, o consultar su resumen
+financiero o su saldo, llama a la función correspondiente con los argumentos extraídos del mensaje.
+Escribe los montos como números sin símbolo de moneda y las fechas con el formato AAAA-MM-DD.
+
+Si el usuario te saluda o hace preguntas generales, responde de manera conversacional sin llamar a ninguna función.
+
+El historial de la conversación muestra los resultados de las acciones ya ejecutadas. Úsalo para entender referencias
+como "márcala como completada", pero para cualquier acción nueva llama siempre a la función correspondiente.
+"""
+
+# Respuesta cuando falla el procesamiento de un mensaje
+MENSAJE_ERROR = "Lo siento, ha ocurrido un error al procesar tu mensaje. Por favor, inténtalo de nuevo."
+
+# Propietario de las tareas y finanzas anteriores a la separación por usuario
+LEGACY_CHAT_ID = os.getenv("LEGACY_CHAT_ID", "")
+
+# Versión del esquema del asistente: subirla al cambiar tablas, índices o migraciones
+VERSION_ESQUEMA = 3
+
 def init_db():
-    """Inicializa las tablas necesarias para el asistente"""
-    conn = sqlite3.connect('assistant.db')
+    """Crea o migra las tablas del asistente si la base de datos no tiene la versión actual del esquema"""
+    if storage.ensure_schema("asistente", VERSION_ESQUEMA, _aplicar_esquema):
+        print("Base de datos inicializada correctamente.")
+
+def _aplicar_esquema(conn):
     cursor = conn.cursor()
-    
+    _crear_tablas(cursor)
+    reconstruir = _migrar_multiusuario(cursor)
+    _crear_vistas(cursor)
+    _crear_indices(cursor)
+    search.crear_indices(conn, ("tareas", "conversaciones"))
+    
+    # Poblar los agregados la primera vez que se crean sobre datos existentes
+    sin_agregados = conn.execute("SELECT 1 FROM finanzas_totales LIMIT 1").fetchone() is None
+    con_movimientos = conn.execute("SELECT 1 FROM finanzas LIMIT 1").fetchone() is not None
+    if reconstruir or (sin_agregados and con_movimientos):
+        _reconstruir_agregados(conn)
+
+def _crear_tablas(cursor):
+    """Crea las tablas del asistente si no existen"""
     # Tabla para tareas
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS tareas (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id TEXT NOT NULL DEFAULT '',
         titulo TEXT NOT NULL,
         descripcion TEXT,
         fecha_creacion TEXT NOT NULL,
         fecha_limite TEXT,
         prioridad TEXT,
-        completada INTEGER DEFAULT 0
+        completada INTEGER DEFAULT 0,
+        recordatorio_enviado INTEGER NOT NULL DEFAULT 0
     )
     ''')
     
@@ -52,6 +142,7 @@ def init_db():
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS finanzas (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id TEXT NOT NULL DEFAULT '',
         tipo TEXT NOT NULL,
         monto REAL NOT NULL,
         categoria TEXT NOT NULL,
@@ -60,88 +151,204 @@ def init_db():
     )
     ''')
     
-    # Tabla para historial de conversaciones
+    # Totales acumulados por usuario y tipo (saldo en O(1))
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS finanzas_totales (
+        chat_id TEXT NOT NULL,
+        tipo TEXT NOT NULL,
+        total REAL NOT NULL DEFAULT 0,
+        movimientos INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, tipo)
+    )
+    ''')
+    
+    # Totales por usuario, día, tipo y categoría para los resúmenes por periodo
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS finanzas_diario (
+        chat_id TEXT NOT NULL,
+        fecha TEXT NOT NULL,
+        tipo TEXT NOT NULL,
+        categoria TEXT NOT NULL,
+        total REAL NOT NULL DEFAULT 0,
+        movimientos INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, fecha, tipo, categoria)
+    )
+    ''')
+    
+    # Tabla para historial de conversaciones; mensaje_id y respuesta_id apuntan a
+    # la fila de mensajes con el mismo texto cuando la retención lo deduplica
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS conversaciones (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         chat_id TEXT NOT NULL,
         mensaje TEXT NOT NULL,
         respuesta TEXT,
-        timestamp TEXT NOT NULL
+        timestamp TEXT NOT NULL,
+        mensaje_id INTEGER,
+        respuesta_id INTEGER
     )
     ''')
-    
-    conn.commit()
-    conn.close()
-    print("Base de datos inicializada correctamente.")
 
-def agregar_tarea(titulo, descripcion=None, fecha_limite=None, prioridad="media"):
-    """Agrega una nueva tarea a la base de datos"""
-    conn = sqlite3.connect('assistant.db')
-    cursor = conn.cursor()
-    
-    fecha_creacion = datetime.now().strftime("%Y-%m-%d")
-    
+def _crear_vistas(cursor):
+    """Crea la vista de conversaciones con el texto deduplicado resuelto desde mensajes"""
+    cursor.execute('''
+    CREATE VIEW IF NOT EXISTS conversaciones_texto AS
+    SELECT c.id, c.chat_id,
+           CASE WHEN c.mensaje_id IS NULL THEN c.mensaje ELSE m.message END AS mensaje,
+           CASE WHEN c.respuesta_id IS NULL THEN c.respuesta ELSE r.message END AS respuesta,
+           c.timestamp
+    FROM conversaciones c
+    LEFT JOIN mensajes m ON m.id = c.mensaje_id
+    LEFT JOIN mensajes r ON r.id = c.respuesta_id
+    ''')
+
+def _columnas(cursor, tabla):
+    return {fila[1] for fila in cursor.execute(f"PRAGMA table_info({tabla})").fetchall()}
+
+def _migrar_multiusuario(cursor):
+    """Agrega chat_id a bases de datos anteriores; devuelve si hay que reconstruir agregados.
+
+    Los datos existentes eran compartidos por todos los usuarios. Si el
+    historial sólo contiene un chat se le asignan a ese chat; si no, quedan
+    bajo LEGACY_CHAT_ID para que puedan reasignarse manualmente.
+    """
+    migrar = [tabla for tabla in ("tareas", "finanzas") if "chat_id" not in _columnas(cursor, tabla)]
+    if migrar:
+        chats = cursor.execute("SELECT DISTINCT chat_id FROM conversaciones LIMIT 2").fetchall()
+        propietario = chats[0][0] if len(chats) == 1 else LEGACY_CHAT_ID
+        for tabla in migrar:
+            cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN chat_id TEXT NOT NULL DEFAULT ''")
+            cursor.execute(f"UPDATE {tabla} SET chat_id = ?", (propietario,))
+        print(f"Migración multiusuario: {', '.join(migrar)} asignadas a '{propietario}'.")
+    
+    # Los agregados anteriores no tenían chat_id: recrearlos
+    reconstruir = False
+    for tabla in ("finanzas_totales", "finanzas_diario"):
+        if "chat_id" not in _columnas(cursor, tabla):
+            cursor.execute(f"DROP TABLE {tabla}")
+            reconstruir = True
+    if reconstruir:
+        _crear_tablas(cursor)
+    
+    # Recordatorios de fecha límite: las tareas anteriores aún no se han avisado
+    if "recordatorio_enviado" not in _columnas(cursor, "tareas"):
+        cursor.execute("ALTER TABLE tareas ADD COLUMN recordatorio_enviado INTEGER NOT NULL DEFAULT 0")
+    
+    # Deduplicación del texto de las conversaciones contra la tabla mensajes
+    columnas = _columnas(cursor, "conversaciones")
+    for columna in ("mensaje_id", "respuesta_id"):
+        if columna not in columnas:
+            cursor.execute(f"ALTER TABLE conversaciones ADD COLUMN {columna} INTEGER")
+    
+    return reconstruir or "finanzas" in migrar
+
+def _crear_indices(cursor):
+    """Crea los índices compuestos encabezados por chat_id"""
+    cursor.execute("DROP INDEX IF EXISTS idx_finanzas_tipo_fecha")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tareas_chat_completada ON tareas(chat_id, completada, fecha_limite)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_finanzas_chat_tipo_fecha ON finanzas(chat_id, tipo, fecha)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_finanzas_chat ON finanzas(chat_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversaciones_chat_timestamp ON conversaciones(chat_id, timestamp)")
+    # Sólo las conversaciones deduplicadas: al archivar mensajes se les devuelve el texto
+    for columna in ("mensaje_id", "respuesta_id"):
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_conversaciones_{columna} ON conversaciones({columna}) "
+            f"WHERE {columna} IS NOT NULL"
+        )
+    # Sólo las tareas con aviso pendiente, en el orden en que las lee el programador de recordatorios
     cursor.execute(
-        "INSERT INTO tareas (titulo, descripcion, fecha_creacion, fecha_limite, prioridad) VALUES (?, ?, ?, ?, ?)",
-        (titulo, descripcion, fecha_creacion, fecha_limite, prioridad)
+        "CREATE INDEX IF NOT EXISTS idx_tareas_recordatorio ON tareas(fecha_limite) "
+        "WHERE completada = 0 AND recordatorio_enviado = 0"
     )
+
+@metrics.instrumentar("db")
+def agregar_tarea(chat_id, titulo, descripcion=None, fecha_limite=None, prioridad="media"):
+    """Agrega una nueva tarea a la base de datos"""
+    fecha_creacion = datetime.now().strftime("%Y-%m-%d")
     
-    conn.commit()
-    tarea_id = cursor.lastrowid
-    conn.close()
+    with storage.transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO tareas (chat_id, titulo, descripcion, fecha_creacion, fecha_limite, prioridad) VALUES (?, ?, ?, ?, ?, ?)",
+            (chat_id, titulo, descripcion, fecha_creacion, fecha_limite, prioridad)
+        )
+        tarea_id = cursor.lastrowid
     
+    reminders.tarea_agregada(tarea_id, fecha_limite)
     return f"✅ Tarea '{titulo}' agregada correctamente."
 
-def registrar_gasto(monto, categoria, descripcion=None, fecha=None):
+def _acumular_movimiento(conn, chat_id, tipo, monto, categoria, fecha):
+    """Actualiza los agregados financieros dentro de la transacción del movimiento"""
+    conn.execute(
+        "INSERT INTO finanzas_totales (chat_id, tipo, total, movimientos) VALUES (?, ?, ?, 1) "
+        "ON CONFLICT(chat_id, tipo) DO UPDATE SET total = total + excluded.total, movimientos = movimientos + 1",
+        (chat_id, tipo, monto)
+    )
+    conn.execute(
+        "INSERT INTO finanzas_diario (chat_id, fecha, tipo, categoria, total, movimientos) VALUES (?, ?, ?, ?, ?, 1) "
+        "ON CONFLICT(chat_id, fecha, tipo, categoria) DO UPDATE SET total = total + excluded.total, movimientos = movimientos + 1",
+        (chat_id, fecha, tipo, categoria, monto)
+    )
+
+def _reconstruir_agregados(conn):
+    """Recalcula los agregados financieros a partir de la tabla finanzas"""
+    conn.execute("DELETE FROM finanzas_totales")
+    conn.execute("DELETE FROM finanzas_diario")
+    conn.execute(
+        "INSERT INTO finanzas_totales (chat_id, tipo, total, movimientos) "
+        "SELECT chat_id, tipo, SUM(monto), COUNT(*) FROM finanzas GROUP BY chat_id, tipo"
+    )
+    conn.execute(
+        "INSERT INTO finanzas_diario (chat_id, fecha, tipo, categoria, total, movimientos) "
+        "SELECT chat_id, fecha, tipo, categoria, SUM(monto), COUNT(*) FROM finanzas GROUP BY chat_id, fecha, tipo, categoria"
+    )
+
+def reconstruir_agregados():
+    """Recalcula los agregados financieros (por ejemplo, tras editar finanzas a mano)"""
+    with storage.transaction() as conn:
+        _reconstruir_agregados(conn)
+        movimientos = conn.execute("SELECT COALESCE(SUM(movimientos), 0) FROM finanzas_totales").fetchone()[0]
+    return f"✅ Agregados financieros reconstruidos ({movimientos} movimientos)."
+
+@metrics.instrumentar("db")
+def registrar_gasto(chat_id, monto, categoria, descripcion=None, fecha=None):
     """Registra un nuevo gasto en la base de datos"""
-    conn = sqlite3.connect('assistant.db')
-    cursor = conn.cursor()
-    
     if not fecha:
         fecha = datetime.now().strftime("%Y-%m-%d")
     
-    cursor.execute(
-        "INSERT INTO finanzas (tipo, monto, categoria, descripcion, fecha) VALUES (?, ?, ?, ?, ?)",
-        ("gasto", monto, categoria, descripcion, fecha)
-    )
-    
-    conn.commit()
-    conn.close()
+    with storage.transaction() as conn:
+        conn.execute(
+            "INSERT INTO finanzas (chat_id, tipo, monto, categoria, descripcion, fecha) VALUES (?, ?, ?, ?, ?, ?)",
+            (chat_id, "gasto", monto, categoria, descripcion, fecha)
+        )
+        _acumular_movimiento(conn, chat_id, "gasto", monto, categoria, fecha)
     
     return f"✅ Gasto de ${monto} en '{categoria}' registrado correctamente."
 
-def registrar_ingreso(monto, categoria, descripcion=None, fecha=None):
+@metrics.instrumentar("db")
+def registrar_ingreso(chat_id, monto, categoria, descripcion=None, fecha=None):
     """Registra un nuevo ingreso en la base de datos"""
-    conn = sqlite3.connect('assistant.db')
-    cursor = conn.cursor()
-    
     if not fecha:
         fecha = datetime.now().strftime("%Y-%m-%d")
     
-    cursor.execute(
-        "INSERT INTO finanzas (tipo, monto, categoria, descripcion, fecha) VALUES (?, ?, ?, ?, ?)",
-        ("ingreso", monto, categoria, descripcion, fecha)
-    )
-    
-    conn.commit()
-    conn.close()
+    with storage.transaction() as conn:
+        conn.execute(
+            "INSERT INTO finanzas (chat_id, tipo, monto, categoria, descripcion, fecha) VALUES (?, ?, ?, ?, ?, ?)",
+            (chat_id, "ingreso", monto, categoria, descripcion, fecha)
+        )
+        _acumular_movimiento(conn, chat_id, "ingreso", monto, categoria, fecha)
     
     return f"✅ Ingreso de ${monto} en '{categoria}' registrado correctamente."
 
-def listar_tareas(filtro="pendientes", ordenar_por="fecha"):
+@metrics.instrumentar("db")
+def listar_tareas(chat_id, filtro="pendientes", ordenar_por="fecha"):
     """Obtiene la lista de tareas según los filtros especificados"""
-    conn = sqlite3.connect('assistant.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    query = "SELECT * FROM tareas"
-    params = []
+    query = "SELECT * FROM tareas WHERE chat_id = ?"
+    params = [chat_id]
     
     if filtro == "pendientes":
-        query += " WHERE completada = 0"
+        query += " AND completada = 0"
     elif filtro == "completadas":
-        query += " WHERE completada = 1"
+        query += " AND completada = 1"
     
     if ordenar_por == "fecha":
         query += " ORDER BY fecha_limite"
@@ -149,9 +356,8 @@ def listar_tareas(filtro="pendientes", ordenar_por="fecha"):
         # Ordenar por prioridad (alta > media > baja)
         query += " ORDER BY CASE prioridad WHEN 'alta' THEN 1 WHEN 'media' THEN 2 WHEN 'baja' THEN 3 END"
     
-    cursor.execute(query, params)
-    tareas = cursor.fetchall()
-    conn.close()
+    with storage.connection() as conn:
+        tareas = conn.execute(query, params).fetchall()
     
     if not tareas:
         return "No hay tareas para mostrar."
@@ -166,46 +372,40 @@ def listar_tareas(filtro="pendientes", ordenar_por="fecha"):
     
     return resultado
 
-def completar_tarea(id_tarea=None, titulo_tarea=None):
+@metrics.instrumentar("db")
+def completar_tarea(chat_id, id_tarea=None, titulo_tarea=None):
     """Marca una tarea como completada"""
     if not id_tarea and not titulo_tarea:
         return "❌ Error: Debes proporcionar el ID o el título de la tarea."
     
-    conn = sqlite3.connect('assistant.db')
-    cursor = conn.cursor()
-    
-    if id_tarea:
-        cursor.execute("SELECT titulo FROM tareas WHERE id = ? AND completada = 0", (id_tarea,))
-        tarea = cursor.fetchone()
-        
-        if not tarea:
-            conn.close()
-            return f"❌ No se encontró una tarea pendiente con ID {id_tarea}."
+    with storage.transaction() as conn:
+        cursor = conn.cursor()
         
-        cursor.execute("UPDATE tareas SET completada = 1 WHERE id = ?", (id_tarea,))
-        titulo = tarea[0]
-    else:
-        cursor.execute("SELECT id FROM tareas WHERE titulo LIKE ? AND completada = 0", (f"%{titulo_tarea}%",))
-        tarea = cursor.fetchone()
-        
-        if not tarea:
-            conn.close()
-            return f"❌ No se encontró una tarea pendiente con título similar a '{titulo_tarea}'."
-        
-        cursor.execute("UPDATE tareas SET completada = 1 WHERE id = ?", (tarea[0],))
-        titulo = titulo_tarea
-    
-    conn.commit()
-    conn.close()
+        if id_tarea:
+            cursor.execute("SELECT titulo FROM tareas WHERE id = ? AND chat_id = ? AND completada = 0", (id_tarea, chat_id))
+            tarea = cursor.fetchone()
+            
+            if not tarea:
+                return f"❌ No se encontró una tarea pendiente con ID {id_tarea}."
+            
+            cursor.execute("UPDATE tareas SET completada = 1 WHERE id = ?", (id_tarea,))
+            tarea_id, titulo = id_tarea, tarea[0]
+        else:
+            # La tarea pendiente con el título más parecido, según el índice de texto completo
+            tarea = search.resolver_tarea(conn, chat_id, titulo_tarea)
+            
+            if not tarea:
+                return f"❌ No se encontró una tarea pendiente con título similar a '{titulo_tarea}'."
+            
+            cursor.execute("UPDATE tareas SET completada = 1 WHERE id = ?", (tarea[0],))
+            tarea_id, titulo = tarea[0], tarea[1]
     
+    reminders.tarea_completada(tarea_id)
     return f"✅ Tarea '{titulo}' marcada como completada."
 
-def resumen_financiero(periodo="mes"):
+@metrics.instrumentar("db")
+def resumen_financiero(chat_id, periodo="mes"):
     """Genera un resumen financiero para el periodo especificado"""
-    conn = sqlite3.connect('assistant.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
     hoy = datetime.now()
     
     if periodo == "dia":
@@ -218,28 +418,19 @@ def resumen_financiero(periodo="mes"):
     else:  # mes por defecto
         fecha_inicio = f"{hoy.year}-{hoy.month:02d}-01"
     
-    # Obtener gastos por categoría
-    cursor.execute(
-        "SELECT SUM(monto) as total, categoria FROM finanzas WHERE tipo = 'gasto' AND fecha >= ? GROUP BY categoria ORDER BY total DESC",
-        (fecha_inicio,)
-    )
-    gastos_por_categoria = cursor.fetchall()
-    
-    # Obtener total de gastos
-    cursor.execute(
-        "SELECT SUM(monto) as total FROM finanzas WHERE tipo = 'gasto' AND fecha >= ?",
-        (fecha_inicio,)
-    )
-    total_gastos = cursor.fetchone()["total"] or 0
-    
-    # Obtener total de ingresos
-    cursor.execute(
-        "SELECT SUM(monto) as total FROM finanzas WHERE tipo = 'ingreso' AND fecha >= ?",
-        (fecha_inicio,)
-    )
-    total_ingresos = cursor.fetchone()["total"] or 0
+    with storage.connection() as conn:
+        cursor = conn.cursor()
+        
+        # Obtener totales por tipo y categoría desde los agregados diarios
+        cursor.execute(
+            "SELECT tipo, categoria, SUM(total) as total FROM finanzas_diario WHERE chat_id = ? AND fecha >= ? GROUP BY tipo, categoria ORDER BY total DESC",
+            (chat_id, fecha_inicio)
+        )
+        filas = cursor.fetchall()
     
-    conn.close()
+    gastos_por_categoria = [fila for fila in filas if fila["tipo"] == "gasto"]
+    total_gastos = sum(fila["total"] for fila in gastos_por_categoria)
+    total_ingresos = sum(fila["total"] for fila in filas if fila["tipo"] == "ingreso")
     
     if total_gastos == 0 and total_ingresos == 0:
         return f"No hay movimientos financieros registrados en este {periodo}."
@@ -257,29 +448,27 @@ def resumen_financiero(periodo="mes"):
     
     return resultado
 
-def saldo_actual():
+@metrics.instrumentar("db")
+def saldo_actual(chat_id):
     """Calcula y muestra el saldo actual"""
-    conn = sqlite3.connect('assistant.db')
-    cursor = conn.cursor()
-    
-    # Obtener total de ingresos
-    cursor.execute("SELECT SUM(monto) as total FROM finanzas WHERE tipo = 'ingreso'")
-    total_ingresos = cursor.fetchone()[0] or 0
-    
-    # Obtener total de gastos
-    cursor.execute("SELECT SUM(monto) as total FROM finanzas WHERE tipo = 'gasto'")
-    total_gastos = cursor.fetchone()[0] or 0
+    with storage.connection() as conn:
+        cursor = conn.cursor()
+        
+        # Obtener totales acumulados de ingresos y gastos
+        cursor.execute("SELECT tipo, total FROM finanzas_totales WHERE chat_id = ?", (chat_id,))
+        totales = {fila["tipo"]: fila["total"] for fila in cursor.fetchall()}
+        total_ingresos = totales.get("ingreso", 0)
+        total_gastos = totales.get("gasto", 0)
+        
+        # Obtener últimos 5 movimientos
+        cursor.execute(
+            "SELECT tipo, monto, categoria, fecha FROM finanzas WHERE chat_id = ? ORDER BY id DESC LIMIT 5",
+            (chat_id,)
+        )
+        ultimos_movimientos = cursor.fetchall()
     
     saldo = total_ingresos - total_gastos
     
-    # Obtener últimos 5 movimientos
-    cursor.execute(
-        "SELECT tipo, monto, categoria, fecha FROM finanzas ORDER BY id DESC LIMIT 5"
-    )
-    ultimos_movimientos = cursor.fetchall()
-    
-    conn.close()
-    
     resultado = f"💵 Saldo actual: ${saldo:.2f}\n\n"
     
     if ultimos_movimientos:
@@ -291,112 +480,400 @@ def saldo_actual():
     
     return resultado
 
+@metrics.instrumentar("db")
 def guardar_conversacion(chat_id, mensaje, respuesta):
     """Guarda la conversación en la base de datos"""
-    conn = sqlite3.connect('assistant.db')
-    cursor = conn.cursor()
-    
     timestamp = datetime.now().isoformat()
     
-    cursor.execute(
-        "INSERT INTO conversaciones (chat_id, mensaje, respuesta, timestamp) VALUES (?, ?, ?, ?)",
-        (chat_id, mensaje, respuesta, timestamp)
-    )
+    write_behind.get_writer().insert("conversaciones", {
+        "chat_id": chat_id,
+        "mensaje": mensaje,
+        "respuesta": respuesta,
+        "timestamp": timestamp
+    })
     
-    conn.commit()
-    conn.close()
+    if contexto is not None:
+        contexto.agregar(chat_id, mensaje, respuesta)
 
-def procesar_mensaje(mensaje, chat_id):
-    """Procesa un mensaje del usuario y devuelve la respuesta del asistente"""
+def _completar_tarea(chat_id, tarea):
+    """Adapta COMPLETAR_TAREA: el argumento es el ID o el título de la tarea"""
+    if tarea.isdigit():
+        return completar_tarea(chat_id, id_tarea=int(tarea))
+    return completar_tarea(chat_id, titulo_tarea=tarea)
+
+_ERROR_MOVIMIENTO = "❌ Error: Formato incorrecto para registrar {}. Necesito al menos el monto y la categoría."
+
+def _campos_movimiento():
+    return {
+        "monto": Campo("numero", requerido=True, descripcion="Monto positivo"),
+        "categoria": Campo(requerido=True, descripcion="Categoría, por ejemplo comida o salario"),
+        "descripcion": Campo(descripcion="Detalle opcional"),
+        "fecha": Campo("fecha", descripcion="Fecha del movimiento; hoy si se omite"),
+    }
+
+# Tabla de comandos: esquema de argumentos y manejador de cada comando
+PROTOCOLO = Protocolo([
+    DefinicionComando("AGREGAR_TAREA", "Agrega una tarea pendiente", {
+        "titulo": Campo(requerido=True, descripcion="Título breve de la tarea"),
+        "descripcion": Campo(descripcion="Detalle opcional"),
+        "fecha_limite": Campo("fecha", descripcion="Fecha límite"),
+        "prioridad": Campo(valores=("alta", "media", "baja"), sinonimos={"urgente": "alta", "normal": "media"},
+                           por_defecto="media"),
+    }, agregar_tarea),
+    DefinicionComando("LISTAR_TAREAS", "Lista las tareas del usuario", {
+        "filtro": Campo(valores=("todas", "pendientes", "completadas"),
+                        sinonimos={"todos": "todas", "pendiente": "pendientes", "completada": "completadas"},
+                        por_defecto="pendientes"),
+    }, listar_tareas),
+    DefinicionComando("COMPLETAR_TAREA", "Marca una tarea como completada", {
+        "tarea": Campo(requerido=True, descripcion="ID numérico o título de la tarea"),
+    }, _completar_tarea),
+    DefinicionComando("REGISTRAR_GASTO", "Registra un gasto", _campos_movimiento(), registrar_gasto,
+                      _ERROR_MOVIMIENTO.format("gasto")),
+    DefinicionComando("REGISTRAR_INGRESO", "Registra un ingreso", _campos_movimiento(), registrar_ingreso,
+                      _ERROR_MOVIMIENTO.format("ingreso")),
+    DefinicionComando("RESUMEN_FINANCIERO", "Resume ingresos y gastos de un periodo", {
+        "periodo": Campo(valores=("dia", "semana", "mes", "año"),
+                         sinonimos={"hoy": "dia", "diario": "dia", "semanal": "semana", "mensual": "mes", "anual": "año"},
+                         por_defecto="mes"),
+    }, resumen_financiero),
+    DefinicionComando("SALDO_ACTUAL", "Muestra el saldo actual y los últimos movimientos", {}, saldo_actual),
+])
+
+# Declaraciones de funciones para Gemini, generadas a partir de la tabla
+DECLARACIONES_FUNCIONES = PROTOCOLO.declaraciones()
+
+def interpretar(respuesta_texto):
+    """Interpreta y valida la respuesta del modelo.
+
+    Devuelve el Comando con los argumentos reparados, o el ErrorValidacion si
+    no se pudo reparar localmente.
+    """
     try:
-        # Configurar el modelo
-        model = genai.GenerativeModel(
+        return PROTOCOLO.resolver(respuesta_texto)
+    except ErrorValidacion as e:
+        return e
+
+def _ejecutar(resultado, chat_id):
+    if isinstance(resultado, ErrorValidacion):
+        return PROTOCOLO.mensaje_error(resultado)
+    return PROTOCOLO.ejecutar(resultado, chat_id)
+
+def ejecutar_comando(respuesta_texto, chat_id):
+    """Ejecuta el comando contenido en la respuesta del modelo y devuelve la respuesta final"""
+    return _ejecutar(interpretar(respuesta_texto), chat_id)
+
+# El SDK de Gemini tarda más de medio segundo en importarse: se carga con el primer
+# mensaje que lo necesita (o al precalentar), no al importar el módulo
+_genai = None
+_modelo = None
+_sdk_lock = threading.RLock()
+
+def sdk_gemini():
+    """Importa y configura el SDK de Gemini la primera vez que se usa"""
+    global _genai
+    if _genai is None:
+        with _sdk_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=API_KEY)
+                _genai = genai
+    return _genai
+
+def obtener_modelo():
+    """Devuelve el cliente del modelo compartido, creándolo la primera vez"""
+    global _modelo
+    if _modelo is None:
+        with _sdk_lock:
+            if _modelo is None:
+                _modelo = crear_modelo()
+    return _modelo
+
+def crear_modelo():
+    """Crea el cliente del modelo de Gemini con las instrucciones del sistema"""
+    genai = sdk_gemini()
+    if GEMINI_PROTOCOL == "functions":
+        return genai.GenerativeModel(
             model_name="gemini-1.5-flash",
             generation_config={"temperature": 0.2},
-            system_instruction=SYSTEM_INSTRUCTIONS
+            system_instruction=SYSTEM_INSTRUCTIONS_FUNCIONES,
+            tools=[{"function_declarations": DECLARACIONES_FUNCIONES}]
         )
+    return genai.GenerativeModel(
+        model_name="gemini-1.5-flash",
+        generation_config={"temperature": 0.2},
+        system_instruction=SYSTEM_INSTRUCTIONS
+    )
+
+def texto_respuesta(response):
+    """Texto de una respuesta (o fragmento) del modelo; una llamada a función se serializa como JSON"""
+    for candidato in getattr(response, "candidates", None) or ():
+        for parte in candidato.content.parts:
+            llamada = getattr(parte, "function_call", None)
+            if llamada is not None and llamada.name:
+                return PROTOCOLO.serializar(llamada.name, dict(llamada.args))
+        break
+    return response.text
+
+def _pedir_correccion(contenidos, respuesta_texto, error):
+    """Añade a la petición la respuesta inválida y el motivo para que el modelo la corrija"""
+    if isinstance(contenidos, str):
+        contenidos = [{"role": "user", "parts": [contenidos]}]
+    return contenidos + [
+        {"role": "model", "parts": [respuesta_texto]},
+        {"role": "user", "parts": [f"La respuesta anterior no es válida: {error}. Corrígela."]},
+    ]
+
+def _contar_reparacion(resultado, reintentos):
+    if isinstance(resultado, ErrorValidacion):
+        metrics.COMMAND_REPAIRS.inc(command=resultado.comando, result="failed")
+    elif reintentos:
+        metrics.COMMAND_REPAIRS.inc(command=resultado.nombre, result="reprompt")
+    elif resultado.reparado:
+        metrics.COMMAND_REPAIRS.inc(command=resultado.nombre, result="local")
+
+def resolver(model, contenidos, respuesta_texto):
+    """Valida la respuesta del modelo y, si no se puede reparar localmente, le pide corregirla.
+
+    Devuelve (texto, resultado), donde resultado es el de `interpretar` para
+    la última respuesta obtenida.
+    """
+    resultado = interpretar(respuesta_texto)
+    reintentos = 0
+    while isinstance(resultado, ErrorValidacion) and reintentos < GEMINI_REPAIR_RETRIES:
+        reintentos += 1
+        contenidos = _pedir_correccion(contenidos, respuesta_texto, resultado)
+        esperar_cuota()
+        with metrics.span("generate_content", operation="repair"):
+            respuesta_texto = texto_respuesta(model.generate_content(contenidos))
+        resultado = interpretar(respuesta_texto)
+    _contar_reparacion(resultado, reintentos)
+    return respuesta_texto, resultado
+
+def guardar_en_cache(mensaje, resultado):
+    """Guarda la clasificación validada en la caché de intenciones"""
+    if cache_intenciones is not None and isinstance(resultado, Comando):
+        cache_intenciones.put(mensaje, PROTOCOLO.como_texto(resultado))
+
+def esperar_cuota():
+    """Espera a que el limitador permita otra llamada a Gemini"""
+    if limite_gemini is not None:
+        with metrics.span("rate_limit"):
+            limite_gemini.acquire()
+
+def armar_contenidos(mensaje, chat_id):
+    """Arma la petición para Gemini con el historial reciente del chat"""
+    if contexto is None:
+        return mensaje
+    return contexto.historial(chat_id) + [{"role": "user", "parts": [mensaje]}]
+
+def clasificar_sin_modelo(mensaje):
+    """Intenta obtener la clasificación del mensaje sin llamar a Gemini.
+
+    Devuelve una tupla (texto, origen); texto es None si hay que consultar al modelo.
+    """
+    with metrics.span("classify"):
+        # Resolver localmente los comandos evidentes
+        if clasificador_local is not None:
+            clasificacion = clasificador_local.clasificar(mensaje)
+            if clasificacion is not None:
+                return clasificacion.texto, "local"
         
-        # Obtener respuesta del modelo
-        response = model.generate_content(mensaje)
-        
-        # Obtener el texto de la respuesta
-        respuesta_texto = response.text
+        # Reutilizar la clasificación de mensajes equivalentes ya vistos
+        if cache_intenciones is not None:
+            texto = cache_intenciones.get(mensaje)
+            if texto is not None:
+                return texto, "cache"
+    
+    return None, "gemini"
+
+def nombre_comando(respuesta_texto):
+    """Devuelve el token de comando de la respuesta, o CONVERSACION si no lo hay"""
+    return PROTOCOLO.nombre_comando(respuesta_texto)
+
+def despachar(respuesta_texto, chat_id, origen, resultado=None):
+    """Ejecuta el comando midiendo su duración con la etiqueta del comando.
+
+    `resultado` es la respuesta ya interpretada por `resolver`; así no se
+    vuelve a interpretar el texto.
+    """
+    if resultado is None:
+        resultado = interpretar(respuesta_texto)
+    comando = resultado.comando if isinstance(resultado, ErrorValidacion) else resultado.nombre
+    metrics.COMMANDS.inc(command=comando, source=origen)
+    with metrics.span("dispatch", command=comando):
+        return _ejecutar(resultado, chat_id)
+
+def procesar_mensaje(mensaje, chat_id):
+    """Procesa un mensaje del usuario y devuelve la respuesta del asistente"""
+    try:
+        respuesta_texto, origen = clasificar_sin_modelo(mensaje)
+        resultado = None
         
-        # Procesar comandos especiales
-        if respuesta_texto.startswith("AGREGAR_TAREA"):
-            # Extraer detalles de la tarea
-            detalles = respuesta_texto[len("AGREGAR_TAREA"):].strip()
-            partes = detalles.split(",")
+        if respuesta_texto is None:
+            # Configurar el modelo
+            model = obtener_modelo()
+            contenidos = armar_contenidos(mensaje, chat_id)
             
-            titulo = partes[0].strip()
-            descripcion = partes[1].strip() if len(partes) > 1 else None
-            fecha_limite = partes[2].strip() if len(partes) > 2 else None
-            prioridad = partes[3].strip().lower() if len(partes) > 3 else "media"
+            # Obtener respuesta del modelo
+            esperar_cuota()
+            with metrics.span("generate_content"):
+                response = model.generate_content(contenidos)
             
-            respuesta_final = agregar_tarea(titulo, descripcion, fecha_limite, prioridad)
+            # Validar el comando (reparándolo localmente o pidiendo al modelo que lo corrija)
+            respuesta_texto, resultado = resolver(model, contenidos, texto_respuesta(response))
+            guardar_en_cache(mensaje, resultado)
         
-        elif respuesta_texto.startswith("LISTAR_TAREAS"):
-            filtro = respuesta_texto[len("LISTAR_TAREAS"):].strip().lower() or "pendientes"
-            respuesta_final = listar_tareas(filtro)
+        # Procesar comandos especiales
+        respuesta_final = despachar(respuesta_texto, chat_id, origen, resultado)
         
-        elif respuesta_texto.startswith("COMPLETAR_TAREA"):
-            id_o_titulo = respuesta_texto[len("COMPLETAR_TAREA"):].strip()
-            try:
-                id_tarea = int(id_o_titulo)
-                respuesta_final = completar_tarea(id_tarea=id_tarea)
-            except ValueError:
-                respuesta_final = completar_tarea(titulo_tarea=id_o_titulo)
+        # Guardar la conversación
+        guardar_conversacion(chat_id, mensaje, respuesta_final)
         
-        elif respuesta_texto.startswith("REGISTRAR_GASTO"):
-            detalles = respuesta_texto[len("REGISTRAR_GASTO"):].strip()
-            partes = detalles.split(",")
-            
-            try:
-                monto = float(partes[0].strip())
-                categoria = partes[1].strip()
-                descripcion = partes[2].strip() if len(partes) > 2 else None
-                fecha = partes[3].strip() if len(partes) > 3 else None
-                
-                respuesta_final = registrar_gasto(monto, categoria, descripcion, fecha)
-            except (ValueError, IndexError):
-                respuesta_final = "❌ Error: Formato incorrecto para registrar gasto. Necesito al menos el monto y la categoría."
+        return respuesta_final
+    
+    except Exception as e:
+        print(f"Error al procesar mensaje: {e}")
+        return MENSAJE_ERROR
+
+def _puede_ser_comando(texto):
+    """Indica si el texto empieza, o podría empezar, con un token de comando o una llamada en JSON"""
+    return PROTOCOLO.puede_ser_comando(texto)
+
+class Transmision:
+    """Decide qué fragmentos de una respuesta en streaming se entregan a la interfaz"""
+
+    def __init__(self):
+        self.partes = []
+        self.transmitiendo = False
+
+    def agregar(self, texto):
+        """Devuelve el texto a entregar, o None mientras la respuesta pueda ser un comando"""
+        self.partes.append(texto)
+        if self.transmitiendo:
+            return texto
         
-        elif respuesta_texto.startswith("REGISTRAR_INGRESO"):
-            detalles = respuesta_texto[len("REGISTRAR_INGRESO"):].strip()
-            partes = detalles.split(",")
+        # Decidir con el primer fragmento si la respuesta es un comando;
+        # sólo se espera más texto mientras siga siendo un prefijo posible
+        acumulado = "".join(self.partes)
+        if not _puede_ser_comando(acumulado):
+            self.transmitiendo = True
+            return acumulado
+        return None
+
+    def texto(self):
+        return "".join(self.partes)
+
+def procesar_mensaje_stream(mensaje, chat_id, on_chunk):
+    """Procesa un mensaje generando la respuesta en streaming.
+
+    Las respuestas conversacionales se entregan fragmento a fragmento a
+    `on_chunk`; si el modelo responde con un comando, se acumula la respuesta
+    completa y se ejecuta sin emitir fragmentos. Devuelve la respuesta final.
+    """
+    try:
+        respuesta_texto, origen = clasificar_sin_modelo(mensaje)
+        resultado = None
+        
+        if respuesta_texto is None:
+            model = obtener_modelo()
+            contenidos = armar_contenidos(mensaje, chat_id)
+            
+            transmision = Transmision()
+            # La duración incluye la entrega de fragmentos a on_chunk, que se
+            # mide aparte en la etapa de emisión
+            esperar_cuota()
+            with metrics.span("generate_content", operation="stream"):
+                for chunk in model.generate_content(contenidos, stream=True):
+                    fragmento = transmision.agregar(texto_respuesta(chunk))
+                    if fragmento is not None:
+                        on_chunk(fragmento)
             
-            try:
-                monto = float(partes[0].strip())
-                categoria = partes[1].strip()
-                descripcion = partes[2].strip() if len(partes) > 2 else None
-                fecha = partes[3].strip() if len(partes) > 3 else None
-                
-                respuesta_final = registrar_ingreso(monto, categoria, descripcion, fecha)
-            except (ValueError, IndexError):
-                respuesta_final = "❌ Error: Formato incorrecto para registrar ingreso. Necesito al menos el monto y la categoría."
+            respuesta_texto, resultado = resolver(model, contenidos, transmision.texto())
+            guardar_en_cache(mensaje, resultado)
         
-        elif respuesta_texto.startswith("RESUMEN_FINANCIERO"):
-            periodo = respuesta_texto[len("RESUMEN_FINANCIERO"):].strip().lower() or "mes"
-            respuesta_final = resumen_financiero(periodo)
+        respuesta_final = despachar(respuesta_texto, chat_id, origen, resultado)
         
-        elif respuesta_texto.startswith("SALDO_ACTUAL"):
-            respuesta_final = saldo_actual()
+        guardar_conversacion(chat_id, mensaje, respuesta_final)
         
-        else:
-            # Si no es un comando especial, devolver la respuesta directamente
-            respuesta_final = respuesta_texto
+        return respuesta_final
+    
+    except Exception as e:
+        print(f"Error al procesar mensaje en streaming: {e}")
+        return MENSAJE_ERROR
+
+async def esperar_cuota_async():
+    """Versión asyncio de esperar_cuota"""
+    if limite_gemini is not None:
+        with metrics.span("rate_limit"):
+            await limite_gemini.acquire_async()
+
+async def resolver_async(model, contenidos, respuesta_texto):
+    """Versión asyncio de resolver"""
+    resultado = interpretar(respuesta_texto)
+    reintentos = 0
+    while isinstance(resultado, ErrorValidacion) and reintentos < GEMINI_REPAIR_RETRIES:
+        reintentos += 1
+        contenidos = _pedir_correccion(contenidos, respuesta_texto, resultado)
+        await esperar_cuota_async()
+        with metrics.span("generate_content", operation="async_repair"):
+            respuesta_texto = texto_respuesta(await model.generate_content_async(contenidos))
+        resultado = interpretar(respuesta_texto)
+    _contar_reparacion(resultado, reintentos)
+    return respuesta_texto, resultado
+
+async def procesar_mensaje_async(mensaje, chat_id, on_chunk=None):
+    """Versión asyncio de procesar_mensaje y procesar_mensaje_stream.
+
+    Gemini se consulta con la API asíncrona y el acceso a la base de datos se
+    ejecuta en hilos, de modo que el bucle de eventos puede atender miles de
+    mensajes a la vez. Si se indica la corrutina `on_chunk`, la respuesta se
+    genera en streaming igual que en procesar_mensaje_stream.
+    """
+    try:
+        respuesta_texto, origen = clasificar_sin_modelo(mensaje)
+        resultado = None
         
-        # Guardar la conversación
-        guardar_conversacion(chat_id, mensaje, respuesta_final)
+        if respuesta_texto is None:
+            model = obtener_modelo()
+            contenidos = await asyncio.to_thread(armar_contenidos, mensaje, chat_id)
+            
+            await esperar_cuota_async()
+            if on_chunk is None:
+                with metrics.span("generate_content", operation="async"):
+                    response = await model.generate_content_async(contenidos)
+                respuesta_texto = texto_respuesta(response)
+            else:
+                transmision = Transmision()
+                with metrics.span("generate_content", operation="async_stream"):
+                    async for chunk in await model.generate_content_async(contenidos, stream=True):
+                        fragmento = transmision.agregar(texto_respuesta(chunk))
+                        if fragmento is not None:
+                            await on_chunk(fragmento)
+                respuesta_texto = transmision.texto()
+            
+            respuesta_texto, resultado = await resolver_async(model, contenidos, respuesta_texto)
+            guardar_en_cache(mensaje, resultado)
+        
+        # El despacho de comandos es el mismo que en el modo síncrono
+        respuesta_final = await asyncio.to_thread(despachar, respuesta_texto, chat_id, origen, resultado)
+        
+        await asyncio.to_thread(guardar_conversacion, chat_id, mensaje, respuesta_final)
         
         return respuesta_final
     
     except Exception as e:
-        print(f"Error al procesar mensaje: {e}")
-        return "Lo siento, ha ocurrido un error al procesar tu mensaje. Por favor, inténtalo de nuevo."
+        print(f"Error al procesar mensaje asíncrono: {e}")
+        return MENSAJE_ERROR
 
 # Inicializar la base de datos al importar el módulo
 if __name__ == "__main__":
+    import sys
+    
     init_db()
-    # Ejemplo de uso
-    print(procesar_mensaje("Hola, ¿cómo estás?", "test_chat_id"))
\ No newline at end of file
+    
+    if "--reconstruir-agregados" in sys.argv:
+        print(reconstruir_agregados())
+    else:
+        # Ejemplo de uso
+        print(procesar_mensaje("Hola, ¿cómo estás?", "test_chat_id"))
\ No newline at end of file
@@ -0,0 +1,306 @@
+"""Protección de los webhooks entrantes: deduplicación y límite de tasa por chat.
+
+Twilio reintenta el webhook si no responde a tiempo, así que el mismo
+mensaje puede llegar dos veces. `IdempotencyStore` recuerda los
+identificadores del proveedor (MessageSid) durante un TTL para descartar
+los reintentos, y `ChatRateLimiter` pone en cola las ráfagas de un mismo
+chat para que sus mensajes lleguen a Gemini al ritmo permitido.
+"""
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+import storage
+
+
+class IdempotencyStore:
+    """Identificadores ya procesados, acotados por TTL y por cantidad.
+
+    En memoria es un OrderedDict en orden de llegada: con un TTL fijo también
+    es el orden de vencimiento, de modo que purgar sólo mira el principio.
+    Con `persist` los identificadores se guardan además en SQLite, lo que
+    cubre reinicios y varios procesos sobre la misma base de datos.
+    """
+
+    def __init__(self, ttl=86400, max_size=50000, persist=False, prune_every=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.persist = persist
+        self.prune_every = prune_every
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+        self._table_ready = False
+
+        self.claims = 0
+        self.duplicates = 0
+        self.releases = 0
+        self.evictions = 0
+
+    def _purge(self, now):
+        while self._ids:
+            expira = next(iter(self._ids.values()))
+            if expira > now and len(self._ids) <= self.max_size:
+                return
+            self._ids.popitem(last=False)
+            if expira > now:
+                self.evictions += 1
+
+    def claim(self, message_id):
+        """Registra el identificador; devuelve False si ya se había visto dentro del TTL.
+
+        Los mensajes sin identificador siempre se procesan.
+        """
+        if not message_id:
+            return True
+        # Reloj de pared: los vencimientos persistidos deben valer tras un reinicio
+        now = time.time()
+        with self._lock:
+            expira = self._ids.get(message_id)
+            if expira is not None and expira > now:
+                self.duplicates += 1
+                return False
+
+        # Fuera del lock: la base de datos decide entre reintentos simultáneos
+        if self.persist and not self._claim_persisted(message_id, now):
+            with self._lock:
+                self.duplicates += 1
+            return False
+
+        with self._lock:
+            expira = self._ids.get(message_id)
+            if expira is not None and expira > now:
+                self.duplicates += 1
+                return False
+            self._ids.pop(message_id, None)
+            self._ids[message_id] = now + self.ttl
+            self._purge(now)
+            self.claims += 1
+            prune = self.persist and self.claims % self.prune_every == 0
+        if prune:
+            self._prune_persisted(now)
+        return True
+
+    def release(self, message_id):
+        """Olvida un identificador cuyo procesamiento falló para que el reintento se atienda"""
+        if not message_id:
+            return
+        with self._lock:
+            if self._ids.pop(message_id, None) is not None:
+                self.releases += 1
+        if self.persist:
+            with storage.transaction() as conn:
+                conn.execute("DELETE FROM webhook_ids WHERE message_id = ?", (message_id,))
+
+    def _claim_persisted(self, message_id, now):
+        with storage.transaction() as conn:
+            if not self._table_ready:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS webhook_ids (message_id TEXT PRIMARY KEY, expires REAL NOT NULL) WITHOUT ROWID"
+                )
+                self._table_ready = True
+            # Inserta o renueva uno vencido; si está vigente no cambia ninguna fila
+            cursor = conn.execute(
+                "INSERT INTO webhook_ids (message_id, expires) VALUES (?, ?) "
+                "ON CONFLICT(message_id) DO UPDATE SET expires = excluded.expires WHERE webhook_ids.expires <= ?",
+                (message_id, now + self.ttl, now)
+            )
+            return cursor.rowcount > 0
+
+    def _prune_persisted(self, now):
+        with storage.transaction() as conn:
+            conn.execute("DELETE FROM webhook_ids WHERE expires <= ?", (now,))
+
+    def stats(self):
+        """Devuelve el tamaño y los contadores de identificadores"""
+        with self._lock:
+            return {
+                "size": len(self._ids),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "persist": self.persist,
+                "claims": self.claims,
+                "duplicates": self.duplicates,
+                "releases": self.releases,
+                "evictions": self.evictions,
+            }
+
+
+class ChatQueueFullError(Exception):
+    """Se lanza cuando un chat ya tiene `max_pending` mensajes esperando su turno"""
+
+    def __init__(self, chat_id, retry_after):
+        super().__init__(f"El chat {chat_id} tiene demasiados mensajes pendientes")
+        self.chat_id = chat_id
+        self.retry_after = retry_after
+
+
+class _ChatState:
+    """Fichas del chat y trabajos en espera mientras no hay fichas"""
+
+    __slots__ = ("tokens", "updated", "pending", "deliver", "retry_at")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+        self.pending = []
+        self.deliver = None
+        self.retry_at = 0.0
+
+
+class ChatRateLimiter:
+    """Cubeta de fichas por chat que pone en cola las ráfagas.
+
+    Si el chat tiene fichas, `submit` devuelve True y el llamador procesa el
+    trabajo en el momento. Si no, el trabajo espera y se entrega, en orden
+    de llegada, cuando se repone una ficha: cada mensaje se procesa por
+    separado (una ráfaga puede traer varios comandos), sólo que al ritmo
+    permitido. Pasados `max_pending` en espera, `submit` lanza
+    ChatQueueFullError para que el proveedor reintente más tarde. Si
+    `deliver` devuelve False (p. ej. la cola de trabajo está llena), ese
+    trabajo y los que lo siguen vuelven al principio de la espera y se
+    reintentan pasados `retry_delay` segundos: el proveedor ya recibió la
+    respuesta y no volverá a enviarlos.
+
+    Por chat sólo se guardan dos números y la lista de pendientes; los chats
+    sin pendientes menos recientes se desalojan al pasar de `max_chats`
+    (vuelven con la cubeta llena). Un único hilo entrega los pendientes.
+    """
+
+    def __init__(self, rate, capacity=None, max_chats=10000, max_pending=20, retry_delay=1.0):
+        if rate <= 0:
+            raise ValueError("La tasa debe ser mayor que cero")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity else max(1.0, self.rate))
+        self.max_chats = max_chats
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._schedule = []
+        self._thread = None
+
+        self.passed = 0
+        self.deferred = 0
+        self.delivered = 0
+        self.rejected = 0
+        self.retried = 0
+
+    def _state(self, chat_id, now):
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = _ChatState(self.capacity, now)
+            self._evict()
+        else:
+            self._chats.move_to_end(chat_id)
+            state.tokens = min(self.capacity, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+        return state
+
+    def _evict(self):
+        for _ in range(len(self._chats)):
+            if len(self._chats) <= self.max_chats:
+                return
+            chat_id, state = self._chats.popitem(last=False)
+            if state.pending or state.deliver is not None:
+                # Todavía espera su entrega: vuelve al final
+                self._chats[chat_id] = state
+
+    def submit(self, chat_id, job, deliver):
+        """Devuelve True si el trabajo debe procesarse ya o False si quedó en espera.
+
+        `deliver(trabajo)` se llama desde el hilo del limitador con cada
+        trabajo en espera cuando le toca, así que debe ser rápido (p. ej.
+        encolar); devuelve False si todavía no puede aceptarlo. Lanza
+        ChatQueueFullError si el chat ya no admite más.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(chat_id, now)
+            # Mientras se entregan los anteriores, los nuevos esperan detrás
+            if not state.pending and state.deliver is None and state.tokens >= 1:
+                state.tokens -= 1
+                self.passed += 1
+                return True
+            if len(state.pending) >= self.max_pending:
+                self.rejected += 1
+                # Cuando se entregue el primero de la cola habrá sitio
+                raise ChatQueueFullError(chat_id, max(0.0, 1 - state.tokens) / self.rate)
+            state.pending.append(job)
+            state.deliver = deliver
+            self.deferred += 1
+            if len(state.pending) == 1:
+                self._program(chat_id, now + (1 - state.tokens) / self.rate)
+            return False
+
+    def _program(self, chat_id, due):
+        heapq.heappush(self._schedule, (due, chat_id))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="chat-rate-limiter", daemon=True)
+            self._thread.start()
+        self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._schedule or self._schedule[0][0] > time.monotonic():
+                    self._wakeup.wait(self._schedule[0][0] - time.monotonic() if self._schedule else None)
+                _, chat_id = heapq.heappop(self._schedule)
+                now = time.monotonic()
+                state = self._state(chat_id, now)
+                if not state.pending or now < state.retry_at:
+                    # Entrada obsoleta: ya se entregó todo o hay un reintento programado
+                    continue
+                if state.tokens < 1:
+                    self._program(chat_id, now + (1 - state.tokens) / self.rate)
+                    continue
+                # Tantos trabajos como fichas, en orden; el resto espera a las siguientes
+                count = min(int(state.tokens), len(state.pending))
+                state.tokens -= count
+                jobs, state.pending = state.pending[:count], state.pending[count:]
+                deliver = state.deliver
+                if state.pending:
+                    self._program(chat_id, now + (1 - state.tokens) / self.rate)
+                self.delivered += count
+            for i, job in enumerate(jobs):
+                try:
+                    accepted = deliver(job) is not False
+                except Exception as e:
+                    accepted = True
+                    print(f"Error al entregar un mensaje en espera del chat {chat_id}: {e}")
+                if not accepted:
+                    self._retry(chat_id, jobs[i:], deliver)
+                    break
+            else:
+                with self._lock:
+                    if not state.pending:
+                        state.deliver = None
+
+    def _retry(self, chat_id, jobs, deliver):
+        """Devuelve los trabajos no aceptados al principio de la espera, con sus fichas"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(chat_id, now)
+            state.retry_at = now + self.retry_delay
+            self._program(chat_id, state.retry_at)
+            state.pending = jobs + state.pending
+            state.deliver = deliver
+            state.tokens = min(self.capacity, state.tokens + len(jobs))
+            self.delivered -= len(jobs)
+            self.retried += 1
+
+    def stats(self):
+        """Devuelve la configuración y los contadores del limitador"""
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "capacity": self.capacity,
+                "chats": len(self._chats),
+                "bursts_pending": len(self._schedule),
+                "passed": self.passed,
+                "deferred": self.deferred,
+                "delivered": self.delivered,
+                "rejected": self.rejected,
+                "retried": self.retried,
+            }
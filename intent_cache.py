@@ -0,0 +1,147 @@
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+# Comandos cuya clasificación no depende de datos del mensaje y pueden
+# reutilizarse; AGREGAR_TAREA, REGISTRAR_GASTO, etc. llevan argumentos
+# extraídos del texto y nunca se guardan
+COMANDOS_CACHEABLES = ("LISTAR_TAREAS", "RESUMEN_FINANCIERO", "SALDO_ACTUAL")
+
+# Palabras que cambian el argumento del comando; dos mensajes sólo se
+# consideran equivalentes por similitud si contienen las mismas
+PALABRAS_ARGUMENTO = {
+    "todas", "todos", "pendiente", "pendientes", "completada", "completadas",
+    "hoy", "dia", "diario", "semana", "semanal", "mes", "mensual", "ano", "anual",
+}
+
+_PUNTUACION = re.compile(r"[^\w\s]")
+_ESPACIOS = re.compile(r"\s+")
+_RESPUESTA_CACHEABLE = re.compile(r"^(%s)(\s+\w+)?\s*$" % "|".join(COMANDOS_CACHEABLES))
+
+
+def normalizar(texto):
+    """Normaliza un mensaje: minúsculas, sin acentos, puntuación ni espacios repetidos"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = _PUNTUACION.sub(" ", texto)
+    return _ESPACIOS.sub(" ", texto).strip()
+
+
+def es_cacheable(mensaje_normalizado, respuesta):
+    """Indica si la respuesta del modelo es una clasificación reutilizable"""
+    if not mensaje_normalizado or any(c.isdigit() for c in mensaje_normalizado):
+        return False
+    return bool(_RESPUESTA_CACHEABLE.match(respuesta.strip()))
+
+
+class IntentCache:
+    """Caché LRU con TTL de clasificaciones de comandos.
+
+    Busca primero por texto normalizado y, si no hay coincidencia exacta,
+    compara por similitud con las entradas más recientes de longitud parecida.
+    """
+
+    def __init__(self, max_size=1000, ttl=3600, fuzzy_threshold=0.9, fuzzy_candidates=200):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.fuzzy_threshold = fuzzy_threshold
+        self.fuzzy_candidates = fuzzy_candidates
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, mensaje):
+        """Devuelve la clasificación guardada para el mensaje o None"""
+        clave = normalizar(mensaje)
+        ahora = time.monotonic()
+
+        with self._lock:
+            entrada = self._entries.get(clave)
+            if entrada is not None:
+                respuesta, expira = entrada
+                if expira > ahora:
+                    self._entries.move_to_end(clave)
+                    self.hits += 1
+                    return respuesta
+                del self._entries[clave]
+                self.expirations += 1
+
+            if self.fuzzy_threshold < 1:
+                respuesta = self._buscar_similar(clave, ahora)
+                if respuesta is not None:
+                    self.fuzzy_hits += 1
+                    return respuesta
+
+            self.misses += 1
+            return None
+
+    def _buscar_similar(self, clave, ahora):
+        argumentos = set(clave.split()) & PALABRAS_ARGUMENTO
+        matcher = SequenceMatcher(None, b=clave, autojunk=False)
+        mejor, mejor_ratio = None, self.fuzzy_threshold
+
+        # Recorrer desde la entrada más reciente
+        for i, candidato in enumerate(reversed(self._entries)):
+            if i >= self.fuzzy_candidates:
+                break
+            respuesta, expira = self._entries[candidato]
+            if expira <= ahora:
+                continue
+            if abs(len(candidato) - len(clave)) > len(clave) * (1 - self.fuzzy_threshold) + 2:
+                continue
+            if set(candidato.split()) & PALABRAS_ARGUMENTO != argumentos:
+                continue
+
+            matcher.set_seq1(candidato)
+            if matcher.quick_ratio() < mejor_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= mejor_ratio:
+                mejor, mejor_ratio = respuesta, ratio
+
+        return mejor
+
+    def put(self, mensaje, respuesta):
+        """Guarda la clasificación si es un comando cacheable; devuelve si se guardó"""
+        clave = normalizar(mensaje)
+        if not es_cacheable(clave, respuesta):
+            return False
+
+        with self._lock:
+            self._entries[clave] = (respuesta.strip(), time.monotonic() + self.ttl)
+            self._entries.move_to_end(clave)
+            self.stores += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Devuelve los contadores de aciertos y fallos"""
+        with self._lock:
+            consultas = self.hits + self.fuzzy_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.fuzzy_hits) / consultas, 4) if consultas else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,206 @@
+import re
+import threading
+import unicodedata
+from collections import namedtuple
+
+# Resultado de una clasificación local. `texto` sigue el mismo protocolo que
+# las respuestas del modelo ("REGISTRAR_GASTO 200, comida") para reutilizar
+# el despacho de comandos existente.
+Clasificacion = namedtuple("Clasificacion", ["comando", "texto", "confianza", "regla"])
+
+_SEPARADOR_SUELTO = re.compile(r"(?<!\d)[.,]|[.,](?!\d)")
+_PUNTUACION = re.compile(r"[^\w\s.,]")
+_ESPACIOS = re.compile(r"\s+")
+_MILES = re.compile(r"^\d{1,3}(\.\d{3})+$")
+# "2,500" puede ser 2500 (miles con coma) o 2.5 (decimal con coma)
+_MILES_O_DECIMAL = re.compile(r"^\d{1,3}(,\d{3})+$")
+
+# Palabras de fecha: el gasto no es de hoy y no forman parte de la categoría
+_FECHAS = frozenset((
+    "hoy", "ayer", "anteayer", "anoche", "manana",
+    "lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo",
+))
+
+PERIODOS = {
+    "hoy": "dia", "dia": "dia", "diario": "dia",
+    "semana": "semana", "semanal": "semana",
+    "mes": "mes", "mensual": "mes",
+    "ano": "año", "anual": "año",
+}
+
+
+def normalizar(texto):
+    """Normaliza un mensaje conservando los separadores decimales de los montos"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = _PUNTUACION.sub(" ", texto)
+    texto = _SEPARADOR_SUELTO.sub(" ", texto)
+    return _ESPACIOS.sub(" ", texto).strip()
+
+
+def parse_monto(texto):
+    """Convierte '1.500', '200,50' o '200.5' a float ('2,500' se lee como 2.5)"""
+    if _MILES.match(texto):
+        return float(texto.replace(".", ""))
+    return float(texto.replace(",", "."))
+
+
+def _formatear_monto(monto):
+    return str(int(monto)) if monto == int(monto) else str(monto)
+
+
+class Regla:
+    """Regla de clasificación: una expresión regular sobre el texto normalizado.
+
+    `construir` recibe el objeto match y devuelve el texto del comando, o None
+    si la regla no puede extraer los argumentos con seguridad.
+    """
+
+    def __init__(self, nombre, comando, patron, construir, confianza):
+        self.nombre = nombre
+        self.comando = comando
+        self.patron = re.compile(patron)
+        self.construir = construir
+        self.confianza = confianza
+
+    def aplicar(self, texto):
+        match = self.patron.search(texto)
+        if not match:
+            return None
+        comando_texto = self.construir(match)
+        if comando_texto is None:
+            return None
+        return Clasificacion(self.comando, comando_texto, self.confianza, self.nombre)
+
+
+def _movimiento(comando, match):
+    """Texto del comando de gasto o ingreso, o None si el monto es ambiguo o la categoría incluye una fecha"""
+    monto, categoria = match.group("monto"), match.group("categoria")
+    if _MILES_O_DECIMAL.match(monto) or _FECHAS.intersection(categoria.split()):
+        return None
+    return f"{comando} {_formatear_monto(parse_monto(monto))}, {categoria}"
+
+
+def _gasto(match):
+    return _movimiento("REGISTRAR_GASTO", match)
+
+
+def _ingreso(match):
+    return _movimiento("REGISTRAR_INGRESO", match)
+
+
+def _resumen(match):
+    periodo = match.group("periodo")
+    return f"RESUMEN_FINANCIERO {PERIODOS.get(periodo, 'mes') if periodo else 'mes'}"
+
+
+def _listar(match):
+    filtro = match.group("filtro") or ("todas" if match.group("todas") else "pendientes")
+    if filtro == "todas":
+        return "LISTAR_TAREAS todas"
+    return f"LISTAR_TAREAS {'completadas' if filtro.startswith('complet') or filtro.startswith('hech') else 'pendientes'}"
+
+
+_CATEGORIA = r"(?P<categoria>[a-z]+(?: [a-z]+)?)"
+_MONTO = r"\$? ?(?P<monto>\d+(?:[.,]\d+)*)(?: (?:pesos|dolares|euros|usd))?"
+
+REGLAS_PREDETERMINADAS = [
+    Regla(
+        "saldo", "SALDO_ACTUAL",
+        r"^(?:(?:cual|cuanto) es |ver |dame |muestrame |consultar |mi |el )*saldo(?: actual)?$",
+        lambda m: "SALDO_ACTUAL", 0.98
+    ),
+    Regla(
+        "saldo_dinero", "SALDO_ACTUAL",
+        r"^cuanto dinero (?:tengo|me queda)$",
+        lambda m: "SALDO_ACTUAL", 0.95
+    ),
+    Regla(
+        "listar_tareas", "LISTAR_TAREAS",
+        r"^(?:(?:lista|listar|ver|muestra|muestrame|dame|mostrar|cuales son) )?(?:mis |las |(?P<todas>todas las ))?tareas"
+        r"(?: (?P<filtro>pendientes|completadas|hechas|todas))?$",
+        _listar, 0.95
+    ),
+    Regla(
+        "completar_tarea_id", "COMPLETAR_TAREA",
+        r"^(?:completar|completa|complete|termine|terminar|marcar|marca|finalizar) (?:la )?tarea"
+        r" (?:numero |n |#)?(?P<id>\d+)(?: como (?:completada|hecha|terminada))?$",
+        lambda m: f"COMPLETAR_TAREA {int(m.group('id'))}", 0.97
+    ),
+    Regla(
+        "gasto", "REGISTRAR_GASTO",
+        r"^(?:gaste|he gastado|pague|gasto(?: de)?|registrar gasto(?: de)?) " + _MONTO
+        + r" (?:en|de|por|para) (?:el |la |los |las )?" + _CATEGORIA + r"$",
+        _gasto, 0.95
+    ),
+    Regla(
+        "ingreso", "REGISTRAR_INGRESO",
+        r"^(?:recibi|gane|cobre|me pagaron|ingreso(?: de)?|registrar ingreso(?: de)?) " + _MONTO
+        + r" (?:de|por|en|del) (?:el |la |los |las |mi )?" + _CATEGORIA + r"$",
+        _ingreso, 0.95
+    ),
+    Regla(
+        "resumen", "RESUMEN_FINANCIERO",
+        r"^(?:dame |ver |muestrame |quiero )?(?:el |un )?resumen(?: financiero)?"
+        r"(?: (?:del|de la|de este|de esta|de|este|esta))?(?: (?P<periodo>hoy|dia|diario|semana|semanal|mes|mensual|ano|anual))?$",
+        _resumen, 0.95
+    ),
+    # Palabras clave sueltas: confianza baja, sólo se usan si se baja el umbral
+    Regla(
+        "saldo_palabra_clave", "SALDO_ACTUAL",
+        r"\bsaldo\b",
+        lambda m: "SALDO_ACTUAL", 0.6
+    ),
+]
+
+
+class ClasificadorLocal:
+    """Clasificador de intenciones basado en reglas con umbral de confianza.
+
+    Devuelve la clasificación de mayor confianza que supere el umbral o None
+    para que el mensaje se envíe a Gemini.
+    """
+
+    def __init__(self, reglas=None, umbral=0.9):
+        self.reglas = list(REGLAS_PREDETERMINADAS if reglas is None else reglas)
+        self.umbral = umbral
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.derivados = 0
+
+    def registrar(self, regla):
+        """Añade una regla al clasificador"""
+        self.reglas.append(regla)
+
+    def clasificar(self, mensaje):
+        """Clasifica el mensaje localmente o devuelve None si no hay suficiente confianza"""
+        texto = normalizar(mensaje)
+        mejor = None
+        for regla in self.reglas:
+            if regla.confianza < self.umbral or (mejor and regla.confianza <= mejor.confianza):
+                continue
+            try:
+                resultado = regla.aplicar(texto)
+            except (ValueError, IndexError):
+                resultado = None
+            if resultado is not None:
+                mejor = resultado
+
+        with self._lock:
+            if mejor is None:
+                self.derivados += 1
+            else:
+                self.aciertos += 1
+        return mejor
+
+    def stats(self):
+        """Devuelve cuántos mensajes se resolvieron localmente y cuántos se derivaron"""
+        with self._lock:
+            total = self.aciertos + self.derivados
+            return {
+                "rules": len(self.reglas),
+                "threshold": self.umbral,
+                "local": self.aciertos,
+                "fallback": self.derivados,
+                "local_rate": round(self.aciertos / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,227 @@
+import os
+import time
+import random
+import bisect
+import cProfile
+import threading
+import functools
+from contextlib import contextmanager
+
+# Límites de los histogramas de latencia, en segundos
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _formatear_etiquetas(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores))
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ""
+    contenido = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pares
+    )
+    return "{" + contenido + "}"
+
+
+def _formatear_valor(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Counter:
+    """Contador monótono con etiquetas"""
+
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, cantidad=1, **etiquetas):
+        clave = tuple(str(etiquetas.get(e, "")) for e in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def muestras(self):
+        with self._lock:
+            valores = dict(self._valores)
+        for clave, valor in sorted(valores.items()):
+            yield f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_valor(valor)}"
+
+
+class Histogram:
+    """Histograma acumulativo al estilo Prometheus"""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, valor, **etiquetas):
+        clave = tuple(str(etiquetas.get(e, "")) for e in self.etiquetas)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def muestras(self):
+        with self._lock:
+            series = {clave: (list(s[0]), s[1], s[2]) for clave, s in self._series.items()}
+        for clave, (conteos, suma, total) in sorted(series.items()):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float("inf"),), conteos):
+                acumulado += conteo
+                etiquetas = _formatear_etiquetas(self.etiquetas, clave, ("le", _formatear_valor(float(limite))))
+                yield f"{self.nombre}_bucket{etiquetas} {acumulado}"
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+            yield f"{self.nombre}_sum{etiquetas} {_formatear_valor(suma)}"
+            yield f"{self.nombre}_count{etiquetas} {total}"
+
+
+class Registry:
+    """Registro de métricas y recolectores que se exponen en /metrics"""
+
+    def __init__(self):
+        self._metricas = {}
+        self._recolectores = []
+        self._lock = threading.Lock()
+
+    def _registrar(self, clase, nombre, ayuda, etiquetas, **kwargs):
+        with self._lock:
+            metrica = self._metricas.get(nombre)
+            if metrica is None:
+                metrica = self._metricas[nombre] = clase(nombre, ayuda, etiquetas, **kwargs)
+            return metrica
+
+    def counter(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Counter, nombre, ayuda, etiquetas)
+
+    def histogram(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS):
+        return self._registrar(Histogram, nombre, ayuda, etiquetas, buckets=buckets)
+
+    def registrar_recolector(self, recolector):
+        """Registra una función que devuelve tuplas (nombre, ayuda, {etiquetas}, valor) como gauges"""
+        with self._lock:
+            self._recolectores.append(recolector)
+
+    def render(self):
+        """Genera el texto de exposición de Prometheus"""
+        lineas = []
+        with self._lock:
+            metricas = list(self._metricas.values())
+            recolectores = list(self._recolectores)
+
+        for metrica in metricas:
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(metrica.muestras())
+
+        vistos = set()
+        for recolector in recolectores:
+            try:
+                muestras = list(recolector())
+            except Exception as e:
+                print(f"Error en recolector de métricas: {e}")
+                continue
+            for nombre, ayuda, etiquetas, valor in muestras:
+                if nombre not in vistos:
+                    vistos.add(nombre)
+                    lineas.append(f"# HELP {nombre} {ayuda}")
+                    lineas.append(f"# TYPE {nombre} gauge")
+                nombres = tuple(etiquetas)
+                lineas.append(f"{nombre}{_formatear_etiquetas(nombres, tuple(etiquetas[n] for n in nombres))} {_formatear_valor(valor)}")
+
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "assistant_stage_duration_seconds",
+    "Duración de cada etapa del procesamiento de un mensaje",
+    ("stage", "command", "operation")
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "assistant_stage_errors_total",
+    "Errores por etapa del procesamiento de un mensaje",
+    ("stage", "command", "operation")
+)
+COMMANDS = REGISTRY.counter(
+    "assistant_commands_total",
+    "Mensajes procesados por comando y por origen de la clasificación",
+    ("command", "source")
+)
+COMMAND_REPAIRS = REGISTRY.counter(
+    "assistant_command_repairs_total",
+    "Comandos del modelo reparados localmente (local), corregidos con otra llamada (reprompt) o descartados (failed)",
+    ("command", "result")
+)
+
+
+@contextmanager
+def span(stage, command="", operation=""):
+    """Mide la duración de una etapa y la registra en el histograma de etapas"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage, command=command, operation=operation)
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - inicio, stage=stage, command=command, operation=operation)
+
+
+def instrumentar(stage, operation=None):
+    """Decorador que mide cada llamada a la función como una etapa"""
+    def decorador(funcion):
+        nombre = operation or funcion.__name__
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with span(stage, operation=nombre):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+# Perfilado por muestreo: se perfila una fracción de los mensajes con cProfile
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", 0))
+PROFILER_OUTPUT_DIR = os.getenv("PROFILER_OUTPUT_DIR", "profiles")
+_perfiles = threading.local()
+
+
+@contextmanager
+def perfilar(nombre):
+    """Perfila el bloque con probabilidad PROFILER_SAMPLE_RATE y guarda un .prof"""
+    if PROFILER_SAMPLE_RATE <= 0 or getattr(_perfiles, "activo", False) or random.random() >= PROFILER_SAMPLE_RATE:
+        yield
+        return
+
+    perfil = cProfile.Profile()
+    _perfiles.activo = True
+    perfil.enable()
+    try:
+        yield
+    finally:
+        perfil.disable()
+        _perfiles.activo = False
+        try:
+            os.makedirs(PROFILER_OUTPUT_DIR, exist_ok=True)
+            ruta = os.path.join(PROFILER_OUTPUT_DIR, f"{nombre}-{time.time_ns()}.prof")
+            perfil.dump_stats(ruta)
+        except OSError as e:
+            print(f"No se pudo guardar el perfil: {e}")
@@ -0,0 +1,341 @@
+"""Pub/sub para repartir los eventos de Socket.IO entre varios procesos.
+
+Uso del broker independiente:
+    python pubsub.py broker [--host 127.0.0.1] [--port 5555]
+
+SOCKETIO_MESSAGE_QUEUE elige el backend:
+- local://                 entre servidores del mismo proceso
+- broker://127.0.0.1:5555  broker TCP propio; el primer proceso que no lo
+                           encuentra lo arranca (SOCKETIO_BROKER_AUTOSTART)
+- redis://, amqp://, kafka://, zmq+tcp://  gestores nativos de python-socketio
+"""
+import os
+import json
+import queue
+import socket
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+
+class LocalBackend:
+    """Backend en memoria: reparte los mensajes entre suscriptores del mismo proceso"""
+
+    _canales = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url):
+        return cls()
+
+    def publish(self, canal, mensaje):
+        with self._lock:
+            suscriptores = list(self._canales.get(canal, ()))
+        for callback in suscriptores:
+            callback(mensaje)
+
+    def subscribe(self, canal, callback):
+        with self._lock:
+            self._canales.setdefault(canal, []).append(callback)
+
+    def close(self):
+        pass
+
+
+class SocketBroker:
+    """Broker TCP mínimo: reenvía cada línea recibida a todas las conexiones.
+
+    Cada conexión tiene su propia cola de salida, de modo que un cliente
+    lento no bloquea al resto.
+    """
+
+    def __init__(self, host="127.0.0.1", port=5555, max_pending=10000):
+        self.host = host
+        self.port = port
+        self.max_pending = max_pending
+        self._servidor = None
+        self._clientes = {}
+        self._lock = threading.Lock()
+        self.reenviados = 0
+        self.descartados = 0
+
+    def start(self):
+        """Abre el puerto (lanza OSError si ya está en uso) y atiende en segundo plano"""
+        servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            servidor.bind((self.host, self.port))
+        except OSError:
+            servidor.close()
+            raise
+        servidor.listen(128)
+        self._servidor = servidor
+        self.port = servidor.getsockname()[1]
+        threading.Thread(target=self._aceptar, name="pubsub-broker", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._servidor is not None:
+            self._servidor.close()
+            self._servidor = None
+        with self._lock:
+            clientes, self._clientes = list(self._clientes), {}
+        for conexion in clientes:
+            conexion.close()
+
+    def _aceptar(self):
+        while self._servidor is not None:
+            try:
+                conexion, _ = self._servidor.accept()
+            except OSError:
+                return
+            conexion.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            salida = queue.Queue(self.max_pending)
+            with self._lock:
+                self._clientes[conexion] = salida
+            threading.Thread(target=self._leer, args=(conexion,), daemon=True).start()
+            threading.Thread(target=self._escribir, args=(conexion, salida), daemon=True).start()
+
+    def _leer(self, conexion):
+        try:
+            with conexion.makefile("rb") as lector:
+                for linea in lector:
+                    self._reenviar(linea)
+        except OSError:
+            pass
+        finally:
+            self._quitar(conexion)
+
+    def _reenviar(self, linea):
+        with self._lock:
+            salidas = list(self._clientes.values())
+        for salida in salidas:
+            try:
+                salida.put_nowait(linea)
+                self.reenviados += 1
+            except queue.Full:
+                self.descartados += 1
+
+    def _escribir(self, conexion, salida):
+        try:
+            while True:
+                linea = salida.get()
+                if linea is None:
+                    return
+                conexion.sendall(linea)
+        except OSError:
+            self._quitar(conexion)
+
+    def _quitar(self, conexion):
+        with self._lock:
+            salida = self._clientes.pop(conexion, None)
+        if salida is not None:
+            try:
+                salida.put_nowait(None)
+            except queue.Full:
+                pass
+        conexion.close()
+
+
+class SocketBrokerBackend:
+    """Cliente del broker TCP; se reconecta (y arranca el broker si falta) automáticamente"""
+
+    def __init__(self, host="127.0.0.1", port=5555, autostart=True, reconnect_delay=1.0):
+        self.host = host
+        self.port = port
+        self.autostart = autostart
+        self.reconnect_delay = reconnect_delay
+        self._suscripciones = {}
+        self._publicador = None
+        self._lock = threading.Lock()
+        self._lector = None
+        self._broker = None
+
+    @classmethod
+    def from_url(cls, url):
+        partes = urlparse(url)
+        autostart = os.getenv("SOCKETIO_BROKER_AUTOSTART", "True").lower() == "true"
+        return cls(partes.hostname or "127.0.0.1", partes.port or 5555, autostart=autostart)
+
+    def _conectar(self):
+        try:
+            conexion = socket.create_connection((self.host, self.port), timeout=5)
+        except OSError:
+            if not self.autostart:
+                raise
+            try:
+                # Nadie atiende el puerto: este proceso hace de broker
+                self._broker = SocketBroker(self.host, self.port).start()
+                print(f"Broker de pub/sub iniciado en {self.host}:{self.port}")
+            except OSError:
+                # Otro proceso lo arrancó al mismo tiempo
+                pass
+            conexion = socket.create_connection((self.host, self.port), timeout=5)
+        conexion.settimeout(None)
+        conexion.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conexion
+
+    def publish(self, canal, mensaje):
+        linea = (json.dumps({"c": canal, "m": mensaje}) + "\n").encode("utf-8")
+        with self._lock:
+            for intento in range(2):
+                try:
+                    if self._publicador is None:
+                        self._publicador = self._conectar()
+                    self._publicador.sendall(linea)
+                    return
+                except OSError as e:
+                    if self._publicador is not None:
+                        self._publicador.close()
+                    self._publicador = None
+                    if intento:
+                        print(f"Error al publicar en el broker: {e}")
+
+    def subscribe(self, canal, callback):
+        with self._lock:
+            self._suscripciones.setdefault(canal, []).append(callback)
+            if self._lector is None:
+                self._lector = threading.Thread(target=self._escuchar, name="pubsub-listener", daemon=True)
+                self._lector.start()
+
+    def _escuchar(self):
+        import time
+
+        while True:
+            try:
+                conexion = self._conectar()
+            except OSError as e:
+                print(f"Broker de pub/sub no disponible: {e}")
+                time.sleep(self.reconnect_delay)
+                continue
+            try:
+                with conexion.makefile("rb") as lector:
+                    for linea in lector:
+                        try:
+                            sobre = json.loads(linea)
+                        except ValueError:
+                            continue
+                        with self._lock:
+                            callbacks = list(self._suscripciones.get(sobre.get("c"), ()))
+                        for callback in callbacks:
+                            callback(sobre.get("m"))
+            except OSError:
+                pass
+            finally:
+                conexion.close()
+            # Conexión perdida: reintentar (y quizá tomar el relevo como broker)
+            time.sleep(self.reconnect_delay)
+
+    def close(self):
+        with self._lock:
+            if self._publicador is not None:
+                self._publicador.close()
+                self._publicador = None
+        if self._broker is not None:
+            self._broker.stop()
+
+
+# Esquema de URL -> fábrica de backend; se pueden registrar backends nuevos
+BACKENDS = {
+    "local": LocalBackend.from_url,
+    "broker": SocketBrokerBackend.from_url,
+}
+
+
+def registrar_backend(esquema, fabrica):
+    """Registra una fábrica `fabrica(url) -> backend` para un esquema de URL"""
+    BACKENDS[esquema] = fabrica
+
+
+class BrokerManager(socketio.PubSubManager):
+    """Gestor de clientes de Socket.IO (modo con hilos) sobre un backend de pub/sub"""
+
+    name = "broker"
+
+    def __init__(self, backend, channel="socketio", write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.backend = backend
+
+    def _publish(self, data):
+        self.backend.publish(self.channel, self.json.dumps(data))
+
+    def _listen(self):
+        mensajes = queue.Queue()
+        # El backend entrega los mensajes desde su hilo lector
+        self.backend.subscribe(self.channel, mensajes.put)
+        while True:
+            yield mensajes.get()
+
+
+class AsyncBrokerManager(AsyncPubSubManager):
+    """Gestor de clientes de Socket.IO para asyncio sobre un backend de pub/sub"""
+
+    name = "async_broker"
+
+    def __init__(self, backend, channel="socketio", write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.backend = backend
+
+    async def _publish(self, data):
+        # La escritura en el socket puede bloquear: se hace en un hilo
+        await asyncio.to_thread(self.backend.publish, self.channel, self.json.dumps(data))
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        mensajes = asyncio.Queue()
+        self.backend.subscribe(self.channel, lambda m: loop.call_soon_threadsafe(mensajes.put_nowait, m))
+        while True:
+            yield await mensajes.get()
+
+
+def create_client_manager(url=None, async_mode=False, channel="socketio", write_only=False):
+    """Crea el gestor de clientes para la URL de cola de mensajes, o None si no hay"""
+    url = url if url is not None else os.getenv("SOCKETIO_MESSAGE_QUEUE", "")
+    if not url:
+        return None
+    esquema = urlparse(url).scheme
+
+    if esquema in BACKENDS:
+        clase = AsyncBrokerManager if async_mode else BrokerManager
+        return clase(BACKENDS[esquema](url), channel=channel, write_only=write_only)
+
+    # Backends externos soportados por python-socketio
+    if esquema.startswith("redis"):
+        clase = socketio.AsyncRedisManager if async_mode else socketio.RedisManager
+    elif async_mode and esquema.startswith("amqp"):
+        clase = socketio.AsyncAioPikaManager
+    elif async_mode:
+        raise ValueError(f"Cola de mensajes no soportada en modo asyncio: {url}")
+    elif esquema.startswith("kafka"):
+        clase = socketio.KafkaManager
+    elif esquema.startswith("zmq"):
+        clase = socketio.ZmqManager
+    else:
+        clase = socketio.KombuManager
+    return clase(url, channel=channel, write_only=write_only)
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Broker TCP de pub/sub para Socket.IO")
+    parser.add_argument("comando", choices=["broker"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    args = parser.parse_args()
+
+    broker = SocketBroker(args.host, args.port).start()
+    print(f"Broker de pub/sub escuchando en {args.host}:{broker.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """Limitador de tasa por cubeta de fichas.
+
+    Repone `rate` fichas por segundo hasta un máximo de `capacity`, lo que
+    permite ráfagas de hasta `capacity` llamadas seguidas.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("La tasa debe ser mayor que cero")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity else max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Toma fichas si hay suficientes; no bloquea"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                self.acquired += 1
+                return True
+            self.throttled += 1
+            return False
+
+    def _reservar(self, tokens, inicio, esperando):
+        """Toma las fichas si hay suficientes (devuelve 0) o devuelve cuánto esperar"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                self.acquired += 1
+                self.total_wait += now - inicio
+                return 0.0
+            if not esperando:
+                self.throttled += 1
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1, timeout=None):
+        """Espera hasta obtener las fichas; devuelve False si vence `timeout`"""
+        inicio = time.monotonic()
+        deadline = None if timeout is None else inicio + timeout
+        esperando = False
+        while True:
+            espera = self._reservar(tokens, inicio, esperando)
+            if not espera:
+                return True
+            esperando = True
+            if deadline is not None:
+                restante = deadline - time.monotonic()
+                if restante <= 0:
+                    return False
+                espera = min(espera, restante)
+            time.sleep(espera)
+
+    async def acquire_async(self, tokens=1, timeout=None):
+        """Versión para asyncio de `acquire`: espera sin bloquear el bucle de eventos"""
+        inicio = time.monotonic()
+        deadline = None if timeout is None else inicio + timeout
+        esperando = False
+        while True:
+            espera = self._reservar(tokens, inicio, esperando)
+            if not espera:
+                return True
+            esperando = True
+            if deadline is not None:
+                restante = deadline - time.monotonic()
+                if restante <= 0:
+                    return False
+                espera = min(espera, restante)
+            await asyncio.sleep(espera)
+
+    def stats(self):
+        """Devuelve la configuración y los contadores del limitador"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "rate": self.rate,
+                "capacity": self.capacity,
+                "tokens": round(self._tokens, 2),
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 2) if self.acquired else 0.0,
+            }
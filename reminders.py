@@ -0,0 +1,433 @@
+"""Recordatorios por WhatsApp antes de la fecha límite de las tareas.
+
+El programador guarda en memoria sólo las tareas pendientes cuyo aviso cae
+dentro de un horizonte de pocos días, y de ellas como mucho
+REMINDER_MAX_LOADED, en un montículo ordenado por el momento del aviso. Las
+lee por páginas del índice parcial idx_tareas_recordatorio en orden
+(fecha_limite, id) y no vuelve a consultar la tabla hasta que el montículo
+baja de un mínimo o el horizonte avanza a medianoche: entre tanto,
+agregar_tarea y completar_tarea le avisan de los cambios (`tarea_agregada`,
+`tarea_completada`).
+
+Los avisos vencidos se reclaman en lote con un solo UPDATE ... RETURNING
+(cada recordatorio se envía una vez aunque haya varios procesos) y se agrupan
+en un mensaje por chat. Si el envío falla, las tareas vuelven a quedar
+pendientes y se reintentan con espera exponencial (REMINDER_RETRY_DELAY,
+hasta REMINDER_MAX_RETRIES veces; después las recoge el próximo arranque).
+
+Las consultas a la base de datos se hacen sin el lock del programador, que
+sólo protege el montículo: agregar y completar tareas no esperan a SQLite.
+
+Uso:
+    python reminders.py [--limite 20]   (muestra los próximos recordatorios)
+"""
+import heapq
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import environment
+import metrics
+import storage
+
+environment.load()
+
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "True").lower() == "true"
+# Días de antelación del aviso y hora del día a la que se envía
+REMINDER_DAYS_BEFORE = int(os.getenv("REMINDER_DAYS_BEFORE", "1"))
+REMINDER_HOUR = int(os.getenv("REMINDER_HOUR", "9"))
+# Días por delante cuyas tareas se mantienen en memoria
+REMINDER_HORIZON_DAYS = int(os.getenv("REMINDER_HORIZON_DAYS", "2"))
+REMINDER_MAX_LOADED = int(os.getenv("REMINDER_MAX_LOADED", "50000"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+REMINDER_SEND_CONCURRENCY = int(os.getenv("REMINDER_SEND_CONCURRENCY", "8"))
+# Segundos antes del primer reintento de un envío fallido (se duplica en cada uno)
+REMINDER_RETRY_DELAY = float(os.getenv("REMINDER_RETRY_DELAY", "60"))
+REMINDER_MAX_RETRIES = int(os.getenv("REMINDER_MAX_RETRIES", "5"))
+
+# Espera máxima entre revisiones del horizonte (cambios de hora, relojes ajustados)
+_ESPERA_MAXIMA = 3600
+
+
+def _fecha(texto):
+    """Fecha AAAA-MM-DD de una fecha límite, o None si no tiene ese formato"""
+    try:
+        return datetime.strptime(texto[:10], "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
+def momento_aviso(fecha_limite, dias_antes=REMINDER_DAYS_BEFORE, hora=REMINDER_HOUR):
+    """Timestamp del aviso de una fecha límite, o None si la fecha no es válida"""
+    fecha = _fecha(fecha_limite)
+    if fecha is None:
+        return None
+    return (fecha - timedelta(days=dias_antes)).replace(hour=hora).timestamp()
+
+
+def _cuando(fecha_limite, hoy):
+    fecha = fecha_limite[:10]
+    if fecha == hoy.strftime("%Y-%m-%d"):
+        return "hoy"
+    if fecha == (hoy + timedelta(days=1)).strftime("%Y-%m-%d"):
+        return "mañana"
+    return f"el {fecha}"
+
+
+def mensaje_recordatorio(tareas, hoy):
+    """Texto del recordatorio para una lista de (titulo, fecha_limite) de un mismo chat"""
+    if len(tareas) == 1:
+        titulo, fecha_limite = tareas[0]
+        return f"⏰ Recordatorio: la tarea '{titulo}' vence {_cuando(fecha_limite, hoy)} ({fecha_limite[:10]})."
+    lineas = [f"⏰ Recordatorio: tienes {len(tareas)} tareas por vencer:"]
+    lineas += [f"- '{titulo}' ({_cuando(fecha_limite, hoy)})" for titulo, fecha_limite in tareas]
+    return "\n".join(lineas)
+
+
+class ProgramadorRecordatorios:
+    """Montículo de avisos pendientes acotado por horizonte y por cantidad.
+
+    `entregar(chat_id, texto)` se llama desde un grupo de hilos de envío.
+    Cancelar o reprogramar una tarea no toca el montículo: `_vigentes`
+    guarda el momento válido de cada tarea y las entradas que no coinciden
+    se descartan al salir (borrado perezoso).
+    """
+
+    def __init__(self, entregar, dias_antes=REMINDER_DAYS_BEFORE, hora=REMINDER_HOUR,
+                 horizonte_dias=REMINDER_HORIZON_DAYS, max_cargadas=REMINDER_MAX_LOADED,
+                 lote=REMINDER_BATCH_SIZE, concurrencia=REMINDER_SEND_CONCURRENCY,
+                 espera_reintento=REMINDER_RETRY_DELAY, max_reintentos=REMINDER_MAX_RETRIES, reloj=datetime.now):
+        self.entregar = entregar
+        self.dias_antes = dias_antes
+        self.hora = hora
+        self.horizonte_dias = horizonte_dias
+        self.max_cargadas = max(1, max_cargadas)
+        self.lote = max(1, lote)
+        self.espera_reintento = espera_reintento
+        self.max_reintentos = max_reintentos
+        self.reloj = reloj
+        self._monticulo = []        # (momento, id)
+        self._vigentes = {}         # id -> (momento, fecha_limite)
+        self._desde = None          # primera fecha límite cargada (hoy)
+        self._hasta = None          # fecha límite siguiente al horizonte (exclusiva)
+        self._cursor = None         # (fecha_limite, id) de la última tarea leída
+        self._agotado = False       # ya se leyó todo hasta _hasta
+        self._cargando = False      # hay una página leyéndose sin el lock
+        self._reintentos = {}       # id -> envíos fallidos de su aviso
+        self._lock = threading.Lock()
+        self._despertar = threading.Condition(self._lock)
+        self._envios = ThreadPoolExecutor(max(1, concurrencia), thread_name_prefix="reminder-send")
+        self._hilo = None
+        self._detenido = False
+
+        self.lecturas = 0
+        self.leidas = 0
+        self.recortes = 0
+        self.canceladas = 0
+        self.reclamadas = 0
+        self.enviados = 0
+        self.fallidos = 0
+        self.reintentados = 0
+
+    def momento(self, fecha_limite):
+        return momento_aviso(fecha_limite, self.dias_antes, self.hora)
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo is None:
+                self._detenido = False
+                self._hilo = threading.Thread(target=self._run, name="reminders", daemon=True)
+                self._hilo.start()
+        return self
+
+    def detener(self):
+        with self._lock:
+            self._detenido = True
+            self._despertar.notify()
+            hilo, self._hilo = self._hilo, None
+        if hilo is not None:
+            hilo.join(timeout=5)
+        self._envios.shutdown(wait=True)
+
+    def tarea_agregada(self, tarea_id, fecha_limite):
+        """Programa una tarea nueva si su fecha límite cae dentro del horizonte cargado"""
+        momento = self.momento(fecha_limite)
+        if momento is None:
+            return
+        fecha = fecha_limite[:10]
+        with self._lock:
+            # Fuera del horizonte la leerá la página que le corresponda
+            if self._hasta is None or not self._desde <= fecha < self._hasta:
+                return
+            # Más allá del cursor la leerá una página, salvo que haya una en curso:
+            # su consulta pudo empezar antes de que se confirmara la tarea
+            if (self._cursor is not None and (fecha, tarea_id) > self._cursor and not self._agotado
+                    and not self._cargando):
+                return
+            self._agregar(tarea_id, momento, fecha)
+            self._recortar()
+            if self._monticulo[0][1] == tarea_id:
+                self._despertar.notify()
+
+    def tarea_completada(self, tarea_id):
+        """Cancela el aviso de una tarea completada"""
+        with self._lock:
+            if self._vigentes.pop(tarea_id, None) is not None:
+                self.canceladas += 1
+                self._compactar()
+
+    def _agregar(self, tarea_id, momento, fecha):
+        self._vigentes[tarea_id] = (momento, fecha)
+        heapq.heappush(self._monticulo, (momento, tarea_id))
+
+    def _compactar(self):
+        # Demasiadas entradas canceladas: reconstruir el montículo con las vigentes
+        if len(self._monticulo) > 2 * len(self._vigentes) + 1024:
+            self._monticulo = [(momento, tarea_id) for tarea_id, (momento, _) in self._vigentes.items()]
+            heapq.heapify(self._monticulo)
+
+    def _recortar(self):
+        """Si se pasa del máximo, conserva la mitad más próxima y retrocede el cursor"""
+        if len(self._vigentes) <= self.max_cargadas:
+            return
+        orden = sorted((fecha, tarea_id) for tarea_id, (_, fecha) in self._vigentes.items())
+        conservar = orden[:self.max_cargadas // 2 or 1]
+        for fecha, tarea_id in orden[len(conservar):]:
+            del self._vigentes[tarea_id]
+        self._cursor = conservar[-1]
+        self._agotado = False
+        self.recortes += 1
+        self._monticulo = [(momento, tarea_id) for tarea_id, (momento, _) in self._vigentes.items()]
+        heapq.heapify(self._monticulo)
+
+    def _avanzar_horizonte(self, ahora):
+        desde = ahora.strftime("%Y-%m-%d")
+        hasta = (ahora + timedelta(days=self.dias_antes + self.horizonte_dias + 1)).strftime("%Y-%m-%d")
+        if hasta != self._hasta:
+            if self._desde is None:
+                self._cursor = (desde, 0)
+            self._desde, self._hasta = desde, hasta
+            self._agotado = False
+
+    def _cargar(self):
+        """Lee la siguiente página del índice parcial; se llama con el lock tomado y lo suelta durante la consulta"""
+        hasta, cursor = self._hasta, self._cursor
+        espacio = self.max_cargadas - len(self._vigentes)
+        self._cargando = True
+        self._lock.release()
+        try:
+            with metrics.span("reminders", operation="load"), storage.connection() as conn:
+                filas = conn.execute(
+                    "SELECT id, fecha_limite FROM tareas "
+                    "WHERE completada = 0 AND recordatorio_enviado = 0 "
+                    "AND fecha_limite < ? AND (fecha_limite, id) > (?, ?) "
+                    "ORDER BY fecha_limite, id LIMIT ?",
+                    (hasta, cursor[0], cursor[1], espacio)
+                ).fetchall()
+        finally:
+            self._lock.acquire()
+            self._cargando = False
+        if self._cursor != cursor:
+            # Un recorte movió el cursor mientras tanto: la página ya no corresponde
+            return
+        self.lecturas += 1
+        self.leidas += len(filas)
+        if len(filas) < espacio:
+            self._agotado = True
+        if filas:
+            self._cursor = (filas[-1][1], filas[-1][0])
+        momentos = {}  # muchas tareas comparten fecha: se convierte una vez por página
+        for tarea_id, fecha_limite in filas:
+            momento = momentos.get(fecha_limite)
+            if momento is None:
+                momento = momentos[fecha_limite] = self.momento(fecha_limite)
+            # Las fechas con otro formato no se pueden programar; las vencidas no se avisan
+            if momento is not None and tarea_id not in self._vigentes and fecha_limite[:10] >= self._desde:
+                self._agregar(tarea_id, momento, fecha_limite[:10])
+
+    def _vencidas(self, ahora):
+        ids = []
+        while self._monticulo and self._monticulo[0][0] <= ahora and len(ids) < self.lote:
+            momento, tarea_id = heapq.heappop(self._monticulo)
+            vigente = self._vigentes.get(tarea_id)
+            if vigente is not None and vigente[0] == momento:
+                del self._vigentes[tarea_id]
+                ids.append(tarea_id)
+        return ids
+
+    def _espera(self, ahora):
+        manana = (ahora + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        espera = min((manana - ahora).total_seconds() + 1, _ESPERA_MAXIMA)
+        if self._monticulo:
+            espera = min(espera, self._monticulo[0][0] - ahora.timestamp())
+        return max(espera, 0.01)
+
+    def _run(self):
+        with self._lock:
+            while not self._detenido:
+                ahora = self.reloj()
+                try:
+                    self._avanzar_horizonte(ahora)
+                    if not self._agotado and len(self._vigentes) <= self.max_cargadas // 4:
+                        self._cargar()
+                        continue
+                    ids = self._vencidas(ahora.timestamp())
+                except Exception as e:
+                    print(f"Error al programar recordatorios: {e}")
+                    self._despertar.wait(5)
+                    continue
+                if ids:
+                    self._lock.release()
+                    try:
+                        self._enviar(ids, ahora)
+                    except Exception as e:
+                        print(f"Error al enviar recordatorios: {e}")
+                    finally:
+                        self._lock.acquire()
+                    continue
+                self._despertar.wait(self._espera(ahora))
+
+    def _enviar(self, ids, ahora):
+        """Reclama las tareas (sólo las que siguen pendientes) y envía un mensaje por chat"""
+        marcas = ",".join("?" * len(ids))
+        with metrics.span("reminders", operation="claim"), storage.transaction() as conn:
+            filas = conn.execute(
+                f"UPDATE tareas SET recordatorio_enviado = 1 WHERE id IN ({marcas}) "
+                "AND completada = 0 AND recordatorio_enviado = 0 "
+                "RETURNING id, chat_id, titulo, fecha_limite",
+                ids
+            ).fetchall()
+        por_chat = {}
+        for tarea_id, chat_id, titulo, fecha_limite in filas:
+            por_chat.setdefault(chat_id, []).append((titulo, fecha_limite, tarea_id))
+        with self._lock:
+            self.reclamadas += len(filas)
+        for chat_id, tareas in por_chat.items():
+            tareas.sort(key=lambda tarea: tarea[1])
+            texto = mensaje_recordatorio([(titulo, fecha_limite) for titulo, fecha_limite, _ in tareas], ahora)
+            self._envios.submit(self._entregar, chat_id, texto, tareas)
+
+    def _entregar(self, chat_id, texto, tareas):
+        try:
+            with metrics.span("reminders", operation="send"):
+                self.entregar(chat_id, texto)
+        except Exception as e:
+            print(f"Error al enviar el recordatorio a {chat_id}: {e}")
+            self._reintentar(tareas)
+            return
+        with self._lock:
+            self.enviados += 1
+            for _, _, tarea_id in tareas:
+                self._reintentos.pop(tarea_id, None)
+
+    def _reintentar(self, tareas):
+        """Devuelve las tareas de un envío fallido a pendientes y las reprograma con espera exponencial"""
+        ids = [tarea_id for _, _, tarea_id in tareas]
+        try:
+            with storage.transaction() as conn:
+                conn.execute(
+                    f"UPDATE tareas SET recordatorio_enviado = 0 WHERE id IN ({','.join('?' * len(ids))})", ids
+                )
+        except Exception as e:
+            print(f"Error al devolver a pendientes los recordatorios {ids}: {e}")
+            with self._lock:
+                self.fallidos += 1
+            return
+        ahora = self.reloj().timestamp()
+        with self._lock:
+            self.fallidos += 1
+            for _, fecha_limite, tarea_id in tareas:
+                intento = self._reintentos.get(tarea_id, 0)
+                if intento >= self.max_reintentos:
+                    # Sigue pendiente en la base de datos: la recoge el próximo arranque
+                    self._reintentos.pop(tarea_id, None)
+                    continue
+                self._reintentos[tarea_id] = intento + 1
+                self._agregar(tarea_id, ahora + self.espera_reintento * 2 ** intento, fecha_limite[:10])
+                self.reintentados += 1
+            self._despertar.notify()
+
+    def stats(self):
+        """Devuelve el tamaño del montículo y los contadores de avisos"""
+        with self._lock:
+            return {
+                "loaded": len(self._vigentes),
+                "heap": len(self._monticulo),
+                "max_loaded": self.max_cargadas,
+                "horizon_until": self._hasta,
+                "exhausted": self._agotado,
+                "next_due": self._monticulo[0][0] if self._monticulo else None,
+                "loads": self.lecturas,
+                "rows_read": self.leidas,
+                "trims": self.recortes,
+                "cancelled": self.canceladas,
+                "claimed": self.reclamadas,
+                "sent": self.enviados,
+                "failed": self.fallidos,
+                "retried": self.reintentados,
+            }
+
+
+# Programador del proceso; None si los recordatorios no están activos
+programador = None
+
+
+def iniciar(entregar):
+    """Crea e inicia el programador del proceso (si REMINDERS_ENABLED)"""
+    global programador
+    if not REMINDERS_ENABLED or programador is not None:
+        return programador
+    programador = ProgramadorRecordatorios(entregar).iniciar()
+    return programador
+
+
+def detener():
+    global programador
+    if programador is not None:
+        programador.detener()
+        programador = None
+
+
+def tarea_agregada(tarea_id, fecha_limite):
+    if programador is not None and fecha_limite:
+        programador.tarea_agregada(tarea_id, fecha_limite)
+
+
+def tarea_completada(tarea_id):
+    if programador is not None:
+        programador.tarea_completada(tarea_id)
+
+
+def stats():
+    return programador.stats() if programador is not None else None
+
+
+def proximos(limite=20, ahora=None):
+    """Próximos recordatorios sin enviar: (momento, chat_id, titulo, fecha_limite)"""
+    ahora = ahora or datetime.now()
+    with storage.connection() as conn:
+        filas = conn.execute(
+            "SELECT chat_id, titulo, fecha_limite FROM tareas "
+            "WHERE completada = 0 AND recordatorio_enviado = 0 AND fecha_limite >= ? "
+            "ORDER BY fecha_limite, id LIMIT ?",
+            (ahora.strftime("%Y-%m-%d"), limite)
+        ).fetchall()
+    return [(momento_aviso(fecha_limite), chat_id, titulo, fecha_limite)
+            for chat_id, titulo, fecha_limite in filas if _fecha(fecha_limite) is not None]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Muestra los próximos recordatorios de tareas")
+    parser.add_argument("--limite", type=int, default=20)
+    args = parser.parse_args()
+    for momento, chat_id, titulo, fecha_limite in proximos(args.limite):
+        aviso = datetime.fromtimestamp(momento).strftime("%Y-%m-%d %H:%M")
+        print(f"{aviso}  {chat_id}  {titulo} (vence {fecha_limite[:10]})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
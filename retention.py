@@ -0,0 +1,784 @@
+"""Retención de mensajes y conversaciones: archivo, deduplicación y vacuum incremental.
+
+Cada tabla tiene su política (RETENTION_<TABLA>_DAYS y RETENTION_<TABLA>_MODE):
+las filas con más días que el límite se copian a un archivo comprimido y se
+borran de la base de datos (`archive`), o sólo se borran (`delete`). Con 0
+días la tabla se conserva entera.
+
+El archivo de cada tabla está en ARCHIVE_DIR/<tabla>/: segmentos .seg a los
+que sólo se agregan bloques (JSON comprimido con zlib, uno por lote) e
+indice.jsonl, una línea por bloque con su posición, el rango de ids y de
+fechas y un filtro de Bloom de los chats que contiene. Las lecturas (`leer`,
+`buscar_id`) descartan con el índice los bloques que no pueden tener lo
+pedido y sólo descomprimen el resto.
+
+Se archiva el prefijo más antiguo de la tabla por id, así que lo archivado es
+siempre un rango contiguo de ids: si el proceso se interrumpe después de
+escribir un bloque, el ciclo siguiente borra las filas que ya estaban
+archivadas antes de continuar.
+
+La deduplicación enlaza cada conversación con las filas de mensajes que
+tienen el mismo texto (el mensaje del usuario y la respuesta) y vacía sus
+columnas de texto; la vista conversaciones_texto lo resuelve. Las filas se
+borran y se vuelven a insertar con el mismo id (sin tocar el índice de
+búsqueda, porque su texto no cambia): SQLite no fusiona páginas cuando un
+UPDATE achica las filas, pero sí al borrarlas, y así las páginas que se
+vacían pasan a la lista libre. Antes de archivar o borrar mensajes se
+devuelve el texto a las conversaciones que apuntan a ellos.
+
+Los borrados no achican los índices de búsqueda hasta que se fusionan sus
+segmentos: cuando lo borrado de una tabla llega al 5% de sus filas, el
+índice se fusiona por tramos de RETENTION_VACUUM_PAGES páginas. Con
+auto_vacuum=INCREMENTAL, las páginas que quedan libres se devuelven al
+sistema de archivos por tramos del mismo tamaño. Las bases de datos
+creadas antes de este modo necesitan un VACUUM completo una sola vez
+(`python retention.py vacuum`, con el servidor detenido).
+
+Uso:
+    python retention.py ciclo|estado|vacuum
+    python retention.py leer mensajes|conversaciones [--chat-id ID] [--desde FECHA] [--hasta FECHA] [--antes-de ID]
+"""
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import takewhile
+
+import environment
+import metrics
+import search
+import storage
+
+try:
+    import fcntl
+except ImportError:  # Windows: sólo se serializan los ciclos del proceso
+    fcntl = None
+
+environment.load()
+
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "True").lower() == "true"
+# Segundos entre ciclos y filas por lote (cada lote es una transacción y un bloque del archivo)
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "2000"))
+RETENTION_DEDUP = os.getenv("RETENTION_DEDUP", "True").lower() == "true"
+# Sólo se deduplican conversaciones con al menos estos segundos (la respuesta ya
+# está guardada) y se buscan sus mensajes hasta estos segundos antes y después
+RETENTION_DEDUP_DELAY = float(os.getenv("RETENTION_DEDUP_DELAY", "300"))
+RETENTION_DEDUP_WINDOW = float(os.getenv("RETENTION_DEDUP_WINDOW", "600"))
+# Páginas por paso al fusionar los índices de búsqueda y al devolver espacio (0 = no compactar)
+RETENTION_VACUUM_PAGES = int(os.getenv("RETENTION_VACUUM_PAGES", "1000"))
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_SEGMENT_MB = float(os.getenv("ARCHIVE_SEGMENT_MB", "256"))
+ARCHIVE_CACHE_BLOCKS = int(os.getenv("ARCHIVE_CACHE_BLOCKS", "64"))
+
+MODOS = ("archive", "delete")
+
+# Relación de la que se leen las filas (con el texto resuelto) y columnas archivadas
+TABLAS = {
+    "mensajes": ("mensajes", ("id", "platform", "sender", "chat_id", "message", "timestamp", "is_from_assistant")),
+    "conversaciones": ("conversaciones_texto", ("id", "chat_id", "mensaje", "respuesta", "timestamp")),
+}
+
+# Versión del esquema de la retención (cursores persistentes)
+VERSION_ESQUEMA = 1
+
+# Textos más cortos no se deduplican: el enlace y su índice ocuparían casi lo mismo
+_MINIMO_DEDUP = 32
+# Fracción de filas borradas de una tabla a partir de la cual se fusiona su índice de búsqueda
+_FRACCION_COMPACTAR = 0.05
+# Funciones hash del filtro de Bloom y bits por chat (~1% de falsos positivos)
+_HASHES = 7
+_BITS_POR_CHAT = 10
+
+_FECHA = re.compile(r"^\d{4}-\d{2}(-\d{2}([T ]\d{2}(:\d{2}(:\d{2}(\.\d+)?)?)?)?)?$")
+_lock = threading.Lock()
+
+
+class Politica:
+    """Días que se conservan las filas de una tabla y qué se hace con las más antiguas"""
+
+    def __init__(self, tabla, dias=0, modo="archive"):
+        if tabla not in TABLAS:
+            raise ValueError(f"Tabla sin retención: {tabla}")
+        if modo not in MODOS:
+            raise ValueError(f"Modo de retención inválido para {tabla}: {modo} (se espera {' o '.join(MODOS)})")
+        self.tabla = tabla
+        self.dias = max(0, dias)
+        self.modo = modo
+
+    @property
+    def activa(self):
+        return self.dias > 0
+
+    def limite(self, ahora):
+        """Timestamp ISO a partir del cual las filas se conservan"""
+        return (ahora - timedelta(days=self.dias)).isoformat()
+
+
+def _politica(tabla):
+    prefijo = f"RETENTION_{tabla.upper()}"
+    return Politica(tabla, int(os.getenv(f"{prefijo}_DAYS", "0")), os.getenv(f"{prefijo}_MODE", "archive").lower())
+
+
+# Las conversaciones primero: así hay menos texto que devolverles al archivar mensajes
+POLITICAS = {tabla: _politica(tabla) for tabla in ("conversaciones", "mensajes")}
+
+
+def validar_fecha(texto):
+    """Devuelve la fecha (prefijo ISO: AAAA-MM, AAAA-MM-DD o con hora); lanza ValueError si no es válida"""
+    if texto is None:
+        return None
+    if not _FECHA.match(texto):
+        raise ValueError(f"Fecha inválida: {texto} (se espera AAAA-MM, AAAA-MM-DD o AAAA-MM-DDTHH:MM)")
+    return texto
+
+
+def init_db():
+    """Crea la tabla de cursores de la retención si la base de datos no tiene la versión actual"""
+    if storage.ensure_schema("retencion", VERSION_ESQUEMA, _aplicar_esquema):
+        print("Retención inicializada correctamente.")
+
+
+def _aplicar_esquema(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS retencion_estado (clave TEXT PRIMARY KEY, valor INTEGER NOT NULL)")
+
+
+def _cursor(conn, clave):
+    fila = conn.execute("SELECT valor FROM retencion_estado WHERE clave = ?", (clave,)).fetchone()
+    return fila[0] if fila else 0
+
+
+def _guardar_cursor(conn, clave, valor):
+    conn.execute(
+        "INSERT INTO retencion_estado (clave, valor) VALUES (?, ?) "
+        "ON CONFLICT(clave) DO UPDATE SET valor = excluded.valor",
+        (clave, valor)
+    )
+
+
+def _sumar(conn, clave, valor):
+    conn.execute(
+        "INSERT INTO retencion_estado (clave, valor) VALUES (?, ?) "
+        "ON CONFLICT(clave) DO UPDATE SET valor = valor + excluded.valor",
+        (clave, valor)
+    )
+
+
+# --- Archivo -------------------------------------------------------------------
+
+def _posiciones(chat_id, bits):
+    digest = hashlib.blake2b(str(chat_id).encode(), digest_size=16).digest()
+    a = int.from_bytes(digest[:8], "little")
+    b = int.from_bytes(digest[8:], "little") | 1
+    return [(a + i * b) % bits for i in range(_HASHES)]
+
+
+def filtro_chats(chats):
+    """Filtro de Bloom de un conjunto de chats, en base64"""
+    bits = max(64, -(-len(chats) * _BITS_POR_CHAT // 8) * 8)
+    mapa = bytearray(bits // 8)
+    for chat_id in chats:
+        for posicion in _posiciones(chat_id, bits):
+            mapa[posicion >> 3] |= 1 << (posicion & 7)
+    return base64.b64encode(mapa).decode()
+
+
+def puede_contener(filtro, chat_id):
+    """Falso si el chat seguro no está en el filtro"""
+    mapa = base64.b64decode(filtro)
+    return all(mapa[p >> 3] & (1 << (p & 7)) for p in _posiciones(chat_id, len(mapa) * 8))
+
+
+@lru_cache(maxsize=ARCHIVE_CACHE_BLOCKS)
+def _leer_bloque(ruta, offset, longitud, crc):
+    """Columnas y filas de un bloque; los bloques no cambian una vez escritos"""
+    with open(ruta, "rb") as f:
+        f.seek(offset)
+        datos = f.read(longitud)
+    if len(datos) != longitud or zlib.crc32(datos) != crc:
+        raise OSError(f"Bloque dañado en {ruta} (posición {offset})")
+    contenido = json.loads(zlib.decompress(datos))
+    return tuple(contenido["columnas"]), contenido["filas"]
+
+
+class Archivo:
+    """Segmentos comprimidos de solo agregado de una tabla y su índice de bloques"""
+
+    def __init__(self, tabla, directorio=ARCHIVE_DIR, segmento_mb=ARCHIVE_SEGMENT_MB):
+        self.tabla = tabla
+        self.directorio = os.path.join(directorio, tabla)
+        self.limite_segmento = int(segmento_mb * 1024 * 1024)
+        self.columnas = TABLAS[tabla][1]
+        self._indice = os.path.join(self.directorio, "indice.jsonl")
+        self._bloques = []
+        self._leido = 0
+        self._lock = threading.Lock()
+
+    def bloques(self):
+        """Entradas del índice, de la más antigua a la más reciente (relee las agregadas por otros procesos)"""
+        with self._lock:
+            try:
+                with open(self._indice, "rb") as f:
+                    f.seek(self._leido)
+                    nuevo = f.read()
+            except FileNotFoundError:
+                return self._bloques
+            # Una última línea sin salto es una escritura interrumpida o en curso
+            completo = nuevo[:nuevo.rfind(b"\n") + 1]
+            if completo:
+                self._bloques = self._bloques + [json.loads(linea) for linea in completo.splitlines()]
+                self._leido += len(completo)
+            return self._bloques
+
+    def ultimo_id(self):
+        bloques = self.bloques()
+        return bloques[-1]["ultimo_id"] if bloques else 0
+
+    def _segmento(self, bloques):
+        if not bloques:
+            return "000001.seg"
+        actual = bloques[-1]["segmento"]
+        try:
+            lleno = os.path.getsize(os.path.join(self.directorio, actual)) >= self.limite_segmento
+        except FileNotFoundError:
+            lleno = False
+        return f"{int(actual.split('.')[0]) + 1:06d}.seg" if lleno else actual
+
+    def agregar(self, filas):
+        """Agrega un bloque con las filas (tuplas en el orden de `columnas`, por id creciente)"""
+        indice_ts = self.columnas.index("timestamp")
+        indice_chat = self.columnas.index("chat_id")
+        fechas = [f[indice_ts] or "" for f in filas]
+        datos = zlib.compress(json.dumps({"columnas": self.columnas, "filas": filas},
+                                         ensure_ascii=False, separators=(",", ":")).encode())
+        os.makedirs(self.directorio, exist_ok=True)
+        segmento = self._segmento(self.bloques())
+        with open(os.path.join(self.directorio, segmento), "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(datos)
+            f.flush()
+            os.fsync(f.fileno())
+        bloque = {
+            "segmento": segmento, "offset": offset, "longitud": len(datos), "crc": zlib.crc32(datos),
+            "filas": len(filas), "primer_id": filas[0][0], "ultimo_id": filas[-1][0],
+            "desde": min(fechas), "hasta": max(fechas),
+            "chats": filtro_chats({f[indice_chat] for f in filas}),
+        }
+        # El bloque sólo existe para los lectores cuando su línea del índice está completa
+        with open(self._indice, "ab") as f:
+            f.write(json.dumps(bloque, separators=(",", ":")).encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return bloque
+
+    def leer_bloque(self, bloque):
+        return _leer_bloque(os.path.join(self.directorio, bloque["segmento"]),
+                            bloque["offset"], bloque["longitud"], bloque["crc"])
+
+    def estado(self):
+        bloques = self.bloques()
+        segmentos = {b["segmento"] for b in bloques}
+        return {
+            "rows": sum(b["filas"] for b in bloques),
+            "blocks": len(bloques),
+            "segments": len(segmentos),
+            "bytes": sum(b["longitud"] for b in bloques),
+            "first_id": bloques[0]["primer_id"] if bloques else None,
+            "last_id": bloques[-1]["ultimo_id"] if bloques else None,
+            "from": bloques[0]["desde"] if bloques else None,
+            "to": bloques[-1]["hasta"] if bloques else None,
+        }
+
+
+_archivos = {}
+
+
+def archivo(tabla, directorio=ARCHIVE_DIR):
+    """Archivo compartido de una tabla (conserva el índice ya leído)"""
+    if tabla not in TABLAS:
+        raise ValueError(f"Tabla sin archivo: {tabla}")
+    clave = (tabla, os.path.abspath(directorio))
+    with _lock:
+        if clave not in _archivos:
+            _archivos[clave] = Archivo(tabla, directorio)
+        return _archivos[clave]
+
+
+def leer(tabla, chat_id=None, desde=None, hasta=None, antes_de=None, limite=100, directorio=ARCHIVE_DIR):
+    """Filas archivadas de la más reciente a la más antigua; lanza ValueError si la tabla o una fecha no son válidas.
+
+    `desde` y `hasta` son prefijos ISO inclusivos y `antes_de` el id a partir
+    del cual continuar (el `next_before` de la página anterior).
+    """
+    validar_fecha(desde)
+    validar_fecha(hasta)
+    destino = archivo(tabla, directorio)
+    filas = []
+    with metrics.span("retention", operation="archive_read"):
+        for bloque in reversed(destino.bloques()):
+            if antes_de is not None and bloque["primer_id"] >= antes_de:
+                continue
+            if desde is not None and bloque["hasta"] < desde:
+                continue
+            if hasta is not None and bloque["desde"][:len(hasta)] > hasta:
+                continue
+            if chat_id is not None and not puede_contener(bloque["chats"], chat_id):
+                continue
+            columnas, contenido = destino.leer_bloque(bloque)
+            id_, chat, ts = columnas.index("id"), columnas.index("chat_id"), columnas.index("timestamp")
+            for fila in reversed(contenido):
+                if ((antes_de is None or fila[id_] < antes_de)
+                        and (chat_id is None or fila[chat] == chat_id)
+                        and (desde is None or (fila[ts] or "") >= desde)
+                        and (hasta is None or (fila[ts] or "")[:len(hasta)] <= hasta)):
+                    filas.append(dict(zip(columnas, fila)))
+                    if len(filas) > limite:
+                        break
+            if len(filas) > limite:
+                break
+    mas = len(filas) > limite
+    filas = filas[:limite]
+    return {"table": tabla, "rows": filas, "next_before": filas[-1]["id"] if mas else None}
+
+
+def buscar_id(tabla, fila_id, directorio=ARCHIVE_DIR):
+    """Fila archivada con ese id, o None"""
+    destino = archivo(tabla, directorio)
+    bloques = destino.bloques()
+    # Los bloques están ordenados por id: búsqueda binaria del primero que puede contenerlo
+    bajo, alto = 0, len(bloques)
+    while bajo < alto:
+        medio = (bajo + alto) // 2
+        if bloques[medio]["ultimo_id"] < fila_id:
+            bajo = medio + 1
+        else:
+            alto = medio
+    if bajo == len(bloques) or bloques[bajo]["primer_id"] > fila_id:
+        return None
+    columnas, contenido = destino.leer_bloque(bloques[bajo])
+    return next((dict(zip(columnas, f)) for f in contenido if f[0] == fila_id), None)
+
+
+# --- Ciclo de retención --------------------------------------------------------
+
+@contextmanager
+def _bloqueo(directorio):
+    """Un ciclo a la vez, también entre procesos si hay fcntl; devuelve False si otro lo tiene"""
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, ".lock"), "w") as f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+        yield True
+
+
+def _fecha_iso(texto):
+    try:
+        return datetime.fromisoformat(texto)
+    except (TypeError, ValueError):
+        return None
+
+
+def _purgar(conn, tabla, hasta_id):
+    """Borra las filas con id hasta `hasta_id`; antes devuelve el texto a las conversaciones que apuntan a ellas.
+
+    Lleva la cuenta de lo borrado para saber cuándo fusionar el índice de búsqueda.
+    """
+    restauradas = 0
+    if tabla == "mensajes":
+        for texto, enlace in (("mensaje", "mensaje_id"), ("respuesta", "respuesta_id")):
+            restauradas += conn.execute(
+                f"UPDATE conversaciones SET {texto} = COALESCE((SELECT message FROM mensajes WHERE id = {enlace}), {texto}), "
+                f"{enlace} = NULL WHERE {enlace} <= ?",
+                (hasta_id,)
+            ).rowcount
+    borradas = conn.execute(f"DELETE FROM {tabla} WHERE id <= ?", (hasta_id,)).rowcount
+    if borradas:
+        _sumar(conn, f"borradas_{tabla}", borradas)
+    return borradas, restauradas
+
+
+class Retencion:
+    """Aplica las políticas, deduplica y devuelve espacio en segundo plano.
+
+    Cada lote es una transacción corta, así que los escritores de la
+    aplicación sólo esperan a un lote y no al ciclo completo.
+    """
+
+    def __init__(self, politicas=None, directorio=ARCHIVE_DIR, intervalo=RETENTION_INTERVAL,
+                 lote=RETENTION_BATCH_SIZE, deduplicar=RETENTION_DEDUP, paginas_vacuum=RETENTION_VACUUM_PAGES,
+                 reloj=datetime.now):
+        self.politicas = POLITICAS if politicas is None else politicas
+        self.directorio = directorio
+        self.intervalo = intervalo
+        self.lote = max(1, lote)
+        self.deduplicar = deduplicar
+        self.paginas_vacuum = paginas_vacuum
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self._despertar = threading.Condition(self._lock)
+        self._hilo = None
+        self._detenido = False
+
+        self.ciclos = 0
+        self.omitidos = 0
+        self.errores = 0
+        self.archivadas = {tabla: 0 for tabla in TABLAS}
+        self.borradas = {tabla: 0 for tabla in TABLAS}
+        self.enlazadas = 0
+        self.restauradas = 0
+        self.paginas_liberadas = 0
+        self.indices_compactados = 0
+        self.duracion = None
+        self.ultimo = None
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo is None:
+                self._detenido = False
+                self._hilo = threading.Thread(target=self._run, name="retention", daemon=True)
+                self._hilo.start()
+        return self
+
+    def detener(self):
+        with self._lock:
+            self._detenido = True
+            self._despertar.notify()
+            hilo, self._hilo = self._hilo, None
+        if hilo is not None:
+            hilo.join(timeout=30)
+
+    def _run(self):
+        with self._lock:
+            while not self._detenido:
+                self._lock.release()
+                try:
+                    self.ciclo()
+                except Exception as e:
+                    print(f"Error en el ciclo de retención: {e}")
+                    self.errores += 1
+                finally:
+                    self._lock.acquire()
+                self._despertar.wait(self.intervalo)
+
+    def ciclo(self):
+        """Ejecuta un ciclo completo; devuelve lo hecho o None si otro proceso tiene el ciclo"""
+        inicio = time.perf_counter()
+        ahora = self.reloj()
+        resumen = {"archived": {}, "deleted": {}, "linked": 0, "restored": 0, "compacted": [], "freed_pages": 0}
+        with _bloqueo(self.directorio) as propio:
+            if not propio:
+                self.omitidos += 1
+                return None
+            for tabla, politica in self.politicas.items():
+                if politica.activa:
+                    archivadas, borradas, restauradas = self._aplicar(politica, ahora)
+                    resumen["archived"][tabla] = archivadas
+                    resumen["deleted"][tabla] = borradas
+                    resumen["restored"] += restauradas
+            if self.deduplicar:
+                resumen["linked"] = self._deduplicar(ahora)
+            if self.paginas_vacuum > 0:
+                resumen["compacted"] = self._compactar_indices()
+                resumen["freed_pages"] = self._vacuum()
+        self.ciclos += 1
+        self.duracion = round(time.perf_counter() - inicio, 3)
+        self.ultimo = ahora.isoformat()
+        return resumen
+
+    def _aplicar(self, politica, ahora):
+        """Archiva (o borra) por lotes el prefijo de filas anterior al límite de la política"""
+        tabla = politica.tabla
+        origen, columnas = TABLAS[tabla]
+        indice_ts = columnas.index("timestamp")
+        limite = politica.limite(ahora)
+        destino = archivo(tabla, self.directorio) if politica.modo == "archive" else None
+        archivadas = borradas = restauradas = 0
+
+        ultimo = destino.ultimo_id() if destino is not None else 0
+        if ultimo:
+            # Filas de un bloque ya escrito cuyo borrado no llegó a confirmarse
+            with storage.transaction() as conn:
+                borradas, restauradas = _purgar(conn, tabla, ultimo)
+
+        while not self._detenido:
+            with storage.connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                filas = cursor.execute(
+                    f"SELECT {', '.join(columnas)} FROM {origen} WHERE id > ? ORDER BY id LIMIT ?",
+                    (ultimo, self.lote)
+                ).fetchall()
+            viejas = list(takewhile(lambda f: (f[indice_ts] or "") < limite, filas))
+            if not viejas:
+                break
+            with metrics.span("retention", operation=politica.modo):
+                if destino is not None:
+                    destino.agregar(viejas)
+                    archivadas += len(viejas)
+                with storage.transaction() as conn:
+                    n, r = _purgar(conn, tabla, viejas[-1][0])
+            borradas += n
+            restauradas += r
+            ultimo = viejas[-1][0]
+            if len(viejas) < len(filas):
+                break
+
+        self.archivadas[tabla] += archivadas
+        self.borradas[tabla] += borradas
+        self.restauradas += restauradas
+        return archivadas, borradas, restauradas
+
+    def _deduplicar(self, ahora):
+        """Enlaza las conversaciones con los mensajes del mismo texto y vacía sus columnas de texto"""
+        limite = (ahora - timedelta(seconds=RETENTION_DEDUP_DELAY)).isoformat()
+        ventana = timedelta(seconds=RETENTION_DEDUP_WINDOW)
+        enlazadas = 0
+        with storage.connection() as conn:
+            cursor = _cursor(conn, "dedup_conversaciones")
+
+        while not self._detenido:
+            with storage.connection() as conn:
+                filas = conn.execute(
+                    "SELECT id, chat_id, mensaje, respuesta, timestamp, mensaje_id, respuesta_id "
+                    "FROM conversaciones WHERE id > ? ORDER BY id LIMIT ?",
+                    (cursor, self.lote)
+                ).fetchall()
+                listas = list(takewhile(lambda f: f["timestamp"] < limite, filas))
+                if not listas:
+                    break
+                enlaces = self._enlaces(conn, listas, ventana)
+            # Con el lock de escritura desde el principio: lo que se relee en
+            # _enlazar no cambia hasta confirmar
+            with metrics.span("retention", operation="dedup"), storage.transaction(immediate=True) as conn:
+                if enlaces:
+                    self._enlazar(conn, enlaces)
+                cursor = listas[-1]["id"]
+                _guardar_cursor(conn, "dedup_conversaciones", cursor)
+            enlazadas += len(enlaces)
+            if len(listas) < len(filas):
+                break
+
+        self.enlazadas += enlazadas
+        return enlazadas
+
+    @staticmethod
+    def _enlazar(conn, enlaces):
+        """Reescribe las conversaciones con sus enlaces (borrar e insertar compacta las páginas).
+
+        Debe llamarse dentro de una transacción: el índice se suspende en ella.
+        """
+        ids = [conversacion_id for _, _, conversacion_id in enlaces]
+        marcadores = ", ".join("?" * len(ids))
+        filas = {f["id"]: f for f in conn.execute(
+            f"SELECT id, chat_id, mensaje, respuesta, timestamp, mensaje_id, respuesta_id FROM conversaciones "
+            f"WHERE id IN ({marcadores})", ids
+        )}
+        nuevas = []
+        for mensaje_id, respuesta_id, conversacion_id in enlaces:
+            f = filas[conversacion_id]
+            nuevas.append((
+                conversacion_id, f["chat_id"],
+                f["mensaje"] if mensaje_id is None else "", f["respuesta"] if respuesta_id is None else None,
+                f["timestamp"], mensaje_id or f["mensaje_id"], respuesta_id or f["respuesta_id"],
+            ))
+        # El texto de cada id no cambia, así que el índice de búsqueda se deja como está
+        with search.sin_sincronizar(conn, "conversaciones"):
+            conn.execute(f"DELETE FROM conversaciones WHERE id IN ({marcadores})", ids)
+            conn.executemany(
+                "INSERT INTO conversaciones (id, chat_id, mensaje, respuesta, timestamp, mensaje_id, respuesta_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                nuevas
+            )
+
+    @staticmethod
+    def _enlaces(conn, filas, ventana):
+        """(mensaje_id, respuesta_id, id) de las conversaciones con texto igual a un mensaje cercano del mismo chat"""
+        por_chat = {}
+        for fila in filas:
+            por_chat.setdefault(fila["chat_id"], []).append(fila)
+        enlaces = []
+        for chat_id, conversaciones in por_chat.items():
+            fechas = [f for f in map(_fecha_iso, (c["timestamp"] for c in conversaciones)) if f is not None]
+            if not fechas:
+                continue
+            candidatos = {}
+            for mensaje_id, texto, del_asistente in conn.execute(
+                "SELECT id, message, is_from_assistant FROM mensajes WHERE chat_id = ? AND timestamp BETWEEN ? AND ?",
+                (chat_id, (min(fechas) - ventana).isoformat(), (max(fechas) + ventana).isoformat())
+            ):
+                # Ante textos repetidos basta cualquiera de las filas: el texto es el mismo
+                candidatos.setdefault((bool(del_asistente), texto), mensaje_id)
+            for c in conversaciones:
+                mensaje_id = respuesta_id = None
+                if c["mensaje_id"] is None and len(c["mensaje"]) >= _MINIMO_DEDUP:
+                    mensaje_id = candidatos.get((False, c["mensaje"]))
+                if c["respuesta_id"] is None and len(c["respuesta"] or "") >= _MINIMO_DEDUP:
+                    respuesta_id = candidatos.get((True, c["respuesta"]))
+                if mensaje_id is not None or respuesta_id is not None:
+                    enlaces.append((mensaje_id, respuesta_id, c["id"]))
+        return enlaces
+
+    def _compactar_indices(self):
+        """Fusiona el índice de búsqueda de las tablas con suficientes filas borradas; devuelve cuáles"""
+        compactadas = []
+        for tabla in TABLAS:
+            with storage.connection() as conn:
+                borradas = _cursor(conn, f"borradas_{tabla}")
+                # Aproximación barata de las filas vivas con el rango de ids
+                vivas = conn.execute(f"SELECT MAX(id) - MIN(id) + 1 FROM {tabla}").fetchone()[0] or 0
+            if not borradas or borradas < max(self.lote, vivas * _FRACCION_COMPACTAR):
+                continue
+            while not self._detenido:
+                with metrics.span("retention", operation="fts_merge"), storage.transaction() as conn:
+                    queda = search.compactar(conn, tabla, self.paginas_vacuum)
+                if not queda:
+                    break
+            else:
+                # Detenido a mitad: la fusión continúa en el ciclo siguiente
+                continue
+            with storage.transaction() as conn:
+                _guardar_cursor(conn, f"borradas_{tabla}", 0)
+            compactadas.append(tabla)
+        self.indices_compactados += len(compactadas)
+        return compactadas
+
+    def _vacuum(self):
+        """Devuelve las páginas libres al sistema de archivos por tramos; 0 si auto_vacuum no es incremental"""
+        liberadas = 0
+        with storage.connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+            libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            while libres and not self._detenido:
+                with metrics.span("retention", operation="vacuum"):
+                    # Cada paso es una transacción propia; hay que leer el resultado para que se complete
+                    conn.execute(f"PRAGMA incremental_vacuum({self.paginas_vacuum})").fetchall()
+                restantes = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if restantes >= libres:
+                    break
+                liberadas += libres - restantes
+                libres = restantes
+            if liberadas:
+                # En modo WAL el archivo se acorta al transferir el WAL a la base de datos
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        self.paginas_liberadas += liberadas
+        return liberadas
+
+    def stats(self):
+        """Contadores acumulados de los ciclos"""
+        resultado = {
+            "cycles": self.ciclos,
+            "skipped": self.omitidos,
+            "errors": self.errores,
+            "linked": self.enlazadas,
+            "restored": self.restauradas,
+            "freed_pages": self.paginas_liberadas,
+            "compacted_indexes": self.indices_compactados,
+            "last_cycle_seconds": self.duracion,
+            "last_cycle": self.ultimo,
+        }
+        for tabla in TABLAS:
+            resultado[f"archived_{tabla}"] = self.archivadas[tabla]
+            resultado[f"deleted_{tabla}"] = self.borradas[tabla]
+        return resultado
+
+
+# Retención del proceso; None si no está activa
+retencion = None
+
+
+def iniciar():
+    """Crea e inicia la retención del proceso (si RETENTION_ENABLED)"""
+    global retencion
+    if not RETENTION_ENABLED or retencion is not None:
+        return retencion
+    retencion = Retencion().iniciar()
+    return retencion
+
+
+def detener():
+    global retencion
+    if retencion is not None:
+        retencion.detener()
+        retencion = None
+
+
+def estado(directorio=ARCHIVE_DIR):
+    """Políticas, archivo de cada tabla y espacio de la base de datos"""
+    with storage.connection() as conn:
+        pagina = conn.execute("PRAGMA page_size").fetchone()[0]
+        paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+        libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    return {
+        "policies": {t: {"days": p.dias, "mode": p.modo} for t, p in POLITICAS.items()},
+        "archive": {tabla: archivo(tabla, directorio).estado() for tabla in TABLAS},
+        "database": {
+            "bytes": pagina * paginas,
+            "free_bytes": pagina * libres,
+            "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(auto_vacuum, auto_vacuum),
+        },
+        "stats": retencion.stats() if retencion is not None else None,
+    }
+
+
+def vacuum_completo():
+    """Reescribe la base de datos con auto_vacuum incremental (una vez; bloquea toda la base de datos)"""
+    with storage.connection() as conn:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Retención y archivo de mensajes y conversaciones")
+    parser.add_argument("comando", choices=["ciclo", "estado", "vacuum", "leer"])
+    parser.add_argument("tabla", nargs="?", choices=list(TABLAS))
+    parser.add_argument("--directorio", default=ARCHIVE_DIR)
+    parser.add_argument("--chat-id")
+    parser.add_argument("--desde")
+    parser.add_argument("--hasta")
+    parser.add_argument("--antes-de", type=int)
+    parser.add_argument("--limite", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.comando == "leer":
+        if args.tabla is None:
+            parser.error("leer necesita la tabla")
+        resultado = leer(args.tabla, args.chat_id, args.desde, args.hasta, args.antes_de, args.limite, args.directorio)
+        print(json.dumps(resultado, indent=2, ensure_ascii=False))
+        return 0
+
+    init_db()
+    if args.comando == "ciclo":
+        inicio = time.perf_counter()
+        resumen = Retencion(directorio=args.directorio).ciclo()
+        if resumen is None:
+            print("Otro proceso está ejecutando la retención.")
+            return 1
+        print(json.dumps(resumen, indent=2, ensure_ascii=False))
+        print(f"Ciclo completado en {time.perf_counter() - inicio:.2f} s")
+    elif args.comando == "vacuum":
+        inicio = time.perf_counter()
+        vacuum_completo()
+        print(f"VACUUM completado en {time.perf_counter() - inicio:.1f} s")
+    else:
+        print(json.dumps(estado(args.directorio), indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
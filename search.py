@@ -0,0 +1,450 @@
+"""Búsqueda de texto completo (SQLite FTS5) sobre tareas, mensajes y conversaciones.
+
+Cada tabla tiene un índice FTS5 de contenido externo (el texto no se duplica)
+que los triggers mantienen sincronizado en cada INSERT, UPDATE y DELETE.
+Si parte del texto se guarda en otra tabla (las conversaciones deduplicadas
+contra mensajes), el índice lee las filas a través de una vista que lo
+resuelve.
+
+Plan de cada consulta:
+- Sin chat_id, o en chats con más de SEARCH_SCAN_ROWS filas, se usa el índice
+  invertido (el chat_id también está indexado) y se ordenan por bm25 las
+  SEARCH_MAX_CANDIDATES coincidencias más recientes.
+- En chats pequeños se recorren sus filas con el índice por chat_id: el coste
+  depende del tamaño del chat y no de las listas de coincidencias de todos
+  los usuarios, que con palabras frecuentes crecen con el historial.
+
+Los fragmentos resaltados se arman en Python a partir de las filas: pedir
+snippet() con "MATCH ... AND rowid IN (...)" obliga a FTS5 a repetir la
+consulta por cada id.
+
+Uso:
+    python search.py "consulta" [--chat-id ID] [--tipo tareas,mensajes] [--reconstruir]
+"""
+import os
+import re
+import math
+import unicodedata
+from contextlib import contextmanager
+from difflib import SequenceMatcher
+
+import metrics
+import storage
+
+# Coincidencias más recientes que se ordenan por relevancia en cada consulta;
+# acota el coste aunque el historial crezca a millones de filas
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", 1000))
+# Chats con hasta estas filas se buscan recorriéndolas en lugar de usar el índice invertido
+SEARCH_SCAN_ROWS = int(os.getenv("SEARCH_SCAN_ROWS", 2000))
+# Cuando ninguna tarea contiene todas las palabras, similitud mínima del título
+# elegido y ventaja sobre el siguiente: completar la tarea equivocada no se deshace
+SEARCH_TITLE_MIN_SIMILARITY = float(os.getenv("SEARCH_TITLE_MIN_SIMILARITY", 0.8))
+SEARCH_TITLE_MIN_MARGIN = float(os.getenv("SEARCH_TITLE_MIN_MARGIN", 0.1))
+
+# Marcas de resaltado en los fragmentos; la interfaz las convierte en <mark>
+MARCA_INICIO = "\x02"
+MARCA_FIN = "\x03"
+# Palabras de contexto antes y después de la primera coincidencia en un fragmento
+FRAGMENTO_ANTES = 4
+FRAGMENTO_DESPUES = 10
+
+_PALABRA = re.compile(r"\w+", re.UNICODE)
+_DIACRITICOS = re.compile("[\u0300-\u036f]")
+# Palabras que no identifican una tarea por sí solas al resolverla por título
+_VACIAS = frozenset((
+    "el", "la", "los", "las", "un", "una", "unos", "unas", "lo", "al", "del", "de", "a", "en",
+    "y", "o", "con", "por", "para", "que", "mi", "mis", "tu", "tus", "su", "sus", "se",
+))
+_MIN_LETRAS = 3
+
+
+class Indice:
+    """Índice FTS5 de una tabla: columnas de texto, pesos de bm25 y columnas devueltas.
+
+    El chat_id se indexa siempre como primera columna (con peso 0).
+
+    `origen` es la vista de la que se lee el texto cuando la tabla guarda
+    parte de él en otra (por defecto, la propia tabla), y `enlaces` las
+    columnas que apuntan a ese texto: los UPDATE que las cambian sólo mueven
+    el texto de sitio y no tocan el índice. Las filas se insertan siempre
+    con su texto completo, así que el trigger de inserción no depende de la
+    tabla enlazada. Los triggers de estos índices no actúan mientras la
+    tabla figura en fts_pausa (ver `sin_sincronizar`).
+    """
+
+    def __init__(self, tabla, columnas, pesos, campos, origen=None, enlaces=()):
+        self.tabla = tabla
+        self.fts = f"{tabla}_fts"
+        self.columnas = ("chat_id",) + columnas
+        self.columnas_texto = columnas
+        self.pesos = pesos
+        self.campos = campos
+        self.origen = origen or tabla
+        self.enlaces = enlaces
+
+    def sentencias(self):
+        """DDL de la tabla virtual y de los triggers que la sincronizan"""
+        columnas = ", ".join(self.columnas)
+        nuevos = ", ".join(f"new.{c}" for c in self.columnas)
+        insertar = f"INSERT INTO {self.fts}(rowid, {columnas}) VALUES (new.id, {nuevos});"
+        tabla_virtual = (
+            # prefix: índices de prefijos de 2 y 3 letras para la búsqueda mientras se escribe
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.fts} USING fts5({columnas}, "
+            f"content='{self.tabla}', content_rowid='id', tokenize='unicode61 remove_diacritics 2', "
+            f"prefix='2 3')"
+        )
+        if self.origen == self.tabla:
+            viejos = ", ".join(f"old.{c}" for c in self.columnas)
+            borrar = (f"INSERT INTO {self.fts}({self.fts}, rowid, {columnas}) "
+                      f"VALUES ('delete', old.id, {viejos});")
+            return [
+                tabla_virtual,
+                f"CREATE TRIGGER {self.fts}_ai AFTER INSERT ON {self.tabla} BEGIN {insertar} END",
+                f"CREATE TRIGGER {self.fts}_ad AFTER DELETE ON {self.tabla} BEGIN {borrar} END",
+                # Sólo cuando cambia el texto indexado (p. ej. no al completar una tarea)
+                f"CREATE TRIGGER {self.fts}_au AFTER UPDATE OF {columnas} ON {self.tabla} "
+                f"BEGIN {borrar} {insertar} END",
+            ]
+
+        # El texto guardado en otra tabla sólo se resuelve a través del origen:
+        # se retira del índice antes de borrar o cambiar la fila y se vuelve a
+        # agregar después del cambio
+        borrar = (f"INSERT INTO {self.fts}({self.fts}, rowid, {columnas}) "
+                  f"SELECT 'delete', id, {columnas} FROM {self.origen} WHERE id = old.id;")
+        reinsertar = (f"INSERT INTO {self.fts}(rowid, {columnas}) "
+                      f"SELECT id, {columnas} FROM {self.origen} WHERE id = new.id;")
+        activo = f"NOT EXISTS (SELECT 1 FROM fts_pausa WHERE tabla = '{self.tabla}')"
+        mismos_enlaces = " AND ".join([f"old.{c} IS new.{c}" for c in self.enlaces] + [activo])
+        return [
+            tabla_virtual,
+            f"CREATE TRIGGER {self.fts}_ai AFTER INSERT ON {self.tabla} WHEN {activo} BEGIN {insertar} END",
+            f"CREATE TRIGGER {self.fts}_bd BEFORE DELETE ON {self.tabla} WHEN {activo} BEGIN {borrar} END",
+            f"CREATE TRIGGER {self.fts}_bu BEFORE UPDATE OF {columnas} ON {self.tabla} "
+            f"WHEN {mismos_enlaces} BEGIN {borrar} END",
+            f"CREATE TRIGGER {self.fts}_au AFTER UPDATE OF {columnas} ON {self.tabla} "
+            f"WHEN {mismos_enlaces} BEGIN {reinsertar} END",
+        ]
+
+
+INDICES = {
+    "tareas": Indice(
+        "tareas", ("titulo", "descripcion"), (10.0, 1.0),
+        ("id", "chat_id", "titulo", "descripcion", "fecha_limite", "prioridad", "completada", "fecha_creacion AS timestamp"),
+    ),
+    "mensajes": Indice(
+        "mensajes", ("message",), (1.0,),
+        ("id", "chat_id", "sender", "platform", "message", "timestamp", "is_from_assistant"),
+    ),
+    "conversaciones": Indice(
+        "conversaciones", ("mensaje", "respuesta"), (2.0, 1.0),
+        ("id", "chat_id", "mensaje", "respuesta", "timestamp"),
+        origen="conversaciones_texto", enlaces=("mensaje_id", "respuesta_id"),
+    ),
+}
+
+# Sufijos de todos los triggers que puede crear un índice
+_TRIGGERS = ("ai", "ad", "au", "bd", "bu")
+
+
+def crear_indices(conn, tablas):
+    """Crea los índices y (re)crea sus triggers; indexa las filas existentes la primera vez"""
+    # Tablas cuyos índices se suspenden mientras la retención reescribe filas;
+    # sólo tiene filas dentro de esas transacciones
+    conn.execute("CREATE TABLE IF NOT EXISTS fts_pausa (tabla TEXT PRIMARY KEY)")
+    for tabla in tablas:
+        indice = INDICES[tabla]
+        existe = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (indice.fts,)
+        ).fetchone()
+        # Sólo se ejecuta al cambiar la versión del esquema: los triggers se
+        # reemplazan por si cambió su definición
+        for sufijo in _TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {indice.fts}_{sufijo}")
+        for sentencia in indice.sentencias():
+            conn.execute(sentencia)
+        if not existe:
+            # Aún no hay texto deduplicado: basta con la tabla
+            conn.execute(f"INSERT INTO {indice.fts}({indice.fts}) VALUES ('rebuild')")
+
+
+@contextmanager
+def sin_sincronizar(conn, tabla):
+    """Suspende los triggers del índice mientras se reescriben filas sin cambiar su texto.
+
+    La marca en fts_pausa se escribe y se borra dentro de la transacción de
+    `conn`, así que ninguna otra conexión llega a verla y un rollback no
+    deja el índice sin sincronizar. Sólo para índices con `origen` propio.
+    """
+    if INDICES[tabla].origen == tabla:
+        raise ValueError(f"El índice de {tabla} no se puede suspender")
+    conn.execute("INSERT INTO fts_pausa (tabla) VALUES (?)", (tabla,))
+    try:
+        yield
+    finally:
+        conn.execute("DELETE FROM fts_pausa WHERE tabla = ?", (tabla,))
+
+
+def compactar(conn, tabla, paginas):
+    """Fusiona los segmentos del índice escribiendo unas `paginas` páginas; devuelve si queda trabajo.
+
+    Los borrados dejan marcas en segmentos nuevos que sólo desaparecen al
+    fusionarlos con los que tienen las filas; llamadas sucesivas continúan
+    la misma fusión, así que cada una es una transacción corta.
+    """
+    fts = INDICES[tabla].fts
+    antes = conn.total_changes
+    conn.execute(f"INSERT INTO {fts}({fts}, rank) VALUES ('merge', ?)", (-max(1, paginas),))
+    # Si no hubo nada que fusionar, el comando no cambia ninguna fila
+    return conn.total_changes - antes >= 2
+
+
+def reconstruir_indices(tablas=tuple(INDICES)):
+    """Reconstruye los índices desde las tablas (p. ej. tras editar la base de datos a mano)"""
+    with storage.transaction() as conn:
+        for tabla in tablas:
+            indice = INDICES[tabla]
+            fts = indice.fts
+            if indice.origen == indice.tabla:
+                conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            else:
+                # 'rebuild' lee la tabla de contenido, que no tiene el texto deduplicado
+                columnas = ", ".join(indice.columnas)
+                conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('delete-all')")
+                conn.execute(f"INSERT INTO {fts}(rowid, {columnas}) SELECT id, {columnas} FROM {indice.origen}")
+            conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('optimize')")
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos, igual que el tokenizador unicode61 del índice"""
+    return _DIACRITICOS.sub("", unicodedata.normalize("NFKD", texto.lower()))
+
+
+def palabras(texto):
+    return _PALABRA.findall(texto or "")
+
+
+def terminos(texto):
+    """Términos normalizados de la consulta; el último se busca por prefijo (búsqueda mientras se escribe)"""
+    return [normalizar(p) for p in palabras(texto)]
+
+
+def consulta_fts(terms, columnas=None, todas=True):
+    """Consulta FTS5 segura: cada término se cita para que no se interprete la sintaxis de FTS5"""
+    citados = [f'"{t}"' for t in terms[:-1]] + [f'"{terms[-1]}"*']
+    expresion = f" {'AND' if todas else 'OR'} ".join(citados)
+    if columnas:
+        return f"{{{' '.join(columnas)}}} : ({expresion})"
+    return f"({expresion})"
+
+
+def _coincide(palabra, terms):
+    """Indica si una palabra normalizada corresponde a algún término (el último, por prefijo)"""
+    return palabra in terms[:-1] or palabra.startswith(terms[-1])
+
+
+def _chat_pequeno(conn, indice, chat_id, extra, params):
+    """Indica si el chat tiene pocas filas; el conteo se detiene al pasar el umbral"""
+    filas = conn.execute(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM {indice.tabla} WHERE chat_id = ? {extra} LIMIT ?)",
+        (chat_id, *params, SEARCH_SCAN_ROWS + 1)
+    ).fetchone()[0]
+    return filas <= SEARCH_SCAN_ROWS
+
+
+def _por_indice(conn, indice, terms, chat_id, columnas, todas, extra, params):
+    """Candidatos del índice invertido, de mejor a peor bm25"""
+    consulta = consulta_fts(terms, columnas, todas)
+    if chat_id is not None:
+        # El chat_id se tokeniza igual que el texto: una frase citada lo identifica
+        consulta = 'chat_id : "{}" AND {}'.format(str(chat_id).replace('"', '""'), consulta)
+        # El índice filtra por los tokens del chat_id; la tabla confirma el valor exacto
+        extra = f"AND chat_id = ? {extra}"
+        params = (chat_id, *params)
+    pesos = ", ".join(str(p) for p in (0,) + indice.pesos)
+    filas = conn.execute(
+        f"SELECT rowid, bm25({indice.fts}, {pesos}) FROM {indice.fts} "
+        f"WHERE {indice.fts} MATCH ? ORDER BY rowid DESC LIMIT ?",
+        (consulta, SEARCH_MAX_CANDIDATES)
+    ).fetchall()
+    rangos = dict(filas)
+    # Las condiciones sobre la tabla base se aplican sólo a los candidatos
+    if rangos and extra:
+        marcadores = ", ".join("?" * len(rangos))
+        vigentes = conn.execute(
+            f"SELECT id FROM {indice.tabla} WHERE id IN ({marcadores}) {extra}", (*rangos, *params)
+        ).fetchall()
+        rangos = {fila[0]: rangos[fila[0]] for fila in vigentes}
+    return sorted(rangos, key=lambda i: (rangos[i], -i))
+
+
+def _por_recorrido(conn, indice, terms, chat_id, columnas, todas, extra, params):
+    """Candidatos de un chat pequeño recorriendo sus filas, de más a menos relevante.
+
+    La relevancia suma, por columna y con sus pesos, las palabras que
+    coinciden divididas por la raíz de la longitud del texto; como bm25,
+    favorece los textos cortos con muchas coincidencias.
+    """
+    columnas = columnas or indice.columnas_texto
+    pesos = dict(zip(indice.columnas_texto, indice.pesos))
+    necesarios = set(terms)
+    filas = conn.execute(
+        f"SELECT id, {', '.join(columnas)} FROM {indice.origen} WHERE chat_id = ? {extra}",
+        (chat_id, *params)
+    ).fetchall()
+    puntajes = {}
+    for fila in filas:
+        encontrados = set()
+        puntaje = 0.0
+        for columna, texto in zip(columnas, fila[1:]):
+            texto = normalizar(texto or "")
+            # Descarte barato antes de separar en palabras: la mayoría de las filas no coincide
+            if not any(t in texto for t in necesarios):
+                continue
+            normalizadas = _PALABRA.findall(texto)
+            aciertos = [p for p in normalizadas if _coincide(p, terms)]
+            if not aciertos:
+                continue
+            puntaje += pesos[columna] * len(aciertos) / math.sqrt(len(normalizadas))
+            for palabra in aciertos:
+                encontrados.add(palabra if palabra in necesarios else terms[-1])
+        if encontrados and (not todas or encontrados >= necesarios):
+            puntajes[fila[0]] = puntaje
+    return sorted(puntajes, key=lambda i: (-puntajes[i], -i))
+
+
+def _candidatos(conn, indice, terms, chat_id, limite, columnas=None, todas=True, extra="", params=()):
+    """Ids que coinciden con los términos, de más a menos relevante, con el plan más barato"""
+    if chat_id is not None and _chat_pequeno(conn, indice, chat_id, extra, params):
+        with metrics.span("search", operation="scan"):
+            return _por_recorrido(conn, indice, terms, chat_id, columnas, todas, extra, params)[:limite]
+    with metrics.span("search", operation="fts"):
+        return _por_indice(conn, indice, terms, chat_id, columnas, todas, extra, params)[:limite]
+
+
+def fragmento(texto, terms):
+    """Extracto alrededor de la primera coincidencia con las palabras encontradas marcadas, o None"""
+    todas = list(_PALABRA.finditer(texto or ""))
+    posiciones = [i for i, m in enumerate(todas) if _coincide(normalizar(m.group()), terms)]
+    if not posiciones:
+        return None
+    primera = posiciones[0]
+    inicio = todas[primera - FRAGMENTO_ANTES].start() if primera > FRAGMENTO_ANTES else 0
+    ultima = primera + FRAGMENTO_DESPUES
+    fin = todas[ultima].start() if ultima < len(todas) else len(texto)
+
+    partes = ["…"] if inicio else []
+    cursor = inicio
+    for i in posiciones:
+        m = todas[i]
+        if m.start() >= fin:
+            break
+        partes.append(texto[cursor:m.start()])
+        partes.append(f"{MARCA_INICIO}{m.group()}{MARCA_FIN}")
+        cursor = m.end()
+    partes.append(texto[cursor:fin].rstrip())
+    if fin < len(texto):
+        partes.append(" …")
+    return "".join(partes)
+
+
+def _detalles(conn, indice, terms, ids):
+    """Filas completas de los ids indicados, en ese orden, con su fragmento resaltado"""
+    if not ids:
+        return []
+    marcadores = ", ".join("?" * len(ids))
+    filas = conn.execute(
+        f"SELECT {', '.join(indice.campos)} FROM {indice.origen} WHERE id IN ({marcadores})", ids
+    ).fetchall()
+    por_id = {}
+    for fila in filas:
+        resultado = dict(fila)
+        # El fragmento sale de la primera columna de texto que contiene una coincidencia
+        extractos = (fragmento(resultado.get(c), terms) for c in indice.columnas_texto)
+        resultado["fragmento"] = next((e for e in extractos if e), "")
+        por_id[resultado["id"]] = resultado
+    return [por_id[i] for i in ids if i in por_id]
+
+
+@metrics.instrumentar("search")
+def buscar(texto, chat_id=None, tipos=tuple(INDICES), limite=20):
+    """Busca en los índices indicados; devuelve {tipo: [filas]} ordenadas por relevancia"""
+    terms = terminos(texto)
+    resultados = {tipo: [] for tipo in tipos}
+    if not terms:
+        return resultados
+    with storage.connection() as conn:
+        for tipo in tipos:
+            indice = INDICES[tipo]
+            ids = _candidatos(conn, indice, terms, chat_id, limite)
+            resultados[tipo] = _detalles(conn, indice, terms, ids)
+    return resultados
+
+
+def _similitud(a, b):
+    """Similitud de 0 a 1 que tolera erratas y palabras en otro orden"""
+    a, b = a.lower(), b.lower()
+    en_orden = SequenceMatcher(None, a, b).ratio()
+    ordenadas = SequenceMatcher(None, " ".join(sorted(palabras(a))), " ".join(sorted(palabras(b)))).ratio()
+    return max(en_orden, ordenadas)
+
+
+def resolver_tarea(conn, chat_id, titulo, pendientes=True):
+    """Encuentra la tarea cuyo título corresponde mejor a `titulo`; devuelve (id, titulo) o None.
+
+    Primero busca tareas cuyo título contenga todas las palabras y, si no
+    hay, las que contengan alguna. Los candidatos se ordenan por similitud
+    con el título pedido y, a igualdad, por relevancia. Salvo que una sola
+    tarea contenga todas las palabras, la mejor debe parecerse al menos
+    SEARCH_TITLE_MIN_SIMILARITY y superar a la siguiente por
+    SEARCH_TITLE_MIN_MARGIN; si no, se devuelve None en lugar de adivinar.
+    Las consultas sin ninguna palabra significativa ("la", "de") no
+    resuelven nada.
+    """
+    terms = terminos(titulo)
+    if not any(len(t) >= _MIN_LETRAS and t not in _VACIAS for t in terms):
+        return None
+    extra = "AND completada = 0" if pendientes else ""
+    for todas in (True, False):
+        ids = _candidatos(conn, INDICES["tareas"], terms, chat_id, 20, ("titulo",), todas, extra)
+        if not ids:
+            continue
+        marcadores = ", ".join("?" * len(ids))
+        titulos = dict(conn.execute(f"SELECT id, titulo FROM tareas WHERE id IN ({marcadores})", ids).fetchall())
+        # ids ya viene ordenado por relevancia: el orden estable conserva el primero a igual similitud
+        similitudes = sorted(((_similitud(titulo, titulos[i]), i) for i in ids), key=lambda par: -par[0])
+        similitud, mejor = similitudes[0]
+        siguiente = similitudes[1][0] if len(similitudes) > 1 else 0.0
+        if todas and len(ids) == 1:
+            return mejor, titulos[mejor]
+        if similitud >= SEARCH_TITLE_MIN_SIMILARITY and similitud - siguiente >= SEARCH_TITLE_MIN_MARGIN:
+            return mejor, titulos[mejor]
+        # Las que sólo comparten alguna palabra incluyen a las mismas candidatas empatadas
+        return None
+    return None
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Búsqueda de texto completo")
+    parser.add_argument("consulta", nargs="?", default="")
+    parser.add_argument("--chat-id")
+    parser.add_argument("--tipo", default=",".join(INDICES))
+    parser.add_argument("--limite", type=int, default=10)
+    parser.add_argument("--reconstruir", action="store_true", help="reconstruir los índices antes de buscar")
+    args = parser.parse_args()
+
+    tipos = [t for t in args.tipo.split(",") if t in INDICES]
+    if args.reconstruir:
+        reconstruir_indices(tipos)
+        print("Índices reconstruidos.")
+    if args.consulta:
+        for tipo, filas in buscar(args.consulta, args.chat_id, tipos, args.limite).items():
+            print(f"{tipo}: {len(filas)} resultados")
+            for fila in filas:
+                extracto = fila["fragmento"].replace(MARCA_INICIO, "[").replace(MARCA_FIN, "]")
+                print(f"  [{fila['id']}] {fila['chat_id']}: {extracto}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,48 @@ const socket = io();
 // Variables globales
 let currentChatId = null;
 let currentPlatform = null;
-let contacts = {};
+let lastMessageId = 0;
+let olderCursor = null;
+let loadingOlder = false;
+
+// Contactos por chat_id y su orden en la lista (más reciente primero).
+// Cada contacto conserva su elemento: al llegar un mensaje sólo se actualiza
+// y se mueve ese elemento, sin reconstruir la lista.
+const contacts = new Map();
+const contactOrder = [];
+
+// Tamaño de página al cargar mensajes de un chat
+const PAGE_SIZE = 50;
+
+// Lista virtualizada del chat abierto: sólo existen en el DOM los mensajes
+// visibles más este margen (en píxeles) por arriba y por abajo
+const VIRTUAL_OVERSCAN_PX = 800;
+// Altura supuesta de un mensaje que todavía no se ha medido
+const MESSAGE_ESTIMATED_HEIGHT = 75;
+// Distancia al final por debajo de la cual el chat sigue los mensajes nuevos
+const STICK_TO_BOTTOM_PX = 40;
+let chatMessages = [];
+let messageKeySeq = 0;
+const renderedMessages = new Map();
+const streamingMessages = new Map();
+
+// Eventos del socket pendientes de aplicar en el próximo frame: en una
+// ráfaga sólo cuenta el último resumen de cada chat y el DOM se toca una vez
+const pendingContacts = new Map();
+const pendingMessages = [];
+let messagesDirty = false;
+let frameRequested = false;
+
+// Búsqueda: espera tras la última tecla y resultados por tipo
+const SEARCH_DELAY_MS = 250;
+const SEARCH_LIMIT = 10;
+const SEARCH_GROUPS = {
+    mensajes: 'Mensajes',
+    conversaciones: 'Conversaciones con el asistente',
+    tareas: 'Tareas'
+};
+let searchTimer = null;
+let searchSeq = 0;
 
 // Elementos del DOM
 const contactsList = document.getElementById('contactsList');
@@ -13,10 +54,45 @@ const messageInput = document.getElementById('messageInput');
 const sendButton = document.getElementById('sendButton');
 const currentChatName = document.getElementById('currentChatName');
 const currentChatStatus = document.getElementById('currentChatStatus');
+const searchInput = document.getElementById('searchInput');
+const searchResults = document.getElementById('searchResults');
 
-// Cargar mensajes al iniciar
+// Espaciadores que ocupan la altura de los mensajes no renderizados
+const topSpacer = document.createElement('div');
+const bottomSpacer = document.createElement('div');
+
+// Cargar contactos al iniciar
 window.addEventListener('DOMContentLoaded', () => {
-    loadMessages();
+    loadContacts();
+});
+
+// Al reconectar, volver a la sala del chat abierto y pedir sólo los mensajes que se perdieron
+socket.on('connect', () => {
+    if (currentChatId) {
+        socket.emit('join_chat', { chat_id: currentChatId });
+    }
+    if (lastMessageId > 0) {
+        syncMessages();
+    }
+});
+
+// Renderizar la ventana visible y cargar mensajes más antiguos al llegar al inicio del chat
+messagesContainer.addEventListener('scroll', () => {
+    if (currentChatId) {
+        messagesDirty = true;
+        scheduleFrame();
+    }
+    if (messagesContainer.scrollTop === 0 && olderCursor && !loadingOlder) {
+        loadOlderMessages();
+    }
+});
+
+// Un único manejador para todos los contactos
+contactsList.addEventListener('click', (e) => {
+    const item = e.target.closest('.contact-item');
+    if (!item) return;
+    const contact = contacts.get(item.dataset.chatId);
+    selectChat(contact.chatId, contact.name, contact.platform);
 });
 
 // Manejar envío de mensajes
@@ -28,80 +104,294 @@ messageInput.addEventListener('keypress', (e) => {
 
 sendButton.addEventListener('click', sendMessage);
 
-// Escuchar nuevos mensajes
-socket.on('new_message', (data) => {
-    // Actualizar la lista de contactos
-    updateContact(data.chat_id, data.sender, data.message, data.timestamp);
-    
-    // Si es el chat actual, mostrar el mensaje
-    if (currentChatId === data.chat_id) {
-        appendMessage(data.message, data.timestamp, data.is_from_assistant);
+// Buscar mientras se escribe
+searchInput.addEventListener('input', () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => runSearch(searchInput.value.trim()), SEARCH_DELAY_MS);
+});
+
+searchInput.addEventListener('keydown', (e) => {
+    if (e.key === 'Escape') {
+        clearSearch();
     }
 });
 
-// Función para cargar mensajes
-function loadMessages() {
-    fetch('/messages')
+// Escuchar el resumen de cada mensaje nuevo (se difunde a todos los clientes)
+socket.on('contact_update', (data) => {
+    if (data.id) {
+        lastMessageId = Math.max(lastMessageId, data.id);
+    }
+    
+    // Actualizar la lista de contactos en el próximo frame
+    pendingContacts.set(data.chat_id, data);
+    scheduleFrame();
+});
+
+// Escuchar los mensajes completos del chat abierto (sólo llegan los de su sala)
+socket.on('new_message', (data) => {
+    if (currentChatId !== data.chat_id) return;
+    pendingMessages.push(data);
+    scheduleFrame();
+});
+
+// Escuchar fragmentos de respuestas en streaming
+socket.on('message_chunk', (data) => {
+    if (currentChatId !== data.chat_id) return;
+    pendingMessages.push({ ...data, partial: true });
+    scheduleFrame();
+});
+
+// Función para agrupar los cambios del DOM en el próximo frame
+function scheduleFrame() {
+    if (!frameRequested) {
+        frameRequested = true;
+        requestAnimationFrame(flushFrame);
+    }
+}
+
+// Función para aplicar los eventos acumulados desde el frame anterior
+function flushFrame() {
+    frameRequested = false;
+    
+    pendingContacts.forEach(data => {
+        updateContact(data.chat_id, data.sender, data.message, data.timestamp, data.is_from_assistant);
+    });
+    pendingContacts.clear();
+    
+    if (!pendingMessages.length && !messagesDirty) return;
+    const stick = isAtBottom();
+    pendingMessages.splice(0).forEach(data => {
+        // Mensajes de un chat que se cerró antes de este frame
+        if (data.chat_id !== currentChatId) return;
+        if (data.partial) {
+            appendChunk(data.stream_id, data.chunk);
+        } else {
+            addMessage(data.message, data.timestamp, data.is_from_assistant, data.stream_id);
+        }
+    });
+    messagesDirty = false;
+    renderMessages(stick);
+}
+
+// Función para cargar la lista de contactos (un registro por chat)
+function loadContacts() {
+    fetch('/contacts')
+        .then(response => response.json())
+        .then(data => {
+            data.contacts.forEach(contact => {
+                if (contacts.has(contact.chat_id)) return;
+                const record = createContact(contact.chat_id, contact.name, contact.platform || 'WhatsApp');
+                setContactMessage(record, contact.message, contact.timestamp);
+                contactOrder.push(record);
+            });
+            lastMessageId = Math.max(lastMessageId, data.last_id || 0);
+            
+            // Ordenar una sola vez e insertar todos los elementos de golpe
+            contactOrder.sort(compareContacts);
+            const fragment = document.createDocumentFragment();
+            contactOrder.forEach(record => fragment.appendChild(record.element));
+            contactsList.appendChild(fragment);
+        })
+        .catch(error => console.error('Error al cargar contactos:', error));
+}
+
+// Función para sincronizar los mensajes recibidos mientras no había conexión
+function syncMessages() {
+    fetch(`/messages?after_id=${lastMessageId}&limit=500`)
         .then(response => response.json())
-        .then(messages => {
-            // Agrupar mensajes por chat_id
-            messages.forEach(msg => {
-                updateContact(msg.chat_id, msg.sender, msg.message, msg.timestamp);
+        .then(data => {
+            data.messages.forEach(msg => {
+                pendingContacts.set(msg.chat_id, msg);
+                if (currentChatId === msg.chat_id) {
+                    pendingMessages.push(msg);
+                }
             });
+            lastMessageId = Math.max(lastMessageId, data.last_id || 0);
+            scheduleFrame();
             
-            // Renderizar contactos
-            renderContacts();
+            if (data.has_more) {
+                syncMessages();
+            }
         })
-        .catch(error => console.error('Error al cargar mensajes:', error));
-}
-
-// Función para actualizar un contacto
-function updateContact(chatId, sender, message, timestamp) {
-    if (!contacts[chatId]) {
-        contacts[chatId] = {
-            name: sender,
-            lastMessage: message,
-            timestamp: timestamp,
-            platform: 'WhatsApp'
-        };
+        .catch(error => console.error('Error al sincronizar mensajes:', error));
+}
+
+// Función para comparar contactos: más reciente primero y, a igual fecha, por chat_id
+function compareContacts(a, b) {
+    return (b.time - a.time) || (a.chatId < b.chatId ? -1 : a.chatId > b.chatId ? 1 : 0);
+}
+
+// Función para buscar (en O(log n)) la posición de un contacto en la lista ordenada
+function contactPosition(record) {
+    let low = 0;
+    let high = contactOrder.length;
+    while (low < high) {
+        const middle = (low + high) >> 1;
+        if (compareContacts(contactOrder[middle], record) < 0) {
+            low = middle + 1;
+        } else {
+            high = middle;
+        }
+    }
+    return low;
+}
+
+// Función para crear un contacto con su elemento de la lista
+function createContact(chatId, name, platform) {
+    const element = document.createElement('div');
+    element.className = `contact-item ${currentChatId === chatId ? 'active' : ''}`;
+    element.dataset.chatId = chatId;
+    
+    const nameElement = document.createElement('div');
+    nameElement.className = 'contact-name';
+    nameElement.textContent = name;
+    const lastMessageElement = document.createElement('div');
+    lastMessageElement.className = 'contact-last-message';
+    element.append(nameElement, lastMessageElement);
+    
+    const record = { chatId, name, platform, lastMessage: '', timestamp: null, time: 0, element, lastMessageElement };
+    contacts.set(chatId, record);
+    return record;
+}
+
+// Función para cambiar el último mensaje de un contacto (sin moverlo)
+function setContactMessage(record, message, timestamp) {
+    if (record.lastMessage !== message) {
+        record.lastMessage = message;
+        record.lastMessageElement.textContent = message;
+    }
+    record.timestamp = timestamp;
+    // La fecha se interpreta una sola vez por mensaje
+    record.time = Date.parse(timestamp) || 0;
+}
+
+// Función para actualizar un contacto y moverlo a su nueva posición
+function updateContact(chatId, sender, message, timestamp, isFromAssistant = false) {
+    let record = contacts.get(chatId);
+    if (record) {
+        contactOrder.splice(contactPosition(record), 1);
     } else {
-        contacts[chatId].lastMessage = message;
-        contacts[chatId].timestamp = timestamp;
+        record = createContact(chatId, isFromAssistant ? chatId : sender, 'WhatsApp');
     }
+    setContactMessage(record, message, timestamp);
+    
+    const position = contactPosition(record);
+    contactOrder.splice(position, 0, record);
     
-    // Renderizar contactos
-    renderContacts();
+    // Mover el elemento sólo si su vecino cambió
+    const next = contactOrder[position + 1];
+    const nextElement = next ? next.element : null;
+    if (record.element.nextSibling !== nextElement || !record.element.parentNode) {
+        contactsList.insertBefore(record.element, nextElement);
+    }
 }
 
-// Función para renderizar contactos
-function renderContacts() {
-    // Ordenar contactos por timestamp (más reciente primero)
-    const sortedContacts = Object.entries(contacts).sort((a, b) => {
-        return new Date(b[1].timestamp) - new Date(a[1].timestamp);
-    });
+// Función para buscar en mensajes, conversaciones y tareas
+function runSearch(query) {
+    const seq = ++searchSeq;
+    if (!query) {
+        searchResults.hidden = true;
+        contactsList.hidden = false;
+        return;
+    }
+    
+    fetch(`/search?q=${encodeURIComponent(query)}&limit=${SEARCH_LIMIT}`)
+        .then(response => response.json())
+        .then(data => {
+            // Ignorar respuestas de búsquedas anteriores
+            if (seq !== searchSeq) return;
+            renderSearchResults(data.results || {});
+        })
+        .catch(error => console.error('Error al buscar:', error));
+}
+
+// Función para limpiar la búsqueda y volver a la lista de contactos
+function clearSearch() {
+    searchInput.value = '';
+    runSearch('');
+}
+
+// Función para renderizar los resultados agrupados por tipo
+function renderSearchResults(results) {
+    searchResults.innerHTML = '';
+    let total = 0;
     
-    // Limpiar lista de contactos
-    contactsList.innerHTML = '';
-    
-    // Agregar contactos a la lista
-    sortedContacts.forEach(([chatId, contact]) => {
-        const contactItem = document.createElement('div');
-        contactItem.className = `contact-item ${currentChatId === chatId ? 'active' : ''}`;
-        contactItem.innerHTML = `
-            <div class="contact-name">${contact.name}</div>
-            <div class="contact-last-message">${contact.lastMessage}</div>
-        `;
+    Object.entries(SEARCH_GROUPS).forEach(([type, groupTitle]) => {
+        const rows = results[type] || [];
+        if (!rows.length) return;
+        total += rows.length;
         
-        contactItem.addEventListener('click', () => {
-            selectChat(chatId, contact.name, contact.platform);
-        });
+        const title = document.createElement('div');
+        title.className = 'search-group-title';
+        title.textContent = groupTitle;
+        searchResults.appendChild(title);
         
-        contactsList.appendChild(contactItem);
+        rows.forEach(row => {
+            const contact = contacts.get(row.chat_id);
+            const name = contact ? contact.name : row.chat_id;
+            const item = document.createElement('div');
+            item.className = 'contact-item search-result';
+            
+            const nameElement = document.createElement('div');
+            nameElement.className = 'contact-name';
+            nameElement.textContent = name;
+            const snippet = document.createElement('div');
+            snippet.className = 'contact-last-message';
+            appendHighlighted(snippet, row.fragmento);
+            item.append(nameElement, snippet);
+            
+            item.addEventListener('click', () => {
+                clearSearch();
+                selectChat(row.chat_id, name, contact ? contact.platform : 'WhatsApp');
+            });
+            searchResults.appendChild(item);
+        });
+    });
+    
+    if (!total) {
+        const empty = document.createElement('div');
+        empty.className = 'search-empty';
+        empty.textContent = 'Sin resultados';
+        searchResults.appendChild(empty);
+    }
+    contactsList.hidden = true;
+    searchResults.hidden = false;
+}
+
+// Función para resaltar las coincidencias; el servidor las delimita con \u0002 y \u0003
+function appendHighlighted(element, text) {
+    (text || '').split('\u0002').forEach((part, index) => {
+        if (index === 0) {
+            element.append(part);
+            return;
+        }
+        const [match, rest = ''] = part.split('\u0003');
+        const mark = document.createElement('mark');
+        mark.textContent = match;
+        element.append(mark, rest);
     });
 }
 
 // Función para seleccionar un chat
 function selectChat(chatId, name, platform) {
+    // Cambiar de sala: sólo se reciben los mensajes del chat abierto
+    if (currentChatId !== chatId) {
+        if (currentChatId) {
+            socket.emit('leave_chat', { chat_id: currentChatId });
+        }
+        socket.emit('join_chat', { chat_id: chatId });
+    }
+    
+    // Marcar como activo en la lista de contactos
+    const previous = contacts.get(currentChatId);
+    if (previous) {
+        previous.element.classList.remove('active');
+    }
+    const selected = contacts.get(chatId);
+    if (selected) {
+        selected.element.classList.add('active');
+    }
+    
     // Actualizar variables globales
     currentChatId = chatId;
     currentPlatform = platform;
@@ -112,62 +402,212 @@ function selectChat(chatId, name, platform) {
     messageInput.disabled = false;
     sendButton.disabled = false;
     
-    // Marcar como activo en la lista de contactos
-    document.querySelectorAll('.contact-item').forEach(item => {
-        item.classList.remove('active');
-    });
-    
-    document.querySelectorAll('.contact-item').forEach(item => {
-        if (item.querySelector('.contact-name').textContent === name) {
-            item.classList.add('active');
-        }
-    });
-    
     // Cargar mensajes del chat
     loadChatMessages(chatId);
 }
 
-// Función para cargar mensajes de un chat específico
+// Función para vaciar la lista de mensajes del chat abierto
+function resetMessages() {
+    chatMessages = [];
+    renderedMessages.clear();
+    streamingMessages.clear();
+    pendingMessages.length = 0;
+    messagesContainer.replaceChildren(topSpacer, bottomSpacer);
+}
+
+// Función para cargar mensajes de un chat específico (última página)
 function loadChatMessages(chatId) {
-    fetch('/messages')
+    olderCursor = null;
+    fetch(`/messages?chat_id=${encodeURIComponent(chatId)}&limit=${PAGE_SIZE}`)
         .then(response => response.json())
-        .then(messages => {
-            // Filtrar mensajes del chat actual
-            const chatMessages = messages.filter(msg => msg.chat_id === chatId);
-            
-            // Ordenar por timestamp (más antiguo primero)
-            chatMessages.sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
+        .then(data => {
+            // Ignorar respuestas de un chat que ya no está seleccionado
+            if (currentChatId !== chatId) return;
             
-            // Limpiar contenedor de mensajes
-            messagesContainer.innerHTML = '';
+            resetMessages();
             
-            // Mostrar mensajes
-            chatMessages.forEach(msg => {
-                appendMessage(msg.message, msg.timestamp, msg.is_from_assistant);
+            // La API devuelve los más recientes primero
+            data.messages.slice().reverse().forEach(msg => {
+                addMessage(msg.message, msg.timestamp, msg.is_from_assistant);
             });
+            olderCursor = data.next_cursor;
             
             // Scroll al final
-            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+            renderMessages(true);
         })
         .catch(error => console.error('Error al cargar mensajes del chat:', error));
 }
 
-// Función para agregar un mensaje al contenedor
-function appendMessage(message, timestamp, isFromAssistant) {
-    const messageElement = document.createElement('div');
-    messageElement.className = `message ${isFromAssistant ? 'received' : 'sent'}`;
+// Función para cargar la página anterior del chat actual
+function loadOlderMessages() {
+    const chatId = currentChatId;
+    loadingOlder = true;
+    fetch(`/messages?chat_id=${encodeURIComponent(chatId)}&limit=${PAGE_SIZE}&before=${encodeURIComponent(olderCursor)}`)
+        .then(response => response.json())
+        .then(data => {
+            if (currentChatId !== chatId) return;
+            
+            // Insertar al principio conservando la posición de scroll
+            const previousHeight = messagesContainer.scrollHeight;
+            const previousTop = messagesContainer.scrollTop;
+            const older = data.messages.slice().reverse().map(msg => createMessageItem(msg.message, msg.timestamp, msg.is_from_assistant));
+            chatMessages = older.concat(chatMessages);
+            renderMessages(false);
+            messagesContainer.scrollTop = previousTop + messagesContainer.scrollHeight - previousHeight;
+            renderMessages(false);
+            olderCursor = data.next_cursor;
+        })
+        .catch(error => console.error('Error al cargar mensajes anteriores:', error))
+        .finally(() => {
+            loadingOlder = false;
+        });
+}
+
+// Función para crear el registro de un mensaje (todavía sin elemento)
+function createMessageItem(message, timestamp, isFromAssistant, streamId = null) {
+    return { key: ++messageKeySeq, message, timestamp, isFromAssistant, streamId, height: 0 };
+}
+
+// Función para agregar un mensaje al final; reemplaza la respuesta parcial del mismo stream
+function addMessage(message, timestamp, isFromAssistant, streamId = null) {
+    const streaming = streamId && streamingMessages.get(streamId);
+    if (streaming) {
+        streamingMessages.delete(streamId);
+        streaming.message = message;
+        streaming.timestamp = timestamp;
+        streaming.streamId = null;
+        refreshMessageElement(streaming);
+        return;
+    }
+    chatMessages.push(createMessageItem(message, timestamp, isFromAssistant));
+}
+
+// Función para agregar un fragmento a la respuesta en streaming
+function appendChunk(streamId, chunk) {
+    let item = streamingMessages.get(streamId);
+    if (!item) {
+        item = createMessageItem('', new Date().toISOString(), true, streamId);
+        streamingMessages.set(streamId, item);
+        chatMessages.push(item);
+    }
+    item.message += chunk;
+    refreshMessageElement(item);
+}
+
+// Función para actualizar el elemento de un mensaje si está renderizado
+function refreshMessageElement(item) {
+    const element = renderedMessages.get(item.key);
+    if (element) {
+        element.querySelector('.message-content').textContent = item.message;
+        element.querySelector('.message-time').textContent = formatTimestamp(item.timestamp);
+        // La altura cambia: se vuelve a medir al renderizar
+        item.height = 0;
+    }
+}
+
+// Función para saber si el chat está mostrando el último mensaje
+function isAtBottom() {
+    return messagesContainer.scrollHeight - messagesContainer.scrollTop - messagesContainer.clientHeight < STICK_TO_BOTTOM_PX;
+}
+
+// Función para renderizar sólo los mensajes dentro de la ventana visible.
+// Los elementos se identifican por clave: los que siguen visibles no se
+// recrean, y las alturas medidas se guardan para calcular los espaciadores.
+function renderMessages(stickToBottom) {
+    if (stickToBottom) {
+        // Renderizar directamente la ventana del final de la lista
+        updateMessageWindow(Math.max(0, messageListHeight() - messagesContainer.clientHeight));
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    } else {
+        updateMessageWindow(messagesContainer.scrollTop);
+    }
+}
+
+function updateMessageWindow(scrollTop) {
+    const viewTop = scrollTop - VIRTUAL_OVERSCAN_PX;
+    const viewBottom = scrollTop + messagesContainer.clientHeight + VIRTUAL_OVERSCAN_PX;
+    
+    // Rango de mensajes que se cruza con la ventana
+    let offset = 0;
+    let start = -1;
+    let end = chatMessages.length;
+    let top = 0;
+    let bottom = 0;
+    for (let i = 0; i < chatMessages.length; i++) {
+        const height = chatMessages[i].height || MESSAGE_ESTIMATED_HEIGHT;
+        if (start < 0 && offset + height > viewTop) {
+            start = i;
+            top = offset;
+        }
+        if (start >= 0 && end === chatMessages.length && offset >= viewBottom) {
+            end = i;
+            bottom = offset;
+        }
+        offset += height;
+    }
+    if (start < 0) {
+        start = end = chatMessages.length;
+        top = offset;
+    }
+    if (end === chatMessages.length) {
+        bottom = offset;
+    }
     
-    const formattedTime = formatTimestamp(timestamp);
+    // Quitar los elementos que salieron de la ventana
+    const visible = new Set();
+    for (let i = start; i < end; i++) {
+        visible.add(chatMessages[i].key);
+    }
+    renderedMessages.forEach((element, key) => {
+        if (!visible.has(key)) {
+            element.remove();
+            renderedMessages.delete(key);
+        }
+    });
     
-    messageElement.innerHTML = `
-        <div class="message-content">${message}</div>
-        <div class="message-time">${formattedTime}</div>
-    `;
+    // Insertar los que faltan en su lugar, sin mover los que ya están en orden
+    let cursor = topSpacer.nextSibling;
+    for (let i = start; i < end; i++) {
+        const item = chatMessages[i];
+        let element = renderedMessages.get(item.key);
+        if (!element) {
+            element = createMessageElement(item.message, item.timestamp, item.isFromAssistant);
+            renderedMessages.set(item.key, element);
+        }
+        if (element === cursor) {
+            cursor = cursor.nextSibling;
+        } else {
+            messagesContainer.insertBefore(element, cursor);
+        }
+    }
+    topSpacer.style.height = `${top}px`;
+    bottomSpacer.style.height = `${offset - bottom}px`;
+    
+    // Medir después de escribir: una sola maquetación por pasada
+    for (let i = start; i < end; i++) {
+        chatMessages[i].height = renderedMessages.get(chatMessages[i].key).offsetHeight;
+    }
+}
+
+// Función para calcular la altura total de la lista (medida o estimada)
+function messageListHeight() {
+    return chatMessages.reduce((total, item) => total + (item.height || MESSAGE_ESTIMATED_HEIGHT), 0);
+}
+
+// Función para crear el elemento de un mensaje
+function createMessageElement(message, timestamp, isFromAssistant) {
+    const messageElement = document.createElement('div');
+    messageElement.className = `message ${isFromAssistant ? 'received' : 'sent'}`;
     
-    messagesContainer.appendChild(messageElement);
+    const content = document.createElement('div');
+    content.className = 'message-content';
+    content.textContent = message;
+    const time = document.createElement('div');
+    time.className = 'message-time';
+    time.textContent = formatTimestamp(timestamp);
+    messageElement.append(content, time);
     
-    // Scroll al final
-    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    return messageElement;
 }
 
 // Función para enviar un mensaje
@@ -186,12 +626,17 @@ function sendMessage() {
     // Limpiar input
     messageInput.value = '';
     
-    // Mostrar mensaje enviado inmediatamente
+    // Mostrar mensaje enviado inmediatamente y actualizar contacto
     const timestamp = new Date().toISOString();
-    appendMessage(message, timestamp, false);
-    
-    // Actualizar contacto
-    updateContact(currentChatId, contacts[currentChatId].name, message, timestamp);
+    addMessage(message, timestamp, false);
+    messagesDirty = true;
+    pendingContacts.set(currentChatId, {
+        chat_id: currentChatId,
+        sender: contacts.get(currentChatId).name,
+        message: message,
+        timestamp: timestamp
+    });
+    scheduleFrame();
 }
 
 // Función para formatear timestamp
@@ -218,10 +663,10 @@ if (window.innerWidth <= 768) {
         sidebar.classList.toggle('show');
     });
     
-    // Cerrar menú al seleccionar un chat
-    document.querySelectorAll('.contact-item').forEach(item => {
-        item.addEventListener('click', () => {
+    // Cerrar menú al seleccionar un chat (también los que se agreguen después)
+    [contactsList, searchResults].forEach(list => {
+        list.addEventListener('click', () => {
             sidebar.classList.remove('show');
         });
     });
-}
\ No newline at end of file
+}
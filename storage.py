@@ -0,0 +1,219 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Valores por defecto; la ruta real se lee de ASSISTANT_DB_PATH al crear el pool
+# para que pueda apuntarse a bases de datos aisladas (pruebas, benchmarks)
+DEFAULT_DB_PATH = 'assistant.db'
+DEFAULT_POOL_SIZE = 8
+DEFAULT_TIMEOUT = 10
+
+# Número de sentencias preparadas que sqlite3 mantiene en caché por conexión
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    # Sólo tiene efecto al crear la base de datos o en el próximo VACUUM; la
+    # retención devuelve después las páginas libres con incremental_vacuum
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+)
+
+
+class ConnectionPool:
+    """Pool de conexiones SQLite de larga duración, seguro entre hilos"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT):
+        self.path = path
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        """Obtiene una conexión libre o crea una nueva si no se alcanzó el límite"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("El pool de conexiones está cerrado")
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("No hay conexiones disponibles en el pool")
+
+    def warm(self, count=None):
+        """Abre por adelantado hasta `count` conexiones (por defecto todo el pool)"""
+        conns = []
+        try:
+            for _ in range(min(count or self.size, self.size)):
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                self.release(conn)
+        return len(conns)
+
+    def release(self, conn):
+        """Devuelve una conexión al pool deshaciendo transacciones abiertas"""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def close(self):
+        """Cierra todas las conexiones libres del pool"""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Devuelve el pool compartido, creándolo la primera vez"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    db_path(),
+                    int(os.getenv('DB_POOL_SIZE', DEFAULT_POOL_SIZE)),
+                    float(os.getenv('DB_TIMEOUT', DEFAULT_TIMEOUT))
+                )
+    return _pool
+
+
+def db_path():
+    """Ruta de la base de datos configurada"""
+    return os.getenv('ASSISTANT_DB_PATH', DEFAULT_DB_PATH)
+
+
+def configure(path=None, pool_size=None):
+    """Cambia la ruta o el tamaño del pool, cerrando el pool anterior"""
+    if path is not None:
+        os.environ['ASSISTANT_DB_PATH'] = path
+    if pool_size is not None:
+        os.environ['DB_POOL_SIZE'] = str(pool_size)
+    close()
+    return get_pool()
+
+
+def close():
+    """Cierra el pool compartido"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+@contextmanager
+def connection():
+    """Presta una conexión del pool durante el bloque `with`"""
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+@contextmanager
+def transaction(immediate=False):
+    """Presta una conexión y confirma los cambios al salir del bloque `with`.
+
+    sqlite3 sólo abre la transacción implícita antes de INSERT/UPDATE/DELETE:
+    el DDL y lo que se lea antes van en autocommit. Con `immediate` la
+    transacción empieza al entrar, con el lock de escritura tomado, y todo
+    el bloque (DDL incluido) se confirma o se deshace junto.
+    """
+    with connection() as conn:
+        try:
+            if immediate:
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def schema_version(component):
+    """Versión del esquema aplicada a un componente, o None si nunca se aplicó"""
+    with connection() as conn:
+        try:
+            row = conn.execute("SELECT version FROM schema_version WHERE component = ?", (component,)).fetchone()
+        except sqlite3.OperationalError:
+            # La tabla de versiones aún no existe
+            return None
+    return row[0] if row else None
+
+
+def ensure_schema(component, version, create):
+    """Aplica `create(conn)` si la base de datos no tiene esa versión del esquema del componente.
+
+    Con el esquema al día el arranque cuesta una consulta en lugar de repetir
+    todo el DDL y las comprobaciones de migración. La migración corre con el
+    lock de escritura y vuelve a comprobar la versión: si varios procesos
+    arrancan a la vez, sólo el primero la aplica. Devuelve True si se aplicó.
+    """
+    if schema_version(component) == version:
+        return False
+    with transaction(immediate=True) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (component TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        row = conn.execute("SELECT version FROM schema_version WHERE component = ?", (component,)).fetchone()
+        if row and row[0] == version:
+            return False
+        create(conn)
+        conn.execute(
+            "INSERT INTO schema_version (component, version) VALUES (?, ?) "
+            "ON CONFLICT(component) DO UPDATE SET version = excluded.version",
+            (component, version)
+        )
+    return True
@@ -0,0 +1,30 @@
+"""Fixtures comunes: cada prueba usa su propia base de datos SQLite temporal."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Base de datos vacía en un directorio temporal (el pool se recrea con la nueva ruta)"""
+    monkeypatch.setenv("ASSISTANT_DB_PATH", str(tmp_path / "test.db"))
+    storage.close()
+    yield tmp_path / "test.db"
+    storage.close()
+
+
+@pytest.fixture
+def esquema(db):
+    """Base de datos temporal con el esquema completo de la aplicación"""
+    import app
+    import gemini_assistant
+    import retention
+    app.init_db()
+    gemini_assistant.init_db()
+    retention.init_db()
+    return db
@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+import analytics
+import storage
+
+
+@pytest.fixture
+def directorio(esquema, tmp_path):
+    return str(tmp_path / "analytics")
+
+
+def _movimientos(*filas):
+    """Inserta (chat_id, tipo, monto, categoria, fecha) en finanzas"""
+    with storage.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO finanzas (chat_id, tipo, monto, categoria, fecha) VALUES (?, ?, ?, ?, ?)", filas
+        )
+        return conn.execute("SELECT MAX(id) FROM finanzas").fetchone()[0]
+
+
+def _ids(directorio):
+    return sorted(analytics.cargar(directorio).columnas["id"].tolist())
+
+
+def test_exporta_solo_lo_posterior_a_la_marca_de_agua(directorio):
+    marca = _movimientos(
+        ("c1", "gasto", 10, "comida", "2026-01-05 10:00:00"),
+        ("c1", "gasto", 20, "renta", "2026-01-20 10:00:00"),
+        ("c2", "ingreso", 500, "salario", "2026-02-01 09:00:00"),
+    )
+    assert analytics.exportar(directorio, lote=2) == {"exportadas": 3, "omitidas": 0, "marca": marca}
+    assert analytics.exportar(directorio) == {"exportadas": 0, "omitidas": 0, "marca": marca}
+
+    nueva = _movimientos(("c2", "gasto", 5, "comida", "2026-02-03 12:00:00"))
+    assert analytics.exportar(directorio) == {"exportadas": 1, "omitidas": 0, "marca": nueva}
+    assert _ids(directorio) == list(range(1, nueva + 1))
+    estado = analytics.estado(directorio)
+    assert (estado["watermark"], estado["rows"], estado["months"]) == (nueva, 4, 2)
+
+
+def test_las_filas_invalidas_se_omiten_sin_frenar_la_marca(directorio):
+    marca = _movimientos(
+        ("c1", "gasto", 10, "comida", "sin fecha"),
+        ("c1", "prestamo", 10, "banco", "2026-01-05"),
+        ("c1", "gasto", 30, "comida", "2026-01-06"),
+    )
+    assert analytics.exportar(directorio) == {"exportadas": 1, "omitidas": 2, "marca": marca}
+    assert _ids(directorio) == [marca]
+    assert analytics.estado(directorio)["skipped"] == 2
+
+
+def test_compacta_los_segmentos_de_un_mes(directorio, monkeypatch):
+    monkeypatch.setattr(analytics, "ANALYTICS_COMPACT_SEGMENTS", 3)
+    for dia in range(1, 5):
+        _movimientos(("c1", "gasto", dia, "comida", f"2026-03-{dia:02d}"))
+        analytics.exportar(directorio)
+    segmentos = analytics.leer_manifiesto(directorio)["segmentos"]["2026-03"]
+    assert len(segmentos) == 2
+    assert sorted(os.listdir(os.path.join(directorio, "2026-03"))) == sorted(s.split("/")[1] for s in segmentos)
+    assert _ids(directorio) == [1, 2, 3, 4]
+
+
+def test_reconstruir_vuelve_a_exportar_todo(directorio):
+    _movimientos(("c1", "gasto", 10, "comida", "2026-01-05"), ("c1", "gasto", 20, "comida", "2025-12-05"))
+    analytics.exportar(directorio)
+    with storage.transaction() as conn:
+        conn.execute("UPDATE finanzas SET monto = 99 WHERE id = 1")
+    assert analytics.exportar(directorio, reconstruir=True)["exportadas"] == 2
+    assert analytics.estado(directorio)["segments"] == 2
+    assert sorted(analytics.cargar(directorio).columnas["monto"].tolist()) == [20, 99]
+
+
+@pytest.fixture
+def exportado(directorio):
+    _movimientos(
+        ("c1", "ingreso", 1000, "salario", "2026-01-01"),
+        ("c1", "gasto", 300, "renta", "2026-01-02"),
+        ("c1", "gasto", 50, "comida", "2026-01-15"),
+        ("c2", "gasto", 150, "comida", "2026-01-20"),
+        ("c2", "gasto", 40, "comida", "2026-03-10"),
+    )
+    analytics.exportar(directorio)
+    return directorio
+
+
+def test_tendencia_por_mes(exportado):
+    resultado = analytics.informe("tendencia", directorio=exportado)
+    assert resultado["rows"] == 5
+    assert resultado["result"] == [
+        {"mes": "2026-01", "ingresos": 1000.0, "gastos": 500.0, "balance": 500.0, "movimientos": 4, "usuarios": 2},
+        {"mes": "2026-03", "ingresos": 0.0, "gastos": 40.0, "balance": -40.0, "movimientos": 1, "usuarios": 1},
+    ]
+
+
+def test_categorias_con_filtros(exportado):
+    resultado = analytics.informe("categorias", directorio=exportado)["result"]
+    assert [(c["categoria"], c["total"], c["usuarios"], c["porcentaje"]) for c in resultado] == [
+        ("renta", 300.0, 1, 55.6), ("comida", 240.0, 2, 44.4)
+    ]
+    enero_c2 = analytics.informe("categorias", chat_id="c2", desde="2026-01", hasta="2026-01-31", directorio=exportado)
+    assert enero_c2["rows"] == 1
+    assert enero_c2["result"][0]["total"] == 150.0
+    assert analytics.informe("categorias", chat_id="nadie", directorio=exportado)["result"] == []
+
+
+def test_anomalias_por_usuario_y_categoria(directorio):
+    habituales = [("c1", "gasto", 100, "comida", f"2026-04-{dia:02d}") for dia in range(1, 13)]
+    # Otro usuario gasta lo mismo siempre: sin desviación no hay anomalías
+    constantes = [("c2", "gasto", 1000, "comida", f"2026-04-{dia:02d}") for dia in range(1, 13)]
+    marca = _movimientos(*habituales, *constantes, ("c1", "gasto", 1000, "comida", "2026-04-20"))
+    analytics.exportar(directorio)
+
+    resultado = analytics.informe("anomalias", directorio=directorio)["result"]
+    assert len(resultado) == 1
+    assert resultado[0]["id"] == marca
+    assert (resultado[0]["chat_id"], resultado[0]["fecha"], resultado[0]["monto"]) == ("c1", "2026-04-20", 1000.0)
+    assert resultado[0]["z"] > 3
+    assert analytics.informe("anomalias", directorio=directorio, minimo=20)["result"] == []
+
+
+def test_informes_y_fechas_invalidas(exportado):
+    with pytest.raises(ValueError):
+        analytics.informe("ventas", directorio=exportado)
+    with pytest.raises(ValueError):
+        analytics.informe("tendencia", desde="2026-13", directorio=exportado)
@@ -0,0 +1,56 @@
+import asyncio
+import json
+import re
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+
+@pytest.fixture
+def servidor(esquema, monkeypatch):
+    import app
+    import async_app
+    import gemini_assistant
+    import reminders
+    import retention
+
+    async def procesar(mensaje, chat_id, on_chunk=None):
+        return f"respuesta a {mensaje}"
+
+    monkeypatch.setattr(reminders, "iniciar", lambda entregar: None)
+    monkeypatch.setattr(retention, "iniciar", lambda: None)
+    monkeypatch.setattr(app, "start_warm_up", lambda async_mode=False: None)
+    monkeypatch.setattr(gemini_assistant, "procesar_mensaje_async", procesar)
+    return async_app.web_app
+
+
+def _rutas_flask():
+    import app
+    return {(re.sub(r"<(\w+)>", r"{\1}", regla.rule), metodo)
+            for regla in app.app.url_map.iter_rules() if regla.endpoint != "static"
+            for metodo in regla.methods - {"HEAD", "OPTIONS"}}
+
+
+def test_el_modo_asyncio_tiene_las_mismas_rutas(servidor):
+    rutas = {(recurso.canonical, ruta.method) for recurso in servidor.router.resources()
+             for ruta in recurso if ruta.method != "HEAD"}
+    assert _rutas_flask() - rutas == set()
+
+
+def test_lote_y_metricas_en_modo_asyncio(servidor):
+    async def probar():
+        async with TestClient(TestServer(servidor)) as cliente:
+            lote = [{"chat_id": "c1", "message": "hola"}, {"chat_id": "c2", "message": "adiós"}, {"message": "x"}]
+            respuesta = await cliente.post("/messages/bulk?concurrency=2", json=lote)
+            eventos = [json.loads(linea) for linea in (await respuesta.text()).splitlines()]
+            cola = await (await cliente.get("/queue/metrics")).json()
+            cache = await (await cliente.get("/intent-cache/metrics")).json()
+            return respuesta.status, eventos, cola, cache
+
+    status, eventos, cola, cache = asyncio.run(probar())
+    assert status == 200
+    resumen = eventos[-1]["summary"]
+    assert (resumen["total"], resumen["ok"], resumen["invalid"]) == (3, 2, 1)
+    assert {e["response"] for e in eventos[:-1] if e["status"] == "ok"} == {"respuesta a hola", "respuesta a adiós"}
+    assert cola["depth"] == 0
+    assert "enabled" in cache
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from command_protocol import CONVERSACION, ErrorValidacion
+from gemini_assistant import PROTOCOLO
+
+
+def test_protocolo_de_texto():
+    comando = PROTOCOLO.resolver("REGISTRAR_GASTO 200, comida, almuerzo")
+    assert comando.nombre == "REGISTRAR_GASTO"
+    assert comando.argumentos == {"monto": 200.0, "categoria": "comida", "descripcion": "almuerzo"}
+    assert PROTOCOLO.como_texto(comando) == "REGISTRAR_GASTO 200, comida, almuerzo"
+
+
+def test_llamada_json_se_repara_localmente():
+    comando = PROTOCOLO.resolver(
+        '```json\n{"comando": "registrar gasto", "argumentos": '
+        '{"Monto": "$1.500 pesos", "categoria": "renta", "fecha": "mañana"}}\n```'
+    )
+    manana = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+    assert comando.argumentos == {"monto": 1500.0, "categoria": "renta", "fecha": manana}
+    assert comando.formato == "json" and comando.reparado
+
+
+def test_sinonimos_y_valores_por_defecto():
+    tarea = PROTOCOLO.resolver('{"comando": "AGREGAR_TAREA", "argumentos": {"titulo": "llamar", "prioridad": "Urgente"}}')
+    assert tarea.argumentos["prioridad"] == "alta"
+    assert PROTOCOLO.resolver("RESUMEN_FINANCIERO").argumentos == {"periodo": "mes"}
+    assert PROTOCOLO.resolver("RESUMEN_FINANCIERO anual").argumentos == {"periodo": "año"}
+
+
+@pytest.mark.parametrize("respuesta, comando, detalle", [
+    ("REGISTRAR_GASTO", "REGISTRAR_GASTO", "falta el argumento 'monto'"),
+    ('{"comando": "REGISTRAR_INGRESO", "argumentos": {"monto": -50, "categoria": "salario"}}',
+     "REGISTRAR_INGRESO", "'monto' debe ser mayor que cero"),
+    ("REGISTRAR_GASTO 20, comida, , 31/02/2025", "REGISTRAR_GASTO", "'fecha' debe ser una fecha"),
+    ("LISTAR_TAREAS algunas", "LISTAR_TAREAS", "'filtro' debe ser uno de"),
+    ('{"comando": "BORRAR_TODO", "argumentos": {}}', CONVERSACION, "comando desconocido"),
+    ('{"comando": "SALDO_ACTUAL", "argumentos": [1]}', "SALDO_ACTUAL", "deben ser un objeto"),
+    ('{"comando": ', CONVERSACION, "no es JSON válido"),
+])
+def test_errores_de_validacion(respuesta, comando, detalle):
+    with pytest.raises(ErrorValidacion) as error:
+        PROTOCOLO.resolver(respuesta)
+    assert error.value.comando == comando
+    assert detalle in str(error.value)
+
+
+def test_mensaje_de_error_propio_del_comando():
+    with pytest.raises(ErrorValidacion) as error:
+        PROTOCOLO.resolver("REGISTRAR_GASTO")
+    assert "gasto" in PROTOCOLO.mensaje_error(error.value)
+
+
+def test_las_respuestas_conversacionales_pasan_tal_cual():
+    comando = PROTOCOLO.resolver("¡Hola! ¿En qué te ayudo?")
+    assert comando.nombre == CONVERSACION
+    assert PROTOCOLO.como_texto(comando) == "¡Hola! ¿En qué te ayudo?"
+    assert not PROTOCOLO.puede_ser_comando("¡Hola!")
+    assert PROTOCOLO.puede_ser_comando("REGIS")
+
+
+def test_declaraciones_marcan_los_obligatorios():
+    declaraciones = {d["name"]: d for d in PROTOCOLO.declaraciones()}
+    assert CONVERSACION not in declaraciones
+    assert declaraciones["REGISTRAR_GASTO"]["parameters"]["required"] == ["monto", "categoria"]
+    assert "parameters" not in declaraciones["SALDO_ACTUAL"]
@@ -0,0 +1,119 @@
+import asyncio
+
+import aiohttp
+import pytest
+import requests
+
+import delivery
+
+
+class Respuesta:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def _cliente(resultados, **opciones):
+    """Cliente cuyo POST devuelve o lanza, en orden, cada elemento de `resultados`"""
+    cliente = delivery.WhatsAppServiceClient("http://servicio", backoff_base=0, **opciones)
+    llamadas = []
+
+    def post(url, json, timeout):
+        llamadas.append(json)
+        resultado = resultados[len(llamadas) - 1]
+        if isinstance(resultado, Exception):
+            raise resultado
+        return Respuesta(resultado)
+
+    cliente.session.post = post
+    return cliente, llamadas
+
+
+def test_reintenta_errores_de_conexion_y_5xx():
+    cliente, llamadas = _cliente([requests.ConnectionError("rechazada"), requests.ConnectTimeout("lento"), 503, 200])
+    assert cliente.send("521", "hola").status_code == 200
+    assert len(llamadas) == 4
+    assert cliente.stats()["retried"] == 3
+    assert cliente.stats()["circuit_state"] == "closed"
+
+
+def test_no_reintenta_un_timeout_de_lectura():
+    # El servicio pudo haber enviado el mensaje: reintentar lo duplicaría
+    cliente, llamadas = _cliente([requests.ReadTimeout("sin respuesta"), 200])
+    with pytest.raises(requests.ReadTimeout):
+        cliente.send("521", "hola")
+    assert len(llamadas) == 1
+    assert cliente.stats()["failed"] == 1
+
+
+def test_el_circuito_se_abre_y_se_cierra_tras_la_prueba():
+    breaker = delivery.CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    cliente, llamadas = _cliente([500, 500, 200], retries=1, breaker=breaker)
+    with pytest.raises(requests.HTTPError):
+        cliente.send("521", "hola")
+    assert breaker.state == delivery.CircuitBreaker.OPEN
+
+    # Pasado reset_timeout se deja pasar una sola llamada de prueba
+    assert cliente.send("521", "hola").status_code == 200
+    assert breaker.state == delivery.CircuitBreaker.CLOSED
+    assert len(llamadas) == 3
+
+
+def test_circuito_abierto_falla_sin_llamar_al_servicio():
+    breaker = delivery.CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    cliente, llamadas = _cliente([requests.ConnectionError("rechazada")], retries=0, breaker=breaker)
+    with pytest.raises(requests.ConnectionError):
+        cliente.send("521", "hola")
+    with pytest.raises(delivery.CircuitOpenError):
+        cliente.send("521", "hola")
+    assert len(llamadas) == 1
+    assert breaker.stats()["short_circuited"] == 1
+
+
+def test_semiabierto_deja_pasar_una_sola_prueba():
+    breaker = delivery.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == delivery.CircuitBreaker.OPEN
+
+
+class _Post:
+    """Contexto asíncrono que lanza `error` al entrar"""
+
+    def __init__(self, error):
+        self.error = error
+
+    async def __aenter__(self):
+        raise self.error
+
+    async def __aexit__(self, *args):
+        return False
+
+
+def _enviar_async(errores, **opciones):
+    cliente = delivery.AsyncWhatsAppServiceClient("http://servicio", backoff_base=0, **opciones)
+    llamadas = []
+
+    class Sesion:
+        def post(self, url, json):
+            llamadas.append(json)
+            return _Post(errores[len(llamadas) - 1])
+
+    cliente._get_session = lambda: Sesion()
+    return cliente, llamadas
+
+
+def test_async_reintenta_timeouts_de_conexion():
+    cliente, llamadas = _enviar_async([aiohttp.ConnectionTimeoutError("lento")] * 3, retries=2)
+    with pytest.raises(aiohttp.ConnectionTimeoutError):
+        asyncio.run(cliente.send("521", "hola"))
+    assert len(llamadas) == 3
+
+
+def test_async_no_reintenta_un_timeout_de_lectura():
+    cliente, llamadas = _enviar_async([asyncio.TimeoutError(), aiohttp.SocketTimeoutError("sin respuesta")])
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(cliente.send("521", "hola"))
+    assert len(llamadas) == 1
+    assert cliente.stats()["failed"] == 1
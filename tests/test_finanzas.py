@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import gemini_assistant
+import storage
+
+HOY = datetime.now().strftime("%Y-%m-%d")
+HACE_UN_ANO = (datetime.now() - timedelta(days=400)).strftime("%Y-%m-%d")
+
+
+def _agregados():
+    with storage.connection() as conn:
+        totales = {tuple(f) for f in conn.execute("SELECT chat_id, tipo, total, movimientos FROM finanzas_totales")}
+        diario = {tuple(f) for f in conn.execute(
+            "SELECT chat_id, fecha, tipo, categoria, total, movimientos FROM finanzas_diario")}
+    return totales, diario
+
+
+def _movimientos():
+    gemini_assistant.registrar_ingreso("c1", 1000, "salario")
+    gemini_assistant.registrar_gasto("c1", 200, "comida")
+    gemini_assistant.registrar_gasto("c1", 50.5, "comida")
+    gemini_assistant.registrar_gasto("c1", 300, "renta", fecha=HACE_UN_ANO)
+
+
+def test_los_agregados_coinciden_con_recalcularlos(esquema):
+    _movimientos()
+    acumulados = _agregados()
+    gemini_assistant.reconstruir_agregados()
+    assert _agregados() == acumulados
+    assert ("c1", "gasto", 550.5, 3) in acumulados[0]
+    assert ("c1", HOY, "gasto", "comida", 250.5, 2) in acumulados[1]
+
+
+def test_saldo_usa_todos_los_movimientos(esquema):
+    _movimientos()
+    saldo = gemini_assistant.saldo_actual("c1")
+    assert "Saldo actual: $449.50" in saldo
+    assert "renta - $300.00" in saldo
+
+
+def test_resumen_solo_suma_el_periodo(esquema):
+    _movimientos()
+    resumen = gemini_assistant.resumen_financiero("c1", "mes")
+    assert "Total de ingresos: $1000.00" in resumen
+    assert "Total de gastos: $250.50" in resumen
+    assert "renta" not in resumen
+    # El gasto de hace más de un año tampoco entra en el resumen anual
+    assert "Total de gastos: $250.50" in gemini_assistant.resumen_financiero("c1", "año")
+
+
+def test_resumen_sin_movimientos(esquema):
+    assert "No hay movimientos" in gemini_assistant.resumen_financiero("c1", "semana")
+
+
+def test_init_db_puebla_los_agregados_de_una_base_existente(esquema):
+    with storage.transaction() as conn:
+        conn.execute("INSERT INTO finanzas (chat_id, tipo, monto, categoria, fecha) VALUES ('c1', 'gasto', 80, 'cine', ?)",
+                     (HOY,))
+        conn.execute("DELETE FROM finanzas_totales")
+        conn.execute("DELETE FROM finanzas_diario")
+        conn.execute("DELETE FROM schema_version WHERE component = 'asistente'")
+
+    gemini_assistant.init_db()
+
+    assert ("c1", "gasto", 80.0, 1) in _agregados()[0]
@@ -0,0 +1,216 @@
+import threading
+import time
+
+import pytest
+
+import inbound
+
+
+def test_idempotency_descarta_reintentos_y_libera(db):
+    ids = inbound.IdempotencyStore(ttl=60)
+    assert ids.claim("SM1")
+    assert not ids.claim("SM1")
+    ids.release("SM1")
+    assert ids.claim("SM1")
+    assert ids.claim(None) and ids.claim(None)
+
+
+def test_idempotency_persistida_entre_procesos(db):
+    assert inbound.IdempotencyStore(ttl=60, persist=True).claim("SM1")
+    otro = inbound.IdempotencyStore(ttl=60, persist=True)
+    assert not otro.claim("SM1")
+    otro.release("SM1")
+    assert inbound.IdempotencyStore(ttl=60, persist=True).claim("SM1")
+
+
+def test_idempotency_vencida_se_vuelve_a_atender(db):
+    ids = inbound.IdempotencyStore(ttl=0.01)
+    assert ids.claim("SM1")
+    time.sleep(0.02)
+    assert ids.claim("SM1")
+
+
+def _entregas():
+    entregados = []
+    listo = threading.Event()
+
+    def deliver(job):
+        entregados.append(job)
+        if len(entregados) == 3:
+            listo.set()
+    return entregados, listo, deliver
+
+
+def test_rafaga_se_entrega_en_orden_y_por_separado():
+    limiter = inbound.ChatRateLimiter(rate=50, capacity=1)
+    entregados, listo, deliver = _entregas()
+    mensajes = ["gasté 20 en comida", "agregar tarea comprar pan", "cuál es mi saldo", "hola"]
+
+    assert limiter.submit("c1", {"message": mensajes[0]}, deliver)
+    for mensaje in mensajes[1:]:
+        assert not limiter.submit("c1", {"message": mensaje}, deliver)
+
+    assert listo.wait(2)
+    assert [job["message"] for job in entregados] == mensajes[1:]
+    assert limiter.stats()["delivered"] == 3
+
+
+def test_los_pendientes_no_aceptados_se_reintentan_en_orden():
+    limiter = inbound.ChatRateLimiter(rate=50, capacity=1, retry_delay=0.01)
+    entregados, listo, aceptar = _entregas()
+    rechazos = []
+
+    def deliver(job):
+        if len(rechazos) < 2:
+            rechazos.append(job["message"])
+            return False
+        aceptar(job)
+        return True
+
+    assert limiter.submit("c1", {"message": "uno"}, deliver)
+    for mensaje in ("dos", "tres", "cuatro"):
+        assert not limiter.submit("c1", {"message": mensaje}, deliver)
+
+    assert listo.wait(2)
+    assert rechazos == ["dos", "dos"]
+    assert [job["message"] for job in entregados] == ["dos", "tres", "cuatro"]
+    assert limiter.stats()["retried"] == 2
+    assert limiter.stats()["delivered"] == 3
+
+
+def test_cola_llena_lanza_error_sin_perder_el_mensaje():
+    limiter = inbound.ChatRateLimiter(rate=0.001, capacity=1, max_pending=1)
+    deliver = lambda job: None
+    assert limiter.submit("c1", {"message": "uno"}, deliver)
+    assert not limiter.submit("c1", {"message": "dos"}, deliver)
+    with pytest.raises(inbound.ChatQueueFullError) as error:
+        limiter.submit("c1", {"message": "tres"}, deliver)
+    assert error.value.retry_after > 0
+    # Otros chats no se ven afectados
+    assert limiter.submit("c2", {"message": "uno"}, deliver)
+    assert limiter.stats()["rejected"] == 1
+
+
+@pytest.fixture
+def webhook(esquema, monkeypatch):
+    """Cliente del webhook de Twilio con la deduplicación activa y Gemini y Twilio simulados"""
+    import app
+    import delivery
+    import gemini_assistant
+    procesados = []
+
+    def procesar(mensaje, chat_id):
+        procesados.append(mensaje)
+        return "Gasto registrado"
+
+    monkeypatch.setattr(app, "webhook_ids", inbound.IdempotencyStore(ttl=60))
+    monkeypatch.setattr(app, "chat_limiter", None)
+    monkeypatch.setattr(app, "QUEUE_MODE", False)
+    monkeypatch.setattr(gemini_assistant, "procesar_mensaje", procesar)
+    monkeypatch.setattr(delivery, "send_twilio_message", lambda chat_id, texto: None)
+    cliente = app.app.test_client()
+
+    def enviar(sid, cuerpo="gasté 20 en comida"):
+        return cliente.post("/whatsapp/webhook", data={"MessageSid": sid, "From": "whatsapp:+521", "Body": cuerpo})
+    return enviar, procesados
+
+
+def test_webhook_no_repite_un_comando_si_falla_la_respuesta(webhook, monkeypatch):
+    import delivery
+    enviar, procesados = webhook
+
+    def falla(chat_id, texto):
+        raise ConnectionError("Twilio no responde")
+
+    monkeypatch.setattr(delivery, "send_twilio_message", falla)
+    assert enviar("SM1").status_code == 500
+    assert enviar("SM1").get_json() == {"status": "duplicate"}
+    assert procesados == ["gasté 20 en comida"]
+
+
+def test_webhook_libera_el_id_si_falla_antes_de_procesar(webhook, monkeypatch):
+    import app
+    enviar, procesados = webhook
+    guardar = app.save_and_emit_message
+
+    def falla(*args, **kwargs):
+        raise RuntimeError("base de datos ocupada")
+
+    monkeypatch.setattr(app, "save_and_emit_message", falla)
+    assert enviar("SM1").status_code == 500
+    monkeypatch.setattr(app, "save_and_emit_message", guardar)
+    assert enviar("SM1").get_json() == {"status": "success"}
+    assert procesados == ["gasté 20 en comida"]
+
+
+def test_webhook_responde_429_y_libera_el_id_con_la_cola_del_chat_llena(webhook, monkeypatch):
+    import app
+    enviar, procesados = webhook
+    monkeypatch.setattr(app, "chat_limiter", inbound.ChatRateLimiter(rate=0.001, capacity=1, max_pending=1))
+
+    assert enviar("SM1").get_json() == {"status": "success"}
+    assert enviar("SM2").get_json() == {"status": "queued"}
+    rechazo = enviar("SM3")
+    assert rechazo.status_code == 429
+    assert int(rechazo.headers["Retry-After"]) >= 1
+    # El reintento de Twilio no se descarta como duplicado
+    assert enviar("SM3").status_code == 429
+    assert procesados == ["gasté 20 en comida"]
+
+
+def test_webhook_conserva_el_mensaje_en_espera_si_el_pool_esta_lleno(webhook, monkeypatch):
+    import app
+    from worker_pool import QueueFullError
+    enviar, procesados = webhook
+    limiter = inbound.ChatRateLimiter(rate=50, capacity=1, retry_delay=0.01)
+    monkeypatch.setattr(app, "chat_limiter", limiter)
+
+    class PoolLleno:
+        """Rechaza los dos primeros trabajos como un pool sin sitio"""
+
+        def __init__(self):
+            self.intentos = 0
+            self.encolados = []
+            self.evento = threading.Event()
+
+        def submit(self, key, job, timeout=0):
+            self.intentos += 1
+            if self.intentos <= 2:
+                raise QueueFullError("Cola llena (1 trabajos pendientes)")
+            self.encolados.append(job["message"])
+            self.evento.set()
+
+    pool = PoolLleno()
+    monkeypatch.setattr(app, "get_worker_pool", lambda: pool)
+
+    assert enviar("SM1").get_json() == {"status": "success"}
+    assert enviar("SM2", "agregar tarea comprar pan").get_json() == {"status": "queued"}
+    assert pool.evento.wait(2)
+    assert pool.encolados == ["agregar tarea comprar pan"]
+    assert limiter.stats()["retried"] == 2
+
+
+def test_webhook_no_guarda_el_mensaje_rechazado_por_la_cola(webhook, monkeypatch):
+    import app
+    from worker_pool import QueueFullError
+    enviar, procesados = webhook
+    guardados, encolados = [], []
+    lleno = [True]
+
+    class Pool:
+        def submit(self, key, job, timeout=0):
+            if lleno[0]:
+                raise QueueFullError("Cola llena (1 trabajos pendientes)")
+            encolados.append(job["message"])
+
+    monkeypatch.setattr(app, "QUEUE_MODE", True)
+    monkeypatch.setattr(app, "get_worker_pool", lambda: Pool())
+    monkeypatch.setattr(app, "save_and_emit_message", lambda *args, **kwargs: guardados.append(args[3]))
+
+    assert enviar("SM1").status_code == 503
+    assert guardados == []
+    lleno[0] = False
+    # El reintento de Twilio se acepta y el mensaje se guarda una sola vez
+    assert enviar("SM1").get_json() == {"status": "queued"}
+    assert guardados == ["gasté 20 en comida"]
+    assert encolados == ["gasté 20 en comida"]
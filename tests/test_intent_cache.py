@@ -0,0 +1,54 @@
+import time
+
+from intent_cache import IntentCache
+
+
+def test_acierto_exacto_ignora_acentos_y_puntuacion():
+    cache = IntentCache()
+    assert cache.put("¿Cuál es mi saldo?", "SALDO_ACTUAL")
+    assert cache.get("cual es mi saldo") == "SALDO_ACTUAL"
+    assert cache.stats()["hits"] == 1
+
+
+def test_solo_guarda_comandos_sin_datos_del_mensaje():
+    cache = IntentCache()
+    assert not cache.put("gasté 200 en comida", "REGISTRAR_GASTO 200, comida")
+    assert not cache.put("agrega comprar pan", "AGREGAR_TAREA comprar pan")
+    # Un número en el mensaje puede ser un argumento aunque el comando no lo use
+    assert not cache.put("tarea 3", "LISTAR_TAREAS pendientes")
+    assert cache.stats()["size"] == 0
+
+
+def test_las_entradas_vencen_con_el_ttl():
+    cache = IntentCache(ttl=0.01)
+    cache.put("mis tareas", "LISTAR_TAREAS pendientes")
+    time.sleep(0.02)
+    assert cache.get("mis tareas") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_desaloja_la_menos_reciente():
+    cache = IntentCache(max_size=2, fuzzy_threshold=1)
+    cache.put("mi saldo", "SALDO_ACTUAL")
+    cache.put("mis tareas", "LISTAR_TAREAS pendientes")
+    cache.get("mi saldo")
+    cache.put("resumen del mes", "RESUMEN_FINANCIERO mes")
+    assert cache.get("mis tareas") is None
+    assert cache.get("mi saldo") == "SALDO_ACTUAL"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_similitud_no_cruza_argumentos_distintos():
+    cache = IntentCache(fuzzy_threshold=0.8)
+    cache.put("muestrame mis tareas pendientes", "LISTAR_TAREAS pendientes")
+    assert cache.get("muestrame mis tareas pendiente") is None
+    assert cache.get("muestrame mis tareas completadas") is None
+    assert cache.get("muestrame mis tareaz pendientes") == "LISTAR_TAREAS pendientes"
+    assert cache.stats()["fuzzy_hits"] == 1
+
+
+def test_clear_vacia_la_cache():
+    cache = IntentCache()
+    cache.put("mi saldo", "SALDO_ACTUAL")
+    cache.clear()
+    assert cache.get("mi saldo") is None
@@ -0,0 +1,45 @@
+import json
+import os
+
+import pytest
+
+from intent_classifier import ClasificadorLocal
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "intent_corpus.jsonl")
+
+with open(CORPUS, encoding="utf-8") as f:
+    EJEMPLOS = [json.loads(linea) for linea in f if linea.strip()]
+
+
+def _texto(mensaje):
+    resultado = ClasificadorLocal().clasificar(mensaje)
+    return resultado and resultado.texto
+
+
+@pytest.mark.parametrize("ejemplo", EJEMPLOS, ids=[e["mensaje"] for e in EJEMPLOS])
+def test_corpus(ejemplo):
+    assert _texto(ejemplo["mensaje"]) == ejemplo["esperado"]
+
+
+@pytest.mark.parametrize("mensaje", ["gasté 200 en comida ayer", "pagué 50 de luz hoy", "gasté 80 en cine el sábado"])
+def test_las_fechas_no_entran_en_la_categoria(mensaje):
+    assert _texto(mensaje) is None
+
+
+def test_cuenta_los_mensajes_locales_y_derivados():
+    clasificador = ClasificadorLocal()
+    clasificador.clasificar("saldo")
+    clasificador.clasificar("cuéntame un chiste")
+    assert clasificador.stats()["local"] == 1
+    assert clasificador.stats()["fallback"] == 1
+
+
+def test_monto_con_punto_de_miles():
+    assert _texto("pagué 1.500 de renta") == "REGISTRAR_GASTO 1500, renta"
+
+
+def test_monto_ambiguo_con_coma_se_deriva():
+    # 2500 o 2.5: equivocarse multiplica el gasto por mil
+    assert _texto("gasté 2,500 en renta") is None
+    assert _texto("recibí 1,000,000 de herencia") is None
+    assert _texto("gasté 2,50 en café") == "REGISTRAR_GASTO 2.5, cafe"
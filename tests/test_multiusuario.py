@@ -0,0 +1,79 @@
+import pytest
+
+import app
+import gemini_assistant
+import storage
+
+# Esquema del asistente anterior a chat_id: tareas y finanzas compartidas por todos
+ESQUEMA_ANTERIOR = """
+CREATE TABLE tareas (id INTEGER PRIMARY KEY AUTOINCREMENT, titulo TEXT NOT NULL, descripcion TEXT,
+                     fecha_creacion TEXT NOT NULL, fecha_limite TEXT, prioridad TEXT, completada INTEGER DEFAULT 0);
+CREATE TABLE finanzas (id INTEGER PRIMARY KEY AUTOINCREMENT, tipo TEXT NOT NULL, monto REAL NOT NULL,
+                       categoria TEXT NOT NULL, descripcion TEXT, fecha TEXT NOT NULL);
+CREATE INDEX idx_finanzas_tipo_fecha ON finanzas(tipo, fecha);
+CREATE TABLE finanzas_totales (tipo TEXT PRIMARY KEY, total REAL NOT NULL DEFAULT 0, movimientos INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE finanzas_diario (fecha TEXT NOT NULL, tipo TEXT NOT NULL, categoria TEXT NOT NULL,
+                              total REAL NOT NULL DEFAULT 0, movimientos INTEGER NOT NULL DEFAULT 0,
+                              PRIMARY KEY (fecha, tipo, categoria));
+CREATE TABLE conversaciones (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT NOT NULL, mensaje TEXT NOT NULL,
+                             respuesta TEXT, timestamp TEXT NOT NULL);
+INSERT INTO tareas (titulo, fecha_creacion) VALUES ('pagar la luz', '2025-01-01');
+INSERT INTO finanzas (tipo, monto, categoria, fecha) VALUES ('ingreso', 500, 'salario', '2025-01-01');
+INSERT INTO finanzas (tipo, monto, categoria, fecha) VALUES ('gasto', 120, 'comida', '2025-01-02');
+INSERT INTO finanzas_totales VALUES ('ingreso', 500, 1), ('gasto', 120, 1);
+"""
+
+
+def _base_anterior(*chats):
+    app.init_db()
+    with storage.connection() as conn:
+        conn.executescript(ESQUEMA_ANTERIOR)
+        for chat_id in chats:
+            conn.execute("INSERT INTO conversaciones (chat_id, mensaje, timestamp) VALUES (?, 'hola', '2025-01-01')",
+                         (chat_id,))
+        conn.commit()
+    gemini_assistant.init_db()
+
+
+def test_tareas_y_finanzas_por_chat(esquema):
+    gemini_assistant.agregar_tarea("c1", "comprar pan")
+    gemini_assistant.registrar_gasto("c1", 100, "comida")
+    gemini_assistant.registrar_ingreso("c2", 40, "ventas")
+
+    assert "comprar pan" in gemini_assistant.listar_tareas("c1")
+    assert "comprar pan" not in gemini_assistant.listar_tareas("c2")
+    assert "Saldo actual: $-100.00" in gemini_assistant.saldo_actual("c1")
+    assert "Saldo actual: $40.00" in gemini_assistant.saldo_actual("c2")
+
+
+def test_no_se_completa_la_tarea_de_otro_chat(esquema):
+    gemini_assistant.agregar_tarea("c1", "comprar pan")
+    with storage.connection() as conn:
+        tarea_id = conn.execute("SELECT id FROM tareas").fetchone()[0]
+
+    assert "No se encontró" in gemini_assistant.completar_tarea("c2", id_tarea=tarea_id)
+    assert "No se encontró" in gemini_assistant.completar_tarea("c2", titulo_tarea="comprar pan")
+    assert "completada" in gemini_assistant.completar_tarea("c1", id_tarea=tarea_id)
+
+
+def test_migracion_asigna_los_datos_al_unico_chat(db):
+    _base_anterior("521")
+
+    assert "pagar la luz" in gemini_assistant.listar_tareas("521")
+    assert "Saldo actual: $380.00" in gemini_assistant.saldo_actual("521")
+    with storage.connection() as conn:
+        totales = {tuple(f) for f in conn.execute("SELECT chat_id, tipo, total FROM finanzas_totales")}
+        indices = {f[0] for f in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert totales == {("521", "ingreso", 500.0), ("521", "gasto", 120.0)}
+    assert "idx_finanzas_tipo_fecha" not in indices
+
+
+@pytest.mark.parametrize("chats", [("521", "522"), ()])
+def test_migracion_con_varios_chats_usa_legacy_chat_id(db, chats):
+    _base_anterior(*chats)
+
+    for chat_id in chats:
+        assert "Saldo actual: $0.00" in gemini_assistant.saldo_actual(chat_id)
+    legado = gemini_assistant.LEGACY_CHAT_ID
+    assert "pagar la luz" in gemini_assistant.listar_tareas(legado)
+    assert "Saldo actual: $380.00" in gemini_assistant.saldo_actual(legado)
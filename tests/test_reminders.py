@@ -0,0 +1,129 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import gemini_assistant
+import reminders
+import storage
+
+# Las 10:00 del día anterior a la fecha límite: el aviso de las 9:00 ya venció
+AHORA = datetime(2026, 3, 9, 10, 0)
+MANANA = "2026-03-10"
+
+
+class Entregas:
+    """Registra los envíos; falla los primeros `fallos`"""
+
+    def __init__(self, fallos=0):
+        self.fallos = fallos
+        self.intentos = 0
+        self.enviados = []
+        self.evento = threading.Event()
+
+    def __call__(self, chat_id, texto):
+        self.intentos += 1
+        if self.intentos <= self.fallos:
+            if self.intentos == self.fallos:
+                self.evento.set()
+            raise ConnectionError("WhatsApp no responde")
+        self.enviados.append((chat_id, texto))
+        self.evento.set()
+
+
+def _tarea(titulo):
+    gemini_assistant.agregar_tarea("c1", titulo, fecha_limite=MANANA)
+    with storage.connection() as conn:
+        return conn.execute("SELECT id FROM tareas WHERE titulo = ?", (titulo,)).fetchone()[0]
+
+
+def _programador(entregar, **opciones):
+    # Reloj que avanza desde AHORA para que venzan las esperas de los reintentos
+    inicio = datetime.now()
+    return reminders.ProgramadorRecordatorios(entregar, dias_antes=1, hora=9,
+                                              reloj=lambda: AHORA + (datetime.now() - inicio), **opciones)
+
+
+def _enviado(tarea_id):
+    with storage.connection() as conn:
+        return conn.execute("SELECT recordatorio_enviado FROM tareas WHERE id = ?", (tarea_id,)).fetchone()[0]
+
+
+def _esperar(condicion, segundos=3):
+    evento = threading.Event()
+    for _ in range(int(segundos / 0.01)):
+        if condicion():
+            return True
+        evento.wait(0.01)
+    return condicion()
+
+
+def test_envia_el_aviso_vencido_una_vez(esquema):
+    tarea_id = _tarea("Entregar informe")
+    entregas = Entregas()
+    programador = _programador(entregas).iniciar()
+    try:
+        assert entregas.evento.wait(3)
+        assert _esperar(lambda: programador.stats()["sent"] == 1)
+    finally:
+        programador.detener()
+    assert len(entregas.enviados) == 1
+    assert "Entregar informe" in entregas.enviados[0][1]
+    assert _enviado(tarea_id) == 1
+
+
+def test_reintenta_un_envio_fallido(esquema):
+    tarea_id = _tarea("Pagar renta")
+    entregas = Entregas(fallos=2)
+    programador = _programador(entregas, espera_reintento=0.01).iniciar()
+    try:
+        assert _esperar(lambda: len(entregas.enviados) == 1)
+    finally:
+        programador.detener()
+    assert entregas.intentos == 3
+    assert programador.stats()["retried"] == 2
+    assert _enviado(tarea_id) == 1
+
+
+def test_tras_agotar_los_reintentos_la_tarea_sigue_pendiente(esquema):
+    tarea_id = _tarea("Pagar renta")
+    entregas = Entregas(fallos=3)
+    programador = _programador(entregas, espera_reintento=0.01, max_reintentos=2).iniciar()
+    try:
+        assert entregas.evento.wait(3)
+        assert _esperar(lambda: programador.stats()["failed"] == 3)
+    finally:
+        programador.detener()
+    assert entregas.enviados == []
+    assert _enviado(tarea_id) == 0
+
+
+def test_la_carga_no_bloquea_agregar_ni_completar(esquema, monkeypatch):
+    dentro, seguir = threading.Event(), threading.Event()
+    conexion = storage.connection
+
+    @contextmanager
+    def lenta():
+        with conexion() as conn:
+            if not dentro.is_set():
+                dentro.set()
+                seguir.wait(5)
+            yield conn
+
+    monkeypatch.setattr(storage, "connection", lenta)
+    entregas = Entregas()
+    programador = _programador(entregas).iniciar()
+    try:
+        assert dentro.wait(3)
+        # La tarea se confirma después de que empezó la consulta de la página
+        tarea_id = _tarea("Llamar al banco")
+        hilo = threading.Thread(target=lambda: (programador.tarea_agregada(tarea_id, MANANA),
+                                                programador.tarea_completada(999)))
+        hilo.start()
+        hilo.join(1)
+        assert not hilo.is_alive()
+        seguir.set()
+        assert entregas.evento.wait(3)
+    finally:
+        seguir.set()
+        programador.detener()
+    assert "Llamar al banco" in entregas.enviados[0][1]
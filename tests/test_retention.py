@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import retention
+import search
+import storage
+
+AHORA = datetime(2026, 6, 1, 12, 0)
+TEXTO = "Necesito recordar pagar la factura de internet antes del viernes"
+RESPUESTA = "Claro, agregué la tarea de pagar la factura de internet para el viernes"
+
+
+def _conversacion(conn, chat_id, momento, mensaje=TEXTO, respuesta=RESPUESTA):
+    """Inserta el mensaje, la conversación y la respuesta como lo hace la aplicación"""
+    for texto, asistente, segundos in ((mensaje, 0, 0), (respuesta, 1, 2)):
+        conn.execute(
+            "INSERT INTO mensajes (platform, sender, chat_id, message, timestamp, is_from_assistant) "
+            "VALUES ('WhatsApp', ?, ?, ?, ?, ?)",
+            ("Asistente" if asistente else chat_id, chat_id, texto,
+             (momento + timedelta(seconds=segundos)).isoformat(), asistente)
+        )
+    return conn.execute(
+        "INSERT INTO conversaciones (chat_id, mensaje, respuesta, timestamp) VALUES (?, ?, ?, ?)",
+        (chat_id, mensaje, respuesta, (momento + timedelta(seconds=1)).isoformat())
+    ).lastrowid
+
+
+def _ids_encontrados(texto, chat_id):
+    return {f["id"] for f in search.buscar(texto, chat_id, ("conversaciones",), limite=50)["conversaciones"]}
+
+
+def _proceso(tmp_path, politicas=(), **opciones):
+    todas = {tabla: retention.Politica(tabla) for tabla in retention.TABLAS}
+    todas.update({p.tabla: p for p in politicas})
+    return retention.Retencion(todas, directorio=str(tmp_path / "archive"), reloj=lambda: AHORA, **opciones)
+
+
+def test_deduplicar_conserva_el_texto_y_la_busqueda(esquema, tmp_path):
+    with storage.transaction() as conn:
+        ids = [_conversacion(conn, "c1", AHORA - timedelta(days=d)) for d in (1, 2)]
+
+    assert _proceso(tmp_path).ciclo()["linked"] == 2
+
+    with storage.connection() as conn:
+        fila = conn.execute("SELECT mensaje, respuesta, mensaje_id, respuesta_id FROM conversaciones "
+                            "WHERE id = ?", (ids[0],)).fetchone()
+        texto = conn.execute("SELECT mensaje, respuesta FROM conversaciones_texto WHERE id = ?", (ids[0],)).fetchone()
+        pausadas = conn.execute("SELECT COUNT(*) FROM fts_pausa").fetchone()[0]
+    assert (fila["mensaje"], fila["respuesta"]) == ("", None)
+    assert fila["mensaje_id"] and fila["respuesta_id"]
+    assert tuple(texto) == (TEXTO, RESPUESTA)
+    assert pausadas == 0
+    assert _ids_encontrados("factura internet", "c1") == set(ids)
+
+
+def test_sin_sincronizar_no_deja_el_indice_suspendido_tras_un_error(esquema):
+    with pytest.raises(RuntimeError):
+        with storage.transaction() as conn:
+            with search.sin_sincronizar(conn, "conversaciones"):
+                raise RuntimeError("fallo al reescribir")
+
+    with storage.transaction() as conn:
+        nueva = _conversacion(conn, "c1", AHORA)
+    assert _ids_encontrados("factura", "c1") == {nueva}
+
+
+def test_sin_sincronizar_solo_en_indices_con_origen_propio(esquema):
+    with storage.transaction() as conn, pytest.raises(ValueError):
+        with search.sin_sincronizar(conn, "mensajes"):
+            pass
+
+
+def test_archivar_mensajes_devuelve_el_texto_a_las_conversaciones(esquema, tmp_path):
+    with storage.transaction() as conn:
+        conversacion_id = _conversacion(conn, "c1", AHORA - timedelta(days=400))
+    _proceso(tmp_path).ciclo()
+
+    resumen = _proceso(tmp_path, [retention.Politica("mensajes", 30, "archive")], deduplicar=False).ciclo()
+
+    assert resumen["archived"]["mensajes"] == 2
+    assert resumen["restored"] == 2
+    with storage.connection() as conn:
+        fila = conn.execute("SELECT mensaje, respuesta, mensaje_id, respuesta_id FROM conversaciones").fetchone()
+    assert tuple(fila) == (TEXTO, RESPUESTA, None, None)
+    assert _ids_encontrados("factura", "c1") == {conversacion_id}
+
+
+def test_el_ciclo_siguiente_completa_un_borrado_interrumpido(esquema, tmp_path, monkeypatch):
+    with storage.transaction() as conn:
+        for dias in (300, 200, 100):
+            _conversacion(conn, "c1", AHORA - timedelta(days=dias))
+    politica = retention.Politica("mensajes", 30, "archive")
+    purgar = retention._purgar
+
+    def falla(conn, tabla, hasta_id):
+        raise RuntimeError("el proceso muere tras escribir el bloque")
+
+    monkeypatch.setattr(retention, "_purgar", falla)
+    with pytest.raises(RuntimeError):
+        _proceso(tmp_path, [politica], deduplicar=False, lote=2).ciclo()
+    monkeypatch.setattr(retention, "_purgar", purgar)
+
+    _proceso(tmp_path, [politica], deduplicar=False, lote=2).ciclo()
+
+    with storage.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM mensajes").fetchone()[0] == 0
+    archivadas = retention.leer("mensajes", "c1", limite=100, directorio=str(tmp_path / "archive"))["rows"]
+    assert sorted(f["id"] for f in archivadas) == [1, 2, 3, 4, 5, 6]
+
+
+def test_el_archivo_ignora_una_linea_del_indice_incompleta(tmp_path):
+    archivo = retention.Archivo("mensajes", str(tmp_path))
+    archivo.agregar([(1, "WhatsApp", "c1", "c1", "hola", "2025-01-01T10:00:00", 0)])
+    with open(archivo._indice, "ab") as f:
+        f.write(b'{"segmento":"000001.seg","offs')
+
+    lector = retention.Archivo("mensajes", str(tmp_path))
+    assert lector.ultimo_id() == 1
+    assert lector.estado()["rows"] == 1
+
+
+def test_compactar_indices_tras_borrar_muchas_filas(esquema, tmp_path):
+    with storage.transaction() as conn:
+        for dias in range(39, -1, -1):
+            _conversacion(conn, f"c{dias % 3}", AHORA - timedelta(days=dias + 1))
+
+    resumen = _proceso(tmp_path, [retention.Politica("conversaciones", 10, "delete")],
+                       deduplicar=False, lote=5).ciclo()
+
+    assert resumen["deleted"]["conversaciones"] == 30
+    assert "conversaciones" in resumen["compacted"]
+    with storage.connection() as conn:
+        assert retention._cursor(conn, "borradas_conversaciones") == 0
+    assert len(_ids_encontrados("factura", "c0")) == 4
@@ -0,0 +1,80 @@
+import gemini_assistant
+import search
+import storage
+
+
+def _ids(texto, chat_id, tipo):
+    return {f["id"] for f in search.buscar(texto, chat_id, (tipo,))[tipo]}
+
+
+def _tareas(chat_id, *titulos):
+    return [gemini_assistant.agregar_tarea(chat_id, titulo) for titulo in titulos]
+
+
+def _resolver(chat_id, titulo):
+    with storage.connection() as conn:
+        tarea = search.resolver_tarea(conn, chat_id, titulo)
+    return tarea and tarea[1]
+
+
+def test_los_triggers_mantienen_el_indice_sincronizado(esquema):
+    with storage.transaction() as conn:
+        mensaje_id = conn.execute(
+            "INSERT INTO mensajes (platform, sender, chat_id, message, timestamp) "
+            "VALUES ('WhatsApp', 'c1', 'c1', 'Pagué la factura de la luz', '2026-01-01T10:00:00')"
+        ).lastrowid
+    assert _ids("factura", "c1", "mensajes") == {mensaje_id}
+    assert _ids("factura", "c2", "mensajes") == set()
+
+    with storage.transaction() as conn:
+        conn.execute("UPDATE mensajes SET message = 'Pagué el agua' WHERE id = ?", (mensaje_id,))
+    assert _ids("factura", "c1", "mensajes") == set()
+    assert _ids("agua", "c1", "mensajes") == {mensaje_id}
+
+    with storage.transaction() as conn:
+        conn.execute("DELETE FROM mensajes WHERE id = ?", (mensaje_id,))
+    assert _ids("agua", "c1", "mensajes") == set()
+
+
+def test_busqueda_por_prefijo_y_sin_acentos(esquema):
+    _tareas("c1", "Reunión con el cliente")
+    assert len(_ids("reunion cli", "c1", "tareas")) == 1
+
+
+def test_resolver_tarea_prefiere_la_que_tiene_todas_las_palabras(esquema):
+    _tareas("c1", "pagar la luz", "pagar el agua", "comprar pan")
+    assert _resolver("c1", "pagar luz") == "pagar la luz"
+
+
+def test_resolver_tarea_tolera_erratas(esquema):
+    _tareas("c1", "comprar pan", "pagar el agua")
+    assert _resolver("c1", "comprar pna") == "comprar pan"
+
+
+def test_resolver_tarea_no_adivina_con_una_palabra_en_comun(esquema):
+    _tareas("c1", "pagar el agua")
+    assert _resolver("c1", "pagar la lus") is None
+    assert "No se encontró" in gemini_assistant.completar_tarea("c1", titulo_tarea="pagar la lus")
+    with storage.connection() as conn:
+        assert conn.execute("SELECT completada FROM tareas").fetchone()[0] == 0
+
+
+def test_resolver_tarea_rechaza_un_empate(esquema):
+    _tareas("c1", "llamar al banco", "llamar al bando")
+    assert _resolver("c1", "llamar al bancx") is None
+
+
+def test_resolver_tarea_no_elige_entre_varias_con_todas_las_palabras(esquema):
+    _tareas("c1", "llamar al banco", "llamar a mamá")
+    assert _resolver("c1", "llamar") is None
+    assert "No se encontró" in gemini_assistant.completar_tarea("c1", titulo_tarea="llamar")
+    assert _resolver("c1", "llamar a mamá") == "llamar a mamá"
+    with storage.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM tareas WHERE completada = 1").fetchone()[0] == 0
+
+
+def test_resolver_tarea_ignora_palabras_vacias(esquema):
+    _tareas("c1", "pagar la luz")
+    assert _resolver("c1", "la") is None
+    assert "No se encontró" in gemini_assistant.completar_tarea("c1", titulo_tarea="la")
+    assert _resolver("c1", "luz") == "pagar la luz"
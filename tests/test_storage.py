@@ -0,0 +1,51 @@
+import sqlite3
+
+import pytest
+
+import storage
+
+
+def _tablas(conn):
+    return {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_ensure_schema_deshace_el_ddl_si_la_migracion_falla(db):
+    def crear(conn):
+        conn.execute("CREATE TABLE a (id INTEGER PRIMARY KEY)")
+        conn.execute("ALTER TABLE a ADD COLUMN b TEXT")
+        raise sqlite3.OperationalError("fallo a mitad de la migración")
+
+    with pytest.raises(sqlite3.OperationalError):
+        storage.ensure_schema("prueba", 1, crear)
+
+    with storage.connection() as conn:
+        assert "a" not in _tablas(conn)
+    assert storage.schema_version("prueba") is None
+
+
+def test_ensure_schema_vuelve_a_comprobar_la_version_con_el_lock(db, monkeypatch):
+    llamadas = []
+
+    def crear(conn):
+        llamadas.append(1)
+        conn.execute("ALTER TABLE t ADD COLUMN nueva TEXT")
+
+    with storage.transaction() as conn:
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY)")
+    assert storage.ensure_schema("prueba", 1, crear)
+
+    # Otro proceso que leyó la versión antes de que se aplicara no repite el ALTER
+    monkeypatch.setattr(storage, "schema_version", lambda componente: None)
+    assert not storage.ensure_schema("prueba", 1, crear)
+    assert llamadas == [1]
+
+
+def test_transaction_immediate_toma_el_lock_de_escritura(db):
+    with storage.transaction(immediate=True) as conn:
+        assert conn.in_transaction
+        otra = sqlite3.connect(str(db), timeout=0)
+        try:
+            with pytest.raises(sqlite3.OperationalError, match="locked"):
+                otra.execute("BEGIN IMMEDIATE")
+        finally:
+            otra.close()
@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+
+import pytest
+
+import storage
+import write_behind
+
+
+@pytest.fixture
+def tablas(db):
+    with storage.transaction() as conn:
+        conn.execute("CREATE TABLE a (id INTEGER PRIMARY KEY AUTOINCREMENT, texto TEXT NOT NULL)")
+        conn.execute("CREATE TABLE b (id INTEGER PRIMARY KEY AUTOINCREMENT, texto TEXT NOT NULL)")
+    return db
+
+
+def _insertar(buffer, tabla, textos, ids):
+    for texto in textos:
+        buffer.insert(tabla, {"texto": texto}, callback=lambda fila_id, texto=texto: ids.append((fila_id, texto)))
+
+
+def _filas(tabla):
+    with storage.connection() as conn:
+        return set(map(tuple, conn.execute(f"SELECT id, texto FROM {tabla}")))
+
+
+@pytest.mark.parametrize("modo", write_behind.MODOS)
+def test_los_ids_del_callback_son_los_asignados(tablas, modo):
+    buffer = write_behind.WriteBehindBuffer(modo, max_batch=7, flush_interval=0.01)
+    buffer.start()
+    ids = {"a": [], "b": []}
+    hilos = [threading.Thread(target=_insertar, args=(buffer, tabla, [f"{tabla}{h}-{i}" for i in range(30)], ids[tabla]))
+             for h in range(4) for tabla in ("a", "b")]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    buffer.stop()
+
+    for tabla in ("a", "b"):
+        assert len(ids[tabla]) == 120
+        assert set(ids[tabla]) == _filas(tabla)
+
+
+def test_los_ids_continuan_la_secuencia_tras_borrar_las_ultimas_filas(tablas):
+    with storage.transaction() as conn:
+        conn.executemany("INSERT INTO a (texto) VALUES (?)", [("x",)] * 5)
+        conn.execute("DELETE FROM a WHERE id > 2")
+    buffer = write_behind.WriteBehindBuffer("sync")
+    ids = []
+    _insertar(buffer, "a", ["nuevo"], ids)
+    # AUTOINCREMENT no reutiliza los ids 3 a 5
+    assert ids == [(6, "nuevo")]
+    assert (6, "nuevo") in _filas("a")
+
+
+def test_una_fila_invalida_avisa_a_quien_la_inserto(tablas):
+    buffer = write_behind.WriteBehindBuffer("group")
+    buffer.start()
+    errores = []
+
+    def insertar(fila):
+        try:
+            buffer.insert("a", fila)
+        except sqlite3.Error as e:
+            errores.append(e)
+
+    try:
+        insertar({"texto": None})
+    finally:
+        buffer.stop()
+    assert len(errores) == 1
+    assert _filas("a") == set()
+    assert buffer.stats()["errors"] == 1
+
+
+def _esperar(condicion):
+    evento = threading.Event()
+    while not condicion():
+        evento.wait(0.005)
+
+
+def test_un_lote_fallido_se_reintenta_fila_a_fila(tablas):
+    buffer = write_behind.WriteBehindBuffer("group")
+    buffer.start()
+    ids, errores = [], {}
+
+    def insertar(texto):
+        try:
+            buffer.insert("a", {"texto": texto}, callback=lambda fila_id: ids.append((fila_id, texto)))
+        except sqlite3.Error as e:
+            errores[texto] = e
+
+    hilos = []
+    try:
+        # Mientras el primer lote espera, las filas siguientes forman un solo lote
+        with buffer._flush_lock:
+            for texto in ("primera", "b", None, "c"):
+                hilos.append(threading.Thread(target=insertar, args=(texto,)))
+                hilos[-1].start()
+                if texto == "primera":
+                    _esperar(lambda: not buffer._pendientes)
+            _esperar(lambda: len(buffer._pendientes) == 3)
+        for hilo in hilos:
+            hilo.join()
+    finally:
+        buffer.stop()
+
+    assert list(errores) == [None]
+    assert sorted(t for _, t in ids) == ["b", "c", "primera"]
+    assert set(ids) == _filas("a")
+    assert buffer.stats()["split_batches"] == 1
+    assert buffer.stats()["errors"] == 1
@@ -0,0 +1,140 @@
+import threading
+import queue
+import time
+import zlib
+
+
+class QueueFullError(Exception):
+    """Se lanza cuando la cola alcanzó su capacidad máxima"""
+
+
+class WorkerPool:
+    """Pool acotado de trabajadores que procesa mensajes en segundo plano.
+
+    Cada chat_id se asigna siempre al mismo trabajador, de modo que los
+    mensajes de un mismo chat se procesan en el orden en que llegaron.
+    """
+
+    def __init__(self, handler, num_workers=4, max_size=1000, name='worker'):
+        self.handler = handler
+        self.num_workers = max(1, int(num_workers))
+        self.max_size = max(1, int(max_size))
+        self.name = name
+
+        self._queues = [queue.Queue() for _ in range(self.num_workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._pending = 0
+        self._in_flight = 0
+        self._started = False
+
+        # Contadores para métricas
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._max_depth = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+
+    def start(self):
+        """Arranca los hilos de los trabajadores (idempotente)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        for i, q in enumerate(self._queues):
+            t = threading.Thread(target=self._run, args=(q,), name=f'{self.name}-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=None):
+        """Espera a que se vacíe la cola y detiene los trabajadores"""
+        if not self._started:
+            return
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._started = False
+
+    def _shard(self, key):
+        # crc32 es estable entre procesos, a diferencia de hash()
+        return zlib.crc32(str(key).encode('utf-8')) % self.num_workers
+
+    def submit(self, key, job, timeout=0):
+        """Encola un trabajo para la clave indicada.
+
+        Si la cola está llena espera hasta `timeout` segundos a que se libere
+        espacio y, si no lo consigue, lanza QueueFullError.
+        """
+        if not self._started:
+            self.start()
+
+        deadline = time.monotonic() + (timeout or 0)
+        with self._not_full:
+            while self._pending >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._rejected += 1
+                    raise QueueFullError(f'Cola llena ({self.max_size} trabajos pendientes)')
+                self._not_full.wait(remaining)
+
+            self._pending += 1
+            self._enqueued += 1
+            self._max_depth = max(self._max_depth, self._pending)
+
+        self._queues[self._shard(key)].put((time.monotonic(), job))
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                break
+
+            enqueued_at, job = item
+            started = time.monotonic()
+            with self._lock:
+                self._in_flight += 1
+                self._total_wait += started - enqueued_at
+
+            failed = False
+            try:
+                self.handler(job)
+            except Exception as e:
+                failed = True
+                print(f"Error en trabajador {threading.current_thread().name}: {e}")
+            finally:
+                with self._not_full:
+                    self._pending -= 1
+                    self._in_flight -= 1
+                    self._total_run += time.monotonic() - started
+                    if failed:
+                        self._failed += 1
+                    else:
+                        self._processed += 1
+                    self._not_full.notify()
+                q.task_done()
+
+    def metrics(self):
+        """Devuelve un resumen del estado de la cola"""
+        with self._lock:
+            done = self._processed + self._failed
+            return {
+                'workers': self.num_workers,
+                'max_size': self.max_size,
+                'depth': self._pending,
+                'in_flight': self._in_flight,
+                'depth_per_worker': [q.qsize() for q in self._queues],
+                'max_depth': self._max_depth,
+                'enqueued': self._enqueued,
+                'processed': self._processed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'avg_wait_ms': round(self._total_wait / done * 1000, 2) if done else 0.0,
+                'avg_run_ms': round(self._total_run / done * 1000, 2) if done else 0.0,
+            }
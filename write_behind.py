@@ -0,0 +1,234 @@
+import os
+import atexit
+import sqlite3
+import threading
+import time
+
+import storage
+import metrics
+
+# Modos de durabilidad:
+# - sync:  cada inserción se confirma en su propia transacción antes de volver
+# - group: la inserción espera a que se confirme el lote en el que entró
+#          (group commit: mismas garantías que sync, un fsync por lote)
+# - async: la inserción vuelve de inmediato; el lote se confirma por tamaño o
+#          por intervalo (puede perderse el último intervalo si el proceso muere)
+MODOS = ("sync", "group", "async")
+
+
+class _Pendiente:
+    __slots__ = ("tabla", "columnas", "valores", "callback", "evento", "error")
+
+    def __init__(self, tabla, columnas, valores, callback, esperar):
+        self.tabla = tabla
+        self.columnas = columnas
+        self.valores = valores
+        self.callback = callback
+        self.evento = threading.Event() if esperar else None
+        self.error = None
+
+
+class WriteBehindBuffer:
+    """Agrupa inserciones en transacciones con executemany.
+
+    Las filas de una misma tabla y columnas se insertan en un solo
+    executemany; `callback` recibe el id asignado una vez confirmado el lote.
+    Si el lote falla, sus filas se reintentan una a una y sólo las que
+    vuelven a fallar reciben el error.
+    """
+
+    def __init__(self, modo="group", max_batch=200, flush_interval=0.05):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de escritura desconocido: {modo}")
+        self.modo = modo
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+
+        self._pendientes = []
+        self._lock = threading.Lock()
+        self._hay_datos = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._hilo = None
+        self._activo = False
+
+        self.lotes = 0
+        self.filas = 0
+        self.errores = 0
+        self.lotes_divididos = 0
+
+    def start(self):
+        """Arranca el hilo que vacía el buffer (no se usa en modo sync)"""
+        if self.modo == "sync" or self._activo:
+            return
+        self._activo = True
+        self._hilo = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._hilo.start()
+
+    def stop(self):
+        """Detiene el hilo y confirma todo lo pendiente"""
+        with self._lock:
+            self._activo = False
+            self._hay_datos.notify_all()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+        self.flush()
+
+    def insert(self, tabla, fila, callback=None):
+        """Inserta una fila (dict columna -> valor) según el modo de durabilidad"""
+        columnas = tuple(fila)
+        pendiente = _Pendiente(tabla, columnas, tuple(fila[c] for c in columnas), callback,
+                               esperar=self.modo == "group")
+
+        with self._lock:
+            encolar = self._activo
+            if encolar:
+                self._pendientes.append(pendiente)
+                if self.modo == "group" or len(self._pendientes) >= self.max_batch:
+                    self._hay_datos.notify()
+
+        if not encolar:
+            # Modo sync o buffer detenido: escribir directamente
+            pendiente.evento = None
+            self._escribir([pendiente])
+            if pendiente.error is not None:
+                raise pendiente.error
+            return
+
+        if pendiente.evento is not None:
+            pendiente.evento.wait()
+            if pendiente.error is not None:
+                raise pendiente.error
+
+    def flush(self):
+        """Confirma inmediatamente las filas pendientes"""
+        with self._lock:
+            lote, self._pendientes = self._pendientes, []
+        if lote:
+            self._escribir(lote)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self.modo == "group":
+                    # Confirmar en cuanto haya algo: mientras se escribe un lote
+                    # las nuevas filas se acumulan para el siguiente
+                    while self._activo and not self._pendientes:
+                        self._hay_datos.wait()
+                else:
+                    limite = time.monotonic() + self.flush_interval
+                    while self._activo and len(self._pendientes) < self.max_batch:
+                        restante = limite - time.monotonic()
+                        if restante <= 0:
+                            break
+                        self._hay_datos.wait(restante)
+                if not self._activo:
+                    return
+                lote, self._pendientes = self._pendientes[:self.max_batch], self._pendientes[self.max_batch:]
+
+            if lote:
+                self._escribir(lote)
+
+    def _escribir(self, lote):
+        """Confirma el lote y avisa a sus filas.
+
+        Si el lote falla se reintenta fila a fila: una fila inválida sólo
+        devuelve el error a quien la insertó.
+        """
+        ids = {}
+        error = None
+        with self._flush_lock:
+            try:
+                ids = self._confirmar(lote)
+                self.lotes += 1
+                self.filas += len(lote)
+            except sqlite3.Error as e:
+                error = e
+                if len(lote) == 1:
+                    self.errores += 1
+                    print(f"Error al escribir una fila en {lote[0].tabla}: {e}")
+                else:
+                    self.lotes_divididos += 1
+                    print(f"Error al escribir lote de {len(lote)} filas, se reintenta fila a fila: {e}")
+
+        if error is not None and len(lote) > 1:
+            for pendiente in lote:
+                self._escribir([pendiente])
+            return
+
+        for pendiente in lote:
+            pendiente.error = error
+            if error is None and pendiente.callback is not None:
+                try:
+                    pendiente.callback(ids.get(id(pendiente)))
+                except Exception as e:
+                    print(f"Error en callback de escritura: {e}")
+            if pendiente.evento is not None:
+                pendiente.evento.set()
+
+    def _confirmar(self, lote):
+        """Inserta el lote en una transacción; devuelve los ids asignados por fila"""
+        # Agrupar por tabla y columnas para un executemany por grupo
+        grupos = {}
+        for pendiente in lote:
+            grupos.setdefault((pendiente.tabla, pendiente.columnas), []).append(pendiente)
+
+        ids = {}
+        with metrics.span("db", operation="write_batch"), storage.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for (tabla, columnas), filas in grupos.items():
+                    if any(p.callback for p in filas):
+                        # Con el lock de escritura tomado, AUTOINCREMENT asigna
+                        # ids consecutivos a partir de la secuencia actual
+                        base = conn.execute(
+                            "SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0), "
+                            f"COALESCE((SELECT MAX(id) FROM {tabla}), 0))",
+                            (tabla,)
+                        ).fetchone()[0]
+                        for i, p in enumerate(filas, start=1):
+                            ids[id(p)] = base + i
+                    conn.executemany(
+                        f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))})",
+                        [p.valores for p in filas]
+                    )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return ids
+
+    def stats(self):
+        """Devuelve contadores de lotes y filas escritas"""
+        with self._lock:
+            pendientes = len(self._pendientes)
+        return {
+            "mode": self.modo,
+            "pending": pendientes,
+            "batches": self.lotes,
+            "rows": self.filas,
+            "avg_batch": round(self.filas / self.lotes, 2) if self.lotes else 0.0,
+            "errors": self.errores,
+            "split_batches": self.lotes_divididos,
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Devuelve el buffer compartido, creándolo la primera vez"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = WriteBehindBuffer(
+                    modo=os.getenv("DB_WRITE_MODE", "group").lower(),
+                    max_batch=int(os.getenv("DB_WRITE_BATCH_SIZE", 200)),
+                    flush_interval=float(os.getenv("DB_WRITE_FLUSH_INTERVAL", 0.05))
+                )
+                writer.start()
+                atexit.register(writer.stop)
+                _writer = writer
+    return _writer